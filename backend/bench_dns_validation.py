@@ -0,0 +1,74 @@
+"""Micro-benchmarks for DNS record validation.
+
+Times validate_record per record type, owner_key and identity, then a
+whole validate_records pass of --records new records merged into a zone
+that already holds --existing records:
+
+    python bench_dns_validation.py --records 20000 --existing 5000
+
+No database is needed; stored rows are stood in for by plain objects.
+"""
+import argparse
+import os
+import sys
+import time
+import timeit
+from types import SimpleNamespace
+
+SAMPLES = {
+    'A': ('www', '192.0.2.10', None),
+    'AAAA': ('www', '2001:db8::10', None),
+    'CNAME': ('cdn', 'cdn.example.net.', None),
+    'MX': ('@', 'mail.example.com', 10),
+    'TXT': ('@', 'v=spf1 include:_spf.example.net ip4:192.0.2.0/24 -all', None),
+    'NS': ('sub', 'ns1.example.net.', None),
+    'SRV': ('_sip._tcp', '5 5060 sip.example.com', 10),
+    'CAA': ('@', '0 issue "letsencrypt.org"', None),
+}
+
+
+def _per_call(func, number):
+    """Best of five runs of `number` calls, in microseconds per call"""
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def _records(count, prefix):
+    records = []
+    for n in range(count):
+        record_type = ('A', 'AAAA', 'CNAME', 'MX', 'TXT')[n % 5]
+        name, value, priority = SAMPLES[record_type]
+        records.append({'name': f'{prefix}{n}', 'type': record_type, 'value': value,
+                        'ttl': 3600, 'priority': priority, 'line': n + 1})
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=20000, help='records in the validated set')
+    parser.add_argument('--existing', type=int, default=5000, help='records already in the zone')
+    parser.add_argument('--number', type=int, default=20000, help='calls per micro-benchmark run')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from src.services import dns_validation
+
+    for record_type, (name, value, priority) in SAMPLES.items():
+        cost = _per_call(lambda: dns_validation.validate_record(name, record_type, value, 3600, priority), args.number)
+        print(f'validate_record {record_type:<6} {cost:6.2f} us')
+    cost = _per_call(lambda: dns_validation.owner_key('www.example.com.', 'example.com'), args.number)
+    print(f'owner_key              {cost:6.2f} us')
+    cost = _per_call(lambda: dns_validation.identity('www', 'CNAME', 'CDN.Example.net.', 'example.com'), args.number)
+    print(f'identity               {cost:6.2f} us')
+
+    existing = [SimpleNamespace(id=n, name=record['name'], record_type=record['type'], value=record['value'])
+                for n, record in enumerate(_records(args.existing, 'old'))]
+    incoming = _records(args.records, 'new')
+    started = time.perf_counter()
+    errors = dns_validation.validate_records(incoming, existing, 'example.com')
+    elapsed = time.perf_counter() - started
+    print(f'validate_records: {args.records} records into a zone of {args.existing} in {elapsed * 1000:.1f}ms '
+          f'({args.records / elapsed:,.0f} records/s, {len(errors)} errors)')
+
+
+if __name__ == '__main__':
+    main()
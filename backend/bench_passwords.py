@@ -0,0 +1,95 @@
+"""Measure login cost at several bcrypt work factors.
+
+Drives passwords.verify_password through the real process pool, one run
+per PANEL_BCRYPT_ROUNDS value, and prints latency and throughput so a
+cost can be picked for the host:
+
+    python bench_passwords.py --rounds 10,11,12,13 --requests 200 --concurrency 8
+
+Pool size and queue depth come from the usual PANEL_PASSWORD_WORKERS and
+PANEL_PASSWORD_QUEUE variables.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+PASSWORD = 'correct horse battery staple'
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def measure(requests, concurrency):
+    """Verify PASSWORD `requests` times from `concurrency` threads; runs with the rounds from the environment"""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from src.services import passwords
+
+    password_hash = passwords.hash_password(PASSWORD)
+    passwords.verify_password(password_hash, PASSWORD)  # start the pool outside the timing
+
+    latencies = []
+    rejected = []
+    lock = threading.Lock()
+    remaining = iter(range(requests))
+
+    def client():
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            started = time.monotonic()
+            try:
+                matches, _ = passwords.verify_password(password_hash, PASSWORD)
+            except passwords.PasswordQueueFull:
+                with lock:
+                    rejected.append(1)
+                continue
+            if not matches:
+                raise RuntimeError('verify_password rejected the correct password')
+            with lock:
+                latencies.append(time.monotonic() - started)
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    if not latencies:
+        print(f'{passwords.BCRYPT_ROUNDS:>6} {0:>8} {len(rejected):>8}', flush=True)
+        return
+
+    print(f'{passwords.BCRYPT_ROUNDS:>6} {len(latencies):>8} {len(rejected):>8} '
+          f'{_percentile(latencies, 0.5) * 1000:>9.1f} {_percentile(latencies, 0.95) * 1000:>9.1f} '
+          f'{max(latencies) * 1000:>9.1f} {len(latencies) / elapsed:>9.1f}', flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', default='10,11,12,13', help='comma-separated bcrypt work factors')
+    parser.add_argument('--requests', type=int, default=100, help='verifications per work factor')
+    parser.add_argument('--concurrency', type=int, default=4, help='threads calling verify_password')
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.requests, args.concurrency)
+        return
+
+    print(f'{"rounds":>6} {"ok":>8} {"rejected":>8} {"p50 ms":>9} {"p95 ms":>9} {"max ms":>9} {"per sec":>9}')
+    for rounds in args.rounds.split(','):
+        # The work factor is read at import, so each value gets a fresh interpreter and pool
+        env = dict(os.environ, PANEL_PASSWORD_ALGORITHM='bcrypt', PANEL_BCRYPT_ROUNDS=rounds.strip())
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--measure',
+                        '--requests', str(args.requests), '--concurrency', str(args.concurrency)],
+                       env=env, check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Measure how long the zone compiler takes on a large panel.
+
+Fills a scratch SQLite database with --zones domains of --records records
+each, then times dns_zone.build() for the first full compile, a forced
+rebuild where nothing changed, and an incremental build after touching
+--dirty percent of the zones:
+
+    python bench_zones.py --zones 50000 --records 8 --dirty 1
+
+Zone files go to a temporary directory and rndc is not called.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--zones', type=int, default=50000)
+    parser.add_argument('--records', type=int, default=8, help='records per zone besides the apex A')
+    parser.add_argument('--dirty', type=float, default=1.0, help='percent of zones changed before the incremental build')
+    parser.add_argument('--batch', type=int, default=500, help='domains per build transaction')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from flask import Flask
+    from src.models.user import db, DNSRecord, Domain, User
+    from src.services import dns_zone
+
+    scratch = tempfile.mkdtemp(prefix='bench-zones-')
+    dns_zone.ZONE_DIR = os.path.join(scratch, 'zones')
+    dns_zone.ZONE_INCLUDE_PATH = os.path.join(scratch, 'named.conf.panel-zones')
+    reloaded = {'success': True, 'stdout': '', 'stderr': ''}
+    dns_zone.run_command = lambda argv, **_: reloaded
+    dns_zone.run_many = lambda commands, **_: [reloaded for _ in commands]
+
+    app = Flask('bench')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(scratch, "bench.db")}'
+    db.init_app(app)
+    try:
+        with app.app_context():
+            db.create_all()
+            started = time.monotonic()
+            user = User(username='bench', email='bench@example.com', password_hash='x')
+            db.session.add(user)
+            db.session.flush()
+            domains = db.session.execute(Domain.__table__.insert().returning(Domain.id), [
+                {'name': f'zone{i:06d}.test', 'user_id': user.id, 'status': 'active', 'is_active': True}
+                for i in range(args.zones)
+            ]).scalars().all()
+            rows = []
+            for domain_id in domains:
+                rows.append({'domain_id': domain_id, 'name': '@', 'record_type': 'A', 'value': '192.0.2.1', 'ttl': 3600})
+                rows.append({'domain_id': domain_id, 'name': '@', 'record_type': 'MX', 'value': 'mail', 'ttl': 3600,
+                             'priority': 10})
+                rows.append({'domain_id': domain_id, 'name': '@', 'record_type': 'TXT', 'ttl': 3600,
+                             'value': 'v=spf1 mx -all'})
+                for n in range(max(args.records - 2, 0)):
+                    rows.append({'domain_id': domain_id, 'name': f'host{n}', 'record_type': 'A',
+                                 'value': f'192.0.2.{n % 250 + 2}', 'ttl': 3600})
+            db.session.execute(DNSRecord.__table__.insert(), rows)
+            db.session.commit()
+            print(f'seeded {args.zones} zones / {len(rows)} records in {time.monotonic() - started:.1f}s')
+
+            started = time.monotonic()
+            result = dns_zone.build(batch_size=args.batch)
+            elapsed = time.monotonic() - started
+            print(f'full build:        {len(result["written"])} written in {elapsed:.1f}s '
+                  f'({len(result["written"]) / elapsed:.0f} zones/s)')
+
+            started = time.monotonic()
+            result = dns_zone.build(force=True, batch_size=args.batch)
+            elapsed = time.monotonic() - started
+            print(f'forced, unchanged: {result["unchanged"]} checked in {elapsed:.1f}s '
+                  f'({result["unchanged"] / elapsed:.0f} zones/s)')
+
+            touched = random.sample(domains, max(1, int(len(domains) * args.dirty / 100)))
+            DNSRecord.query.filter(DNSRecord.domain_id.in_(touched), DNSRecord.record_type == 'TXT').update(
+                {'value': 'v=spf1 a mx -all'}, synchronize_session=False)
+            dns_zone.mark_dirty_many(touched)
+            db.session.commit()
+            started = time.monotonic()
+            result = dns_zone.build(batch_size=args.batch)
+            elapsed = time.monotonic() - started
+            print(f'incremental:       {len(result["written"])} of {args.zones} rewritten in {elapsed:.2f}s')
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,6 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from flask import Flask, send_from_directory
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager
 from datetime import timedelta
 
 from src.models.user import db, bcrypt, User
@@ -20,12 +19,14 @@ from src.routes.php import php_bp
 from src.routes.database import database_bp
 from src.routes.email import email_bp
 from src.routes.terminal import terminal_bp
+from src.routes.system import system_bp
+from src.routes.analytics import analytics_bp
+from src.services import nginx_status, access_log, dns_zone, whois, domain_lifecycle, revocation, jwt_keys, mail_maps, maildir_usage, mail_queue, db_provisioning, db_backup, passwords
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 
 # Configuration
 app.config['SECRET_KEY'] = 'hosting-panel-secret-key-change-in-production'
-app.config['JWT_SECRET_KEY'] = 'jwt-secret-key-change-in-production'
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
 app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=30)
 
@@ -35,7 +36,9 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # Initialize extensions
 CORS(app, origins="*")  # Allow all origins for development
-jwt = JWTManager(app)
+# Tokens are signed with rotating asymmetric keys, see services/jwt_keys.py
+jwt = jwt_keys.PanelJWTManager(app)
+revocation.init_jwt(jwt)
 db.init_app(app)
 bcrypt.init_app(app)
 
@@ -51,9 +54,40 @@ app.register_blueprint(php_bp, url_prefix="/api")
 app.register_blueprint(database_bp, url_prefix="/api")
 app.register_blueprint(email_bp, url_prefix="/api")
 app.register_blueprint(terminal_bp, url_prefix="/api")
+app.register_blueprint(system_bp, url_prefix="/api")
+app.register_blueprint(analytics_bp, url_prefix="/api")
+
+def add_missing_columns():
+    """create_all skips tables that already exist; add the nullable columns introduced since.
+
+    Scalar defaults are written into the existing rows so they read the
+    same as newly inserted ones.
+    """
+    inspector = db.inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            present = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in present:
+                    continue
+                if not column.nullable:
+                    print(f"Cannot add NOT NULL column {table.name}.{column.name} to an existing table")
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                conn.execute(db.text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+                if column.default is not None and column.default.is_scalar:
+                    conn.execute(table.update().values({column.name: column.default.arg}))
+                print(f"Added column {table.name}.{column.name}")
 
 with app.app_context():
     db.create_all()
+    add_missing_columns()
+    # Likewise for indexes, now that their columns exist
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
     
     # Create default admin user
     admin_user = User.query.filter_by(username="admin").first()
@@ -68,6 +102,25 @@ with app.app_context():
         db.session.add(admin_user)
         db.session.commit()
         print("Default admin user created: admin/admin123")
+
+# Background collectors, after the password fork server so it starts from a
+# single-threaded process. When this file is run directly the hashing
+# children import it as __mp_main__ and must not start any of this.
+if __name__ != "__mp_main__":
+    passwords.start_pool()
+    nginx_status.start_collector(app)
+    access_log.start_ingestion(app)
+    dns_zone.start_builder(app)
+    whois.start_expiry_refresh(app)
+    domain_lifecycle.start_sweeper(app)
+    revocation.start_pruner(app)
+    jwt_keys.start_rotation(app)
+    mail_maps.start_builder(app)
+    maildir_usage.start_scanner(app)
+    mail_queue.start_worker(app)
+    db_provisioning.start_size_refresh(app)
+    db_backup.start_scheduler(app)
+
 @app.route("/api/health", methods=["GET"])
 def health_check():
     return {'status': 'ok', 'message': 'Hosting Panel API is running'}, 200
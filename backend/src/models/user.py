@@ -1,6 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from datetime import datetime
+from src.services import passwords
 
 db = SQLAlchemy()
 bcrypt = Bcrypt()
@@ -10,60 +11,68 @@ class User(db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(128), nullable=False)
-    role = db.Column(db.String(20), default=\'user\')  # admin, user, readonly
+    role = db.Column(db.String(20), default='user')  # admin, user, readonly
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_login = db.Column(db.DateTime)
 
     def __repr__(self):
-        return f\'<User {self.username}>\'
+        return f'<User {self.username}>'
 
     def set_password(self, password):
-        self.password_hash = bcrypt.generate_password_hash(password).decode(\'utf-8\')
+        self.password_hash = passwords.hash_password(password)
 
     def check_password(self, password):
-        return bcrypt.check_password_hash(self.password_hash, password)
+        """Verify and, on success, upgrade an outdated hash in place (caller commits)"""
+        matches, new_hash = passwords.verify_password(self.password_hash, password)
+        if new_hash:
+            self.password_hash = new_hash
+        return matches
 
     def to_dict(self):
         return {
-            \'id\': self.id,
-            \'username\': self.username,
-            \'email\': self.email,
-            \'role\': self.role,
-            \'is_active\': self.is_active,
-            \'created_at\': self.created_at.isoformat() if self.created_at else None,
-            \'last_login\': self.last_login.isoformat() if self.last_login else None
+            'id': self.id,
+            'username': self.username,
+            'email': self.email,
+            'role': self.role,
+            'is_active': self.is_active,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'last_login': self.last_login.isoformat() if self.last_login else None
         }
 
 class Domain(db.Model):
+    # Expired domains keep serving through the grace period until the sweeper suspends them
+    SERVING_STATUSES = ('active', 'expired')
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), unique=True, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey(\'user.id\'), nullable=False)
-    status = db.Column(db.String(50), default=\'active\') # Added status column
-    expires_at = db.Column(db.DateTime) # Added expires_at column
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    status = db.Column(db.String(50), default='active') # Added status column
+    expires_at = db.Column(db.DateTime, index=True) # Added expires_at column
+    expiry_checked_at = db.Column(db.DateTime, index=True)  # last whois refresh, answered or not
     document_root = db.Column(db.String(500))
     is_active = db.Column(db.Boolean, default=True)
     ssl_enabled = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    user = db.relationship(\'User\', backref=db.backref(\'domains\', lazy=True))
+    user = db.relationship('User', backref=db.backref('domains', lazy=True))
 
     def to_dict(self):
         return {
-            \'id\': self.id,
-            \'name\': self.name,
-            \'user_id\': self.user_id,
-            \'status\': self.status, # Added to dict
-            \'expires_at\': self.expires_at.isoformat() if self.expires_at else None, # Added to dict
-            \'document_root\': self.document_root,
-            \'is_active\': self.is_active,
-            \'ssl_enabled\': self.ssl_enabled,
-            \'created_at\': self.created_at.isoformat() if self.created_at else None
+            'id': self.id,
+            'name': self.name,
+            'user_id': self.user_id,
+            'status': self.status, # Added to dict
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None, # Added to dict
+            'document_root': self.document_root,
+            'is_active': self.is_active,
+            'ssl_enabled': self.ssl_enabled,
+            'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
 class DNSRecord(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    domain_id = db.Column(db.Integer, db.ForeignKey(\'domain.id\'), nullable=False)
+    domain_id = db.Column(db.Integer, db.ForeignKey('domain.id'), nullable=False)
     record_type = db.Column(db.String(10), nullable=False)  # A, AAAA, CNAME, MX, TXT
     name = db.Column(db.String(255), nullable=False)
     value = db.Column(db.Text, nullable=False)
@@ -71,24 +80,24 @@ class DNSRecord(db.Model):
     priority = db.Column(db.Integer)  # For MX records
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    domain = db.relationship(\'Domain\', backref=db.backref(\'dns_records\', lazy=True))
+    domain = db.relationship('Domain', backref=db.backref('dns_records', lazy=True))
 
     def to_dict(self):
         return {
-            \'id\': self.id,
-            \'domain_id\': self.domain_id,
-            \'record_type\': self.record_type,
-            \'name\': self.name,
-            \'value\': self.value,
-            \'ttl\': self.ttl,
-            \'priority\': self.priority,
-            \'created_at\': self.created_at.isoformat() if self.created_at else None
+            'id': self.id,
+            'domain_id': self.domain_id,
+            'record_type': self.record_type,
+            'name': self.name,
+            'value': self.value,
+            'ttl': self.ttl,
+            'priority': self.priority,
+            'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
 class SSLCertificate(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    domain_id = db.Column(db.Integer, db.ForeignKey(\'domain.id\'), nullable=False)
-    certificate_type = db.Column(db.String(20), default=\'letsencrypt\')  # letsencrypt, custom
+    domain_id = db.Column(db.Integer, db.ForeignKey('domain.id'), nullable=False)
+    certificate_type = db.Column(db.String(20), default='letsencrypt')  # letsencrypt, custom
     certificate_data = db.Column(db.Text)
     private_key = db.Column(db.Text)
     chain_data = db.Column(db.Text)
@@ -97,67 +106,292 @@ class SSLCertificate(db.Model):
     auto_renew = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    domain = db.relationship(\'Domain\', backref=db.backref(\'ssl_certificates\', lazy=True))
+    domain = db.relationship('Domain', backref=db.backref('ssl_certificates', lazy=True))
 
     def to_dict(self):
         return {
-            \'id\': self.id,
-            \'domain_id\': self.domain_id,
-            \'certificate_type\': self.certificate_type,
-            \'expires_at\': self.expires_at.isoformat() if self.expires_at else None,
-            \'is_active\': self.is_active,
-            \'auto_renew\': self.auto_renew,
-            \'created_at\': self.created_at.isoformat() if self.created_at else None
+            'id': self.id,
+            'domain_id': self.domain_id,
+            'certificate_type': self.certificate_type,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None,
+            'is_active': self.is_active,
+            'auto_renew': self.auto_renew,
+            'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
 class Database(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey(\'user.id\'), nullable=False)
-    db_type = db.Column(db.String(20), default=\'mysql\')  # mysql, postgresql
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    db_type = db.Column(db.String(20), default='mysql')  # mysql, postgresql
     db_user = db.Column(db.String(100), nullable=False)
-    db_password = db.Column(db.String(255), nullable=False)
+    db_password = db.Column(db.String(255), nullable=False)  # hash only; the server keeps the real credential
     size_mb = db.Column(db.Float, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    user = db.relationship(\'User\', backref=db.backref(\'databases\', lazy=True))
+    user = db.relationship('User', backref=db.backref('databases', lazy=True))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'user_id': self.user_id,
+            'db_type': self.db_type,
+            'db_user': self.db_user,
+            'size_mb': self.size_mb,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class DatabaseUser(db.Model):
+    """An extra account on a managed database besides its owner (Database.db_user)"""
+    id = db.Column(db.Integer, primary_key=True)
+    database_id = db.Column(db.Integer, db.ForeignKey('database.id'), nullable=False, index=True)
+    username = db.Column(db.String(100), nullable=False)
+    permissions = db.Column(db.String(20), default='all')  # all, readonly
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    database = db.relationship('Database', backref=db.backref('extra_users', lazy=True, cascade='all, delete-orphan'))
+
+    def to_dict(self):
+        return {
+            'username': self.username,
+            'permissions': self.permissions,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class DatabaseBackup(db.Model):
+    """One compressed dump of a managed database in its owner's backup directory"""
+    id = db.Column(db.Integer, primary_key=True)
+    database_id = db.Column(db.Integer, db.ForeignKey('database.id'), nullable=False, index=True)
+    path = db.Column(db.String(500), nullable=False)
+    compression = db.Column(db.String(10), nullable=False)  # zstd, gzip
+    status = db.Column(db.String(20), default='queued')  # queued, running, completed, failed
+    trigger = db.Column(db.String(20), default='manual')  # manual, scheduled
+    size_bytes = db.Column(db.BigInteger, default=0)
+    duration_seconds = db.Column(db.Float)
+    error = db.Column(db.Text)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    restore_status = db.Column(db.String(20))  # queued, running, completed, failed; NULL if never restored
+    restore_error = db.Column(db.Text)
+    restore_started_at = db.Column(db.DateTime)
+    restored_at = db.Column(db.DateTime)
+
+    database = db.relationship('Database', backref=db.backref('backups', lazy=True, cascade='all, delete-orphan'))
 
     def to_dict(self):
         return {
-            \'id\': self.id,
-            \'name\': self.name,
-            \'user_id\': self.user_id,
-            \'db_type\': self.db_type,
-            \'db_user\': self.db_user,
-            \'size_mb\': self.size_mb,
-            \'created_at\': self.created_at.isoformat() if self.created_at else None
+            'id': self.id,
+            'database_id': self.database_id,
+            'file': self.path.rsplit('/', 1)[-1],
+            'compression': self.compression,
+            'status': self.status,
+            'trigger': self.trigger,
+            'size_bytes': self.size_bytes,
+            'duration_seconds': self.duration_seconds,
+            'error': self.error,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'restore_status': self.restore_status,
+            'restore_error': self.restore_error,
+            'restore_started_at': self.restore_started_at.isoformat() if self.restore_started_at else None,
+            'restored_at': self.restored_at.isoformat() if self.restored_at else None
         }
 
 class EmailAccount(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(255), unique=True, nullable=False)
-    domain_id = db.Column(db.Integer, db.ForeignKey(\'domain.id\'), nullable=False)
+    domain_id = db.Column(db.Integer, db.ForeignKey('domain.id'), nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
     quota_mb = db.Column(db.Integer, default=1000)
     used_mb = db.Column(db.Float, default=0)
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    domain = db.relationship(\'Domain\', backref=db.backref(\'email_accounts\', lazy=True))
+    domain = db.relationship('Domain', backref=db.backref('email_accounts', lazy=True))
 
     def set_password(self, password):
-        self.password_hash = bcrypt.generate_password_hash(password).decode(\'utf-8\')
+        self.password_hash = passwords.hash_password(password)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'email': self.email,
+            'domain_id': self.domain_id,
+            'quota_mb': self.quota_mb,
+            'used_mb': self.used_mb,
+            'is_active': self.is_active,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class TrafficStat(db.Model):
+    """Per-domain, per-minute access log aggregate"""
+    __table_args__ = (db.UniqueConstraint('domain_id', 'minute', name='uq_traffic_domain_minute'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    domain_id = db.Column(db.Integer, db.ForeignKey('domain.id'), nullable=False)
+    minute = db.Column(db.Integer, nullable=False, index=True)  # unix time // 60
+    requests = db.Column(db.Integer, default=0)
+    bytes_sent = db.Column(db.BigInteger, default=0)
+    status_2xx = db.Column(db.Integer, default=0)
+    status_3xx = db.Column(db.Integer, default=0)
+    status_4xx = db.Column(db.Integer, default=0)
+    status_5xx = db.Column(db.Integer, default=0)
+    upstream_histogram = db.Column(db.LargeBinary)  # packed uint32 bucket counts
+
+class NginxSample(db.Model):
+    """One stub_status scrape by the collector; a failed scrape carries only `error`"""
+    id = db.Column(db.Integer, primary_key=True)
+    time = db.Column(db.Float, nullable=False, index=True)  # epoch seconds
+    active = db.Column(db.Integer)
+    accepts = db.Column(db.BigInteger)
+    handled = db.Column(db.BigInteger)
+    requests = db.Column(db.BigInteger)
+    reading = db.Column(db.Integer)
+    writing = db.Column(db.Integer)
+    waiting = db.Column(db.Integer)
+    rps = db.Column(db.Float)
+    error = db.Column(db.String(500))
+
+    def to_dict(self):
+        return {
+            'time': self.time,
+            'active': self.active,
+            'accepts': self.accepts,
+            'handled': self.handled,
+            'requests': self.requests,
+            'reading': self.reading,
+            'writing': self.writing,
+            'waiting': self.waiting,
+            'rps': self.rps
+        }
+
+class NginxReload(db.Model):
+    """A reload done by the panel or noticed by the collector"""
+    id = db.Column(db.Integer, primary_key=True)
+    time = db.Column(db.Float, nullable=False)  # epoch seconds
+    source = db.Column(db.String(20), nullable=False)  # panel, detected
+    detail = db.Column(db.JSON)
+
+    def to_dict(self):
+        return {'time': self.time, 'source': self.source, 'detail': self.detail}
+
+class LogCursor(db.Model):
+    """Read position of an access log, tracked by inode to follow rotations"""
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(500), unique=True, nullable=False)
+    inode = db.Column(db.BigInteger)
+    offset = db.Column(db.BigInteger, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class DNSZone(db.Model):
+    """Build state of a domain's authoritative zone file"""
+    id = db.Column(db.Integer, primary_key=True)
+    domain_id = db.Column(db.Integer, db.ForeignKey('domain.id'), unique=True, nullable=False)
+    serial = db.Column(db.BigInteger, default=0)
+    dirty = db.Column(db.Boolean, default=True, index=True)
+    version = db.Column(db.Integer, default=0)  # bumped on every mark_dirty
+    content_hash = db.Column(db.String(64))  # hash of the rendered zone without the serial
+    built_at = db.Column(db.DateTime)
+
+    domain = db.relationship('Domain', backref=db.backref('dns_zone', uselist=False, lazy=True))
+
+    def to_dict(self):
+        return {
+            'domain_id': self.domain_id,
+            'serial': self.serial,
+            'dirty': self.dirty,
+            'built_at': self.built_at.isoformat() if self.built_at else None
+        }
+
+class MailMapState(db.Model):
+    """Build state of the Postfix/Dovecot maps, which are rebuilt as a whole"""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, default=0)  # bumped on every mark_dirty
+    built_version = db.Column(db.Integer, default=0)
+    built_at = db.Column(db.DateTime)
+
+class OutboundMessage(db.Model):
+    """A message accepted for delivery; its recipients are tracked separately"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    sender = db.Column(db.String(255), nullable=False)
+    message_id = db.Column(db.String(255))  # the Message-ID header
+    content = db.Column(db.Text, nullable=False)  # RFC 5322 message as sent
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    recipients = db.relationship('OutboundRecipient', backref='message', lazy=True,
+                                 cascade='all, delete-orphan')
+
+class OutboundRecipient(db.Model):
+    """Delivery state of one envelope recipient"""
+    __table_args__ = (db.Index('ix_outbound_recipient_due', 'status', 'next_attempt_at'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.Integer, db.ForeignKey('outbound_message.id'), nullable=False, index=True)
+    address = db.Column(db.String(255), nullable=False)
+    domain = db.Column(db.String(255), nullable=False)
+    status = db.Column(db.String(20), default='queued')  # queued, sending, deferred, sent, failed
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claimed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.String(500))
+    sent_at = db.Column(db.DateTime, index=True)
 
     def to_dict(self):
         return {
-            \'id\': self.id,
-            \'email\': self.email,
-            \'domain_id\': self.domain_id,
-            \'quota_mb\': self.quota_mb,
-            \'used_mb\': self.used_mb,
-            \'is_active\': self.is_active,
-            \'created_at\': self.created_at.isoformat() if self.created_at else None
+            'address': self.address,
+            'status': self.status,
+            'attempts': self.attempts,
+            'next_attempt_at': self.next_attempt_at.isoformat() if self.next_attempt_at and self.status in ('queued', 'deferred') else None,
+            'last_error': self.last_error,
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None
         }
 
+class WhoisCache(db.Model):
+    """Parsed whois answers, and per-TLD referral servers, with their own expiry"""
+    id = db.Column(db.Integer, primary_key=True)
+    lookup_key = db.Column(db.String(255), unique=True, nullable=False)  # domain, or "tld:<tld>" for referrals
+    status = db.Column(db.String(20), nullable=False)  # registered, available, error, referral
+    server = db.Column(db.String(255))
+    registrar = db.Column(db.String(255))
+    registered_at = db.Column(db.DateTime)
+    expires_at = db.Column(db.DateTime)
+    raw = db.Column(db.Text)
+    fetched_at = db.Column(db.DateTime, default=datetime.utcnow)
+    valid_until = db.Column(db.DateTime, nullable=False, index=True)
 
+class TokenRevocation(db.Model):
+    """Append-only revocation log; workers replay new rows into memory by id"""
+    # Ids must never be reused after a prune, or workers past that id would skip the new rows
+    __table_args__ = {'sqlite_autoincrement': True}
 
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(64))  # one revoked token, or NULL for a per-user watermark
+    user_id = db.Column(db.Integer)
+    not_before = db.Column(db.BigInteger)  # watermark: tokens issued before this epoch millisecond are dead
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)  # row can be pruned after this
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class UserImport(db.Model):
+    """A bulk user import running in the background; polled until it finishes"""
+    id = db.Column(db.Integer, primary_key=True)
+    created_by = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), default='queued')  # queued, running, completed, failed
+    total = db.Column(db.Integer, default=0)
+    # provision() summary; generated passwords only as an expiring token, see services/users.py
+    result = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'total': self.total,
+            'result': self.result,
+            'error': self.error,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
@@ -0,0 +1,40 @@
+import time
+from flask import Blueprint, jsonify, request
+from flask_jwt_extended import jwt_required
+from src.models.user import Domain
+from src.services import access_log
+from src.services.authz import get_owned
+
+analytics_bp = Blueprint('analytics', __name__)
+
+MAX_RANGE_SECONDS = 31 * 24 * 3600
+
+@analytics_bp.route('/analytics/domains/<int:domain_id>/traffic', methods=['GET'])
+@jwt_required()
+def get_domain_traffic(domain_id):
+    try:
+        domain = get_owned(Domain, domain_id)
+        if not domain:
+            return jsonify({'error': 'Domain tidak ditemukan atau tidak memiliki akses'}), 404
+        
+        end = request.args.get('to', time.time(), type=float)
+        start = request.args.get('from', end - 3600, type=float)
+        resolution = request.args.get('resolution', 60, type=int)
+        
+        if start > end or end - start > MAX_RANGE_SECONDS:
+            return jsonify({'error': 'Rentang waktu tidak valid (maksimal 31 hari)'}), 400
+        if resolution < 60:
+            return jsonify({'error': 'Resolution minimal 60 detik'}), 400
+        
+        traffic = access_log.query_traffic(domain.id, start, end, resolution=resolution)
+        
+        return jsonify({
+            'domain': domain.name,
+            'from': int(start),
+            'to': int(end),
+            'resolution': resolution,
+            **traffic
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
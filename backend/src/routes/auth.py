@@ -1,19 +1,36 @@
 from flask import Blueprint, jsonify, request
-from flask_jwt_extended import jwt_required, create_access_token, get_jwt_identity, create_refresh_token
-from src.models.user import User, db, bcrypt
+from flask_jwt_extended import jwt_required, create_access_token, get_jwt_identity, create_refresh_token, get_jwt, verify_jwt_in_request
+from src.models.user import User, db
+from src.services import ratelimit, revocation, jwt_keys, users as user_service
+from src.services.authz import admin_only_fields, current_principal, require_admin
+from src.services.passwords import PasswordQueueFull, RETRY_AFTER
 from datetime import datetime, timedelta
 
 auth_bp = Blueprint('auth', __name__)
 
+def busy_response():
+    response = jsonify({'error': 'Server sedang sibuk, coba lagi sebentar'})
+    response.headers['Retry-After'] = str(RETRY_AFTER)
+    return response, 429
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
+    # Open to everyone, but an admin's token lets them pick the role
+    verify_jwt_in_request(optional=True)
     try:
         data = request.get_json()
+        denied = admin_only_fields(User, data)
+        if denied:
+            return jsonify({'error': f'Hanya admin yang dapat mengatur: {", ".join(denied)}'}), 403
         
         # Validasi input
         if not data.get('username') or not data.get('email') or not data.get('password'):
             return jsonify({'error': 'Username, email, dan password wajib diisi'}), 400
         
+        role = data.get('role', 'user')
+        if role not in user_service.ROLES:
+            return jsonify({'error': f'Role tidak valid. Gunakan: {", ".join(user_service.ROLES)}'}), 400
+        
         # Cek apakah user sudah ada
         if User.query.filter_by(username=data['username']).first():
             return jsonify({'error': 'Username sudah digunakan'}), 400
@@ -25,7 +42,7 @@ def register():
         user = User(
             username=data['username'],
             email=data['email'],
-            role=data.get('role', 'user')
+            role=role
         )
         user.set_password(data['password'])
         
@@ -37,6 +54,9 @@ def register():
             'user': user.to_dict()
         }), 201
         
+    except PasswordQueueFull:
+        db.session.rollback()
+        return busy_response()
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -48,11 +68,22 @@ def login():
         if not data.get('username') or not data.get('password'):
             return jsonify({'error': 'Username dan password wajib diisi'}), 400
         
+        # Throttled attempts are turned away before paying for a hash
+        ip = ratelimit.client_ip(request)
+        wait = ratelimit.check_login(ip, data['username'])
+        if wait:
+            response = jsonify({'error': 'Terlalu banyak percobaan login, coba lagi nanti'})
+            response.headers['Retry-After'] = str(wait)
+            return response, 429
+        
         user = User.query.filter_by(username=data['username']).first()
         
         if not user or not user.check_password(data['password']):
+            ratelimit.login_failed(ip, data['username'])
             return jsonify({'error': 'Username atau password salah'}), 401
         
+        ratelimit.login_succeeded(ip, data['username'])
+        
         if not user.is_active:
             return jsonify({'error': 'Akun tidak aktif'}), 401
         
@@ -73,6 +104,9 @@ def login():
             'user': user.to_dict()
         }), 200
         
+    except PasswordQueueFull:
+        db.session.rollback()
+        return busy_response()
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -96,6 +130,48 @@ def refresh():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@auth_bp.route('/jwks.json', methods=['GET'])
+def get_jwks():
+    """Public signing keys so other services can verify panel tokens locally"""
+    try:
+        response = jsonify(jwt_keys.jwks())
+        response.headers['Cache-Control'] = 'public, max-age=300'
+        return response, 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@auth_bp.route('/logout', methods=['POST'])
+@jwt_required(verify_type=False)
+def logout():
+    """Revoke the presented token (access or refresh)"""
+    try:
+        revocation.revoke_token(get_jwt())
+        return jsonify({'message': 'Logout berhasil'}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@auth_bp.route('/users/<int:user_id>/revoke', methods=['POST'])
+@jwt_required()
+def revoke_user_tokens(user_id):
+    """Invalidate all tokens already issued to a user"""
+    try:
+        principal = current_principal()
+        if not principal or (not principal.is_admin and principal.id != user_id):
+            return jsonify({'error': 'Akses ditolak'}), 403
+        
+        if not User.query.get(user_id):
+            return jsonify({'error': 'User tidak ditemukan'}), 404
+        
+        revocation.revoke_user(user_id)
+        return jsonify({'message': 'Semua token user telah dicabut'}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @auth_bp.route('/profile', methods=['GET'])
 @jwt_required()
 def get_profile():
@@ -131,35 +207,43 @@ def update_profile():
                 return jsonify({'error': 'Email sudah digunakan'}), 400
             user.email = data['email']
         
-        if 'password' in data and data['password']:
+        password_changed = bool(data.get('password'))
+        if password_changed:
             user.set_password(data['password'])
         
         db.session.commit()
         
-        return jsonify({
+        result = {
             'message': 'Profile berhasil diupdate',
             'user': user.to_dict()
-        }), 200
-        
+        }
+        if password_changed:
+            # Sign out every other session; this one continues on fresh tokens
+            revocation.revoke_user(user.id)
+            result['access_token'] = create_access_token(identity=user.id, expires_delta=timedelta(hours=24))
+            result['refresh_token'] = create_refresh_token(identity=user.id)
+        
+        return jsonify(result), 200
+        
+    except PasswordQueueFull:
+        db.session.rollback()
+        return busy_response()
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @auth_bp.route('/users', methods=['GET'])
-@jwt_required()
+@require_admin()
 def get_users():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        # Hanya admin yang bisa melihat semua user
-        if current_user.role != 'admin':
-            return jsonify({'error': 'Akses ditolak'}), 403
-        
-        users = User.query.all()
+        users, next_cursor = user_service.page_from_args(request.args)
         return jsonify({
-            'users': [user.to_dict() for user in users]
+            'users': [user.to_dict() for user in users],
+            'next_cursor': next_cursor
         }), 200
         
+    except ValueError:
+        return jsonify({'error': 'Cursor atau limit tidak valid'}), 400
+        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1,42 +1,313 @@
+import secrets
 from flask import Blueprint, jsonify, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
+from src.models.user import db, Database, DatabaseBackup, DatabaseUser
+from src.services import db_backup, db_provisioning, passwords
+from src.services.db_backup import BackupError
+from src.services.authz import current_principal, require_admin, scoped
+from src.services.db_provisioning import ProvisioningError, PERMISSIONS, valid_name
+from src.services.passwords import PasswordQueueFull, RETRY_AFTER
 
 database_bp = Blueprint("database", __name__)
 
+MAX_BULK = 200
+GENERATED_PASSWORD_BYTES = 18
+
+def busy_response():
+    response = jsonify({"error": "Server busy, try again shortly"})
+    response.headers["Retry-After"] = str(RETRY_AFTER)
+    return response, 429
+
+def owned_database(name):
+    return scoped(Database).filter(Database.name == name).first()
+
+def existing_names(names):
+    """Which of `names` are taken; database and account names share one namespace"""
+    names = list(set(names))
+    taken = set()
+    for i in range(0, len(names), 500):
+        chunk = names[i:i + 500]
+        for name, user in db.session.query(Database.name, Database.db_user).filter(
+            db.or_(Database.name.in_(chunk), Database.db_user.in_(chunk))
+        ):
+            taken.update((name, user))
+        taken.update(username for (username,) in db.session.query(DatabaseUser.username).filter(
+            DatabaseUser.username.in_(chunk)
+        ))
+    return taken & set(names)
+
+def parse_spec(data, taken):
+    """A validated create request, or an error message; `taken` collects names in use"""
+    if not isinstance(data, dict):
+        return None, "Each database must be an object"
+    name = (data.get("name") or "").strip().lower()
+    db_type = data.get("db_type", "mysql")
+    user = (data.get("username") or name).strip().lower()
+    password = data.get("password") or None
+    if db_type not in db_provisioning.DB_TYPES:
+        return None, f"db_type must be one of {', '.join(db_provisioning.DB_TYPES)}"
+    if not valid_name(name) or not valid_name(user):
+        return None, "Names must be 1-32 lowercase letters, digits or underscores, starting with a letter"
+    if password is not None and (not isinstance(password, str) or len(password) < 8):
+        return None, "Password must be at least 8 characters"
+    if name in taken or user in taken:
+        return None, "Database or user name already exists"
+    taken.update((name, user))
+    return {"name": name, "db_type": db_type, "user": user, "password": password}, None
+
+def candidate_names(items):
+    names = []
+    for item in items:
+        if isinstance(item, dict):
+            name = str(item.get("name") or "").strip().lower()
+            names.extend((name, str(item.get("username") or name).strip().lower()))
+    return names
+
+def provision(specs, user_id):
+    """Create the specs on their servers and record the ones that worked.
+
+    Passwords are hashed first, so a busy hashing pool can't leave
+    databases on a server that the panel doesn't know about.
+    """
+    generated = {}
+    for spec in specs:
+        if spec["password"] is None:
+            spec["password"] = generated[spec["name"]] = secrets.token_urlsafe(GENERATED_PASSWORD_BYTES)
+    hashes = dict(zip((spec["name"] for spec in specs), passwords.hash_many([spec["password"] for spec in specs])))
+    errors = {}
+    for db_type in db_provisioning.DB_TYPES:
+        batch = [spec for spec in specs if spec["db_type"] == db_type]
+        if not batch:
+            continue
+        try:
+            outcomes = db_provisioning.get_server(db_type).create_many(batch)
+        except ProvisioningError as e:
+            # An unreachable server fails its share only; the others' databases still get recorded
+            outcomes = [str(e)] * len(batch)
+        for spec, error in zip(batch, outcomes):
+            if error:
+                errors[spec["name"]] = error
+    db.session.add_all([Database(name=spec["name"], user_id=user_id, db_type=spec["db_type"], db_user=spec["user"],
+                                 db_password=hashes[spec["name"]]) for spec in specs if spec["name"] not in errors])
+    db.session.commit()
+    results = []
+    for spec in specs:
+        if spec["name"] in errors:
+            results.append({"name": spec["name"], "error": errors[spec["name"]]})
+            continue
+        result = {"name": spec["name"], "db_type": spec["db_type"], "username": spec["user"]}
+        if spec["name"] in generated:
+            result["password"] = generated[spec["name"]]
+        results.append(result)
+    return results
+
 @database_bp.route("/databases", methods=["GET"])
 @jwt_required()
 def list_databases():
-    # Placeholder for listing databases
-    return jsonify({"message": "List databases placeholder"}), 200
+    try:
+        databases = scoped(Database).order_by(Database.name).all()
+        return jsonify({"databases": [database.to_dict() for database in databases]}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 @database_bp.route("/databases", methods=["POST"])
 @jwt_required()
 def create_database():
-    # Placeholder for creating a database
-    return jsonify({"message": "Create database placeholder"}), 200
+    try:
+        data = request.get_json() or {}
+        spec, error = parse_spec(data, existing_names(candidate_names([data])))
+        if error:
+            return jsonify({"error": error}), 400
+        result = provision([spec], current_principal().id)[0]
+        if "error" in result:
+            return jsonify(result), 502
+        return jsonify({"message": f"Database {spec['name']} created", "database": result}), 201
+    except ProvisioningError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 502
+    except PasswordQueueFull:
+        db.session.rollback()
+        return busy_response()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+@database_bp.route("/databases/bulk", methods=["POST"])
+@jwt_required()
+def create_databases():
+    """Create many databases at once; each server gets all of its share over one admin connection"""
+    try:
+        items = (request.get_json() or {}).get("databases")
+        if not isinstance(items, list) or not items:
+            return jsonify({"error": "databases must be a non-empty list"}), 400
+        if len(items) > MAX_BULK:
+            return jsonify({"error": f"At most {MAX_BULK} databases per request"}), 400
+        taken = existing_names(candidate_names(items))
+        specs, invalid = [], []
+        for index, item in enumerate(items):
+            spec, error = parse_spec(item, taken)
+            if error:
+                invalid.append({"index": index, "name": item.get("name") if isinstance(item, dict) else None,
+                                "error": error})
+            else:
+                specs.append(spec)
+        results = provision(specs, current_principal().id) if specs else []
+        created = sum("error" not in result for result in results)
+        return jsonify({"created": created, "results": results, "invalid": invalid}), 201 if created else 400
+    except ProvisioningError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 502
+    except PasswordQueueFull:
+        db.session.rollback()
+        return busy_response()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
 
 @database_bp.route("/databases/<name>", methods=["DELETE"])
 @jwt_required()
 def delete_database(name):
-    # Placeholder for deleting a database
-    return jsonify({"message": f"Delete database {name} placeholder"}), 200
+    try:
+        database = owned_database(name)
+        if not database:
+            return jsonify({"error": "Database not found or access denied"}), 404
+        users = [database.db_user] + [user.username for user in database.extra_users]
+        db_provisioning.get_server(database.db_type).drop_database(database.name, users)
+        # Backup records go with the database; the dump files are kept for the admin to remove
+        db.session.delete(database)
+        db.session.commit()
+        return jsonify({"message": f"Database {name} deleted"}), 200
+    except ProvisioningError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 502
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
 
 @database_bp.route("/databases/<name>/users", methods=["GET"])
 @jwt_required()
 def list_database_users(name):
-    # Placeholder for listing database users
-    return jsonify({"message": f"List users for {name} placeholder"}), 200
+    try:
+        database = owned_database(name)
+        if not database:
+            return jsonify({"error": "Database not found or access denied"}), 404
+        users = [{"username": database.db_user, "permissions": "owner"}]
+        users.extend(user.to_dict() for user in database.extra_users)
+        return jsonify({"users": users}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 @database_bp.route("/databases/<name>/users", methods=["POST"])
 @jwt_required()
 def create_database_user(name):
-    # Placeholder for creating a database user
-    return jsonify({"message": f"Create user for {name} placeholder"}), 200
+    try:
+        database = owned_database(name)
+        if not database:
+            return jsonify({"error": "Database not found or access denied"}), 404
+        data = request.get_json() or {}
+        username = (data.get("username") or "").strip().lower()
+        password = data.get("password")
+        permissions = data.get("permissions", "all")
+        if not valid_name(username):
+            return jsonify({"error": "Invalid username"}), 400
+        if not isinstance(password, str) or len(password) < 8:
+            return jsonify({"error": "Password must be at least 8 characters"}), 400
+        if permissions not in PERMISSIONS:
+            return jsonify({"error": f"permissions must be one of {', '.join(PERMISSIONS)}"}), 400
+        if existing_names([username]):
+            return jsonify({"error": "User name already exists"}), 409
+        db_provisioning.get_server(database.db_type).create_user(database.name, username, password, permissions)
+        user = DatabaseUser(database_id=database.id, username=username, permissions=permissions)
+        db.session.add(user)
+        db.session.commit()
+        return jsonify({"message": f"User {username} created for {name}", "user": user.to_dict()}), 201
+    except ProvisioningError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 502
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+@database_bp.route("/databases/servers", methods=["GET"])
+@require_admin("Admin access required")
+def get_database_servers():
+    """Pool usage and capabilities of each database server; ?probe=1 re-checks them"""
+    try:
+        return jsonify(db_provisioning.get_stats(probe=request.args.get("probe") == "1")), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 @database_bp.route("/databases/<name>/backup", methods=["POST"])
 @jwt_required()
 def backup_database(name):
-    # Placeholder for backing up a database
-    return jsonify({"message": f"Backup database {name} placeholder"}), 200
+    """Start a dump of one database; poll GET /databases/<name>/backups for the outcome"""
+    try:
+        database = owned_database(name)
+        if not database:
+            return jsonify({"error": "Database not found or access denied"}), 404
+        if DatabaseBackup.query.filter(DatabaseBackup.database_id == database.id,
+                                       DatabaseBackup.status.in_(("queued", "running"))).first():
+            return jsonify({"error": f"A backup of {name} is already running"}), 409
+        backups, _ = db_backup.queue([database])
+        return jsonify({"message": f"Backup of {name} started", "backup": backups[0].to_dict()}), 202
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+@database_bp.route("/databases/<name>/backups", methods=["GET"])
+@jwt_required()
+def list_database_backups(name):
+    try:
+        database = owned_database(name)
+        if not database:
+            return jsonify({"error": "Database not found or access denied"}), 404
+        backups = DatabaseBackup.query.filter_by(database_id=database.id).order_by(
+            DatabaseBackup.started_at.desc(), DatabaseBackup.id.desc()
+        ).all()
+        return jsonify({"backups": [backup.to_dict() for backup in backups]}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@database_bp.route("/databases/<name>/backups/<int:backup_id>/restore", methods=["POST"])
+@jwt_required()
+def restore_database_backup(name, backup_id):
+    """Start replacing the database's contents with a backup; poll GET /databases/<name>/backups for the outcome"""
+    try:
+        database = owned_database(name)
+        if not database:
+            return jsonify({"error": "Database not found or access denied"}), 404
+        backup = DatabaseBackup.query.filter_by(id=backup_id, database_id=database.id).first()
+        if not backup:
+            return jsonify({"error": "Backup not found"}), 404
+        if backup.status != "completed":
+            return jsonify({"error": "Only completed backups can be restored"}), 409
+        if DatabaseBackup.query.filter(DatabaseBackup.database_id == database.id,
+                                       DatabaseBackup.restore_status.in_(("queued", "running"))).first():
+            return jsonify({"error": f"A restore of {name} is already running"}), 409
+        db_backup.restore(backup)
+        return jsonify({"message": f"Restore of {name} started", "backup": backup.to_dict()}), 202
+    except BackupError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
 
+@database_bp.route("/databases/backups/run", methods=["POST"])
+@require_admin("Admin access required")
+def run_database_backups():
+    """Queue every due database now, ignoring the backup window"""
+    try:
+        summary, _ = db_backup.queue_due()
+        return jsonify(summary), 202
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
 
+@database_bp.route("/databases/backups/stats", methods=["GET"])
+@require_admin("Admin access required")
+def get_database_backup_stats():
+    try:
+        return jsonify(db_backup.get_stats()), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
@@ -1,64 +1,34 @@
-from flask import Blueprint, jsonify, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from src.models.user import User, Domain, DNSRecord, db
-import subprocess
-import re
-import socket
+from flask import Blueprint, Response, jsonify, request
+from flask_jwt_extended import jwt_required
+from src.models.user import Domain, DNSRecord, DNSZone, db
+from src.services import dns_zone, dns_client, zone_io, dns_validation, dns_propagation
+from src.services.authz import require_admin, scoped, get_owned, owned_domain
+from src.services.dns_validation import validate_domain
 
 dns_bp = Blueprint('dns', __name__)
 
-def validate_domain(domain):
-    """Validate domain name format"""
-    pattern = r'^[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?(\.[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?)*$'
-    return re.match(pattern, domain) is not None
-
-def validate_ip(ip):
-    """Validate IP address"""
-    try:
-        socket.inet_aton(ip)
-        return True
-    except socket.error:
-        return False
+MAX_BATCH_LOOKUPS = 500
 
 @dns_bp.route('/dns/records', methods=['GET'])
 @jwt_required()
 def get_dns_records():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
         domain_name = request.args.get('domain')
         
-        if current_user.role == 'admin':
-            # Admin can see all DNS records
-            if domain_name:
-                domain = Domain.query.filter_by(name=domain_name).first()
-                if not domain:
-                    return jsonify({'error': 'Domain tidak ditemukan'}), 404
-                records = DNSRecord.query.filter_by(domain_id=domain.id).all()
-            else:
-                records = DNSRecord.query.all()
-        else:
-            # Regular users can only see their own DNS records
-            user_domains = Domain.query.filter_by(user_id=current_user_id).all()
-            domain_ids = [d.id for d in user_domains]
-            
-            if domain_name:
-                domain = Domain.query.filter_by(name=domain_name, user_id=current_user_id).first()
-                if not domain:
-                    return jsonify({'error': 'Domain tidak ditemukan atau tidak memiliki akses'}), 404
-                records = DNSRecord.query.filter_by(domain_id=domain.id).all()
-            else:
-                records = DNSRecord.query.filter(DNSRecord.domain_id.in_(domain_ids)).all()
+        # Ownership is part of the query; the domain name comes from the same join
+        query = scoped(DNSRecord).add_columns(Domain.name)
+        if domain_name:
+            if not owned_domain(domain_name):
+                return jsonify({'error': 'Domain tidak ditemukan atau tidak memiliki akses'}), 404
+            query = query.filter(Domain.name == domain_name)
         
         records_data = []
-        for record in records:
-            domain = Domain.query.get(record.domain_id)
+        for record, name in query.all():
             records_data.append({
                 'id': record.id,
-                'domain': domain.name if domain else 'Unknown',
+                'domain': name,
                 'name': record.name,
-                'type': record.type,
+                'type': record.record_type,
                 'value': record.value,
                 'ttl': record.ttl,
                 'priority': record.priority,
@@ -74,9 +44,6 @@ def get_dns_records():
 @jwt_required()
 def create_dns_record():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
         data = request.get_json()
         domain_name = data.get('domain')
         name = data.get('name', '')
@@ -92,39 +59,30 @@ def create_dns_record():
         if not validate_domain(domain_name):
             return jsonify({'error': 'Format domain tidak valid'}), 400
         
-        # Check if user owns the domain or is admin
-        if current_user.role != 'admin':
-            domain = Domain.query.filter_by(name=domain_name, user_id=current_user_id).first()
-            if not domain:
-                return jsonify({'error': 'Domain tidak ditemukan atau tidak memiliki akses'}), 404
-        else:
-            domain = Domain.query.filter_by(name=domain_name).first()
-            if not domain:
-                return jsonify({'error': 'Domain tidak ditemukan'}), 404
-        
-        # Validate record type and value
-        valid_types = ['A', 'AAAA', 'CNAME', 'MX', 'TXT', 'NS', 'PTR', 'SRV']
-        if record_type not in valid_types:
-            return jsonify({'error': f'Type record tidak valid. Gunakan: {", ".join(valid_types)}'}), 400
-        
-        # Type-specific validation
-        if record_type == 'A' and not validate_ip(value):
-            return jsonify({'error': 'Value untuk A record harus berupa IP address yang valid'}), 400
+        domain = owned_domain(domain_name)
+        if not domain:
+            return jsonify({'error': 'Domain tidak ditemukan atau tidak memiliki akses'}), 404
         
-        if record_type == 'MX' and not priority:
-            return jsonify({'error': 'Priority wajib diisi untuk MX record'}), 400
+        record_type = record_type.upper()
+        error = dns_validation.validate_record(name or '@', record_type, value, ttl, priority)
+        if error is None:
+            index = dns_validation.ZoneIndex(DNSRecord.query.filter_by(domain_id=domain.id), domain.name)
+            error = index.check(name, record_type, value)
+        if error:
+            return jsonify({'error': f'Record tidak valid: {error}'}), 400
         
         # Create DNS record
         dns_record = DNSRecord(
             domain_id=domain.id,
             name=name,
-            type=record_type,
+            record_type=record_type,
             value=value,
             ttl=ttl,
             priority=priority
         )
         
         db.session.add(dns_record)
+        dns_zone.mark_dirty(domain.id)
         db.session.commit()
         
         return jsonify({
@@ -133,7 +91,7 @@ def create_dns_record():
                 'id': dns_record.id,
                 'domain': domain.name,
                 'name': dns_record.name,
-                'type': dns_record.type,
+                'type': dns_record.record_type,
                 'value': dns_record.value,
                 'ttl': dns_record.ttl,
                 'priority': dns_record.priority
@@ -148,37 +106,34 @@ def create_dns_record():
 @jwt_required()
 def update_dns_record(record_id):
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        dns_record = DNSRecord.query.get(record_id)
+        dns_record = get_owned(DNSRecord, record_id)
         if not dns_record:
-            return jsonify({'error': 'DNS record tidak ditemukan'}), 404
-        
-        # Check permissions
-        domain = Domain.query.get(dns_record.domain_id)
-        if current_user.role != 'admin' and domain.user_id != current_user_id:
-            return jsonify({'error': 'Tidak memiliki akses untuk mengubah record ini'}), 403
+            return jsonify({'error': 'DNS record tidak ditemukan atau tidak memiliki akses'}), 404
+        domain = dns_record.domain
         
         data = request.get_json()
         
-        # Update fields if provided
-        if 'name' in data:
-            dns_record.name = data['name']
-        if 'type' in data:
-            if data['type'] not in ['A', 'AAAA', 'CNAME', 'MX', 'TXT', 'NS', 'PTR', 'SRV']:
-                return jsonify({'error': 'Type record tidak valid'}), 400
-            dns_record.type = data['type']
-        if 'value' in data:
-            # Validate based on type
-            if dns_record.type == 'A' and not validate_ip(data['value']):
-                return jsonify({'error': 'Value untuk A record harus berupa IP address yang valid'}), 400
-            dns_record.value = data['value']
-        if 'ttl' in data:
-            dns_record.ttl = data['ttl']
-        if 'priority' in data:
-            dns_record.priority = data['priority']
-        
+        # Validate the record as it will be after the update
+        name = data.get('name', dns_record.name)
+        record_type = str(data.get('type', dns_record.record_type)).upper()
+        value = data.get('value', dns_record.value)
+        ttl = data.get('ttl', dns_record.ttl)
+        priority = data.get('priority', dns_record.priority)
+        
+        error = dns_validation.validate_record(name or '@', record_type, value, ttl, priority)
+        if error is None:
+            index = dns_validation.ZoneIndex(DNSRecord.query.filter_by(domain_id=domain.id), domain.name)
+            error = index.check(name, record_type, value, record_id=dns_record.id)
+        if error:
+            return jsonify({'error': f'Record tidak valid: {error}'}), 400
+        
+        dns_record.name = name
+        dns_record.record_type = record_type
+        dns_record.value = value
+        dns_record.ttl = ttl
+        dns_record.priority = priority
+        
+        dns_zone.mark_dirty(domain.id)
         db.session.commit()
         
         return jsonify({
@@ -187,7 +142,7 @@ def update_dns_record(record_id):
                 'id': dns_record.id,
                 'domain': domain.name,
                 'name': dns_record.name,
-                'type': dns_record.type,
+                'type': dns_record.record_type,
                 'value': dns_record.value,
                 'ttl': dns_record.ttl,
                 'priority': dns_record.priority
@@ -202,19 +157,13 @@ def update_dns_record(record_id):
 @jwt_required()
 def delete_dns_record(record_id):
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        dns_record = DNSRecord.query.get(record_id)
+        dns_record = get_owned(DNSRecord, record_id)
         if not dns_record:
-            return jsonify({'error': 'DNS record tidak ditemukan'}), 404
-        
-        # Check permissions
-        domain = Domain.query.get(dns_record.domain_id)
-        if current_user.role != 'admin' and domain.user_id != current_user_id:
-            return jsonify({'error': 'Tidak memiliki akses untuk menghapus record ini'}), 403
+            return jsonify({'error': 'DNS record tidak ditemukan atau tidak memiliki akses'}), 404
+        domain = dns_record.domain
         
         db.session.delete(dns_record)
+        dns_zone.mark_dirty(domain.id)
         db.session.commit()
         
         return jsonify({'message': 'DNS record berhasil dihapus'}), 200
@@ -236,35 +185,91 @@ def dns_lookup():
         if not validate_domain(domain):
             return jsonify({'error': 'Format domain tidak valid'}), 400
         
-        # Perform DNS lookup using nslookup
-        try:
-            if record_type == 'A':
-                result = subprocess.run(['nslookup', '-type=A', domain], 
-                                      capture_output=True, text=True, timeout=10)
-            elif record_type == 'MX':
-                result = subprocess.run(['nslookup', '-type=MX', domain], 
-                                      capture_output=True, text=True, timeout=10)
-            elif record_type == 'NS':
-                result = subprocess.run(['nslookup', '-type=NS', domain], 
-                                      capture_output=True, text=True, timeout=10)
-            elif record_type == 'TXT':
-                result = subprocess.run(['nslookup', '-type=TXT', domain], 
-                                      capture_output=True, text=True, timeout=10)
-            else:
-                result = subprocess.run(['nslookup', domain], 
-                                      capture_output=True, text=True, timeout=10)
-            
-            return jsonify({
-                'domain': domain,
-                'type': record_type,
-                'output': result.stdout,
-                'error': result.stderr if result.stderr else None
-            }), 200
-            
-        except subprocess.TimeoutExpired:
+        record_type = record_type.upper()
+        if record_type not in dns_client.RECORD_TYPES:
+            return jsonify({'error': f'Type record tidak valid. Gunakan: {", ".join(dns_client.RECORD_TYPES)}'}), 400
+        
+        result = dns_client.query(domain, record_type)
+        
+        if result['status'] == 'TIMEOUT':
             return jsonify({'error': 'DNS lookup timeout'}), 408
-        except Exception as e:
-            return jsonify({'error': f'DNS lookup failed: {str(e)}'}), 500
+        
+        return jsonify({
+            'domain': domain,
+            'type': record_type,
+            'status': result['status'],
+            'answers': result['answers'],
+            'authority': result['authority'],
+            'server': result['server'],
+            'cached': result['cached'],
+            'elapsed_ms': result['elapsed_ms'],
+            'error': result.get('error')
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@dns_bp.route('/dns/lookup/batch', methods=['POST'])
+@jwt_required()
+def dns_lookup_batch():
+    try:
+        data = request.get_json() or {}
+        queries = data.get('queries', [])
+        
+        if not isinstance(queries, list) or not queries:
+            return jsonify({'error': 'Daftar queries wajib diisi'}), 400
+        if len(queries) > MAX_BATCH_LOOKUPS:
+            return jsonify({'error': f'Maksimal {MAX_BATCH_LOOKUPS} query per permintaan'}), 400
+        
+        questions = []
+        for item in queries:
+            if isinstance(item, str):
+                name, record_type = item, data.get('type', 'A')
+            else:
+                name, record_type = item.get('domain'), item.get('type', 'A')
+            record_type = str(record_type).upper()
+            if not name or not validate_domain(name):
+                return jsonify({'error': f'Format domain tidak valid: {name}'}), 400
+            if record_type not in dns_client.RECORD_TYPES:
+                return jsonify({'error': f'Type record tidak valid: {record_type}'}), 400
+            questions.append((name, record_type))
+        
+        results = dns_client.query_many(questions)
+        
+        return jsonify({
+            'results': [{
+                'domain': result['name'],
+                'type': result['type'],
+                'status': result['status'],
+                'answers': result['answers'],
+                'cached': result['cached'],
+                'error': result.get('error')
+            } for result in results]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@dns_bp.route('/dns/propagation', methods=['GET'])
+@jwt_required()
+def dns_propagation_check():
+    try:
+        domain_name = request.args.get('domain')
+        name = request.args.get('name', '@')
+        record_type = request.args.get('type', 'A').upper()
+        
+        if not domain_name:
+            return jsonify({'error': 'Domain wajib diisi'}), 400
+        if record_type not in dns_client.RECORD_TYPES:
+            return jsonify({'error': f'Type record tidak valid. Gunakan: {", ".join(dns_client.RECORD_TYPES)}'}), 400
+        if name != '@' and not dns_validation.OWNER_PATTERN.match(name):
+            return jsonify({'error': 'Nama record tidak valid'}), 400
+        
+        domain = owned_domain(domain_name)
+        if not domain:
+            return jsonify({'error': 'Domain tidak ditemukan atau tidak memiliki akses'}), 404
+        
+        return jsonify(dns_propagation.check(domain, name, record_type)), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -273,21 +278,26 @@ def dns_lookup():
 @jwt_required()
 def get_dns_zones():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        domains = scoped(Domain).all()
         
-        if current_user.role == 'admin':
-            domains = Domain.query.all()
-        else:
-            domains = Domain.query.filter_by(user_id=current_user_id).all()
+        domain_ids = [d.id for d in domains]
+        counts = dict(
+            db.session.query(DNSRecord.domain_id, db.func.count(DNSRecord.id))
+            .filter(DNSRecord.domain_id.in_(domain_ids))
+            .group_by(DNSRecord.domain_id)
+        )
+        builds = {z.domain_id: z for z in DNSZone.query.filter(DNSZone.domain_id.in_(domain_ids))}
         
         zones = []
         for domain in domains:
-            records_count = DNSRecord.query.filter_by(domain_id=domain.id).count()
+            build = builds.get(domain.id)
             zones.append({
                 'domain': domain.name,
-                'records_count': records_count,
+                'records_count': counts.get(domain.id, 0),
                 'status': domain.status,
+                'serial': build.serial if build else None,
+                'dirty': build.dirty if build else True,
+                'built_at': build.built_at.isoformat() if build and build.built_at else None,
                 'created_at': domain.created_at.isoformat() if domain.created_at else None
             })
         
@@ -296,3 +306,95 @@ def get_dns_zones():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@dns_bp.route('/dns/zones/build', methods=['POST'])
+@require_admin()
+def build_dns_zones():
+    try:
+        data = request.get_json(silent=True) or {}
+        result = dns_zone.build(domain_ids=data.get('domain_ids'), force=bool(data.get('force')))
+        
+        return jsonify({
+            'message': 'Zone berhasil dibangun',
+            'written': len(result['written']),
+            'removed': len(result['removed']),
+            'unchanged': result['unchanged'],
+            'reload': result['reload']
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@dns_bp.route('/dns/zones/<domain_name>/file', methods=['GET'])
+@jwt_required()
+def get_zone_file(domain_name):
+    try:
+        domain = owned_domain(domain_name)
+        if not domain:
+            return jsonify({'error': 'Domain tidak ditemukan atau tidak memiliki akses'}), 404
+        
+        zone = DNSZone.query.filter_by(domain_id=domain.id).first()
+        return jsonify({
+            'domain': domain.name,
+            'serial': zone.serial if zone else None,
+            'dirty': zone.dirty if zone else True,
+            'content': dns_zone.get_zone_file(domain.name)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+EXPORT_CONTENT_TYPES = {'bind': 'text/dns', 'csv': 'text/csv', 'json': 'application/json'}
+
+@dns_bp.route('/dns/zones/<domain_name>/import', methods=['POST'])
+@jwt_required()
+def import_zone(domain_name):
+    try:
+        domain = owned_domain(domain_name)
+        if not domain:
+            return jsonify({'error': 'Domain tidak ditemukan atau tidak memiliki akses'}), 404
+        
+        data = request.get_json() or {}
+        fmt = data.get('format', 'bind')
+        content = data.get('records') if fmt == 'json' and 'records' in data else data.get('content')
+        if not content:
+            return jsonify({'error': 'Content wajib diisi'}), 400
+        
+        try:
+            result = zone_io.import_records(
+                domain, fmt, content,
+                replace=data.get('mode') == 'replace',
+                dry_run=bool(data.get('dry_run'))
+            )
+        except zone_io.ZoneImportError as e:
+            return jsonify({'error': e.message, 'line': e.line}), 400
+        
+        if result['errors']:
+            return jsonify(dict(result, error='Record tidak valid')), 400
+        
+        return jsonify(dict(result, message='Import berhasil' if result['applied'] else 'Pratinjau import')), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@dns_bp.route('/dns/zones/<domain_name>/export', methods=['GET'])
+@jwt_required()
+def export_zone(domain_name):
+    try:
+        domain = owned_domain(domain_name)
+        if not domain:
+            return jsonify({'error': 'Domain tidak ditemukan atau tidak memiliki akses'}), 404
+        
+        fmt = request.args.get('format', 'bind')
+        if fmt not in EXPORT_CONTENT_TYPES:
+            return jsonify({'error': f'Format tidak valid. Gunakan: {", ".join(EXPORT_CONTENT_TYPES)}'}), 400
+        
+        return Response(
+            zone_io.export_records(domain, fmt),
+            mimetype=EXPORT_CONTENT_TYPES[fmt],
+            headers={'Content-Disposition': f'attachment; filename={domain.name}.{"zone" if fmt == "bind" else fmt}'}
+        )
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
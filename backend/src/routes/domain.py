@@ -1,112 +1,101 @@
 from flask import Blueprint, jsonify, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
 from src.models.user import User, Domain, db
-import re
-import socket
-import subprocess
+from src.services import dns_zone, dns_client, events, whois, domain_lifecycle, mail_maps
+from src.services.authz import admin_only_fields, current_principal, require_admin, scoped, get_owned
+from src.services.dns_validation import validate_domain
 import traceback # Import traceback module
 
-domain_bp = Blueprint(\'domain\', __name__)
+domain_bp = Blueprint('domain', __name__)
 
-def validate_domain(domain):
-    """Validate domain name format"""
-    pattern = r\'^[a-zA-Z0-9]([a-zA-Z0-9\\-]{0,61}[a-zA-Z0-9])?(\\.[a-zA-Z0-9]([a-zA-Z0-9\\-]{0,61}[a-zA-Z0-9])?)*$\'
-    return re.match(pattern, domain) is not None
+MAX_WHOIS_BATCH = 50
 
 def check_domain_availability(domain):
-    """Check if domain is available using whois"""
-    try:
-        result = subprocess.run([\'whois\', domain], capture_output=True, text=True, timeout=10)
-        # Simple check - if "No match" or "Not found" in output, domain might be available
-        output = result.stdout.lower()
-        if \'no match\' in output or \'not found\' in output or \'no data found\' in output:
-            return True, \'Domain appears to be available\'
-        else:
-            return False, \'Domain is registered\'
-    except subprocess.TimeoutExpired:
-        return None, \'Whois lookup timeout\'
-    except Exception as e:
-        return None, f\'Whois lookup failed: {str(e)}\'
+    """Check if domain is available: delegated domains are registered, whois decides the rest"""
+    ns = dns_client.query(domain, 'NS')
+    if ns['status'] == 'NOERROR' and any(answer['type'] == 'NS' for answer in ns['answers']):
+        return False, 'Domain is registered', None
+    
+    result = whois.lookup(domain)
+    if result['status'] == 'error':
+        return None, f"Whois lookup failed: {result['error']}", result
+    if result['available']:
+        return True, 'Domain appears to be available', result
+    return False, 'Domain is registered', result
 
-@domain_bp.route(\'/domains\', methods=[\'GET\'])
+@domain_bp.route('/domains', methods=['GET'])
 @jwt_required()
 def get_domains():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        if current_user.role == \'admin\':
-            domains = Domain.query.all()
-        else:
-            domains = Domain.query.filter_by(user_id=current_user_id).all()
+        # Owner names come from the same query instead of one lookup per domain
+        domains = scoped(Domain).outerjoin(User, Domain.user_id == User.id).add_columns(User.username).all()
         
         domains_data = []
-        for domain in domains:
-            owner = User.query.get(domain.user_id)
+        for domain, owner in domains:
             domains_data.append({
-                \'id\': domain.id,
-                \'name\': domain.name,
-                \'status\': domain.status,
-                \'owner\': owner.username if owner else \'Unknown\',
-                \'created_at\': domain.created_at.isoformat() if domain.created_at else None,
-                \'expires_at\': domain.expires_at.isoformat() if domain.expires_at else None
+                'id': domain.id,
+                'name': domain.name,
+                'status': domain.status,
+                'owner': owner or 'Unknown',
+                'created_at': domain.created_at.isoformat() if domain.created_at else None,
+                'expires_at': domain.expires_at.isoformat() if domain.expires_at else None
             })
         
-        return jsonify({\'domains\': domains_data}), 200
+        return jsonify({'domains': domains_data}), 200
         
     except Exception as e:
         print(f"Error in get_domains: {e}") # Added for debugging
         traceback.print_exc() # Print full traceback
-        return jsonify({\'error\': str(e)}), 500
+        return jsonify({'error': str(e)}), 500
 
-@domain_bp.route(\'/domains\', methods=[\'POST\'])
+@domain_bp.route('/domains', methods=['POST'])
 @jwt_required()
 def create_domain():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        principal = current_principal()
         
         data = request.get_json()
-        domain_name = data.get(\'name\')
+        domain_name = data.get('name')
         
         if not domain_name:
-            return jsonify({\'error\': \'Nama domain wajib diisi\'}), 400
+            return jsonify({'error': 'Nama domain wajib diisi'}), 400
         
         # Validate domain format
         if not validate_domain(domain_name):
-            return jsonify({\'error\': \'Format domain tidak valid\'}), 400
+            return jsonify({'error': 'Format domain tidak valid'}), 400
         
         # Check if domain already exists in our system
         existing_domain = Domain.query.filter_by(name=domain_name).first()
         if existing_domain:
-            return jsonify({\'error\': \'Domain sudah terdaftar dalam sistem\'}), 400
+            return jsonify({'error': 'Domain sudah terdaftar dalam sistem'}), 400
         
         # For admin, allow specifying user_id
-        if current_user.role == \'admin\' and \'user_id\' in data:
-            target_user_id = data[\'user_id\']
+        if principal.is_admin and 'user_id' in data:
+            target_user_id = data['user_id']
             target_user = User.query.get(target_user_id)
             if not target_user:
-                return jsonify({\'error\': \'User tidak ditemukan\'}), 404
+                return jsonify({'error': 'User tidak ditemukan'}), 404
         else:
-            target_user_id = current_user_id
+            target_user_id = principal.id
         
         # Create domain
         domain = Domain(
             name=domain_name,
             user_id=target_user_id,
-            status=\'active\'
+            status='active'
         )
         
         db.session.add(domain)
         db.session.commit()
+        events.emit(events.DOMAIN_CHANGED, domain_ids=[domain.id])
         
         return jsonify({
-            \'message\': \'Domain berhasil ditambahkan\',
-            \'domain\': {
-                \'id\': domain.id,
-                \'name\': domain.name,
-                \'status\': domain.status,
-                \'user_id\': domain.user_id
+            'message': 'Domain berhasil ditambahkan',
+            'domain': {
+                'id': domain.id,
+                'name': domain.name,
+                'status': domain.status,
+                'user_id': domain.user_id
             }
         }), 201
         
@@ -114,48 +103,51 @@ def create_domain():
         db.session.rollback()
         print(f"Error in create_domain: {e}") # Added for debugging
         traceback.print_exc() # Print full traceback
-        return jsonify({\'error\': str(e)}), 500
+        return jsonify({'error': str(e)}), 500
 
-@domain_bp.route(\'/domains/<int:domain_id>\', methods=[\'PUT\'])
+@domain_bp.route('/domains/<int:domain_id>', methods=['PUT'])
 @jwt_required()
 def update_domain(domain_id):
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        domain = Domain.query.get(domain_id)
+        domain = get_owned(Domain, domain_id)
         if not domain:
-            return jsonify({\'error\': \'Domain tidak ditemukan\'}), 404
-        
-        # Check permissions
-        if current_user.role != \'admin\' and domain.user_id != current_user_id:
-            return jsonify({\'error\': \'Tidak memiliki akses untuk mengubah domain ini\'}), 403
+            return jsonify({'error': 'Domain tidak ditemukan atau tidak memiliki akses'}), 404
         
         data = request.get_json()
+        denied = admin_only_fields(Domain, data)
+        if denied:
+            return jsonify({'error': f'Hanya admin yang dapat mengubah: {", ".join(denied)}'}), 403
         
         # Update fields if provided
-        if \'status\' in data:
-            valid_statuses = [\'active\', \'suspended\', \'expired\', \'pending\']
-            if data[\'status\'] not in valid_statuses:
-                return jsonify({\'error\': f\'Status tidak valid. Gunakan: {\", \".join(valid_statuses)}\'}), 400
-            domain.status = data[\'status\']
-        
-        if \'expires_at\' in data and current_user.role == \'admin\':
+        status_changed = False
+        if 'status' in data:
+            valid_statuses = ['active', 'suspended', 'expired', 'pending']
+            if data['status'] not in valid_statuses:
+                return jsonify({'error': f'Status tidak valid. Gunakan: {", ".join(valid_statuses)}'}), 400
+            status_changed = data['status'] != domain.status
+            if status_changed:
+                dns_zone.mark_dirty(domain.id)
+            domain.status = data['status']
+        
+        if 'expires_at' in data:
             from datetime import datetime
             try:
-                domain.expires_at = datetime.fromisoformat(data[\'expires_at\'])
+                domain.expires_at = datetime.fromisoformat(data['expires_at'])
             except ValueError:
-                return jsonify({\'error\': \'Format tanggal expires_at tidak valid (gunakan ISO format)\'}), 400
+                return jsonify({'error': 'Format tanggal expires_at tidak valid (gunakan ISO format)'}), 400
         
+        if status_changed:
+            # Subscribers mark zones and mail maps dirty in this transaction
+            events.emit(events.DOMAIN_STATUS_CHANGED, domain_ids=[domain.id], new_status=domain.status)
         db.session.commit()
         
         return jsonify({
-            \'message\': \'Domain berhasil diupdate\',
-            \'domain\': {
-                \'id\': domain.id,
-                \'name\': domain.name,
-                \'status\': domain.status,
-                \'expires_at\': domain.expires_at.isoformat() if domain.expires_at else None
+            'message': 'Domain berhasil diupdate',
+            'domain': {
+                'id': domain.id,
+                'name': domain.name,
+                'status': domain.status,
+                'expires_at': domain.expires_at.isoformat() if domain.expires_at else None
             }
         }), 200
         
@@ -163,134 +155,165 @@ def update_domain(domain_id):
         db.session.rollback()
         print(f"Error in update_domain: {e}") # Added for debugging
         traceback.print_exc() # Print full traceback
-        return jsonify({\'error\': str(e)}), 500
+        return jsonify({'error': str(e)}), 500
 
-@domain_bp.route(\'/domains/<int:domain_id>\', methods=[\'DELETE\'])
+@domain_bp.route('/domains/<int:domain_id>', methods=['DELETE'])
 @jwt_required()
 def delete_domain(domain_id):
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        domain = Domain.query.get(domain_id)
+        domain = get_owned(Domain, domain_id)
         if not domain:
-            return jsonify({\'error\': \'Domain tidak ditemukan\'}), 404
-        
-        # Check permissions
-        if current_user.role != \'admin\' and domain.user_id != current_user_id:
-            return jsonify({\'error\': \'Tidak memiliki akses untuk menghapus domain ini\'}), 403
+            return jsonify({'error': 'Domain tidak ditemukan atau tidak memiliki akses'}), 404
         
         # Delete associated DNS records first
-        from src.models.user import DNSRecord
+        from src.models.user import DNSRecord, DNSZone, EmailAccount, SSLCertificate
         DNSRecord.query.filter_by(domain_id=domain.id).delete()
+        DNSZone.query.filter_by(domain_id=domain.id).delete()
+        SSLCertificate.query.filter_by(domain_id=domain.id).delete()
+        if EmailAccount.query.filter_by(domain_id=domain.id).delete():
+            mail_maps.mark_dirty()
         
+        domain_id, domain_name = domain.id, domain.name
         db.session.delete(domain)
         db.session.commit()
+        dns_zone.remove_zone(domain_name)
+        # Its vhost, TLS files and PHP-FPM pool go too
+        events.emit(events.DOMAIN_DELETED, domain_id=domain_id, domain_name=domain_name)
         
-        return jsonify({\'message\': \'Domain berhasil dihapus\'}), 200
+        return jsonify({'message': 'Domain berhasil dihapus'}), 200
         
     except Exception as e:
         db.session.rollback()
         print(f"Error in delete_domain: {e}") # Added for debugging
         traceback.print_exc() # Print full traceback
-        return jsonify({\'error\': str(e)}), 500
+        return jsonify({'error': str(e)}), 500
+
+@domain_bp.route('/domains/lifecycle/sweep', methods=['POST'])
+@require_admin()
+def sweep_domain_lifecycle():
+    """Run the expiry sweep now instead of waiting for the scheduler"""
+    try:
+        return jsonify(domain_lifecycle.sweep()), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
 
-@domain_bp.route(\'/domains/check\', methods=[\'GET\'])
+@domain_bp.route('/domains/check', methods=['GET'])
 @jwt_required()
 def check_domain():
     try:
-        domain_name = request.args.get(\'domain\')
+        domain_name = request.args.get('domain')
         
         if not domain_name:
-            return jsonify({\'error\': \'Nama domain wajib diisi\'}), 400
+            return jsonify({'error': 'Nama domain wajib diisi'}), 400
         
         if not validate_domain(domain_name):
-            return jsonify({\'error\': \'Format domain tidak valid\'}), 400
+            return jsonify({'error': 'Format domain tidak valid'}), 400
         
         # Check if domain exists in our system
         existing_domain = Domain.query.filter_by(name=domain_name).first()
         in_system = existing_domain is not None
         
-        # Check domain availability via whois
-        available, whois_message = check_domain_availability(domain_name)
+        # Check domain availability via DNS, then whois
+        available, whois_message, whois_result = check_domain_availability(domain_name)
+        if existing_domain and whois_result and whois.sync_expiry([existing_domain], [whois_result]):
+            db.session.commit()
         
         return jsonify({
-            \'domain\': domain_name,
-            \'in_system\': in_system,
-            \'available\': available,
-            \'whois_message\': whois_message,
-            \'owner\': existing_domain.user_id if existing_domain else None
+            'domain': domain_name,
+            'in_system': in_system,
+            'available': available,
+            'whois_message': whois_message,
+            'registrar': whois_result['registrar'] if whois_result else None,
+            'expires_at': whois_result['expires_at'] if whois_result else None,
+            'owner': existing_domain.user_id if existing_domain else None
         }), 200
         
     except Exception as e:
         print(f"Error in check_domain: {e}") # Added for debugging
         traceback.print_exc() # Print full traceback
-        return jsonify({\'error\': str(e)}), 500
+        return jsonify({'error': str(e)}), 500
 
-@domain_bp.route(\'/domains/search\', methods=[\'GET\'])
+@domain_bp.route('/domains/whois', methods=['POST'])
 @jwt_required()
-def search_domains():
+def whois_batch():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        data = request.get_json() or {}
+        names = data.get('domains', [])
         
-        query = request.args.get(\'q\', \'\')
+        if not isinstance(names, list) or not names:
+            return jsonify({'error': 'Daftar domain wajib diisi'}), 400
+        if len(names) > MAX_WHOIS_BATCH:
+            return jsonify({'error': f'Maksimal {MAX_WHOIS_BATCH} domain per permintaan'}), 400
+        invalid = [name for name in names if not isinstance(name, str) or not validate_domain(name)]
+        if invalid:
+            return jsonify({'error': f'Format domain tidak valid: {", ".join(map(str, invalid[:5]))}'}), 400
         
-        if current_user.role == \'admin\':
-            domains = Domain.query.filter(Domain.name.contains(query)).all()
-        else:
-            domains = Domain.query.filter(
-                Domain.user_id == current_user_id,
-                Domain.name.contains(query)
-            ).all()
+        results = whois.lookup_many(names)
+        
+        # Keep expiry dates of the caller's own domains current
+        owned = Domain.query.filter(Domain.name.in_([r['domain'] for r in results]),
+                                    Domain.user_id == current_principal().id).all()
+        if whois.sync_expiry(owned, results):
+            db.session.commit()
+        
+        return jsonify({'results': results}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@domain_bp.route('/domains/search', methods=['GET'])
+@jwt_required()
+def search_domains():
+    try:
+        query = request.args.get('q', '')
+        
+        domains = scoped(Domain).filter(Domain.name.contains(query)) \
+            .outerjoin(User, Domain.user_id == User.id).add_columns(User.username).all()
         
         domains_data = []
-        for domain in domains:
-            owner = User.query.get(domain.user_id)
+        for domain, owner in domains:
             domains_data.append({
-                \'id\': domain.id,
-                \'name\': domain.name,
-                \'status\': domain.status,
-                \'owner\': owner.username if owner else \'Unknown\',
-                \'created_at\': domain.created_at.isoformat() if domain.created_at else None
+                'id': domain.id,
+                'name': domain.name,
+                'status': domain.status,
+                'owner': owner or 'Unknown',
+                'created_at': domain.created_at.isoformat() if domain.created_at else None
             })
         
-        return jsonify({\'domains\': domains_data}), 200
+        return jsonify({'domains': domains_data}), 200
         
     except Exception as e:
         print(f"Error in search_domains: {e}") # Added for debugging
         traceback.print_exc() # Print full traceback
-        return jsonify({\'error\': str(e)}), 500
+        return jsonify({'error': str(e)}), 500
 
-@domain_bp.route(\'/domains/stats\', methods=[\'GET\'])
+@domain_bp.route('/domains/stats', methods=['GET'])
 @jwt_required()
 def get_domain_stats():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        if current_user.role == \'admin\':
-            total_domains = Domain.query.count()
-            active_domains = Domain.query.filter_by(status=\'active\').count()
-            suspended_domains = Domain.query.filter_by(status=\'suspended\').count()
-            expired_domains = Domain.query.filter_by(status=\'expired\').count()
-        else:
-            total_domains = Domain.query.filter_by(user_id=current_user_id).count()
-            active_domains = Domain.query.filter_by(user_id=current_user_id, status=\'active\').count()
-            suspended_domains = Domain.query.filter_by(user_id=current_user_id, status=\'suspended\').count()
-            expired_domains = Domain.query.filter_by(user_id=current_user_id, status=\'expired\').count()
+        total_domains, active_domains, suspended_domains, expired_domains = scoped(
+            Domain, query=db.session.query(
+                db.func.count(Domain.id),
+                db.func.count(db.case((Domain.status == 'active', 1))),
+                db.func.count(db.case((Domain.status == 'suspended', 1))),
+                db.func.count(db.case((Domain.status == 'expired', 1)))
+            )
+        ).one()
         
         return jsonify({
-            \'total\': total_domains,
-            \'active\': active_domains,
-            \'suspended\': suspended_domains,
-            \'expired\': expired_domains
+            'total': total_domains,
+            'active': active_domains,
+            'suspended': suspended_domains,
+            'expired': expired_domains
         }), 200
         
     except Exception as e:
         print(f"Error in get_domain_stats: {e}") # Added for debugging
         traceback.print_exc() # Print full traceback
-        return jsonify({\'error\': str(e)}), 500
+        return jsonify({'error': str(e)}), 500
 
 
 
@@ -1,37 +1,217 @@
+import re
 from flask import Blueprint, jsonify, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
+from src.models.user import db, Domain, EmailAccount, OutboundMessage
+from src.services import mail_maps, maildir_usage, mail_queue
+from src.services.authz import current_principal, require_admin, scoped, get_owned, owned_domain
+from src.services.passwords import PasswordQueueFull, RETRY_AFTER
 
 email_bp = Blueprint('email', __name__)
 
+# No ':' or whitespace, which would break the passwd-file and map formats
+LOCAL_PART_PATTERN = re.compile(r'^[a-z0-9](?:[a-z0-9._+\-]{0,62}[a-z0-9])?$')
+ADDRESS_PATTERN = re.compile(r"^[A-Za-z0-9.!#$%&'*+/=?^_`{|}~\-]+@[a-zA-Z0-9.\-]+\.[a-zA-Z]{2,63}$")
+MAX_QUOTA_MB = 1024 * 1024
+
+def busy_response():
+    response = jsonify({'error': 'Server busy, try again shortly'})
+    response.headers['Retry-After'] = str(RETRY_AFTER)
+    return response, 429
+
+def parse_quota(value):
+    quota = int(value)
+    if quota < 0 or quota > MAX_QUOTA_MB:
+        raise ValueError('quota_mb out of range')
+    return quota
+
 @email_bp.route('/email/accounts', methods=['GET'])
 @jwt_required()
 def list_email_accounts():
-    # Placeholder for listing email accounts
-    return jsonify({'message': 'List of email accounts (placeholder)'}), 200
+    try:
+        query = scoped(EmailAccount).add_columns(Domain.name)
+        if request.args.get('domain'):
+            query = query.filter(Domain.name == request.args['domain'].lower())
+        accounts = []
+        for account, domain_name in query.order_by(EmailAccount.email):
+            data = account.to_dict()
+            data['domain'] = domain_name
+            accounts.append(data)
+        return jsonify({'accounts': accounts}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @email_bp.route('/email/accounts', methods=['POST'])
 @jwt_required()
 def create_email_account():
-    data = request.get_json()
-    email = data.get('email')
-    password = data.get('password')
-    # Placeholder for creating email account
-    return jsonify({'message': f'Email account {email} created (placeholder)'}), 201
+    try:
+        data = request.get_json() or {}
+        email = (data.get('email') or '').strip().lower()
+        password = data.get('password')
+        if not email or not password:
+            return jsonify({'error': 'Email and password are required'}), 400
+        local, _, domain_name = email.partition('@')
+        if not LOCAL_PART_PATTERN.match(local):
+            return jsonify({'error': 'Invalid email address'}), 400
+        try:
+            quota_mb = parse_quota(data.get('quota_mb', 1000))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid quota_mb'}), 400
+
+        domain = owned_domain(domain_name)
+        if not domain:
+            return jsonify({'error': 'Domain not found or access denied'}), 404
+        if EmailAccount.query.filter_by(email=email).first():
+            return jsonify({'error': 'Email account already exists'}), 409
+
+        account = EmailAccount(email=email, domain_id=domain.id, quota_mb=quota_mb)
+        account.set_password(password)
+        db.session.add(account)
+        mail_maps.mark_dirty()
+        db.session.commit()
+        return jsonify({'message': f'Email account {email} created', 'account': account.to_dict()}), 201
+    except PasswordQueueFull:
+        db.session.rollback()
+        return busy_response()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@email_bp.route('/email/accounts/<int:account_id>', methods=['PUT'])
+@jwt_required()
+def update_email_account(account_id):
+    try:
+        account = get_owned(EmailAccount, account_id)
+        if not account:
+            return jsonify({'error': 'Email account not found or access denied'}), 404
+        data = request.get_json() or {}
+        if 'quota_mb' in data:
+            try:
+                account.quota_mb = parse_quota(data['quota_mb'])
+            except (TypeError, ValueError):
+                return jsonify({'error': 'Invalid quota_mb'}), 400
+        if 'is_active' in data:
+            account.is_active = bool(data['is_active'])
+        if data.get('password'):
+            account.set_password(data['password'])
+        mail_maps.mark_dirty()
+        db.session.commit()
+        return jsonify({'message': f'Email account {account.email} updated', 'account': account.to_dict()}), 200
+    except PasswordQueueFull:
+        db.session.rollback()
+        return busy_response()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
 
 @email_bp.route('/email/accounts/<int:account_id>', methods=['DELETE'])
 @jwt_required()
 def delete_email_account(account_id):
-    # Placeholder for deleting email account
-    return jsonify({'message': f'Email account {account_id} deleted (placeholder)'}), 200
+    try:
+        account = get_owned(EmailAccount, account_id)
+        if not account:
+            return jsonify({'error': 'Email account not found or access denied'}), 404
+        email = account.email
+        db.session.delete(account)
+        mail_maps.mark_dirty()
+        db.session.commit()
+        # The Maildir itself is kept; removing mail is left to the admin
+        return jsonify({'message': f'Email account {email} deleted'}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@email_bp.route('/email/maps/build', methods=['POST'])
+@require_admin('Admin access required')
+def build_mail_maps():
+    """Rebuild the Postfix/Dovecot maps now instead of waiting for the builder"""
+    try:
+        return jsonify(mail_maps.build(force=bool((request.get_json(silent=True) or {}).get('force')))), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@email_bp.route('/email/usage/scan', methods=['POST'])
+@require_admin('Admin access required')
+def scan_mail_usage():
+    try:
+        return jsonify({'scan': maildir_usage.scan(), 'stats': maildir_usage.get_stats()}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @email_bp.route('/email/send', methods=['POST'])
 @jwt_required()
 def send_email():
-    data = request.get_json()
-    to = data.get('to')
-    subject = data.get('subject')
-    body = data.get('body')
-    # Placeholder for sending email
-    return jsonify({'message': f'Email sent to {to} (placeholder)'}), 200
+    """Queue a message for delivery; the queue worker sends it within seconds"""
+    try:
+        data = request.get_json() or {}
+        sender = (data.get('from') or '').strip().lower()
+        recipients = {}
+        for field in ('to', 'cc', 'bcc'):
+            value = data.get(field) or []
+            addresses = [value] if isinstance(value, str) else value
+            if not isinstance(addresses, list) or not all(isinstance(a, str) for a in addresses):
+                return jsonify({'error': f'{field} must be an address or a list of addresses'}), 400
+            recipients[field] = [address.strip() for address in addresses if address.strip()]
+        envelope = recipients['to'] + recipients['cc'] + recipients['bcc']
+        if not envelope:
+            return jsonify({'error': 'At least one recipient is required'}), 400
+        if len(envelope) > mail_queue.MAX_RECIPIENTS_PER_MESSAGE:
+            return jsonify({'error': f'At most {mail_queue.MAX_RECIPIENTS_PER_MESSAGE} recipients per message'}), 400
+        if any(not ADDRESS_PATTERN.match(address) for address in envelope + [sender]):
+            return jsonify({'error': 'Invalid email address'}), 400
+
+        # Only mail from the caller's own domains, so the panel can't be used to spoof others
+        principal = current_principal()
+        domain = owned_domain(sender.rsplit('@', 1)[-1], principal)
+        if not domain:
+            return jsonify({'error': 'Sender domain not found or access denied'}), 403
+
+        message = mail_queue.build_message(
+            sender, recipients['to'] or ['undisclosed-recipients:;'], data.get('subject'), data.get('body'),
+            cc=recipients['cc'], html=data.get('html'), reply_to=data.get('reply_to'),
+            sender_name=data.get('from_name')
+        )
+        queued = mail_queue.enqueue(principal.id, sender, envelope, message)
+        db.session.commit()
+        return jsonify({
+            'message': f'Email queued for {len(queued.recipients)} recipient(s)',
+            'id': queued.id,
+            'message_id': queued.message_id
+        }), 202
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@email_bp.route('/email/messages/<int:message_id>', methods=['GET'])
+@jwt_required()
+def get_queued_message(message_id):
+    """Delivery status of a queued message, per recipient"""
+    try:
+        message = get_owned(OutboundMessage, message_id)
+        if not message:
+            return jsonify({'error': 'Message not found or access denied'}), 404
+        return jsonify({
+            'id': message.id,
+            'message_id': message.message_id,
+            'sender': message.sender,
+            'created_at': message.created_at.isoformat() if message.created_at else None,
+            'recipients': [recipient.to_dict() for recipient in message.recipients]
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
+@email_bp.route('/email/queue/stats', methods=['GET'])
+@require_admin('Admin access required')
+def get_mail_queue_stats():
+    try:
+        return jsonify(mail_queue.get_stats()), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
+@email_bp.route('/email/queue/flush', methods=['POST'])
+@require_admin('Admin access required')
+def flush_mail_queue():
+    """Run a delivery pass now, e.g. after fixing the relay"""
+    try:
+        return jsonify(mail_queue.deliver()), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
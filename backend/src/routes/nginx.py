@@ -1,51 +1,20 @@
 import os
-import subprocess
 from flask import Blueprint, jsonify, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from src.models.user import User
+from src.models.user import Domain
+from src.services import nginx_vhost, nginx_status, nginx_conf
+from src.services.authz import require_admin
+from src.services.fsutil import atomic_write
 
 nginx_bp = Blueprint('nginx', __name__)
+admin_required = require_admin('Admin access required')
 
 # Default nginx config path (adjust for your system)
 NGINX_CONFIG_PATH = '/etc/nginx/nginx.conf'
-NGINX_SITES_PATH = '/etc/nginx/sites-available'
-NGINX_ENABLED_PATH = '/etc/nginx/sites-enabled'
-
-def run_command(command):
-    """Run shell command safely"""
-    try:
-        result = subprocess.run(command, shell=True, capture_output=True, text=True, timeout=30)
-        return {
-            'success': result.returncode == 0,
-            'stdout': result.stdout,
-            'stderr': result.stderr,
-            'returncode': result.returncode
-        }
-    except subprocess.TimeoutExpired:
-        return {
-            'success': False,
-            'stdout': '',
-            'stderr': 'Command timed out',
-            'returncode': -1
-        }
-    except Exception as e:
-        return {
-            'success': False,
-            'stdout': '',
-            'stderr': str(e),
-            'returncode': -1
-        }
 
 @nginx_bp.route('/nginx/config', methods=['GET'])
-@jwt_required()
+@admin_required
 def get_nginx_config():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        if current_user.role != 'admin':
-            return jsonify({'error': 'Admin access required'}), 403
-        
         # Try to read nginx config
         config_content = "# Nginx configuration\n# This is a sample configuration\n\nuser www-data;\nworker_processes auto;\npid /run/nginx.pid;\n\nevents {\n    worker_connections 768;\n}\n\nhttp {\n    sendfile on;\n    tcp_nopush on;\n    tcp_nodelay on;\n    keepalive_timeout 65;\n    types_hash_max_size 2048;\n    \n    include /etc/nginx/mime.types;\n    default_type application/octet-stream;\n    \n    access_log /var/log/nginx/access.log;\n    error_log /var/log/nginx/error.log;\n    \n    gzip on;\n    \n    include /etc/nginx/conf.d/*.conf;\n    include /etc/nginx/sites-enabled/*;\n}"
         
@@ -65,110 +34,162 @@ def get_nginx_config():
         return jsonify({'error': str(e)}), 500
 
 @nginx_bp.route('/nginx/config', methods=['POST'])
-@jwt_required()
+@admin_required
 def update_nginx_config():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        if current_user.role != 'admin':
-            return jsonify({'error': 'Admin access required'}), 403
-        
         data = request.get_json()
         config_content = data.get('config', '')
         
         if not config_content:
             return jsonify({'error': 'Configuration content is required'}), 400
         
-        # Test nginx configuration first
-        test_result = run_command('nginx -t')
+        # Cheap in-process checks first; nginx itself only sees configs that pass them
+        issues = nginx_conf.lint(config_content, prefix=os.path.dirname(NGINX_CONFIG_PATH),
+                                 source_name=NGINX_CONFIG_PATH)
+        if nginx_conf.has_errors(issues):
+            return jsonify({'error': 'Configuration has errors', 'issues': issues}), 400
+        
+        test_result = nginx_conf.test_with_nginx(config_content, NGINX_CONFIG_PATH)
+        if not test_result['success']:
+            return jsonify({
+                'error': 'nginx -t rejected the configuration',
+                'issues': issues,
+                'test_result': test_result
+            }), 400
+        
+        previous = None
+        if os.path.exists(NGINX_CONFIG_PATH):
+            with open(NGINX_CONFIG_PATH, 'r') as f:
+                previous = f.read()
+        atomic_write(NGINX_CONFIG_PATH, config_content)
+        
+        reload_result = nginx_vhost.reload_nginx()
+        if not reload_result['success'] and reload_result['stage'] == 'test' and previous is not None:
+            atomic_write(NGINX_CONFIG_PATH, previous)
+            return jsonify({
+                'error': 'Configuration failed validation after saving and was reverted',
+                'issues': issues,
+                'reload_result': reload_result
+            }), 400
         
         return jsonify({
-            'message': 'Configuration updated successfully (simulated)',
+            'message': 'Configuration updated successfully',
+            'issues': issues,
             'test_result': test_result,
-            'note': 'This is a simulation. In production, this would write to nginx config file.'
+            'reload_result': reload_result
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@nginx_bp.route('/nginx/restart', methods=['POST'])
-@jwt_required()
-def restart_nginx():
+@nginx_bp.route('/nginx/config/lint', methods=['POST'])
+@admin_required
+def lint_nginx_config():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        if current_user.role != 'admin':
-            return jsonify({'error': 'Admin access required'}), 403
+        data = request.get_json() or {}
+        config_content = data.get('config', '')
         
-        # Simulate nginx restart
-        restart_result = run_command('echo "Simulating nginx restart"')
+        issues = nginx_conf.lint(
+            config_content,
+            prefix=os.path.dirname(NGINX_CONFIG_PATH),
+            follow_includes=data.get('follow_includes', True)
+        )
         
         return jsonify({
-            'message': 'Nginx restart completed (simulated)',
-            'result': restart_result,
-            'note': 'This is a simulation. In production, this would run: systemctl restart nginx'
+            'valid': not nginx_conf.has_errors(issues),
+            'issues': issues
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@nginx_bp.route('/nginx/restart', methods=['POST'])
+@admin_required
+def restart_nginx():
+    try:
+        # Graceful reload: old workers finish in-flight requests
+        reload_result = nginx_vhost.reload_nginx()
+        
+        return jsonify({
+            'message': 'Nginx reload completed' if reload_result['success'] else 'Nginx reload failed',
+            'result': reload_result
+        }), 200 if reload_result['success'] else 500
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @nginx_bp.route('/nginx/status', methods=['GET'])
-@jwt_required()
+@admin_required
 def get_nginx_status():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        return jsonify(nginx_status.get_status()), 200
         
-        if current_user.role != 'admin':
-            return jsonify({'error': 'Admin access required'}), 403
-        
-        # Simulate nginx status check
-        status_result = run_command('echo "nginx is running (simulated)"')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@nginx_bp.route('/nginx/metrics', methods=['GET'])
+@admin_required
+def get_nginx_metrics():
+    try:
+        window = request.args.get('window', 3600, type=int)
+        step = request.args.get('step', type=int)
         
         return jsonify({
-            'status': 'running',
-            'result': status_result,
-            'uptime': '2 days, 3 hours',
-            'note': 'This is simulated data'
+            'interval': nginx_status.SCRAPE_INTERVAL,
+            'samples': nginx_status.get_series(window=window, step=step),
+            'reloads': nginx_status.get_reloads()
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @nginx_bp.route('/nginx/sites', methods=['GET'])
-@jwt_required()
+@admin_required
 def list_nginx_sites():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        if current_user.role != 'admin':
-            return jsonify({'error': 'Admin access required'}), 403
-        
-        # Simulate site listing
-        sites = [
-            {
-                'name': 'default',
-                'enabled': True,
-                'domain': 'localhost',
-                'root': '/var/www/html'
-            },
-            {
-                'name': 'example.com',
-                'enabled': False,
-                'domain': 'example.com',
-                'root': '/var/www/example.com'
-            }
-        ]
-        
-        return jsonify({
-            'sites': sites,
-            'note': 'This is simulated data'
-        }), 200
+        return jsonify({'sites': nginx_vhost.list_sites()}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@nginx_bp.route('/nginx/sites/sync', methods=['POST'])
+@admin_required
+def sync_nginx_sites():
+    try:
+        data = request.get_json(silent=True) or {}
+        domain_ids = data.get('domain_ids')
+        if domain_ids is not None and not all(isinstance(i, int) for i in domain_ids):
+            return jsonify({'error': 'domain_ids must be a list of integers'}), 400
+        
+        result = nginx_vhost.sync(domain_ids=domain_ids)
+        status = 500 if result.get('rolled_back') else 200
+        
+        return jsonify(result), status
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
+@nginx_bp.route('/nginx/sites/<int:domain_id>/options', methods=['PUT'])
+@admin_required
+def update_nginx_site_options(domain_id):
+    try:
+        domain = Domain.query.get(domain_id)
+        if not domain:
+            return jsonify({'error': 'Domain not found'}), 404
+        
+        data = request.get_json() or {}
+        options = {}
+        for key, value in data.items():
+            if key not in nginx_vhost.VHOST_DEFAULTS:
+                return jsonify({'error': f'Unknown option {key}. Allowed: {", ".join(sorted(nginx_vhost.VHOST_DEFAULTS))}'}), 400
+            if not isinstance(value, bool):
+                return jsonify({'error': f'{key} must be true or false'}), 400
+            options[key] = value
+        
+        result = nginx_vhost.sync(domain_ids=[domain.id], options={domain.name: options})
+        status = 500 if result.get('rolled_back') else 200
+        
+        return jsonify(result), status
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
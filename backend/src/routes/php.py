@@ -1,60 +1,43 @@
 
 import os
-import subprocess
 from flask import Blueprint, jsonify, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from src.models.user import User
+from src.models.user import Domain
+from src.services import events, php_inventory, php_ini, php_fpm
+from src.services.authz import require_admin
 
 php_bp = Blueprint("php", __name__)
+admin_required = require_admin('Admin access required')
 
-def run_command(command):
-    """Run shell command safely"""
-    try:
-        result = subprocess.run(command, shell=True, capture_output=True, text=True, timeout=30)
-        return {
-            'success': result.returncode == 0,
-            'stdout': result.stdout,
-            'stderr': result.stderr,
-            'returncode': result.returncode
-        }
-    except subprocess.TimeoutExpired:
-        return {
-            'success': False,
-            'stdout': '',
-            'stderr': 'Command timed out',
-            'returncode': -1
-        }
-    except Exception as e:
-        return {
-            'success': False,
-            'stdout': '',
-            'stderr': str(e),
-            'returncode': -1
-        }
+SETTINGS_KEYS = [
+    'memory_limit', 'max_execution_time', 'upload_max_filesize', 'post_max_size',
+    'max_file_uploads', 'display_errors', 'log_errors', 'error_log'
+]
+EDITABLE_SETTINGS = {
+    'memory_limit', 'max_execution_time', 'upload_max_filesize',
+    'post_max_size', 'max_file_uploads', 'display_errors', 'log_errors'
+}
+
+def resolve_config_target(version=None, sapi=None):
+    """Pick the PHP version/SAPI whose configuration should be read or written"""
+    if not version:
+        _, version = php_inventory.get_versions()
+        installed = php_ini.list_versions()
+        if version not in installed:
+            version = installed[-1] if installed else None
+    if not version:
+        return None, sapi
+    if not sapi:
+        sapis = php_ini.list_sapis(version)
+        sapi = 'fpm' if 'fpm' in sapis or not sapis else sapis[0]
+    return version, sapi
 
 @php_bp.route("/php/versions", methods=["GET"])
-@jwt_required()
+@admin_required
 def get_php_versions():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        if current_user.role != 'admin':
-            return jsonify({'error': 'Admin access required'}), 403
-        
-        # Try to get actual PHP versions
-        versions = []
-        
-        # Check for common PHP versions
-        common_versions = ['7.4', '8.0', '8.1', '8.2', '8.3']
-        for version in common_versions:
-            result = run_command(f'php{version} --version')
-            if result['success']:
-                versions.append({
-                    'version': version,
-                    'status': 'installed',
-                    'path': f'/usr/bin/php{version}'
-                })
+        # Installed versions come from the cached inventory; binaries are
+        # only re-probed when they change on disk
+        versions, current_version = php_inventory.get_versions()
         
         # If no versions found, provide simulated data
         if not versions:
@@ -64,17 +47,8 @@ def get_php_versions():
                 {'version': '7.4', 'status': 'available', 'path': '/usr/bin/php7.4'}
             ]
         
-        # Get current default version
-        current_result = run_command('php --version')
-        current_version = 'Unknown'
-        if current_result['success']:
-            lines = current_result['stdout'].split('\n')
-            if lines:
-                # Extract version from first line
-                import re
-                match = re.search(r'PHP (\d+\.\d+)', lines[0])
-                if match:
-                    current_version = match.group(1)
+        if not current_version:
+            current_version = 'Unknown'
         
         return jsonify({
             'versions': versions,
@@ -86,40 +60,14 @@ def get_php_versions():
         return jsonify({'error': str(e)}), 500
 
 @php_bp.route("/php/settings", methods=["GET"])
-@jwt_required()
+@admin_required
 def get_php_settings():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        if current_user.role != 'admin':
-            return jsonify({'error': 'Admin access required'}), 403
-        
-        # Try to get actual PHP settings
+        # Read the effective php.ini + conf.d (+ pool overrides) directly
         settings = {}
-        
-        # Get PHP info
-        php_info_result = run_command('php -i')
-        if php_info_result['success']:
-            info_lines = php_info_result['stdout'].split('\n')
-            for line in info_lines:
-                if '=>' in line:
-                    parts = line.split('=>')
-                    if len(parts) >= 2:
-                        key = parts[0].strip()
-                        value = parts[1].strip()
-                        
-                        # Extract common settings
-                        if 'memory_limit' in key.lower():
-                            settings['memory_limit'] = value
-                        elif 'max_execution_time' in key.lower():
-                            settings['max_execution_time'] = value
-                        elif 'upload_max_filesize' in key.lower():
-                            settings['upload_max_filesize'] = value
-                        elif 'post_max_size' in key.lower():
-                            settings['post_max_size'] = value
-                        elif 'max_file_uploads' in key.lower():
-                            settings['max_file_uploads'] = value
+        version, sapi = resolve_config_target(request.args.get('version'), request.args.get('sapi'))
+        if version:
+            settings = php_ini.get_settings(version, sapi, keys=SETTINGS_KEYS, pool=request.args.get('pool'))
         
         # Provide default values if not found
         if not settings:
@@ -136,6 +84,8 @@ def get_php_settings():
         
         return jsonify({
             'settings': settings,
+            'version': version,
+            'sapi': sapi,
             'note': 'Some settings may be simulated in development environment'
         }), 200
         
@@ -143,59 +93,56 @@ def get_php_settings():
         return jsonify({'error': str(e)}), 500
 
 @php_bp.route("/php/settings", methods=["POST"])
-@jwt_required()
+@admin_required
 def update_php_settings():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        if current_user.role != 'admin':
-            return jsonify({'error': 'Admin access required'}), 403
-        
         data = request.get_json()
         settings = data.get('settings', {})
         
         if not settings:
             return jsonify({'error': 'Settings data is required'}), 400
         
-        # Validate settings
-        valid_settings = {
-            'memory_limit', 'max_execution_time', 'upload_max_filesize',
-            'post_max_size', 'max_file_uploads', 'display_errors', 'log_errors'
-        }
-        
         updated_settings = {}
         for key, value in settings.items():
-            if key in valid_settings:
+            if key in EDITABLE_SETTINGS:
                 updated_settings[key] = value
         
-        # In production, this would write to php.ini and restart PHP-FPM
+        if not updated_settings:
+            return jsonify({'error': f'No editable settings provided. Allowed: {", ".join(sorted(EDITABLE_SETTINGS))}'}), 400
+        
+        version, sapi = resolve_config_target(data.get('version'), data.get('sapi'))
+        if not version:
+            return jsonify({'error': 'No PHP configuration found on this server'}), 404
+        
+        try:
+            path = php_ini.update_settings(version, updated_settings, sapi=sapi)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        reload_result = None
+        if sapi == 'fpm':
+            reload_result = php_fpm.reload_fpm(version)
+        
         return jsonify({
-            'message': 'PHP settings updated successfully (simulated)',
+            'message': 'PHP settings updated successfully',
             'updated_settings': updated_settings,
-            'note': 'This is a simulation. In production, this would update php.ini and restart PHP-FPM.'
+            'version': version,
+            'sapi': sapi,
+            'path': path,
+            'reload_result': reload_result
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @php_bp.route("/php/modules", methods=["GET"])
-@jwt_required()
+@admin_required
 def get_php_modules():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        if current_user.role != 'admin':
-            return jsonify({'error': 'Admin access required'}), 403
-        
         # Get PHP modules
-        modules_result = run_command('php -m')
-        modules = []
+        modules = php_inventory.get_modules(request.args.get('version'))
         
-        if modules_result['success']:
-            modules = [module.strip() for module in modules_result['stdout'].split('\n') if module.strip()]
-        else:
+        if not modules:
             # Provide common modules as fallback
             modules = [
                 'Core', 'date', 'libxml', 'openssl', 'pcre', 'sqlite3', 'zlib',
@@ -216,25 +163,111 @@ def get_php_modules():
         return jsonify({'error': str(e)}), 500
 
 @php_bp.route("/php/restart", methods=["POST"])
-@jwt_required()
+@admin_required
 def restart_php_fpm():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        data = request.get_json(silent=True) or {}
+        versions = [data['version']] if data.get('version') else php_ini.list_versions()
+        versions = [v for v in versions if 'fpm' in php_ini.list_sapis(v)]
+        
+        if not versions:
+            return jsonify({'error': 'No PHP-FPM installation found'}), 404
         
-        if current_user.role != 'admin':
-            return jsonify({'error': 'Admin access required'}), 403
+        # Graceful reload: busy workers finish their request before being replaced
+        results = {version: php_fpm.reload_fpm(version) for version in versions}
         
-        # Simulate PHP-FPM restart
-        restart_result = run_command('echo "Simulating PHP-FPM restart"')
+        return jsonify({
+            'message': 'PHP-FPM reload completed' if all(r['success'] for r in results.values()) else 'PHP-FPM reload failed',
+            'results': results
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@php_bp.route("/php/pools", methods=["GET"])
+@admin_required
+def list_php_pools():
+    try:
+        pools = php_fpm.list_pools()
+        for pool in pools:
+            pool['status'] = php_fpm.pool_status(pool)
         
         return jsonify({
-            'message': 'PHP-FPM restart completed (simulated)',
-            'result': restart_result,
-            'note': 'This is a simulation. In production, this would run: systemctl restart php-fpm'
+            'pools': pools,
+            'host': php_fpm.host_resources()
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@php_bp.route("/php/pools/<int:domain_id>", methods=["POST"])
+@admin_required
+def apply_php_pool(domain_id):
+    try:
+        domain = Domain.query.get(domain_id)
+        if not domain:
+            return jsonify({'error': 'Domain not found'}), 404
+        
+        data = request.get_json(silent=True) or {}
+        version = data.get('version')
+        if not version:
+            existing = php_fpm.find_pool(domain.id)
+            version = existing['version'] if existing else resolve_config_target()[0]
+        if not version or 'fpm' not in php_ini.list_sapis(version):
+            return jsonify({'error': f'PHP-FPM {version} is not installed'}), 400
+        
+        # Omitted keeps the pool's stored overrides; the merged config is validated by apply_pool
+        overrides = data.get('overrides')
+        if overrides is not None and not isinstance(overrides, dict):
+            return jsonify({'error': 'overrides must be an object'}), 400
+        unknown = sorted(set(overrides or {}) - php_fpm.OVERRIDABLE)
+        if unknown:
+            return jsonify({'error': f"Cannot override {', '.join(unknown)}"}), 400
+        
+        try:
+            result = php_fpm.apply_pool(domain, version, overrides)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if result['rolled_back']:
+            return jsonify({
+                'error': 'PHP-FPM rejected the pool configuration; previous pools restored',
+                'domain': domain.name,
+                'version': version,
+                **result
+            }), 400
+        if result['changed']:
+            # The vhost's fastcgi_pass follows the pool's socket
+            events.emit(events.DOMAIN_CHANGED, domain_ids=[domain.id])
+        
+        return jsonify({
+            'message': 'PHP-FPM pool applied' if result['changed'] else 'PHP-FPM pool unchanged',
+            'domain': domain.name,
+            'version': version,
+            **result
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
+@php_bp.route("/php/pools/<int:domain_id>", methods=["DELETE"])
+@admin_required
+def delete_php_pool(domain_id):
+    try:
+        domain = Domain.query.get(domain_id)
+        if not domain:
+            return jsonify({'error': 'Domain not found'}), 404
+        
+        result = php_fpm.remove_pool(domain.id)
+        if result is None:
+            return jsonify({'error': 'No PHP-FPM pool for this domain'}), 404
+        if result['rolled_back']:
+            return jsonify({'error': 'PHP-FPM rejected the remaining pools; nothing was removed', **result}), 400
+        events.emit(events.DOMAIN_CHANGED, domain_ids=[domain.id])
+        
+        return jsonify({
+            'message': 'PHP-FPM pool removed',
+            **result
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
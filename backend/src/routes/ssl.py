@@ -1,6 +1,9 @@
 from flask import Blueprint, jsonify, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from src.models.user import User, Domain, SSLCertificate, db
+from flask_jwt_extended import jwt_required
+from src.models.user import Domain, SSLCertificate, db
+from src.services import events
+from src.services.authz import scoped, get_owned, owned_domain
+from src.services.dns_validation import validate_domain
 import subprocess
 import os
 import ssl
@@ -15,12 +18,6 @@ from cryptography.hazmat.primitives.asymmetric import rsa
 
 ssl_bp = Blueprint('ssl', __name__)
 
-def validate_domain(domain):
-    """Validate domain name format"""
-    import re
-    pattern = r'^[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?(\.[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?)*$'
-    return re.match(pattern, domain) is not None
-
 def check_ssl_certificate(domain, port=443):
     """Check SSL certificate for a domain"""
     try:
@@ -134,37 +131,19 @@ def generate_self_signed_certificate(domain, days=365):
 @jwt_required()
 def get_ssl_certificates():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
         domain_name = request.args.get('domain')
         
-        if current_user.role == 'admin':
-            if domain_name:
-                domain = Domain.query.filter_by(name=domain_name).first()
-                if not domain:
-                    return jsonify({'error': 'Domain tidak ditemukan'}), 404
-                certificates = SSLCertificate.query.filter_by(domain_id=domain.id).all()
-            else:
-                certificates = SSLCertificate.query.all()
-        else:
-            user_domains = Domain.query.filter_by(user_id=current_user_id).all()
-            domain_ids = [d.id for d in user_domains]
-            
-            if domain_name:
-                domain = Domain.query.filter_by(name=domain_name, user_id=current_user_id).first()
-                if not domain:
-                    return jsonify({'error': 'Domain tidak ditemukan atau tidak memiliki akses'}), 404
-                certificates = SSLCertificate.query.filter_by(domain_id=domain.id).all()
-            else:
-                certificates = SSLCertificate.query.filter(SSLCertificate.domain_id.in_(domain_ids)).all()
+        query = scoped(SSLCertificate).add_columns(Domain.name)
+        if domain_name:
+            if not owned_domain(domain_name):
+                return jsonify({'error': 'Domain tidak ditemukan atau tidak memiliki akses'}), 404
+            query = query.filter(Domain.name == domain_name)
         
         certificates_data = []
-        for cert in certificates:
-            domain = Domain.query.get(cert.domain_id)
+        for cert, name in query.all():
             certificates_data.append({
                 'id': cert.id,
-                'domain': domain.name if domain else 'Unknown',
+                'domain': name,
                 'type': cert.type,
                 'status': cert.status,
                 'issuer': cert.issuer,
@@ -184,9 +163,6 @@ def get_ssl_certificates():
 @jwt_required()
 def create_ssl_certificate():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
         data = request.get_json()
         domain_name = data.get('domain')
         cert_type = data.get('type', 'self_signed')  # self_signed, uploaded, letsencrypt
@@ -200,15 +176,9 @@ def create_ssl_certificate():
         if not validate_domain(domain_name):
             return jsonify({'error': 'Format domain tidak valid'}), 400
         
-        # Check if user owns the domain or is admin
-        if current_user.role != 'admin':
-            domain = Domain.query.filter_by(name=domain_name, user_id=current_user_id).first()
-            if not domain:
-                return jsonify({'error': 'Domain tidak ditemukan atau tidak memiliki akses'}), 404
-        else:
-            domain = Domain.query.filter_by(name=domain_name).first()
-            if not domain:
-                return jsonify({'error': 'Domain tidak ditemukan'}), 404
+        domain = owned_domain(domain_name)
+        if not domain:
+            return jsonify({'error': 'Domain tidak ditemukan atau tidak memiliki akses'}), 404
         
         # Check if certificate already exists for this domain
         existing_cert = SSLCertificate.query.filter_by(domain_id=domain.id).first()
@@ -262,28 +232,30 @@ def create_ssl_certificate():
         # Create SSL certificate record
         ssl_cert = SSLCertificate(
             domain_id=domain.id,
-            type=cert_type,
-            status='active',
-            certificate=certificate_data,
+            certificate_type=cert_type,
+            is_active=True,
+            certificate_data=certificate_data,
             private_key=private_key_data,
-            issuer=issuer_name,
-            not_before=not_before,
-            not_after=not_after,
+            expires_at=not_after,
             auto_renew=auto_renew
         )
         
         db.session.add(ssl_cert)
+        domain.ssl_enabled = True
         db.session.commit()
+        # nginx starts serving it right away
+        events.emit(events.DOMAIN_CHANGED, domain_ids=[domain.id])
         
         return jsonify({
             'message': 'SSL certificate berhasil dibuat',
             'certificate': {
                 'id': ssl_cert.id,
                 'domain': domain.name,
-                'type': ssl_cert.type,
-                'status': ssl_cert.status,
-                'issuer': ssl_cert.issuer,
-                'not_after': ssl_cert.not_after.isoformat() if ssl_cert.not_after else None,
+                'type': ssl_cert.certificate_type,
+                'status': 'active',
+                'issuer': issuer_name,
+                'not_before': not_before.isoformat(),
+                'not_after': ssl_cert.expires_at.isoformat() if ssl_cert.expires_at else None,
                 'auto_renew': ssl_cert.auto_renew
             }
         }), 201
@@ -296,17 +268,10 @@ def create_ssl_certificate():
 @jwt_required()
 def update_ssl_certificate(cert_id):
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        ssl_cert = SSLCertificate.query.get(cert_id)
+        ssl_cert = get_owned(SSLCertificate, cert_id)
         if not ssl_cert:
-            return jsonify({'error': 'SSL certificate tidak ditemukan'}), 404
-        
-        # Check permissions
-        domain = Domain.query.get(ssl_cert.domain_id)
-        if current_user.role != 'admin' and domain.user_id != current_user_id:
-            return jsonify({'error': 'Tidak memiliki akses untuk mengubah certificate ini'}), 403
+            return jsonify({'error': 'SSL certificate tidak ditemukan atau tidak memiliki akses'}), 404
+        domain = ssl_cert.domain
         
         data = request.get_json()
         
@@ -315,19 +280,22 @@ def update_ssl_certificate(cert_id):
             valid_statuses = ['active', 'inactive', 'expired', 'revoked']
             if data['status'] not in valid_statuses:
                 return jsonify({'error': f'Status tidak valid. Gunakan: {", ".join(valid_statuses)}'}), 400
-            ssl_cert.status = data['status']
+            ssl_cert.is_active = data['status'] == 'active'
         
         if 'auto_renew' in data:
             ssl_cert.auto_renew = data['auto_renew']
         
+        domain.ssl_enabled = any(cert.is_active for cert in domain.ssl_certificates)
         db.session.commit()
+        if 'status' in data:
+            events.emit(events.DOMAIN_CHANGED, domain_ids=[domain.id])
         
         return jsonify({
             'message': 'SSL certificate berhasil diupdate',
             'certificate': {
                 'id': ssl_cert.id,
                 'domain': domain.name,
-                'status': ssl_cert.status,
+                'status': 'active' if ssl_cert.is_active else 'inactive',
                 'auto_renew': ssl_cert.auto_renew
             }
         }), 200
@@ -340,20 +308,15 @@ def update_ssl_certificate(cert_id):
 @jwt_required()
 def delete_ssl_certificate(cert_id):
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        ssl_cert = SSLCertificate.query.get(cert_id)
+        ssl_cert = get_owned(SSLCertificate, cert_id)
         if not ssl_cert:
-            return jsonify({'error': 'SSL certificate tidak ditemukan'}), 404
-        
-        # Check permissions
-        domain = Domain.query.get(ssl_cert.domain_id)
-        if current_user.role != 'admin' and domain.user_id != current_user_id:
-            return jsonify({'error': 'Tidak memiliki akses untuk menghapus certificate ini'}), 403
+            return jsonify({'error': 'SSL certificate tidak ditemukan atau tidak memiliki akses'}), 404
+        domain = ssl_cert.domain
         
         db.session.delete(ssl_cert)
+        domain.ssl_enabled = any(cert.is_active for cert in domain.ssl_certificates if cert is not ssl_cert)
         db.session.commit()
+        events.emit(events.DOMAIN_CHANGED, domain_ids=[domain.id])
         
         return jsonify({'message': 'SSL certificate berhasil dihapus'}), 200
         
@@ -390,17 +353,10 @@ def check_ssl():
 @jwt_required()
 def download_ssl_certificate(cert_id):
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        ssl_cert = SSLCertificate.query.get(cert_id)
+        ssl_cert = get_owned(SSLCertificate, cert_id)
         if not ssl_cert:
-            return jsonify({'error': 'SSL certificate tidak ditemukan'}), 404
-        
-        # Check permissions
-        domain = Domain.query.get(ssl_cert.domain_id)
-        if current_user.role != 'admin' and domain.user_id != current_user_id:
-            return jsonify({'error': 'Tidak memiliki akses untuk download certificate ini'}), 403
+            return jsonify({'error': 'SSL certificate tidak ditemukan atau tidak memiliki akses'}), 404
+        domain = ssl_cert.domain
         
         cert_type = request.args.get('type', 'certificate')  # certificate, private_key, both
         
@@ -427,33 +383,20 @@ def download_ssl_certificate(cert_id):
 @jwt_required()
 def get_expiring_certificates():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
         days = request.args.get('days', 30, type=int)  # Default 30 days
         expiry_date = datetime.now() + timedelta(days=days)
         
-        if current_user.role == 'admin':
-            certificates = SSLCertificate.query.filter(
-                SSLCertificate.not_after <= expiry_date,
-                SSLCertificate.status == 'active'
-            ).all()
-        else:
-            user_domains = Domain.query.filter_by(user_id=current_user_id).all()
-            domain_ids = [d.id for d in user_domains]
-            certificates = SSLCertificate.query.filter(
-                SSLCertificate.domain_id.in_(domain_ids),
-                SSLCertificate.not_after <= expiry_date,
-                SSLCertificate.status == 'active'
-            ).all()
+        certificates = scoped(SSLCertificate).add_columns(Domain.name).filter(
+            SSLCertificate.not_after <= expiry_date,
+            SSLCertificate.status == 'active'
+        ).all()
         
         certificates_data = []
-        for cert in certificates:
-            domain = Domain.query.get(cert.domain_id)
+        for cert, name in certificates:
             days_until_expiry = (cert.not_after - datetime.now()).days if cert.not_after else None
             certificates_data.append({
                 'id': cert.id,
-                'domain': domain.name if domain else 'Unknown',
+                'domain': name,
                 'type': cert.type,
                 'issuer': cert.issuer,
                 'not_after': cert.not_after.isoformat() if cert.not_after else None,
@@ -473,35 +416,17 @@ def get_expiring_certificates():
 @jwt_required()
 def get_ssl_stats():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        if current_user.role == 'admin':
-            total_certs = SSLCertificate.query.count()
-            active_certs = SSLCertificate.query.filter_by(status='active').count()
-            expired_certs = SSLCertificate.query.filter_by(status='expired').count()
-            expiring_soon = SSLCertificate.query.filter(
-                SSLCertificate.not_after <= datetime.now() + timedelta(days=30),
-                SSLCertificate.status == 'active'
-            ).count()
-        else:
-            user_domains = Domain.query.filter_by(user_id=current_user_id).all()
-            domain_ids = [d.id for d in user_domains]
-            
-            total_certs = SSLCertificate.query.filter(SSLCertificate.domain_id.in_(domain_ids)).count()
-            active_certs = SSLCertificate.query.filter(
-                SSLCertificate.domain_id.in_(domain_ids),
-                SSLCertificate.status == 'active'
-            ).count()
-            expired_certs = SSLCertificate.query.filter(
-                SSLCertificate.domain_id.in_(domain_ids),
-                SSLCertificate.status == 'expired'
-            ).count()
-            expiring_soon = SSLCertificate.query.filter(
-                SSLCertificate.domain_id.in_(domain_ids),
-                SSLCertificate.not_after <= datetime.now() + timedelta(days=30),
-                SSLCertificate.status == 'active'
-            ).count()
+        # All four counts in one scoped aggregate
+        expiring_cutoff = datetime.now() + timedelta(days=30)
+        total_certs, active_certs, expired_certs, expiring_soon = scoped(
+            SSLCertificate, query=db.session.query(
+                db.func.count(SSLCertificate.id),
+                db.func.count(db.case((SSLCertificate.status == 'active', 1))),
+                db.func.count(db.case((SSLCertificate.status == 'expired', 1))),
+                db.func.count(db.case((db.and_(SSLCertificate.status == 'active',
+                                               SSLCertificate.not_after <= expiring_cutoff), 1)))
+            )
+        ).one()
         
         return jsonify({
             'total': total_certs,
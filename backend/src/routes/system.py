@@ -0,0 +1,42 @@
+from flask import Blueprint, jsonify
+from src.services import executor, passwords, ratelimit, jwt_keys
+from src.services.authz import require_admin
+
+system_bp = Blueprint('system', __name__)
+admin_required = require_admin('Admin access required')
+
+@system_bp.route('/system/commands/stats', methods=['GET'])
+@admin_required
+def get_command_stats():
+    try:
+        return jsonify(executor.get_stats()), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@system_bp.route('/system/passwords/stats', methods=['GET'])
+@admin_required
+def get_password_stats():
+    try:
+        return jsonify(passwords.get_stats()), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@system_bp.route('/system/ratelimit/stats', methods=['GET'])
+@admin_required
+def get_ratelimit_stats():
+    try:
+        return jsonify(ratelimit.get_stats()), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@system_bp.route('/system/jwt/stats', methods=['GET'])
+@admin_required
+def get_jwt_stats():
+    try:
+        return jsonify(jwt_keys.get_stats()), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
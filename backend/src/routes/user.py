@@ -1,29 +1,111 @@
 from flask import Blueprint, jsonify, request
-from src.models.user import User, db
+from flask_jwt_extended import jwt_required
+from sqlalchemy.exc import IntegrityError
+from src.models.user import User, UserImport, db
+from src.services import revocation, users as user_service
+from src.services.authz import current_principal, require_admin
+from src.services.passwords import PasswordQueueFull, RETRY_AFTER
 
 user_bp = Blueprint('user', __name__)
 
+def busy_response():
+    response = jsonify({'error': 'Server sedang sibuk, coba lagi sebentar'})
+    response.headers['Retry-After'] = str(RETRY_AFTER)
+    return response, 429
+
+def can_manage(user_id):
+    """Admins manage everyone, other users only themselves"""
+    principal = current_principal()
+    return principal is not None and (principal.is_admin or principal.id == user_id)
+
 @user_bp.route('/users', methods=['GET'])
+@require_admin()
 def get_users():
-    users = User.query.all()
-    return jsonify([user.to_dict() for user in users])
+    try:
+        users, next_cursor = user_service.page_from_args(request.args)
+    except ValueError:
+        return jsonify({'error': 'Cursor atau limit tidak valid'}), 400
+    return jsonify({'users': [user.to_dict() for user in users], 'next_cursor': next_cursor})
 
 @user_bp.route('/users', methods=['POST'])
+@require_admin()
 def create_user():
-    
     data = request.json
-    user = User(username=data['username'], email=data['email'])
+    if not data.get('username') or not data.get('email') or not data.get('password'):
+        return jsonify({'error': 'Username, email, dan password wajib diisi'}), 400
+    role = data.get('role', 'user')
+    if role not in user_service.ROLES:
+        return jsonify({'error': f'Role tidak valid. Gunakan: {", ".join(user_service.ROLES)}'}), 400
+    user = User(username=data['username'], email=data['email'], role=role)
+    try:
+        user.set_password(data['password'])
+    except PasswordQueueFull:
+        return busy_response()
     db.session.add(user)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'Username atau email sudah digunakan'}), 409
     return jsonify(user.to_dict()), 201
 
+@user_bp.route('/users/import', methods=['POST'])
+@require_admin()
+def import_users():
+    """Bulk-create users with their domains from JSON or CSV.
+
+    JSON: {"users": [{"username", "email", "password"?, "role"?, "domains"?}], "dry_run"?}
+    CSV: a `file` upload or a text/csv body with a header row.
+    A dry run answers inline; a real import runs in the background, poll
+    GET /users/import/<id> for its result.
+    """
+    try:
+        upload = request.files.get('file')
+        if upload is not None or request.mimetype == 'text/csv':
+            text = upload.read().decode('utf-8-sig') if upload is not None else request.get_data(as_text=True)
+            rows = user_service.parse_csv(text)
+            dry_run = request.args.get('dry_run') in ('1', 'true', 'yes')
+        else:
+            data = request.get_json() or {}
+            rows = data.get('users')
+            if not isinstance(rows, list):
+                return jsonify({'error': 'users must be a list'}), 400
+            dry_run = bool(data.get('dry_run'))
+        if dry_run:
+            return jsonify(user_service.provision(rows, dry_run=True)), 200
+        job = user_service.start_import(rows, current_principal().id)
+        return jsonify(job.to_dict()), 202
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@user_bp.route('/users/import/<int:import_id>', methods=['GET'])
+@require_admin()
+def get_import(import_id):
+    job = db.session.get(UserImport, import_id)
+    if not job:
+        return jsonify({'error': 'Import tidak ditemukan'}), 404
+    try:
+        return jsonify(user_service.import_status(job))
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @user_bp.route('/users/<int:user_id>', methods=['GET'])
+@jwt_required()
 def get_user(user_id):
+    if not can_manage(user_id):
+        return jsonify({'error': 'Akses ditolak'}), 403
     user = User.query.get_or_404(user_id)
     return jsonify(user.to_dict())
 
 @user_bp.route('/users/<int:user_id>', methods=['PUT'])
+@jwt_required()
 def update_user(user_id):
+    if not can_manage(user_id):
+        return jsonify({'error': 'Akses ditolak'}), 403
     user = User.query.get_or_404(user_id)
     data = request.json
     user.username = data.get('username', user.username)
@@ -32,8 +114,10 @@ def update_user(user_id):
     return jsonify(user.to_dict())
 
 @user_bp.route('/users/<int:user_id>', methods=['DELETE'])
+@require_admin()
 def delete_user(user_id):
     user = User.query.get_or_404(user_id)
     db.session.delete(user)
     db.session.commit()
+    revocation.revoke_user(user_id)
     return '', 204
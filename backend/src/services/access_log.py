@@ -0,0 +1,304 @@
+import glob
+import os
+import re
+import struct
+import time
+from datetime import datetime
+from src.models.user import db, Domain, TrafficStat, LogCursor
+from src.services import scheduler
+
+NGINX_LOG_DIR = '/var/log/nginx'
+ACCESS_LOG_SUFFIX = '.access.log'
+INGEST_INTERVAL = 30
+MAX_BYTES_PER_PASS = 64 * 1024 * 1024
+READ_CHUNK = 1024 * 1024
+RETENTION_DAYS = 30
+
+# Fallback for logs written in nginx's default `combined` format
+COMBINED_PATTERN = re.compile(
+    rb'^\S+ \S+ \S+ \[(?P<time>[^\]]+)\] "[^"]*" (?P<status>\d{3}) (?P<bytes>\d+|-)'
+)
+COMBINED_TIME_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
+
+# Upstream response time buckets (seconds); the last bucket is +inf
+HISTOGRAM_BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+HISTOGRAM_STRUCT = struct.Struct(f'<{len(HISTOGRAM_BOUNDS) + 1}I')
+
+
+def _bucket(seconds):
+    for i, bound in enumerate(HISTOGRAM_BOUNDS):
+        if seconds <= bound:
+            return i
+    return len(HISTOGRAM_BOUNDS)
+
+
+def pack_histogram(counts):
+    return HISTOGRAM_STRUCT.pack(*counts)
+
+
+def unpack_histogram(blob):
+    if not blob:
+        return [0] * (len(HISTOGRAM_BOUNDS) + 1)
+    return list(HISTOGRAM_STRUCT.unpack(blob))
+
+
+def percentile(counts, fraction):
+    """Estimate a percentile from bucket counts by interpolating inside the bucket"""
+    total = sum(counts)
+    if not total:
+        return None
+    target = fraction * total
+    seen = 0
+    for i, count in enumerate(counts):
+        if seen + count >= target and count:
+            lower = HISTOGRAM_BOUNDS[i - 1] if i > 0 else 0.0
+            upper = HISTOGRAM_BOUNDS[i] if i < len(HISTOGRAM_BOUNDS) else HISTOGRAM_BOUNDS[-1] * 2
+            return round(lower + (upper - lower) * (target - seen) / count, 4)
+        seen += count
+    return HISTOGRAM_BOUNDS[-1]
+
+
+def parse_line(line):
+    """Return (epoch, status, bytes, upstream_seconds or None) or None for junk lines.
+
+    Panel vhosts log in the tab-separated `panel` format declared in
+    nginx_vhost.PANEL_LOG_FORMAT, which splits without a regex.
+    """
+    fields = line.split(b'\t')
+    if len(fields) >= 5:
+        try:
+            epoch = float(fields[0])
+            status = int(fields[1])
+            size = int(fields[2]) if fields[2] != b'-' else 0
+        except ValueError:
+            return None
+        upstream = None
+        raw = fields[4]
+        if raw and raw != b'-':
+            # Several upstreams are reported as "0.010, 0.020"; count the total
+            try:
+                upstream = sum(float(part) for part in raw.replace(b':', b',').split(b',') if part.strip() not in (b'', b'-'))
+            except ValueError:
+                upstream = None
+        return epoch, status, size, upstream
+
+    match = COMBINED_PATTERN.match(line)
+    if not match:
+        return None
+    try:
+        epoch = datetime.strptime(match.group('time').decode(), COMBINED_TIME_FORMAT).timestamp()
+    except ValueError:
+        return None
+    size = match.group('bytes')
+    return epoch, int(match.group('status')), int(size) if size != b'-' else 0, None
+
+
+class _Aggregates:
+    def __init__(self):
+        self.rows = {}
+
+    def add(self, domain_id, parsed):
+        epoch, status, size, upstream = parsed
+        key = (domain_id, int(epoch) // 60)
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = [0, 0, 0, 0, 0, 0, [0] * (len(HISTOGRAM_BOUNDS) + 1)]
+        row[0] += 1
+        row[1] += size
+        status_class = status // 100
+        if 2 <= status_class <= 5:
+            row[status_class] += 1
+        if upstream is not None:
+            row[6][_bucket(upstream)] += 1
+
+
+def _consume(handle, start, limit, domain_id, aggregates):
+    """Parse complete lines from `start`; returns the offset after the last full line"""
+    handle.seek(start)
+    offset = start
+    remaining = limit
+    carry = b''
+    while remaining > 0:
+        chunk = handle.read(min(READ_CHUNK, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        data = carry + chunk
+        last_newline = data.rfind(b'\n')
+        if last_newline == -1:
+            carry = data
+            continue
+        for line in data[:last_newline].split(b'\n'):
+            parsed = parse_line(line)
+            if parsed:
+                aggregates.add(domain_id, parsed)
+        offset += last_newline + 1
+        carry = data[last_newline + 1:]
+    return offset
+
+
+def _ingest_file(path, domain_id, cursor, aggregates, budget):
+    """Advance one log's cursor, finishing a rotated predecessor first"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return 0
+    consumed = 0
+
+    if cursor.inode is not None and cursor.inode != st.st_ino:
+        # Rotated: the old inode usually lives on as path.1 until compression
+        rotated = path + '.1'
+        try:
+            rst = os.stat(rotated)
+            if rst.st_ino == cursor.inode and rst.st_size > cursor.offset:
+                with open(rotated, 'rb') as f:
+                    end = _consume(f, cursor.offset, rst.st_size - cursor.offset, domain_id, aggregates)
+                consumed += end - cursor.offset
+        except FileNotFoundError:
+            pass
+        cursor.inode = st.st_ino
+        cursor.offset = 0
+    elif cursor.inode is None:
+        cursor.inode = st.st_ino
+        cursor.offset = 0
+    elif st.st_size < cursor.offset:
+        # copytruncate rotation
+        cursor.offset = 0
+
+    if st.st_size > cursor.offset:
+        limit = min(st.st_size - cursor.offset, max(budget - consumed, 0))
+        if limit:
+            with open(path, 'rb') as f:
+                end = _consume(f, cursor.offset, limit, domain_id, aggregates)
+            consumed += end - cursor.offset
+            cursor.offset = end
+    cursor.updated_at = datetime.utcnow()
+    return consumed
+
+
+def _flush(aggregates):
+    """Merge aggregates into TrafficStat rows with one read and one bulk write"""
+    if not aggregates.rows:
+        return 0
+    keys = aggregates.rows.keys()
+    domain_ids = {domain_id for domain_id, _ in keys}
+    minutes = [minute for _, minute in keys]
+    existing = {
+        (row.domain_id, row.minute): row
+        for row in TrafficStat.query.filter(
+            TrafficStat.domain_id.in_(domain_ids),
+            TrafficStat.minute.between(min(minutes), max(minutes))
+        )
+    }
+    new_rows = []
+    for key, (requests, size, s2, s3, s4, s5, hist) in aggregates.rows.items():
+        row = existing.get(key)
+        if row is None:
+            new_rows.append({
+                'domain_id': key[0], 'minute': key[1], 'requests': requests, 'bytes_sent': size,
+                'status_2xx': s2, 'status_3xx': s3, 'status_4xx': s4, 'status_5xx': s5,
+                'upstream_histogram': pack_histogram(hist)
+            })
+            continue
+        row.requests += requests
+        row.bytes_sent += size
+        row.status_2xx += s2
+        row.status_3xx += s3
+        row.status_4xx += s4
+        row.status_5xx += s5
+        merged = [a + b for a, b in zip(unpack_histogram(row.upstream_histogram), hist)]
+        row.upstream_histogram = pack_histogram(merged)
+    if new_rows:
+        db.session.execute(TrafficStat.__table__.insert(), new_rows)
+    return len(aggregates.rows)
+
+
+def ingest():
+    """One pass over every per-domain access log; run by the scheduler"""
+    domains = {name: domain_id for domain_id, name in db.session.query(Domain.id, Domain.name)}
+    cursors = {cursor.path: cursor for cursor in LogCursor.query.all()}
+    aggregates = _Aggregates()
+    budget = MAX_BYTES_PER_PASS
+    files = 0
+
+    for path in sorted(glob.glob(os.path.join(NGINX_LOG_DIR, '*' + ACCESS_LOG_SUFFIX))):
+        domain_id = domains.get(os.path.basename(path)[:-len(ACCESS_LOG_SUFFIX)])
+        if domain_id is None or budget <= 0:
+            continue
+        cursor = cursors.get(path)
+        if cursor is None:
+            cursor = LogCursor(path=path, inode=None, offset=0)
+            db.session.add(cursor)
+        budget -= _ingest_file(path, domain_id, cursor, aggregates, budget)
+        files += 1
+
+    try:
+        minutes = _flush(aggregates)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return {'files': files, 'bytes': MAX_BYTES_PER_PASS - budget, 'minutes_updated': minutes}
+
+
+def prune(days=RETENTION_DAYS):
+    cutoff = int(time.time() // 60) - days * 24 * 60
+    deleted = TrafficStat.query.filter(TrafficStat.minute < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def _ingest_and_prune():
+    ingest()
+    # Prune roughly once an hour
+    if int(time.time()) % 3600 < INGEST_INTERVAL:
+        prune()
+
+
+def start_ingestion(app):
+    return scheduler.start_periodic('access-log-ingest', INGEST_INTERVAL, _ingest_and_prune,
+                                    app=app, leader_only=True)
+
+
+def query_traffic(domain_id, start, end, resolution=60):
+    """Roll per-minute rows up to `resolution`-second buckets between two epoch times"""
+    bucket_minutes = max(resolution // 60, 1)
+    rows = TrafficStat.query.filter(
+        TrafficStat.domain_id == domain_id,
+        TrafficStat.minute >= int(start) // 60,
+        TrafficStat.minute <= int(end) // 60
+    ).order_by(TrafficStat.minute)
+
+    series = {}
+    totals = {'requests': 0, 'bytes': 0, 'status_2xx': 0, 'status_3xx': 0, 'status_4xx': 0, 'status_5xx': 0}
+    total_hist = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+    for row in rows:
+        bucket = row.minute - row.minute % bucket_minutes
+        point = series.get(bucket)
+        if point is None:
+            point = series[bucket] = {
+                'time': bucket * 60, 'requests': 0, 'bytes': 0, 'status_2xx': 0,
+                'status_3xx': 0, 'status_4xx': 0, 'status_5xx': 0,
+                '_hist': [0] * (len(HISTOGRAM_BOUNDS) + 1)
+            }
+        hist = unpack_histogram(row.upstream_histogram)
+        for target in (point, totals):
+            target['requests'] += row.requests
+            target['bytes'] += row.bytes_sent
+            target['status_2xx'] += row.status_2xx
+            target['status_3xx'] += row.status_3xx
+            target['status_4xx'] += row.status_4xx
+            target['status_5xx'] += row.status_5xx
+        point['_hist'] = [a + b for a, b in zip(point['_hist'], hist)]
+        total_hist = [a + b for a, b in zip(total_hist, hist)]
+
+    points = []
+    for bucket in sorted(series):
+        point = series[bucket]
+        hist = point.pop('_hist')
+        point['upstream_p50'] = percentile(hist, 0.5)
+        point['upstream_p95'] = percentile(hist, 0.95)
+        points.append(point)
+    totals['upstream_p50'] = percentile(total_hist, 0.5)
+    totals['upstream_p95'] = percentile(total_hist, 0.95)
+    return {'series': points, 'totals': totals}
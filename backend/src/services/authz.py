@@ -0,0 +1,140 @@
+import threading
+import time
+from functools import wraps
+from flask import g, jsonify
+from flask_jwt_extended import get_jwt, verify_jwt_in_request
+from src.models.user import db, User, Domain, DNSRecord, DNSZone, SSLCertificate, EmailAccount, Database, OutboundMessage
+
+# A role change reaches cached principals within this many seconds;
+# disabling or deleting a user revokes their tokens outright
+PRINCIPAL_TTL = 60
+PRINCIPAL_CACHE_SIZE = 10000
+
+# How each tenant-owned model reaches its owner: directly, or via its domain
+OWNER_COLUMNS = {
+    Domain: Domain.user_id,
+    Database: Database.user_id,
+    OutboundMessage: OutboundMessage.user_id,
+}
+DOMAIN_SCOPED = (DNSRecord, DNSZone, SSLCertificate, EmailAccount)
+
+# Fields of a request body only an admin may set: a user's role, and the
+# lifecycle of a domain (suspensions and expiry are billing decisions)
+ADMIN_FIELDS = {
+    User: ('role',),
+    Domain: ('status', 'expires_at'),
+}
+
+_principals = {}  # jti -> (Principal, cached until)
+_principals_lock = threading.Lock()
+
+
+class Principal:
+    """The authenticated user as far as authorization cares"""
+
+    __slots__ = ('id', 'username', 'role', 'is_active')
+
+    def __init__(self, id, username, role, is_active):
+        self.id = id
+        self.username = username
+        self.role = role
+        self.is_active = is_active
+
+    @property
+    def is_admin(self):
+        return self.role == 'admin'
+
+
+def _load(user_id):
+    row = db.session.query(User.id, User.username, User.role, User.is_active).filter(User.id == user_id).first()
+    return Principal(*row) if row else None
+
+
+def current_principal():
+    """Principal for the request's token, resolved once per jti and cached"""
+    claims = get_jwt()
+    jti = claims.get('jti')
+    resolved = g.get('principal')
+    if resolved is not None and resolved[0] == jti:
+        return resolved[1]
+    now = time.monotonic()
+    principal = None
+    with _principals_lock:
+        cached = _principals.get(jti)
+        if cached and cached[1] > now:
+            principal = cached[0]
+    if principal is None:
+        principal = _load(claims.get('sub'))
+        if principal is not None and jti:
+            with _principals_lock:
+                if len(_principals) >= PRINCIPAL_CACHE_SIZE:
+                    for key in [k for k, (_, until) in _principals.items() if until <= now] or list(_principals)[:1]:
+                        del _principals[key]
+                _principals[jti] = (principal, now + PRINCIPAL_TTL)
+    if principal is not None and not principal.is_active:
+        principal = None
+    g.principal = (jti, principal)
+    return principal
+
+
+def require_role(*roles, error='Akses ditolak'):
+    """Reject the request with 403 unless the principal has one of `roles`.
+
+    Implies @jwt_required(); `error` keeps each blueprint's own wording.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            verify_jwt_in_request()
+            principal = current_principal()
+            if principal is None or (roles and principal.role not in roles):
+                return jsonify({'error': error}), 403
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def require_admin(error='Akses ditolak'):
+    return require_role('admin', error=error)
+
+
+def scoped(model, principal=None, query=None):
+    """`query` (default model.query) limited to rows the principal owns.
+
+    The tenant filter is part of the SQL, so listing or fetching owned
+    objects is one statement; admins get no filter. Models owned through
+    a domain are joined to Domain.
+    """
+    principal = principal or current_principal()
+    query = query if query is not None else model.query
+    if principal is None:
+        # Token of a deleted or disabled user: sees nothing
+        return query.filter(db.false())
+    if model in DOMAIN_SCOPED:
+        # Always joined, so callers can filter or select on Domain columns
+        query = query.join(Domain, model.domain_id == Domain.id)
+        return query if principal.is_admin else query.filter(Domain.user_id == principal.id)
+    if model not in OWNER_COLUMNS:
+        raise ValueError(f'{model.__name__} has no owner mapping')
+    return query if principal.is_admin else query.filter(OWNER_COLUMNS[model] == principal.id)
+
+
+def get_owned(model, object_id, principal=None):
+    """One row by primary key if it exists and the principal may access it"""
+    return scoped(model, principal).filter(model.id == object_id).first()
+
+
+def owned_domain(name, principal=None):
+    return scoped(Domain, principal).filter(Domain.name == name).first()
+
+
+def admin_only_fields(model, data, principal=None):
+    """Fields in `data` the principal may not set on `model`, in body order.
+
+    Empty for admins. Works on unauthenticated routes too (principal None),
+    as long as the JWT was looked for with verify_jwt_in_request(optional=True).
+    """
+    principal = principal or current_principal()
+    if principal is not None and principal.is_admin:
+        return []
+    return [field for field in data if field in ADMIN_FIELDS.get(model, ())]
@@ -0,0 +1,420 @@
+import fcntl
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func
+from src.models.user import db, Database, DatabaseBackup
+from src.services import scheduler
+from src.services.db_provisioning import (
+    MYSQL_HOST, MYSQL_PORT, MYSQL_SOCKET, MYSQL_ADMIN_USER, MYSQL_ADMIN_PASSWORD, POSTGRES_DSN, psycopg2
+)
+
+# Dumps land in <BACKUP_ROOT>/user_<id>/databases/, next to the tenant's other backups
+BACKUP_ROOT = os.environ.get('PANEL_BACKUP_ROOT', '/var/backups/hosting-panel')
+# Dumps and restores running at once across all panel processes; each is
+# one dump plus one compressor, mostly disk-bound
+CONCURRENCY = int(os.environ.get('PANEL_BACKUP_CONCURRENCY', '2'))
+SLOT_DIR = os.path.join(BACKUP_ROOT, '.slots')
+SLOT_POLL = 1.0
+COMPRESSION = os.environ.get('PANEL_BACKUP_COMPRESSION', 'auto')  # auto, zstd, gzip
+KEEP = int(os.environ.get('PANEL_BACKUP_KEEP', '7'))
+# UTC hours [start, end) in which scheduled backups may start
+WINDOW = tuple(int(hour) for hour in os.environ.get('PANEL_BACKUP_WINDOW', '1-5').split('-'))
+NICENESS = 10
+ZSTD_LEVEL = 3
+GZIP_LEVEL = 6
+TIMEOUT = 6 * 3600
+# A database is due again once its last good backup is older than this
+MAX_AGE = timedelta(hours=20)
+RETRY_AFTER_FAILURE = timedelta(hours=1)
+# Jobs still queued after this belonged to a process that is gone
+QUEUE_TIMEOUT = timedelta(hours=24)
+CHECK_INTERVAL = 600
+
+EXTENSIONS = {'zstd': '.zst', 'gzip': '.gz'}
+
+
+class BackupError(Exception):
+    """A dump or restore pipeline failed"""
+
+
+_runner = ThreadPoolExecutor(max_workers=CONCURRENCY, thread_name_prefix='db-backup')
+
+
+def tenant_dir(user_id):
+    return os.path.join(BACKUP_ROOT, f'user_{user_id}', 'databases')
+
+
+def compression_tool():
+    """Preferred codec, taken from PANEL_BACKUP_COMPRESSION or whatever is installed"""
+    if COMPRESSION in EXTENSIONS:
+        return COMPRESSION
+    return 'zstd' if shutil.which('zstd') else 'gzip'
+
+
+def _compress_argv(codec):
+    if codec == 'zstd':
+        # One thread per stream: parallelism comes from running several databases at once
+        return ['zstd', '-q', f'-{ZSTD_LEVEL}', '-T1', '-c']
+    return ['pigz' if shutil.which('pigz') else 'gzip', '-c', f'-{GZIP_LEVEL}']
+
+
+def _decompress_argv(codec):
+    if codec == 'zstd':
+        return ['zstd', '-q', '-d', '-c']
+    return ['pigz' if shutil.which('pigz') else 'gzip', '-d', '-c']
+
+
+def _mysql_connection():
+    """Client flags for the admin account; the password goes in MYSQL_PWD to stay out of `ps`"""
+    if MYSQL_HOST == 'localhost' and MYSQL_SOCKET and os.path.exists(MYSQL_SOCKET):
+        args = ['--socket', MYSQL_SOCKET]
+    else:
+        args = ['--host', MYSQL_HOST, '--port', str(MYSQL_PORT)]
+    return args + ['--user', MYSQL_ADMIN_USER], dict(os.environ, MYSQL_PWD=MYSQL_ADMIN_PASSWORD)
+
+
+def _postgres_connection(name):
+    """DSN and environment for pg_dump/psql; the password goes in PGPASSWORD to stay out of `ps`"""
+    if psycopg2 is None:
+        raise BackupError('postgresql: psycopg2 is not installed')
+    params = psycopg2.extensions.parse_dsn(POSTGRES_DSN)
+    password = params.pop('password', None)
+    params['dbname'] = name
+    env = dict(os.environ, PGPASSWORD=password) if password is not None else None
+    return psycopg2.extensions.make_dsn(**params), env
+
+
+def _dump_command(db_type, name):
+    if db_type == 'mysql':
+        args, env = _mysql_connection()
+        # --single-transaction + --quick: a consistent InnoDB snapshot streamed row by row, no table locks
+        return ['mysqldump'] + args + ['--single-transaction', '--quick', '--routines', '--triggers', '--events',
+                                       '--hex-blob', '--no-tablespaces', '--default-character-set=utf8mb4', name], env
+    dsn, env = _postgres_connection(name)
+    # --clean --if-exists makes the dump replace what is there when restored
+    return ['pg_dump', '--dbname', dsn, '--no-password', '--clean', '--if-exists'], env
+
+
+def _restore_command(db_type, name):
+    if db_type == 'mysql':
+        args, env = _mysql_connection()
+        return ['mysql'] + args + ['--default-character-set=utf8mb4', name], env
+    dsn, env = _postgres_connection(name)
+    return ['psql', '--dbname', dsn, '--no-password', '--no-psqlrc', '--quiet',
+            '--set', 'ON_ERROR_STOP=1', '--single-transaction'], env
+
+
+def _niced(argv):
+    """Run `argv` at lowered CPU and I/O priority via the nice/ionice wrappers"""
+    prefix = []
+    if shutil.which('nice'):
+        prefix += ['nice', '-n', str(NICENESS)]
+    if shutil.which('ionice'):
+        prefix += ['ionice', '-c2', '-n7']
+    return prefix + argv
+
+
+@contextmanager
+def _io_slot():
+    """Hold one of CONCURRENCY host-wide slots while a dump or restore runs.
+
+    Slots are flock()ed files, so every gunicorn worker and the scheduler
+    leader share one cap, and a slot frees itself if its holder dies.
+    """
+    os.makedirs(SLOT_DIR, mode=0o700, exist_ok=True)
+    while True:
+        for index in range(CONCURRENCY):
+            handle = open(os.path.join(SLOT_DIR, f'{index}.lock'), 'w')
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                handle.close()
+                continue
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+                handle.close()
+            return
+        time.sleep(SLOT_POLL)
+
+
+def _run_pipeline(stages, stdin, stdout, timeout=TIMEOUT):
+    """Run (argv, env) stages as `a | b` from `stdin` to `stdout`.
+
+    The data moves through kernel pipes between the processes and never
+    passes through Python, so a dump of any size costs no panel memory.
+    """
+    errors = [tempfile.TemporaryFile() for _ in stages]
+    procs = []
+    try:
+        source = stdin
+        for index, (argv, env) in enumerate(stages):
+            last = index == len(stages) - 1
+            proc = subprocess.Popen(_niced(argv), stdin=source, stdout=stdout if last else subprocess.PIPE,
+                                    stderr=errors[index], env=env)
+            if procs:
+                # Only the consumer holds the read end now, so the producer sees EPIPE if it dies
+                procs[-1].stdout.close()
+            procs.append(proc)
+            source = proc.stdout
+        deadline = time.monotonic() + timeout
+        for proc in procs:
+            proc.wait(timeout=max(0, deadline - time.monotonic()))
+    except subprocess.TimeoutExpired:
+        for proc in procs:
+            proc.kill()
+            proc.wait()
+        raise BackupError(f'timed out after {timeout}s')
+    except OSError as e:
+        for proc in procs:
+            proc.kill()
+            proc.wait()
+        raise BackupError(str(e)) from e
+    finally:
+        failures = []
+        for (argv, _), proc, error in zip(stages, procs, errors):
+            if proc.returncode:
+                error.seek(0)
+                message = error.read()[-500:].decode('utf-8', 'replace').strip()
+                failures.append(f'{argv[0]} exited {proc.returncode}: {message}')
+        for error in errors:
+            error.close()
+    if failures:
+        raise BackupError('; '.join(failures))
+
+
+def _partial_path(path):
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, f'.{filename}.partial')
+
+
+def _dump(db_type, name, path, codec):
+    """Stream a dump through the compressor straight into `path`; returns (bytes, seconds).
+
+    The file is written under a hidden name and renamed into place once
+    complete, so a listed backup is never a truncated one.
+    """
+    started = time.monotonic()
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    partial = _partial_path(path)
+    try:
+        with open(os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as output:
+            _run_pipeline([_dump_command(db_type, name), (_compress_argv(codec), None)],
+                          subprocess.DEVNULL, output)
+            os.fsync(output.fileno())
+        os.replace(partial, path)
+    except BaseException:
+        try:
+            os.unlink(partial)
+        except FileNotFoundError:
+            pass
+        raise
+    return os.stat(path).st_size, time.monotonic() - started
+
+
+def _remove_files(paths):
+    for path in paths:
+        for candidate in (path, _partial_path(path)):
+            try:
+                os.unlink(candidate)
+            except FileNotFoundError:
+                pass
+
+
+def _prune(database_id, keep=KEEP):
+    """Drop all but the newest `keep` completed backups of one database"""
+    old = DatabaseBackup.query.filter_by(database_id=database_id, status='completed').order_by(
+        DatabaseBackup.started_at.desc(), DatabaseBackup.id.desc()
+    ).offset(keep).all()
+    _remove_files([backup.path for backup in old])
+    for backup in old:
+        db.session.delete(backup)
+    return len(old)
+
+
+def _update(app, backup_id, values, prune_database=None):
+    with app.app_context():
+        try:
+            DatabaseBackup.query.filter_by(id=backup_id).update(values)
+            if prune_database is not None:
+                _prune(prune_database)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+def _job(app, backup_id, database_id, db_type, name, path, codec):
+    try:
+        with _io_slot():
+            _update(app, backup_id, {'status': 'running', 'started_at': datetime.utcnow()})
+            size, duration = _dump(db_type, name, path, codec)
+        outcome = {'status': 'completed', 'size_bytes': size, 'duration_seconds': round(duration, 3), 'error': None}
+    except Exception as e:
+        outcome = {'status': 'failed', 'size_bytes': 0, 'duration_seconds': None, 'error': str(e)[:2000]}
+    _update(app, backup_id, dict(outcome, finished_at=datetime.utcnow()),
+            prune_database=database_id if outcome['status'] == 'completed' else None)
+    return outcome
+
+
+def queue(databases, trigger='manual'):
+    """Record a queued backup for each database and hand the dumps to the runner.
+
+    Returns (backups, futures); at most CONCURRENCY dumps and restores run
+    at a time on the host and the rest wait for a slot.
+    """
+    codec = compression_tool()
+    stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    targets = [(database.id, database.user_id, database.db_type, database.name) for database in databases]
+    backups = [DatabaseBackup(database_id=database_id, path='', compression=codec, trigger=trigger)
+               for database_id, _, _, _ in targets]
+    db.session.add_all(backups)
+    db.session.flush()
+    jobs = []
+    for (database_id, user_id, db_type, name), backup in zip(targets, backups):
+        backup.path = os.path.join(tenant_dir(user_id), f'{name}-{stamp}-{backup.id}.sql{EXTENSIONS[codec]}')
+        jobs.append((backup.id, database_id, db_type, name, backup.path, codec))
+    db.session.commit()
+    app = current_app._get_current_object()
+    futures = [_runner.submit(_job, app, *job) for job in jobs]
+    return backups, futures
+
+
+def _restore_job(app, backup_id, db_type, name, path, codec):
+    try:
+        with _io_slot():
+            _update(app, backup_id, {'restore_status': 'running', 'restore_started_at': datetime.utcnow()})
+            with open(path, 'rb') as source:
+                _run_pipeline([(_decompress_argv(codec), None), _restore_command(db_type, name)],
+                              source, subprocess.DEVNULL)
+        outcome = {'restore_status': 'completed', 'restore_error': None, 'restored_at': datetime.utcnow()}
+    except Exception as e:
+        outcome = {'restore_status': 'failed', 'restore_error': str(e)[:2000]}
+    _update(app, backup_id, outcome)
+    return outcome
+
+
+def restore(backup):
+    """Queue streaming a completed backup back into its database, decompressing on the fly.
+
+    Runs on the backup runner like a dump; poll the backup's
+    restore_status for the outcome.
+    """
+    if backup.status != 'completed':
+        raise BackupError('Only completed backups can be restored')
+    if not os.path.exists(backup.path):
+        raise BackupError('Backup file is missing')
+    if backup.restore_status in ('queued', 'running'):
+        raise BackupError('This backup is already being restored')
+    database = backup.database
+    job = (backup.id, database.db_type, database.name, backup.path, backup.compression)
+    backup.restore_status = 'queued'
+    backup.restore_error = None
+    backup.restore_started_at = datetime.utcnow()
+    db.session.commit()
+    return _runner.submit(_restore_job, current_app._get_current_object(), *job)
+
+
+def _recover(now):
+    """Fail jobs left behind by a process that died and remove their partial files"""
+    stale = DatabaseBackup.query.filter(db.or_(
+        db.and_(DatabaseBackup.status == 'running', DatabaseBackup.started_at < now - timedelta(seconds=TIMEOUT * 2)),
+        db.and_(DatabaseBackup.status == 'queued', DatabaseBackup.started_at < now - QUEUE_TIMEOUT)
+    )).all()
+    _remove_files([backup.path for backup in stale])
+    for backup in stale:
+        backup.status = 'failed'
+        backup.error = 'interrupted'
+        backup.finished_at = now
+    restores = DatabaseBackup.query.filter(db.or_(
+        db.and_(DatabaseBackup.restore_status == 'running',
+                DatabaseBackup.restore_started_at < now - timedelta(seconds=TIMEOUT * 2)),
+        db.and_(DatabaseBackup.restore_status == 'queued', DatabaseBackup.restore_started_at < now - QUEUE_TIMEOUT)
+    )).update({'restore_status': 'failed', 'restore_error': 'interrupted'}, synchronize_session=False)
+    return len(stale) + restores
+
+
+def due_databases(now=None):
+    """Databases without a recent good backup, a running one or a fresh failure; largest first.
+
+    Starting the biggest dumps first keeps one long dump from trailing
+    alone at the end of the window.
+    """
+    now = now or datetime.utcnow()
+    recent = db.session.query(DatabaseBackup.database_id).filter(db.or_(
+        DatabaseBackup.status.in_(('queued', 'running')),
+        db.and_(DatabaseBackup.status == 'completed', DatabaseBackup.started_at >= now - MAX_AGE),
+        db.and_(DatabaseBackup.status == 'failed', DatabaseBackup.started_at >= now - RETRY_AFTER_FAILURE)
+    ))
+    return Database.query.filter(~Database.id.in_(recent)).order_by(
+        Database.size_mb.desc(), Database.id
+    ).all()
+
+
+def in_window(now=None):
+    start, end = WINDOW
+    hour = (now or datetime.utcnow()).hour
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+
+def queue_due(now=None):
+    now = now or datetime.utcnow()
+    recovered = _recover(now)
+    db.session.commit()
+    databases = due_databases(now)
+    backups, futures = queue(databases, trigger='scheduled') if databases else ([], [])
+    return {'recovered': recovered, 'queued': len(backups)}, futures
+
+
+def run_scheduled():
+    """Back up every due database when inside the window and wait for the dumps to finish"""
+    now = datetime.utcnow()
+    if not in_window(now):
+        return {'skipped': 'outside backup window'}
+    started = time.monotonic()
+    summary, futures = queue_due(now)
+    wait(futures)
+    outcomes = [future.result() for future in futures if future.exception() is None]
+    completed = sum(outcome['status'] == 'completed' for outcome in outcomes)
+    summary.update({
+        'completed': completed,
+        'failed': len(futures) - completed,
+        'bytes': sum(outcome['size_bytes'] for outcome in outcomes),
+        'seconds': round(time.monotonic() - started, 3)
+    })
+    return summary
+
+
+def get_stats():
+    """Backup and restore counts from the database, so every worker reports the same"""
+    since = datetime.utcnow() - timedelta(days=1)
+    statuses = dict(db.session.query(DatabaseBackup.status, func.count()).group_by(DatabaseBackup.status))
+    restores = dict(db.session.query(DatabaseBackup.restore_status, func.count()).filter(
+        DatabaseBackup.restore_status.isnot(None)
+    ).group_by(DatabaseBackup.restore_status))
+    completed, size, seconds = db.session.query(
+        func.count(), func.sum(DatabaseBackup.size_bytes), func.sum(DatabaseBackup.duration_seconds)
+    ).filter(DatabaseBackup.status == 'completed', DatabaseBackup.finished_at >= since).one()
+    failed = DatabaseBackup.query.filter(DatabaseBackup.status == 'failed', DatabaseBackup.finished_at >= since).count()
+    return {
+        'backups': {status: statuses.get(status, 0) for status in ('queued', 'running', 'completed', 'failed')},
+        'restores': {status: restores.get(status, 0) for status in ('queued', 'running', 'completed', 'failed')},
+        'last_24h': {'completed': completed, 'failed': failed, 'bytes_written': int(size or 0),
+                     'dump_seconds': round(seconds or 0, 3)},
+        'concurrency': CONCURRENCY,
+        'compression': compression_tool(),
+        'window_utc': f'{WINDOW[0]:02d}:00-{WINDOW[1]:02d}:00',
+        'keep': KEEP
+    }
+
+
+def start_scheduler(app):
+    return scheduler.start_periodic('database-backups', CHECK_INTERVAL, run_scheduled, app=app, leader_only=True)
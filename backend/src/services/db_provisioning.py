@@ -0,0 +1,478 @@
+import abc
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import bindparam
+from src.models.user import db, Database
+from src.services import scheduler
+
+try:
+    import pymysql
+except ImportError:  # only needed when MySQL databases are managed
+    pymysql = None
+
+try:
+    import psycopg2
+    from psycopg2 import sql as pgsql
+except ImportError:  # only needed when PostgreSQL databases are managed
+    psycopg2 = None
+
+# Admin access to the database servers; point these at any local or
+# containerised instance to test provisioning
+MYSQL_HOST = os.environ.get('PANEL_MYSQL_HOST', 'localhost')
+MYSQL_PORT = int(os.environ.get('PANEL_MYSQL_PORT', '3306'))
+MYSQL_SOCKET = os.environ.get('PANEL_MYSQL_SOCKET', '/run/mysqld/mysqld.sock')
+MYSQL_ADMIN_USER = os.environ.get('PANEL_MYSQL_ADMIN_USER', 'root')
+MYSQL_ADMIN_PASSWORD = os.environ.get('PANEL_MYSQL_ADMIN_PASSWORD', '')
+# Host part of the accounts we create ('localhost' = socket/loopback only)
+MYSQL_USER_HOST = os.environ.get('PANEL_MYSQL_USER_HOST', 'localhost')
+POSTGRES_DSN = os.environ.get('PANEL_POSTGRES_DSN', 'dbname=postgres user=postgres host=/var/run/postgresql')
+
+POOL_SIZE = int(os.environ.get('PANEL_DB_ADMIN_POOL_SIZE', '4'))
+CONNECT_TIMEOUT = 10
+# Connections idle longer than this are pinged before being handed out
+VALIDATE_AFTER = 30
+CAPABILITY_TTL = 3600
+SIZE_REFRESH_INTERVAL = 3600
+
+DB_TYPES = ('mysql', 'postgresql')
+# Valid as an unquoted identifier on both servers and within MySQL's 32-character user names
+NAME_PATTERN = re.compile(r'^[a-z][a-z0-9_]{0,31}$')
+RESERVED_NAMES = {'mysql', 'sys', 'information_schema', 'performance_schema', 'root', 'postgres',
+                  'template0', 'template1', 'public', 'admin', 'replication'}
+PERMISSIONS = ('all', 'readonly')
+
+
+class ProvisioningError(Exception):
+    """A database server refused or failed an operation"""
+
+
+def valid_name(name):
+    return bool(name) and NAME_PATTERN.match(name) is not None and name not in RESERVED_NAMES
+
+
+class ConnectionPool:
+    """Up to `size` admin connections to one server, reused across requests"""
+
+    def __init__(self, connect, size):
+        self.connect = connect
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = []  # (connection, last used)
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.opened = 0
+        self.reused = 0
+
+    @staticmethod
+    def _alive(conn):
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+            finally:
+                cursor.close()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _take(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                # Sockets inherited from the parent gunicorn process aren't ours to use
+                self.idle = []
+                self.pid = os.getpid()
+            entry = self.idle.pop() if self.idle else None
+        if entry is not None:
+            conn, last_used = entry
+            if time.monotonic() - last_used < VALIDATE_AFTER or self._alive(conn):
+                self.reused += 1
+                return conn
+            self._close(conn)
+        conn = self.connect()
+        self.opened += 1
+        return conn
+
+    @contextmanager
+    def connection(self):
+        with self.slots:
+            conn = self._take()
+            try:
+                yield conn
+            except BaseException:
+                # A failed statement leaves an autocommit session usable; a dropped one isn't
+                if self._alive(conn):
+                    self._release(conn)
+                else:
+                    self._close(conn)
+                raise
+            self._release(conn)
+
+    def _release(self, conn):
+        with self.lock:
+            self.idle.append((conn, time.monotonic()))
+
+    def stats(self):
+        with self.lock:
+            return {'size': POOL_SIZE, 'idle': len(self.idle), 'opened': self.opened, 'reused': self.reused}
+
+
+class _Server(abc.ABC):
+    """Provisioning against one database server through its admin pool"""
+
+    db_type = None
+
+    def __init__(self):
+        self.pool = ConnectionPool(self._connect, POOL_SIZE)
+        self._capabilities = None
+        self._capabilities_at = 0.0
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def _connect(self):
+        """A new autocommit admin connection"""
+
+    @abc.abstractmethod
+    def _errors(self):
+        """The driver's exception classes, wrapped as ProvisioningError"""
+
+    @contextmanager
+    def cursor(self):
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    yield cursor
+                finally:
+                    cursor.close()
+        except self._errors() as e:
+            raise ProvisioningError(f'{self.db_type}: {e}') from e
+
+    def capabilities(self, refresh=False):
+        """Version and feature flags of the server, probed once per CAPABILITY_TTL"""
+        with self._lock:
+            if not refresh and self._capabilities and time.monotonic() - self._capabilities_at < CAPABILITY_TTL:
+                return self._capabilities
+        with self.cursor() as cursor:
+            capabilities = self._probe(cursor)
+        with self._lock:
+            self._capabilities = capabilities
+            self._capabilities_at = time.monotonic()
+        return capabilities
+
+    def create_many(self, specs):
+        """Create each {name, user, password} database with its owner over one connection.
+
+        Returns an error message (or None) per spec. Names already on the
+        server are refused up front: tenants pick them, and the panel must
+        never take over (or, on rollback, drop) a database it didn't make.
+        A database whose owner can't be created is dropped again so nothing
+        is left half made.
+        """
+        capabilities = self.capabilities()
+        results = []
+        with self.cursor() as cursor:
+            taken = self._existing(cursor, [name for spec in specs for name in (spec['name'], spec['user'])])
+            for spec in specs:
+                if spec['name'] in taken or spec['user'] in taken:
+                    results.append('Database or user name already exists on the server')
+                    continue
+                try:
+                    self._create(cursor, capabilities, spec['name'], spec['user'], spec['password'])
+                    results.append(None)
+                except self._errors() as e:
+                    results.append(str(e))
+        return results
+
+    @abc.abstractmethod
+    def _probe(self, cursor):
+        """Version and feature flags"""
+
+    @abc.abstractmethod
+    def _existing(self, cursor, names):
+        """Which of `names` already exist on the server as a database or account"""
+
+    @abc.abstractmethod
+    def _create(self, cursor, capabilities, name, user, password):
+        """Create one database owned by a new account"""
+
+    @abc.abstractmethod
+    def create_user(self, database, user, password, permissions):
+        """Add an account with `permissions` on an existing database"""
+
+    @abc.abstractmethod
+    def drop_database(self, name, users):
+        """Drop a database and its accounts"""
+
+    @abc.abstractmethod
+    def sizes(self):
+        """{database name: bytes} for every database on the server"""
+
+    def stats(self):
+        with self._lock:
+            capabilities = self._capabilities
+        return {'pool': self.pool.stats(), 'capabilities': capabilities}
+
+
+class MySQLServer(_Server):
+    db_type = 'mysql'
+
+    def _connect(self):
+        if pymysql is None:
+            raise ProvisioningError('mysql: PyMySQL is not installed')
+        kwargs = {'user': MYSQL_ADMIN_USER, 'password': MYSQL_ADMIN_PASSWORD, 'charset': 'utf8mb4',
+                  'connect_timeout': CONNECT_TIMEOUT, 'autocommit': True}
+        if MYSQL_HOST == 'localhost' and MYSQL_SOCKET and os.path.exists(MYSQL_SOCKET):
+            kwargs['unix_socket'] = MYSQL_SOCKET
+        else:
+            kwargs.update(host=MYSQL_HOST, port=MYSQL_PORT)
+        try:
+            return pymysql.connect(**kwargs)
+        except pymysql.MySQLError as e:
+            raise ProvisioningError(f'mysql: {e}') from e
+
+    def _errors(self):
+        return (pymysql.MySQLError,) if pymysql is not None else ()
+
+    def _probe(self, cursor):
+        cursor.execute('SELECT VERSION()')
+        version = cursor.fetchone()[0]
+        numbers = tuple(int(part) for part in re.findall(r'\d+', version)[:3])
+        mariadb = 'mariadb' in version.lower()
+        return {
+            'version': version,
+            'flavor': 'mariadb' if mariadb else 'mysql',
+            # CREATE/DROP USER IF [NOT] EXISTS: MySQL 5.7, MariaDB 10.1
+            'user_if_exists': numbers >= ((10, 1) if mariadb else (5, 7)),
+            'collation': 'utf8mb4_0900_ai_ci' if not mariadb and numbers >= (8, 0) else 'utf8mb4_unicode_ci',
+        }
+
+    @staticmethod
+    def _account(user):
+        return f"'{user}'@'{MYSQL_USER_HOST}'"
+
+    @staticmethod
+    def _grant_target(name):
+        # `_` and `%` are wildcards in a database-level GRANT: `a_b`.* would also cover `aXb`
+        return '`' + name.replace('_', r'\_').replace('%', r'\%') + '`.*'
+
+    def _existing(self, cursor, names):
+        names = list(set(names))
+        if not names:
+            return set()
+        placeholders = ', '.join(['%s'] * len(names))
+        cursor.execute(f'SELECT schema_name FROM information_schema.schemata WHERE schema_name IN ({placeholders})',
+                       names)
+        taken = {row[0] for row in cursor.fetchall()}
+        cursor.execute(f'SELECT DISTINCT user FROM mysql.user WHERE user IN ({placeholders})', names)
+        return taken | {row[0] for row in cursor.fetchall()}
+
+    def _create(self, cursor, capabilities, name, user, password):
+        cursor.execute(f"CREATE DATABASE `{name}` CHARACTER SET utf8mb4 COLLATE {capabilities['collation']}")
+        user_created = False
+        try:
+            cursor.execute(f'CREATE USER {self._account(user)} IDENTIFIED BY %s', (password,))
+            user_created = True
+            cursor.execute(f'GRANT ALL PRIVILEGES ON {self._grant_target(name)} TO {self._account(user)}')
+        except pymysql.MySQLError:
+            # As in create_user: an account that failed its GRANT is dropped, not left behind
+            if user_created:
+                cursor.execute(f'DROP USER {self._account(user)}')
+            cursor.execute(f'DROP DATABASE IF EXISTS `{name}`')
+            raise
+
+    def create_user(self, database, user, password, permissions):
+        privileges = 'ALL PRIVILEGES' if permissions == 'all' else 'SELECT, SHOW VIEW'
+        with self.cursor() as cursor:
+            cursor.execute(f'CREATE USER {self._account(user)} IDENTIFIED BY %s', (password,))
+            try:
+                cursor.execute(f'GRANT {privileges} ON {self._grant_target(database)} TO {self._account(user)}')
+            except pymysql.MySQLError:
+                cursor.execute(f'DROP USER {self._account(user)}')
+                raise
+
+    def drop_database(self, name, users):
+        if_exists = 'IF EXISTS ' if self.capabilities()['user_if_exists'] else ''
+        with self.cursor() as cursor:
+            cursor.execute(f'DROP DATABASE IF EXISTS `{name}`')
+            for user in users:
+                cursor.execute(f'DROP USER {if_exists}{self._account(user)}')
+
+    def sizes(self):
+        with self.cursor() as cursor:
+            cursor.execute('SELECT table_schema, SUM(data_length + index_length) '
+                           'FROM information_schema.tables GROUP BY table_schema')
+            return {name: int(size or 0) for name, size in cursor.fetchall()}
+
+
+class PostgresServer(_Server):
+    db_type = 'postgresql'
+
+    def _connect(self, dbname=None):
+        if psycopg2 is None:
+            raise ProvisioningError('postgresql: psycopg2 is not installed')
+        try:
+            conn = psycopg2.connect(POSTGRES_DSN, connect_timeout=CONNECT_TIMEOUT,
+                                    **({'dbname': dbname} if dbname else {}))
+        except psycopg2.Error as e:
+            raise ProvisioningError(f'postgresql: {e}') from e
+        # CREATE/DROP DATABASE can't run inside a transaction block
+        conn.autocommit = True
+        return conn
+
+    def _errors(self):
+        return (psycopg2.Error,) if psycopg2 is not None else ()
+
+    def _probe(self, cursor):
+        cursor.execute("SELECT current_setting('server_version'), current_setting('server_version_num')::int, "
+                       "current_setting('password_encryption')")
+        version, version_num, password_encryption = cursor.fetchone()
+        return {
+            'version': version,
+            'version_num': version_num,
+            'password_encryption': password_encryption,
+            # DROP DATABASE ... WITH (FORCE) disconnects sessions itself (13+)
+            'drop_force': version_num >= 130000,
+        }
+
+    def _existing(self, cursor, names):
+        names = list(set(names))
+        if not names:
+            return set()
+        cursor.execute('SELECT datname FROM pg_database WHERE datname = ANY(%s) '
+                       'UNION SELECT rolname FROM pg_roles WHERE rolname = ANY(%s)', (names, names))
+        return {row[0] for row in cursor.fetchall()}
+
+    def _create(self, cursor, capabilities, name, user, password):
+        cursor.execute(pgsql.SQL('CREATE ROLE {} LOGIN PASSWORD %s').format(pgsql.Identifier(user)), (password,))
+        created = False
+        try:
+            cursor.execute(pgsql.SQL('CREATE DATABASE {} OWNER {} ENCODING %s TEMPLATE template0').format(
+                pgsql.Identifier(name), pgsql.Identifier(user)), ('UTF8',))
+            created = True
+            cursor.execute(pgsql.SQL('REVOKE ALL ON DATABASE {} FROM PUBLIC').format(pgsql.Identifier(name)))
+        except psycopg2.Error:
+            # Undo only what this call made; a failed CREATE DATABASE may mean the name belongs to someone else
+            if created:
+                cursor.execute(pgsql.SQL('DROP DATABASE {}').format(pgsql.Identifier(name)))
+            cursor.execute(pgsql.SQL('DROP ROLE IF EXISTS {}').format(pgsql.Identifier(user)))
+            raise
+
+    def create_user(self, database, user, password, permissions):
+        role, dbname = pgsql.Identifier(user), pgsql.Identifier(database)
+        with self.cursor() as cursor:
+            cursor.execute(pgsql.SQL('CREATE ROLE {} LOGIN PASSWORD %s').format(role), (password,))
+            try:
+                privileges = pgsql.SQL('ALL' if permissions == 'all' else 'CONNECT')
+                cursor.execute(pgsql.SQL('GRANT {} ON DATABASE {} TO {}').format(privileges, dbname, role))
+                # Default privileges belong to the role creating the tables, which is the
+                # database owner; without FOR ROLE they would attach to the admin instead
+                cursor.execute('SELECT pg_get_userbyid(datdba) FROM pg_database WHERE datname = %s', (database,))
+                owner = pgsql.Identifier(cursor.fetchone()[0])
+                # Schema grants only exist inside the database, so this part needs its own session
+                conn = self._connect(dbname=database)
+                try:
+                    with conn.cursor() as target:
+                        if permissions == 'all':
+                            target.execute(pgsql.SQL('GRANT ALL ON SCHEMA public TO {0}; '
+                                                     'GRANT ALL ON ALL TABLES IN SCHEMA public TO {0}; '
+                                                     'GRANT ALL ON ALL SEQUENCES IN SCHEMA public TO {0}; '
+                                                     'ALTER DEFAULT PRIVILEGES FOR ROLE {1} IN SCHEMA public '
+                                                     'GRANT ALL ON TABLES TO {0}; '
+                                                     'ALTER DEFAULT PRIVILEGES FOR ROLE {1} IN SCHEMA public '
+                                                     'GRANT ALL ON SEQUENCES TO {0}').format(role, owner))
+                        else:
+                            target.execute(pgsql.SQL('GRANT USAGE ON SCHEMA public TO {0}; '
+                                                     'GRANT SELECT ON ALL TABLES IN SCHEMA public TO {0}; '
+                                                     'ALTER DEFAULT PRIVILEGES FOR ROLE {1} IN SCHEMA public '
+                                                     'GRANT SELECT ON TABLES TO {0}').format(role, owner))
+                finally:
+                    conn.close()
+            except (psycopg2.Error, ProvisioningError):
+                cursor.execute(pgsql.SQL('DROP OWNED BY {}').format(role))
+                cursor.execute(pgsql.SQL('DROP ROLE IF EXISTS {}').format(role))
+                raise
+
+    def drop_database(self, name, users):
+        dbname = pgsql.Identifier(name)
+        with self.cursor() as cursor:
+            if self.capabilities()['drop_force']:
+                cursor.execute(pgsql.SQL('DROP DATABASE IF EXISTS {} WITH (FORCE)').format(dbname))
+            else:
+                cursor.execute('SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = %s', (name,))
+                cursor.execute(pgsql.SQL('DROP DATABASE IF EXISTS {}').format(dbname))
+            for user in users:
+                cursor.execute(pgsql.SQL('DROP ROLE IF EXISTS {}').format(pgsql.Identifier(user)))
+
+    def sizes(self):
+        with self.cursor() as cursor:
+            cursor.execute('SELECT datname, pg_database_size(datname) FROM pg_database WHERE NOT datistemplate')
+            return {name: int(size) for name, size in cursor.fetchall()}
+
+
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def get_server(db_type):
+    if db_type not in DB_TYPES:
+        raise ValueError(f'Unsupported database type {db_type}')
+    with _servers_lock:
+        server = _servers.get(db_type)
+        if server is None:
+            server = _servers[db_type] = MySQLServer() if db_type == 'mysql' else PostgresServer()
+        return server
+
+
+def refresh_sizes():
+    """Copy each server's database sizes onto Database.size_mb in one executemany per server"""
+    updated = 0
+    for (db_type,) in db.session.query(Database.db_type).distinct():
+        try:
+            sizes = get_server(db_type).sizes()
+        except (ProvisioningError, ValueError) as e:
+            print(f'Database size refresh for {db_type} failed: {e}')
+            continue
+        changes = []
+        for database_id, name, size_mb in db.session.query(Database.id, Database.name, Database.size_mb).filter(
+            Database.db_type == db_type
+        ):
+            new_size = round(sizes.get(name, 0) / (1024 * 1024), 2)
+            if new_size != size_mb:
+                changes.append({'b_id': database_id, 'b_size': new_size})
+        if changes:
+            db.session.execute(
+                Database.__table__.update().where(Database.id == bindparam('b_id')).values(size_mb=bindparam('b_size')),
+                changes
+            )
+            updated += len(changes)
+    db.session.commit()
+    return updated
+
+
+def get_stats(probe=False):
+    stats = {}
+    for db_type in DB_TYPES:
+        server = get_server(db_type)
+        if probe:
+            try:
+                server.capabilities(refresh=True)
+            except ProvisioningError as e:
+                stats[db_type] = dict(server.stats(), error=str(e))
+                continue
+        stats[db_type] = server.stats()
+    return stats
+
+
+def start_size_refresh(app):
+    return scheduler.start_periodic('database-size-refresh', SIZE_REFRESH_INTERVAL, refresh_sizes,
+                                    app=app, leader_only=True)
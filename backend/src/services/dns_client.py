@@ -0,0 +1,425 @@
+import ipaddress
+import os
+import random
+import selectors
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+
+RESOLV_CONF = '/etc/resolv.conf'
+FALLBACK_NAMESERVERS = ('127.0.0.1',)
+DNS_PORT = 53
+DEFAULT_TIMEOUT = 2.0
+RETRIES = 2
+MAX_IN_FLIGHT = 128
+# Advertised EDNS0 buffer; large enough for most answers without fragmenting
+EDNS_UDP_SIZE = 1232
+CACHE_SIZE = 10000
+MAX_CACHE_TTL = 3600
+NEGATIVE_TTL = 60
+
+RECORD_TYPES = {
+    'A': 1, 'NS': 2, 'CNAME': 5, 'SOA': 6, 'PTR': 12, 'MX': 15,
+    'TXT': 16, 'AAAA': 28, 'SRV': 33, 'CAA': 257,
+}
+TYPE_NAMES = {code: name for name, code in RECORD_TYPES.items()}
+RCODES = {0: 'NOERROR', 1: 'FORMERR', 2: 'SERVFAIL', 3: 'NXDOMAIN', 4: 'NOTIMP', 5: 'REFUSED'}
+
+HEADER = struct.Struct('!HHHHHH')
+RR_FIXED = struct.Struct('!HHIH')
+
+
+class DNSError(Exception):
+    """Malformed DNS message or unusable query"""
+
+
+def _encode_name(name):
+    name = name.rstrip('.')
+    encoded = bytearray()
+    if name:
+        for label in name.split('.'):
+            raw = label.encode('idna') if any(ord(c) > 127 for c in label) else label.encode('ascii')
+            if not raw or len(raw) > 63:
+                raise DNSError(f'Invalid label in {name!r}')
+            encoded.append(len(raw))
+            encoded += raw
+    encoded.append(0)
+    if len(encoded) > 255:
+        raise DNSError(f'Name too long: {name!r}')
+    return bytes(encoded)
+
+
+def build_query(name, qtype, query_id):
+    """Recursive query with an EDNS0 OPT record"""
+    header = HEADER.pack(query_id, 0x0100, 1, 0, 0, 1)
+    question = _encode_name(name) + struct.pack('!HH', RECORD_TYPES[qtype], 1)
+    opt = b'\x00' + struct.pack('!HHIH', 41, EDNS_UDP_SIZE, 0, 0)
+    return header + question + opt
+
+
+def _read_name(data, offset):
+    """Decode a possibly compressed name; returns (name, offset after it)"""
+    labels = []
+    end = None
+    jumps = 0
+    while True:
+        if offset >= len(data):
+            raise DNSError('Truncated name')
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if offset + 1 >= len(data):
+                raise DNSError('Truncated pointer')
+            if end is None:
+                end = offset + 2
+            jumps += 1
+            if jumps > 64:
+                raise DNSError('Compression loop')
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(data[offset:offset + length].decode('ascii', 'replace'))
+        offset += length
+    return '.'.join(labels), (end if end is not None else offset)
+
+
+def _character_strings(rdata):
+    strings = []
+    i = 0
+    while i < len(rdata):
+        length = rdata[i]
+        strings.append(rdata[i + 1:i + 1 + length].decode('utf-8', 'replace'))
+        i += 1 + length
+    return strings
+
+
+def _decode_rdata(rtype, data, offset, length):
+    rdata = data[offset:offset + length]
+    if rtype == 1 and length == 4:
+        return socket.inet_ntop(socket.AF_INET, rdata)
+    if rtype == 28 and length == 16:
+        return socket.inet_ntop(socket.AF_INET6, rdata)
+    if rtype in (2, 5, 12):
+        return _read_name(data, offset)[0]
+    if rtype == 15:
+        return {'priority': struct.unpack('!H', rdata[:2])[0], 'exchange': _read_name(data, offset + 2)[0]}
+    if rtype == 16:
+        return ''.join(_character_strings(rdata))
+    if rtype == 6:
+        mname, pos = _read_name(data, offset)
+        rname, pos = _read_name(data, pos)
+        serial, refresh, retry, expire, minimum = struct.unpack('!IIIII', data[pos:pos + 20])
+        return {'mname': mname, 'rname': rname, 'serial': serial, 'refresh': refresh,
+                'retry': retry, 'expire': expire, 'minimum': minimum}
+    if rtype == 33:
+        priority, weight, port = struct.unpack('!HHH', rdata[:6])
+        return {'priority': priority, 'weight': weight, 'port': port, 'target': _read_name(data, offset + 6)[0]}
+    if rtype == 257 and length >= 2:
+        tag_length = rdata[1]
+        return {'flags': rdata[0], 'tag': rdata[2:2 + tag_length].decode('ascii', 'replace'),
+                'value': rdata[2 + tag_length:].decode('utf-8', 'replace')}
+    return rdata.hex()
+
+
+def _read_records(data, offset, count):
+    records = []
+    for _ in range(count):
+        name, offset = _read_name(data, offset)
+        if offset + RR_FIXED.size > len(data):
+            raise DNSError('Truncated resource record')
+        rtype, rclass, ttl, length = RR_FIXED.unpack_from(data, offset)
+        offset += RR_FIXED.size
+        if offset + length > len(data):
+            raise DNSError('Truncated rdata')
+        if rtype != 41:  # skip the EDNS OPT pseudo-record
+            records.append({
+                'name': name,
+                'type': TYPE_NAMES.get(rtype, str(rtype)),
+                'ttl': ttl,
+                'value': _decode_rdata(rtype, data, offset, length)
+            })
+        offset += length
+    return records, offset
+
+
+def parse_response(data):
+    """Parse a DNS response message into a dict"""
+    if len(data) < HEADER.size:
+        raise DNSError('Short response')
+    query_id, flags, qdcount, ancount, nscount, arcount = HEADER.unpack_from(data)
+    offset = HEADER.size
+    question = None
+    for _ in range(qdcount):
+        qname, offset = _read_name(data, offset)
+        qtype, _ = struct.unpack_from('!HH', data, offset)
+        offset += 4
+        question = (qname.lower(), qtype)
+    answers, offset = _read_records(data, offset, ancount)
+    authority, offset = _read_records(data, offset, nscount)
+    return {
+        'id': query_id,
+        'question': question,
+        'truncated': bool(flags & 0x0200),
+        'rcode': flags & 0x000F,
+        'answers': answers,
+        'authority': authority
+    }
+
+
+_resolv_cache = {'key': None, 'servers': FALLBACK_NAMESERVERS}
+_resolv_lock = threading.Lock()
+
+
+def nameservers():
+    """Nameservers from resolv.conf, re-read only when the file changes"""
+    try:
+        st = os.stat(RESOLV_CONF)
+        key = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return FALLBACK_NAMESERVERS
+    with _resolv_lock:
+        if _resolv_cache['key'] == key:
+            return _resolv_cache['servers']
+        servers = []
+        with open(RESOLV_CONF) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == 'nameserver':
+                    servers.append(parts[1].split('%')[0])
+        _resolv_cache['key'] = key
+        _resolv_cache['servers'] = tuple(servers) or FALLBACK_NAMESERVERS
+        return _resolv_cache['servers']
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_stats = {'queries': 0, 'cache_hits': 0, 'tcp_fallbacks': 0, 'timeouts': 0}
+
+
+def _cache_get(key):
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        expires, result = entry
+        if expires <= time.monotonic():
+            del _cache[key]
+            return None
+        _cache.move_to_end(key)
+        _stats['cache_hits'] += 1
+        remaining = int(expires - time.monotonic())
+    # Hand out the TTL that is actually left, like a caching resolver would
+    answers = [dict(record, ttl=min(record['ttl'], remaining)) for record in result['answers']]
+    return dict(result, answers=answers, cached=True)
+
+
+def _cache_put(key, result):
+    if result['status'] == 'NOERROR' and result['answers']:
+        ttl = min(record['ttl'] for record in result['answers'])
+    elif result['status'] in ('NOERROR', 'NXDOMAIN'):
+        # Negative answers are cached for the SOA minimum (RFC 2308)
+        soa = next((r['value'] for r in result['authority'] if r['type'] == 'SOA'), None)
+        ttl = min(soa['minimum'], NEGATIVE_TTL) if soa else NEGATIVE_TTL
+    else:
+        return
+    ttl = min(ttl, MAX_CACHE_TTL)
+    if ttl <= 0:
+        return
+    with _cache_lock:
+        _cache[key] = (time.monotonic() + ttl, result)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def get_stats():
+    with _cache_lock:
+        return dict(_stats, cache_entries=len(_cache))
+
+
+def _address_family(server):
+    return socket.AF_INET6 if ipaddress.ip_address(server).version == 6 else socket.AF_INET
+
+
+def _query_tcp(server, port, packet, timeout):
+    with socket.socket(_address_family(server), socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect((server, port))
+        sock.sendall(struct.pack('!H', len(packet)) + packet)
+        header = b''
+        while len(header) < 2:
+            chunk = sock.recv(2 - len(header))
+            if not chunk:
+                raise DNSError('Connection closed')
+            header += chunk
+        (length,) = struct.unpack('!H', header)
+        data = bytearray()
+        while len(data) < length:
+            chunk = sock.recv(length - len(data))
+            if not chunk:
+                raise DNSError('Connection closed')
+            data += chunk
+        return bytes(data)
+
+
+def _result(name, qtype, server, response, started):
+    return {
+        'name': name,
+        'type': qtype,
+        'status': RCODES.get(response['rcode'], str(response['rcode'])),
+        'answers': response['answers'],
+        'authority': response['authority'],
+        'server': server,
+        'cached': False,
+        'elapsed_ms': round((time.monotonic() - started) * 1000, 2)
+    }
+
+
+def _error_result(name, qtype, server, status, error, started):
+    return {
+        'name': name,
+        'type': qtype,
+        'status': status,
+        'answers': [],
+        'authority': [],
+        'server': server,
+        'cached': False,
+        'error': error,
+        'elapsed_ms': round((time.monotonic() - started) * 1000, 2)
+    }
+
+
+def _resolve_on(server, port, questions, timeout, retries):
+    """Send the questions to one server over a single UDP socket and multiplex replies.
+
+    At most MAX_IN_FLIGHT queries are outstanding at once so a large batch
+    doesn't overrun the socket buffers; each query is retried `retries`
+    times after `timeout` seconds without an answer.
+    """
+    started = time.monotonic()
+    results = [None] * len(questions)
+    waiting = deque(range(len(questions)))
+    attempts = [0] * len(questions)
+    in_flight = {}  # query id -> (index, packet, deadline)
+    sock = socket.socket(_address_family(server), socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+    try:
+        while waiting or in_flight:
+            while waiting and len(in_flight) < MAX_IN_FLIGHT:
+                index = waiting.popleft()
+                name, qtype = questions[index]
+                query_id = random.getrandbits(16)
+                while query_id in in_flight:
+                    query_id = random.getrandbits(16)
+                packet = build_query(name, qtype, query_id)
+                attempts[index] += 1
+                try:
+                    sock.sendto(packet, (server, port))
+                except OSError as e:
+                    results[index] = _error_result(name, qtype, server, 'ERROR', str(e), started)
+                    continue
+                in_flight[query_id] = (index, packet, time.monotonic() + timeout)
+            if not in_flight:
+                break
+
+            now = time.monotonic()
+            next_deadline = min(deadline for _, _, deadline in in_flight.values())
+            if next_deadline <= now or not selector.select(next_deadline - now):
+                for query_id in [qid for qid, entry in in_flight.items() if entry[2] <= time.monotonic()]:
+                    index = in_flight.pop(query_id)[0]
+                    if attempts[index] <= retries:
+                        waiting.append(index)
+                    else:
+                        with _cache_lock:
+                            _stats['timeouts'] += 1
+                        name, qtype = questions[index]
+                        results[index] = _error_result(name, qtype, server, 'TIMEOUT', 'DNS query timed out', started)
+                continue
+
+            try:
+                data, _ = sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                continue
+            except OSError:
+                # ICMP port unreachable surfaces here; let the deadlines expire
+                time.sleep(min(0.05, max(next_deadline - time.monotonic(), 0)))
+                continue
+            try:
+                response = parse_response(data)
+            except (DNSError, struct.error):
+                continue
+            entry = in_flight.get(response['id'])
+            if entry is None:
+                continue
+            name, qtype = questions[entry[0]]
+            # Ignore stray or spoofed replies that don't echo our question
+            if response['question'] != (name, RECORD_TYPES[qtype]):
+                continue
+            del in_flight[response['id']]
+            if response['truncated']:
+                with _cache_lock:
+                    _stats['tcp_fallbacks'] += 1
+                try:
+                    response = parse_response(_query_tcp(server, port, entry[1], timeout))
+                except (OSError, DNSError, struct.error) as e:
+                    results[entry[0]] = _error_result(name, qtype, server, 'ERROR', str(e), started)
+                    continue
+            results[entry[0]] = _result(name, qtype, server, response, started)
+    finally:
+        selector.close()
+        sock.close()
+    return results
+
+
+def query_many(questions, server=None, port=DNS_PORT, timeout=DEFAULT_TIMEOUT, retries=RETRIES, use_cache=True):
+    """Resolve many (name, type) pairs at once; results come back in the same order.
+
+    Answers are cached for their TTL (negative answers for the SOA
+    minimum). Unanswered questions are retried on the next configured
+    nameserver unless `server` pins one.
+    """
+    questions = [(name.rstrip('.').lower(), qtype.upper()) for name, qtype in questions]
+    for _, qtype in questions:
+        if qtype not in RECORD_TYPES:
+            raise DNSError(f'Unsupported record type {qtype}')
+
+    results = [None] * len(questions)
+    servers = (server,) if server else nameservers()
+    todo = []
+    for index, question in enumerate(questions):
+        cached = _cache_get((question, servers[0], port)) if use_cache else None
+        if cached is not None:
+            results[index] = cached
+        else:
+            todo.append(index)
+    with _cache_lock:
+        _stats['queries'] += len(todo)
+
+    for current in servers:
+        if not todo:
+            break
+        answered = _resolve_on(current, port, [questions[i] for i in todo], timeout, retries)
+        retry = []
+        for index, result in zip(todo, answered):
+            results[index] = result
+            if result['status'] in ('TIMEOUT', 'ERROR', 'SERVFAIL', 'REFUSED'):
+                retry.append(index)
+            elif use_cache:
+                _cache_put((questions[index], servers[0], port), result)
+        todo = retry
+    return results
+
+
+def query(name, qtype='A', server=None, port=DNS_PORT, timeout=DEFAULT_TIMEOUT, retries=RETRIES, use_cache=True):
+    return query_many([(name, qtype)], server=server, port=port, timeout=timeout,
+                      retries=retries, use_cache=use_cache)[0]
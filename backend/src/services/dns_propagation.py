@@ -0,0 +1,177 @@
+import ipaddress
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from src.models.user import DNSRecord
+from src.services import dns_client
+
+# name=address pairs; override with PANEL_DNS_PROPAGATION_RESOLVERS="google=8.8.8.8,quad9=9.9.9.9"
+DEFAULT_RESOLVERS = (
+    ('google', '8.8.8.8'),
+    ('cloudflare', '1.1.1.1'),
+    ('quad9', '9.9.9.9'),
+    ('opendns', '208.67.222.222'),
+)
+QUERY_TIMEOUT = 2.0
+QUERY_RETRIES = 1
+REPORT_CACHE_TTL = 15
+REPORT_CACHE_SIZE = 1000
+
+
+def _configured_resolvers():
+    raw = os.environ.get('PANEL_DNS_PROPAGATION_RESOLVERS')
+    if not raw:
+        return DEFAULT_RESOLVERS
+    resolvers = []
+    for item in raw.split(','):
+        label, _, address = item.strip().partition('=')
+        if not address:
+            label, address = item.strip(), item.strip()
+        if address:
+            resolvers.append((label, address))
+    return tuple(resolvers) or DEFAULT_RESOLVERS
+
+
+RESOLVERS = _configured_resolvers()
+
+_pool = ThreadPoolExecutor(max_workers=min(len(RESOLVERS), 16) or 1, thread_name_prefix='dns-propagation')
+_reports = {}
+_reports_lock = threading.Lock()
+
+
+def _fqdn(name, origin):
+    name = (name or '').strip()
+    if name in ('', '@'):
+        return origin
+    if name.endswith('.'):
+        return name[:-1].lower()
+    lowered = name.lower()
+    if lowered == origin or lowered.endswith('.' + origin):
+        return lowered
+    return f'{lowered}.{origin}'
+
+
+def _target(value, origin):
+    """Record targets as stored (relative, dotted or '@') to a bare FQDN"""
+    value = value.strip()
+    if value in ('', '@'):
+        return origin
+    if value.endswith('.'):
+        return value[:-1].lower()
+    return value.lower() if '.' in value else f'{value.lower()}.{origin}'
+
+
+def expected_values(record, origin):
+    """Canonical string for a stored DNSRecord, comparable with answer_value()"""
+    record_type = record.record_type.upper()
+    value = record.value.strip()
+    if record_type in ('A', 'AAAA'):
+        try:
+            return str(ipaddress.ip_address(value))
+        except ValueError:
+            return value
+    if record_type in ('CNAME', 'NS', 'PTR'):
+        return _target(value, origin)
+    if record_type == 'MX':
+        return f'{record.priority or 0} {_target(value, origin)}'
+    if record_type == 'SRV':
+        parts = value.split()
+        if len(parts) == 3:
+            parts = [str(record.priority or 0)] + parts
+        if len(parts) == 4:
+            parts[3] = _target(parts[3], origin)
+        return ' '.join(parts)
+    if record_type == 'TXT' and len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1]
+    return value
+
+
+def answer_value(answer):
+    value = answer['value']
+    record_type = answer['type']
+    if record_type == 'MX':
+        return f'{value["priority"]} {value["exchange"].lower()}'
+    if record_type == 'SRV':
+        return f'{value["priority"]} {value["weight"]} {value["port"]} {value["target"].lower()}'
+    if record_type == 'CAA':
+        return f'{value["flags"]} {value["tag"]} "{value["value"]}"'
+    if record_type in ('CNAME', 'NS', 'PTR'):
+        return value.lower().rstrip('.')
+    return value
+
+
+def _ask(label, address, fqdn, record_type):
+    result = dns_client.query(fqdn, record_type, server=address, timeout=QUERY_TIMEOUT,
+                              retries=QUERY_RETRIES, use_cache=False)
+    # A CNAME chain comes back alongside the requested type; compare only the latter
+    answers = [a for a in result['answers'] if a['type'] == record_type]
+    return {
+        'resolver': label,
+        'address': address,
+        'status': result['status'],
+        'values': sorted(answer_value(a) for a in answers),
+        'ttl': min((a['ttl'] for a in answers), default=None),
+        'elapsed_ms': result['elapsed_ms'],
+        'error': result.get('error')
+    }
+
+
+def check(domain, name, record_type, resolvers=None):
+    """Query every resolver at once and compare with the panel's records.
+
+    Returns a report with one entry per resolver saying whether it already
+    serves exactly the stored record set. Reports are cached for
+    REPORT_CACHE_TTL seconds so repeated polling doesn't hammer resolvers.
+    """
+    origin = domain.name.lower().rstrip('.')
+    record_type = record_type.upper()
+    fqdn = _fqdn(name, origin)
+    resolvers = tuple(resolvers or RESOLVERS)
+    key = (fqdn, record_type, resolvers)
+
+    now = time.monotonic()
+    with _reports_lock:
+        cached = _reports.get(key)
+        if cached and cached[0] > now:
+            return dict(cached[1], cached=True)
+
+    expected = sorted({
+        expected_values(record, origin)
+        for record in DNSRecord.query.filter_by(domain_id=domain.id, record_type=record_type)
+        if _fqdn(record.name, origin) == fqdn
+    })
+
+    futures = [_pool.submit(_ask, label, address, fqdn, record_type) for label, address in resolvers]
+    results = []
+    for future in futures:
+        entry = future.result()
+        served = set(entry['values'])
+        entry['missing'] = [value for value in expected if value not in served]
+        entry['unexpected'] = [value for value in entry['values'] if value not in expected]
+        if entry['status'] in ('TIMEOUT', 'ERROR', 'SERVFAIL', 'REFUSED'):
+            entry['state'] = 'error'
+        elif not entry['missing'] and not entry['unexpected']:
+            entry['state'] = 'propagated'
+        else:
+            entry['state'] = 'stale'
+        results.append(entry)
+
+    propagated = sum(1 for entry in results if entry['state'] == 'propagated')
+    report = {
+        'name': fqdn,
+        'type': record_type,
+        'expected': expected,
+        'resolvers': results,
+        'propagated': propagated,
+        'total': len(results),
+        'consistent': propagated == len(results),
+        'checked_at': time.time(),
+        'cached': False
+    }
+    with _reports_lock:
+        if len(_reports) >= REPORT_CACHE_SIZE:
+            for stale in [k for k, (expires, _) in _reports.items() if expires <= now] or list(_reports)[:1]:
+                del _reports[stale]
+        _reports[key] = (now + REPORT_CACHE_TTL, report)
+    return report
@@ -0,0 +1,235 @@
+import ipaddress
+import re
+
+RECORD_TYPES = ('A', 'AAAA', 'CNAME', 'MX', 'TXT', 'NS', 'PTR', 'SRV', 'CAA')
+MAX_TTL = 2147483647
+MAX_TXT_LENGTH = 4096
+CAA_TAGS = ('issue', 'issuewild', 'iodef')
+
+# Compiled once and shared by every blueprint that validates names
+_LABEL = r'[a-zA-Z0-9](?:[a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?'
+DOMAIN_PATTERN = re.compile(rf'^{_LABEL}(?:\.{_LABEL})*$')
+# Owner names and targets may use underscore labels (_dmarc, _sip._tcp) and a leading wildcard
+_HOST_LABEL = r'(?:[a-zA-Z0-9_](?:[a-zA-Z0-9_\-]{0,61}[a-zA-Z0-9])?)'
+OWNER_PATTERN = re.compile(rf'^(?:\*|{_HOST_LABEL})(?:\.{_HOST_LABEL})*\.?$')
+TARGET_PATTERN = re.compile(rf'^{_HOST_LABEL}(?:\.{_HOST_LABEL})*\.?$')
+SRV_OWNER_PATTERN = re.compile(r'^_[a-zA-Z0-9\-]+\._(?:tcp|udp|tls|sctp)(?:\.|$)', re.IGNORECASE)
+CAA_PATTERN = re.compile(r'^(\d{1,3})[ \t]+([a-zA-Z0-9]+)[ \t]+"([^"\x00-\x1f\x7f]*)"\Z')
+# Tab is the only control character a value may hold; CR/LF would end the
+# line in the zone file and let the rest be read as directives ($INCLUDE...)
+CONTROL_CHARS = re.compile(r'[\x00-\x08\x0a-\x1f\x7f]')
+
+
+def validate_domain(domain):
+    """Validate domain name format"""
+    return bool(domain) and len(domain) <= 253 and DOMAIN_PATTERN.fullmatch(domain) is not None
+
+
+def _is_ipv4(value):
+    try:
+        ipaddress.IPv4Address(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _is_ipv6(value):
+    try:
+        ipaddress.IPv6Address(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _valid_target(value):
+    return value == '@' or (len(value.rstrip('.')) <= 253 and TARGET_PATTERN.fullmatch(value) is not None)
+
+
+def _u16(value):
+    return isinstance(value, int) and 0 <= value <= 65535
+
+
+def _check_a(name, value, priority):
+    if not _is_ipv4(value):
+        return 'A record value must be an IPv4 address'
+
+
+def _check_aaaa(name, value, priority):
+    if not _is_ipv6(value):
+        return 'AAAA record value must be an IPv6 address'
+
+
+def _check_target(name, value, priority):
+    if _is_ipv4(value) or _is_ipv6(value):
+        return 'value must be a hostname, not an IP address'
+    if not _valid_target(value):
+        return 'value must be a valid hostname'
+
+
+def _check_mx(name, value, priority):
+    if not _u16(priority):
+        return 'MX record priority must be between 0 and 65535'
+    return _check_target(name, value, priority)
+
+
+def _check_txt(name, value, priority):
+    if len(value.encode('utf-8')) > MAX_TXT_LENGTH:
+        return f'TXT record value is longer than {MAX_TXT_LENGTH} bytes'
+    if CONTROL_CHARS.search(value):
+        return 'TXT record value contains control characters'
+
+
+def _check_srv(name, value, priority):
+    if not SRV_OWNER_PATTERN.match(name):
+        return 'SRV record name must look like _service._proto'
+    if not _u16(priority):
+        return 'SRV record priority must be between 0 and 65535'
+    parts = value.split()
+    if len(parts) == 4:
+        parts = parts[1:]
+    if len(parts) != 3 or not parts[0].isdigit() or not parts[1].isdigit():
+        return 'SRV record value must be "weight port target"'
+    if not _u16(int(parts[0])) or not _u16(int(parts[1])):
+        return 'SRV weight and port must be between 0 and 65535'
+    if parts[2] != '.' and not _valid_target(parts[2]):
+        return 'SRV target must be a valid hostname'
+
+
+def _check_caa(name, value, priority):
+    match = CAA_PATTERN.match(value)
+    if not match:
+        return 'CAA record value must be: flags tag "value"'
+    if int(match.group(1)) > 255:
+        return 'CAA flags must be between 0 and 255'
+    if match.group(2).lower() not in CAA_TAGS:
+        return f'CAA tag must be one of {", ".join(CAA_TAGS)}'
+
+
+VALIDATORS = {
+    'A': _check_a,
+    'AAAA': _check_aaaa,
+    'CNAME': _check_target,
+    'NS': _check_target,
+    'PTR': _check_target,
+    'MX': _check_mx,
+    'TXT': _check_txt,
+    'SRV': _check_srv,
+    'CAA': _check_caa,
+}
+
+
+def owner_key(name, origin=None):
+    """Canonical owner name, relative to `origin` by the same rule as dns_zone._owner.
+
+    'www', 'www.example.com' and 'www.example.com.' all render as `www`
+    in the example.com zone, so they must compare equal here too.
+    """
+    name = (name or '').strip().lower()
+    bare = name.rstrip('.')
+    if bare in ('', '@'):
+        return '@'
+    if origin:
+        origin = origin.lower().rstrip('.')
+        if bare == origin:
+            return '@'
+        if bare.endswith('.' + origin):
+            return bare[:-len(origin) - 1]
+        # Any other absolute name stays absolute
+        return name
+    return bare
+
+
+def identity(name, record_type, value, origin=None):
+    """Key two records share when they are the same resource record"""
+    value = value.strip()
+    if record_type in ('A', 'AAAA'):
+        try:
+            value = str(ipaddress.ip_address(value))
+        except ValueError:
+            pass
+    elif record_type in ('CNAME', 'MX', 'NS', 'PTR', 'SRV'):
+        value = value.lower().rstrip('.')
+    return owner_key(name, origin), record_type, value
+
+
+def validate_record(name, record_type, value, ttl=None, priority=None):
+    """Return an error message for one record, or None if it is valid"""
+    if record_type not in VALIDATORS:
+        return f'unsupported record type {record_type or "(empty)"}; use {", ".join(RECORD_TYPES)}'
+    if not isinstance(name, (str, type(None))) or CONTROL_CHARS.search(name or ''):
+        return 'invalid record name'
+    name = (name or '@').strip()
+    if name != '@' and not OWNER_PATTERN.fullmatch(name):
+        return 'invalid record name'
+    if not isinstance(value, str) or not value.strip():
+        return 'value is required'
+    if CONTROL_CHARS.search(value):
+        return 'value contains control characters'
+    if ttl is not None and not (isinstance(ttl, int) and 0 <= ttl <= MAX_TTL):
+        return 'ttl must be an integer between 0 and 2147483647'
+    return VALIDATORS[record_type](name, value.strip(), priority)
+
+
+class ZoneIndex:
+    """Per-zone index of owner names and record identities.
+
+    Catches the conflicts a single-record check can't see: a CNAME that
+    shares its name with other data (RFC 1034 3.6.2), a CNAME at the apex,
+    and exact duplicates.
+    """
+
+    def __init__(self, records=(), origin=None):
+        self.origin = origin
+        self.types_by_owner = {}
+        self.identities = {}
+        for record in records:
+            self.add(record.name, record.record_type, record.value, getattr(record, 'id', None))
+
+    def identity(self, name, record_type, value):
+        return identity(name, record_type, value, self.origin)
+
+    def add(self, name, record_type, value, record_id=None):
+        owner = owner_key(name, self.origin)
+        self.types_by_owner.setdefault(owner, {}).setdefault(record_type, set()).add(record_id)
+        self.identities[self.identity(name, record_type, value)] = record_id
+
+    def check(self, name, record_type, value, record_id=None):
+        """Conflict message for adding (or, with record_id, replacing) a record"""
+        owner = owner_key(name, self.origin)
+        if record_type == 'CNAME' and owner == '@':
+            return 'CNAME is not allowed at the zone apex'
+        existing = self.identities.get(self.identity(name, record_type, value), record_id)
+        if existing != record_id:
+            return 'an identical record already exists'
+        others = {
+            other for other, ids in self.types_by_owner.get(owner, {}).items()
+            if ids - {record_id}
+        }
+        if record_type == 'CNAME' and others:
+            return f'CNAME cannot coexist with other records at {owner}'
+        if record_type != 'CNAME' and 'CNAME' in others:
+            return f'{owner} already has a CNAME record'
+        return None
+
+
+def validate_records(records, existing=(), origin=None):
+    """Validate a record set in one pass.
+
+    `records` are dicts with name, type, value, ttl, priority and an
+    optional line; `existing` are stored rows the set is merged into and
+    `origin` is the zone's domain name. Returns a list of {'line',
+    'error'}; repeats of a record are left for the caller to collapse.
+    """
+    index = ZoneIndex(existing, origin)
+    errors = []
+    for position, record in enumerate(records):
+        name, record_type, value = record['name'], record['type'], record['value']
+        error = validate_record(name, record_type, value, record.get('ttl'), record.get('priority'))
+        if error is None and index.identity(name, record_type, value) not in index.identities:
+            error = index.check(name, record_type, value)
+            if error is None:
+                # Distinct placeholder ids keep new records visible to later checks
+                index.add(name, record_type, value, ('new', position))
+        if error:
+            errors.append({'line': record.get('line'), 'error': error})
+    return errors
@@ -0,0 +1,370 @@
+import fcntl
+import hashlib
+import os
+import re
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import bindparam
+from sqlalchemy.orm import selectinload
+from src.models.user import db, Domain, DNSZone
+from src.services import events, scheduler
+from src.services.executor import run_command, run_many
+from src.services.fsutil import atomic_write
+
+ZONE_DIR = '/var/lib/hosting-panel/zones'
+# Included from named.conf.local; lists every zone file in ZONE_DIR
+ZONE_INCLUDE_PATH = '/etc/bind/named.conf.panel-zones'
+ZONE_SUFFIX = '.zone'
+BUILD_INTERVAL = 15
+# Above this many changed zones one `rndc reload` is cheaper than one per zone
+RELOAD_ALL_THRESHOLD = 100
+
+DEFAULT_TTL = 3600
+NAMESERVERS = tuple(
+    ns if ns.endswith('.') else ns + '.'
+    for ns in os.environ.get('PANEL_DNS_NAMESERVERS', 'ns1.hosting-panel.local,ns2.hosting-panel.local').split(',')
+    if ns
+)
+SOA_TIMERS = {'refresh': 3600, 'retry': 900, 'expire': 1209600, 'minimum': 300}
+
+# SOA first, then NS, then everything else alphabetically
+TYPE_ORDER = {'SOA': 0, 'NS': 1}
+TARGET_TYPES = {'CNAME', 'MX', 'NS', 'PTR', 'SRV'}
+TXT_CHUNK = 255
+QUOTED_STRINGS = re.compile(rb'(?:\s*"(?:[^"\\]|\\.)*")+\s*', re.DOTALL)
+QUOTED_STRING = re.compile(rb'"((?:[^"\\]|\\.)*)"', re.DOTALL)
+ESCAPE = re.compile(rb'\\(\d{3}|.)', re.DOTALL)
+
+
+def zone_path(domain_name):
+    return os.path.join(ZONE_DIR, domain_name + ZONE_SUFFIX)
+
+
+@contextmanager
+def _build_lock():
+    """Serialise builds and removals across gunicorn workers"""
+    os.makedirs(ZONE_DIR, exist_ok=True)
+    with open(os.path.join(ZONE_DIR, '.build.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def next_serial(current, today=None):
+    """YYYYMMDDnn serial strictly greater than `current`"""
+    today = today or datetime.utcnow()
+    base = int(today.strftime('%Y%m%d')) * 100
+    return max(base, (current or 0) + 1)
+
+
+def mark_dirty(domain_id):
+    """Flag a zone for the next build; call inside the transaction that changes its records"""
+    zone = DNSZone.query.filter_by(domain_id=domain_id).first()
+    if zone is None:
+        db.session.add(DNSZone(domain_id=domain_id, dirty=True, version=1))
+    else:
+        zone.dirty = True
+        # Bumped in SQL so a build that read the old version won't clear this flag
+        zone.version = DNSZone.version + 1
+
+
+def mark_dirty_many(domain_ids):
+    """Bulk variant of mark_dirty for rows that already have a zone; unbuilt zones are picked up anyway"""
+    for start in range(0, len(domain_ids), 500):
+        db.session.execute(
+            DNSZone.__table__.update()
+            .where(DNSZone.domain_id.in_(domain_ids[start:start + 500]))
+            .values(dirty=True, version=DNSZone.version + 1)
+        )
+
+
+@events.subscribe(events.DOMAIN_STATUS_CHANGED)
+def _domain_status_changed(domain_ids, **_):
+    # Zones of suspended or expired domains are withdrawn on the next build;
+    # the emitter commits this with the status change
+    mark_dirty_many(list(domain_ids))
+
+
+def _owner(name, origin):
+    name = (name or '').strip()
+    if name in ('', '@') or name.rstrip('.').lower() == origin:
+        return '@'
+    if name.endswith('.'):
+        lowered = name[:-1].lower()
+        if lowered.endswith('.' + origin):
+            return name[:-len(origin) - 2]
+        return name
+    if name.lower().endswith('.' + origin):
+        return name[:-len(origin) - 1]
+    return name
+
+
+def _target(value, origin):
+    value = value.strip()
+    if value in ('@', '') or value.endswith('.'):
+        return value or '@'
+    if value.lower() == origin:
+        return '@'
+    # Dotted names are taken as fully qualified, bare labels as relative to the zone
+    return value + '.' if '.' in value else value
+
+
+def _unescape(match):
+    escaped = match.group(1)
+    return bytes([int(escaped) & 0xff]) if escaped.isdigit() else escaped
+
+
+def _txt_bytes(value):
+    """The data of a stored TXT value; a value already written as "quoted" strings is unquoted"""
+    data = value.strip().encode('utf-8')
+    if not QUOTED_STRINGS.fullmatch(data):
+        return data
+    return b''.join(ESCAPE.sub(_unescape, chunk) for chunk in QUOTED_STRING.findall(data))
+
+
+def _escape_txt(chunk):
+    out = []
+    for byte in chunk:
+        if byte in (0x22, 0x5c):
+            out.append('\\' + chr(byte))
+        elif 0x20 <= byte < 0x7f:
+            out.append(chr(byte))
+        else:
+            # Line breaks, other control bytes and non-ASCII as \DDD, so nothing can end the line
+            out.append(f'\\{byte:03d}')
+    return ''.join(out)
+
+
+def _quote_txt(value):
+    """TXT rdata as quoted strings of at most TXT_CHUNK bytes, always escaped"""
+    data = _txt_bytes(value)
+    chunks = [data[i:i + TXT_CHUNK] for i in range(0, len(data), TXT_CHUNK)] or [b'']
+    return ' '.join(f'"{_escape_txt(chunk)}"' for chunk in chunks)
+
+
+def _rdata(record, origin):
+    record_type = record.record_type.upper()
+    value = record.value or ''
+    if record_type == 'MX':
+        return f'{record.priority if record.priority is not None else 10} {_target(value, origin)}'
+    if record_type == 'SRV':
+        parts = value.split()
+        if len(parts) == 3:
+            # priority lives in its own column; value is "weight port target"
+            parts = [str(record.priority or 0)] + parts
+        if len(parts) == 4:
+            parts[3] = _target(parts[3], origin)
+        return ' '.join(parts)
+    if record_type in TARGET_TYPES:
+        return _target(value, origin)
+    if record_type in ('TXT', 'SPF'):
+        return _quote_txt(value)
+    return value.strip()
+
+
+def _owner_sort_key(owner):
+    if owner == '@':
+        return ()
+    return tuple(reversed(owner.lower().split('.')))
+
+
+def render_records(domain_name, records):
+    """Resource record lines for a zone, sorted canonically (everything but the SOA)"""
+    origin = domain_name.lower().rstrip('.')
+    lines = []
+    has_apex_ns = False
+    for record in records:
+        record_type = record.record_type.upper()
+        if record_type == 'SOA':
+            continue
+        owner = _owner(record.name, origin)
+        if record_type == 'NS' and owner == '@':
+            has_apex_ns = True
+        ttl = record.ttl if record.ttl and record.ttl != DEFAULT_TTL else None
+        lines.append((
+            _owner_sort_key(owner), TYPE_ORDER.get(record_type, 2), record_type,
+            record.priority or 0, _rdata(record, origin), owner, ttl
+        ))
+    if not has_apex_ns:
+        lines.extend(((), 1, 'NS', 0, ns, '@', None) for ns in NAMESERVERS)
+    lines.sort(key=lambda line: line[:5])
+
+    rendered = []
+    for _, _, record_type, _, rdata, owner, ttl in lines:
+        ttl_field = str(ttl) if ttl else ''
+        rendered.append(f'{owner:<24} {ttl_field:<6} IN {record_type:<6} {rdata}')
+    return '\n'.join(rendered) + '\n'
+
+
+def render_zone(domain_name, body, serial):
+    """Full zone file: directives, SOA with `serial`, then the rendered records"""
+    origin = domain_name.lower().rstrip('.')
+    primary = NAMESERVERS[0] if NAMESERVERS else f'ns1.{origin}.'
+    soa = (
+        f'@ IN SOA {primary} hostmaster.{origin}. (\n'
+        f'    {serial} ; serial\n'
+        f'    {SOA_TIMERS["refresh"]} ; refresh\n'
+        f'    {SOA_TIMERS["retry"]} ; retry\n'
+        f'    {SOA_TIMERS["expire"]} ; expire\n'
+        f'    {SOA_TIMERS["minimum"]} ) ; negative caching TTL\n'
+    )
+    return (
+        f'; Managed by hosting panel - changes will be overwritten\n'
+        f'$ORIGIN {origin}.\n'
+        f'$TTL {DEFAULT_TTL}\n'
+        f'{soa}\n'
+        f'{body}'
+    )
+
+
+def _content_hash(domain_name, body):
+    # The SOA serial is left out so an unchanged record set keeps its serial
+    header = f'{domain_name}|{DEFAULT_TTL}|{NAMESERVERS}|{sorted(SOA_TIMERS.items())}'
+    return hashlib.sha256(header.encode() + b'\0' + body.encode()).hexdigest()
+
+
+def render_include():
+    names = sorted(
+        entry[:-len(ZONE_SUFFIX)] for entry in os.listdir(ZONE_DIR)
+        if entry.endswith(ZONE_SUFFIX)
+    ) if os.path.isdir(ZONE_DIR) else []
+    lines = ['// Managed by hosting panel - changes will be overwritten']
+    for name in names:
+        lines.append(f'zone "{name}" {{ type master; file "{zone_path(name)}"; }};')
+    return '\n'.join(lines) + '\n'
+
+
+def _write_include():
+    """Rewrite the named.conf include; returns True if its content changed"""
+    content = render_include()
+    try:
+        with open(ZONE_INCLUDE_PATH) as f:
+            if f.read() == content:
+                return False
+    except OSError:
+        pass
+    atomic_write(ZONE_INCLUDE_PATH, content)
+    return True
+
+
+def _reload(changed, reconfig):
+    """Tell named about new and changed zones"""
+    results = []
+    if reconfig:
+        results.append(run_command(['rndc', 'reconfig'], timeout=60))
+    if len(changed) > RELOAD_ALL_THRESHOLD:
+        results.append(run_command(['rndc', 'reload'], timeout=120))
+    elif changed:
+        results.extend(run_many([['rndc', 'reload', name] for name in changed], timeout=30))
+    failed = [r for r in results if not r['success']]
+    return {
+        'success': not failed,
+        'commands': len(results),
+        'errors': [(r['stderr'] or r['stdout']).strip() for r in failed][:10]
+    }
+
+
+def _pending_domain_ids(domain_ids, force):
+    if force:
+        query = db.session.query(Domain.id)
+        if domain_ids is not None:
+            query = query.filter(Domain.id.in_(domain_ids))
+        return [row[0] for row in query.order_by(Domain.id)]
+    # Dirty zones plus domains that have never been built
+    query = db.session.query(Domain.id).outerjoin(DNSZone, DNSZone.domain_id == Domain.id).filter(
+        db.or_(DNSZone.id.is_(None), DNSZone.dirty.is_(True))
+    )
+    if domain_ids is not None:
+        query = query.filter(Domain.id.in_(domain_ids))
+    return [row[0] for row in query.order_by(Domain.id)]
+
+
+def build(domain_ids=None, force=False, batch_size=500):
+    """Compile dirty zones and write only those whose record set changed.
+
+    Unchanged zones keep their serial; changed ones get a YYYYMMDDnn bump.
+    Zones of inactive domains are withdrawn. Each batch commits on its own,
+    and a dirty flag set while the batch was rendering survives the build.
+    """
+    pending = _pending_domain_ids(domain_ids, force)
+    result = {'written': [], 'removed': [], 'unchanged': 0, 'reload': None}
+    if not pending:
+        return result
+
+    with _build_lock():
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            domains = Domain.query.options(selectinload(Domain.dns_records)).filter(Domain.id.in_(batch)).all()
+            zones = {zone.domain_id: zone for zone in DNSZone.query.filter(DNSZone.domain_id.in_(batch))}
+            cleaned = []
+
+            for domain in domains:
+                zone = zones.get(domain.id)
+                if zone is None:
+                    zone = DNSZone(domain_id=domain.id, serial=0, dirty=False, version=0)
+                    db.session.add(zone)
+                seen_version = zone.version or 0
+                path = zone_path(domain.name)
+
+                if not domain.is_active or domain.status not in Domain.SERVING_STATUSES:
+                    if os.path.exists(path):
+                        os.unlink(path)
+                        result['removed'].append(domain.name)
+                    zone.content_hash = None
+                else:
+                    body = render_records(domain.name, domain.dns_records)
+                    digest = _content_hash(domain.name, body)
+                    if digest == zone.content_hash and os.path.exists(path):
+                        result['unchanged'] += 1
+                    else:
+                        zone.serial = next_serial(zone.serial)
+                        atomic_write(path, render_zone(domain.name, body, zone.serial))
+                        zone.content_hash = digest
+                        zone.built_at = datetime.utcnow()
+                        result['written'].append(domain.name)
+                cleaned.append({'b_domain_id': domain.id, 'b_version': seen_version})
+
+            db.session.flush()
+            if cleaned:
+                db.session.execute(
+                    DNSZone.__table__.update()
+                    .where(DNSZone.domain_id == bindparam('b_domain_id'))
+                    .where(DNSZone.version == bindparam('b_version'))
+                    .values(dirty=False),
+                    cleaned
+                )
+            db.session.commit()
+
+        reconfig = _write_include()
+
+    changed = result['written'] + result['removed']
+    if changed or reconfig:
+        result['reload'] = _reload(result['written'], reconfig)
+    return result
+
+
+def remove_zone(domain_name):
+    """Withdraw a deleted domain's zone file and drop it from named"""
+    if not os.path.exists(zone_path(domain_name)):
+        return None
+    with _build_lock():
+        path = zone_path(domain_name)
+        if os.path.exists(path):
+            os.unlink(path)
+        if _write_include():
+            return _reload([], True)
+    return None
+
+
+def get_zone_file(domain_name):
+    try:
+        with open(zone_path(domain_name)) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def start_builder(app):
+    return scheduler.start_periodic('dns-zone-build', BUILD_INTERVAL, build, app=app, leader_only=True)
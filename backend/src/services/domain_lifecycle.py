@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+from src.models.user import db, Domain
+from src.services import events, scheduler
+# Imported for their DOMAIN_STATUS_CHANGED subscribers (zone, vhost and mail map regeneration)
+from src.services import dns_zone, mail_maps, nginx_vhost  # noqa: F401
+
+SWEEP_INTERVAL = 300
+BATCH_SIZE = 500
+# How long an expired domain keeps serving (vhost, zone and mail, see
+# Domain.SERVING_STATUSES) before it is suspended
+GRACE_PERIOD = timedelta(days=30)
+
+
+def _transition(old_status, new_status, condition, batch_size):
+    """Move matching domains from old_status to new_status in keyset batches.
+
+    Candidates are walked in (expires_at, id) order over the expires_at
+    index, so each batch is one range scan rather than an OFFSET. The
+    UPDATE re-checks the old status, leaving alone anything an admin
+    changed in the meantime. Returns the ids that changed.
+    """
+    changed = []
+    last = None
+    while True:
+        query = db.session.query(Domain.id, Domain.expires_at).filter(
+            Domain.status == old_status, Domain.expires_at.isnot(None), condition
+        )
+        if last is not None:
+            query = query.filter(db.or_(
+                Domain.expires_at > last[0],
+                db.and_(Domain.expires_at == last[0], Domain.id > last[1])
+            ))
+        rows = query.order_by(Domain.expires_at, Domain.id).limit(batch_size).all()
+        if not rows:
+            break
+        last = rows[-1]
+        ids = [row.id for row in rows]
+        result = db.session.execute(
+            Domain.__table__.update()
+            .where(Domain.id.in_(ids), Domain.status == old_status)
+            .values(status=new_status)
+        )
+        if result.rowcount:
+            changed.extend(ids)
+            # Before the commit, so zone and mail dirty marks land with the status change
+            events.emit(events.DOMAIN_STATUS_CHANGED, domain_ids=ids,
+                        old_status=old_status, new_status=new_status)
+        db.session.commit()
+        if len(rows) < batch_size:
+            break
+    return changed
+
+
+def sweep(now=None, batch_size=BATCH_SIZE):
+    """Apply expiry-driven status transitions; returns counts per transition.
+
+    active -> expired once expires_at passes, expired -> suspended after
+    GRACE_PERIOD, and expired -> active when the expiry moved into the
+    future (a renewal). Manual suspensions are never lifted here.
+    """
+    now = now or datetime.utcnow()
+    expired = _transition('active', 'expired', Domain.expires_at <= now, batch_size)
+    suspended = _transition('expired', 'suspended', Domain.expires_at <= now - GRACE_PERIOD, batch_size)
+    renewed = _transition('expired', 'active', Domain.expires_at > now, batch_size)
+    return {'expired': len(expired), 'suspended': len(suspended), 'renewed': len(renewed)}
+
+
+def start_sweeper(app):
+    return scheduler.start_periodic('domain-lifecycle', SWEEP_INTERVAL, sweep, app=app, leader_only=True)
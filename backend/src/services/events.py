@@ -0,0 +1,37 @@
+import threading
+import traceback
+
+# Emitted inside the transaction that changes the status, before its commit;
+# handlers add their own changes to it and leave committing to the emitter.
+# Payload domain_ids, new_status (and old_status from the sweeper)
+DOMAIN_STATUS_CHANGED = 'domain.status_changed'
+# A domain was added or what it serves changed (certificates, PHP pool); payload domain_ids
+DOMAIN_CHANGED = 'domain.changed'
+# After the domain row is gone; payload domain_id, domain_name
+DOMAIN_DELETED = 'domain.deleted'
+
+_subscribers = {}
+_lock = threading.Lock()
+
+
+def subscribe(event):
+    """Decorator registering a handler called as handler(**payload) for `event`"""
+    def register(handler):
+        with _lock:
+            _subscribers.setdefault(event, []).append(handler)
+        return handler
+    return register
+
+
+def emit(event, **payload):
+    """Call every handler synchronously; one failing handler doesn't stop the rest"""
+    with _lock:
+        handlers = list(_subscribers.get(event, ()))
+    failures = 0
+    for handler in handlers:
+        try:
+            handler(**payload)
+        except Exception:
+            failures += 1
+            traceback.print_exc()
+    return failures
@@ -0,0 +1,269 @@
+import os
+import shutil
+import signal
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Bounded pool shared by every blueprint that needs to shell out
+MAX_WORKERS = int(os.environ.get('PANEL_EXECUTOR_WORKERS', '4'))
+DEFAULT_TIMEOUT = 30
+
+# Limits applied to every child process; override per call with `limits=`
+DEFAULT_LIMITS = {
+    'cpu_seconds': 60,
+    'memory_mb': 1024,
+    'nice': 10,
+}
+
+# Optional cgroup v2 directory (e.g. /sys/fs/cgroup/panel-commands) that
+# children are moved into right after spawning, so the host can cap them as one unit
+EXECUTOR_CGROUP = os.environ.get('PANEL_EXECUTOR_CGROUP')
+
+# Cached probe results kept at most; expired ones go first, then least recently used
+CACHE_SIZE = int(os.environ.get('PANEL_EXECUTOR_CACHE_SIZE', '512'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+_cache = OrderedDict()  # key -> (expires at, result), least recently used first
+_inflight = {}
+_cache_lock = threading.Lock()
+
+_histograms = {}
+_histogram_lock = threading.Lock()
+
+
+def _get_pool():
+    """Create the worker pool lazily so forked gunicorn workers get their own"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='panel-exec')
+    return _pool
+
+
+def _limited(argv, limits):
+    """Prefix argv with the nice/prlimit wrappers that apply `limits` in the child.
+
+    Done with wrapper commands rather than a preexec_fn, which is not safe
+    to run between fork and exec in a threaded process.
+    """
+    prefix = []
+    niceness = limits.get('nice')
+    if niceness and shutil.which('nice'):
+        prefix += ['nice', '-n', str(niceness)]
+    rlimits = []
+    if limits.get('cpu_seconds'):
+        rlimits.append(f'--cpu={limits["cpu_seconds"]}')
+    if limits.get('memory_mb'):
+        rlimits.append(f'--as={limits["memory_mb"] * 1024 * 1024}')
+    if rlimits and shutil.which('prlimit'):
+        prefix += ['prlimit'] + rlimits + ['--']
+    return prefix + argv
+
+
+def _join_cgroup(pid):
+    try:
+        with open(os.path.join(EXECUTOR_CGROUP, 'cgroup.procs'), 'w') as f:
+            f.write(str(pid))
+    except OSError:
+        pass
+
+
+def _result(success, stdout, stderr, returncode, duration, timed_out=False):
+    return {
+        'success': success,
+        'stdout': stdout,
+        'stderr': stderr,
+        'returncode': returncode,
+        'duration': round(duration, 6),
+        'timed_out': timed_out
+    }
+
+
+def _record_latency(name, duration):
+    with _histogram_lock:
+        hist = _histograms.get(name)
+        if hist is None:
+            hist = _histograms[name] = {
+                'count': 0,
+                'failures': 0,
+                'sum': 0.0,
+                'max': 0.0,
+                'buckets': [0] * (len(LATENCY_BUCKETS) + 1)
+            }
+        hist['count'] += 1
+        hist['sum'] += duration
+        hist['max'] = max(hist['max'], duration)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if duration <= bound:
+                hist['buckets'][i] += 1
+                break
+        else:
+            hist['buckets'][-1] += 1
+        return hist
+
+
+def _execute(argv, timeout, limits, input_data, env, cwd):
+    """Run one argv to completion in the calling thread"""
+    name = os.path.basename(argv[0])
+    started = time.monotonic()
+    try:
+        # Resolved up front so a missing command fails here, not inside the wrappers
+        if shutil.which(argv[0], path=(env if env is not None else os.environ).get('PATH')) is None:
+            raise FileNotFoundError(f'No such file or directory: {argv[0]!r}')
+        proc = subprocess.Popen(
+            _limited(argv, limits),
+            stdin=subprocess.PIPE if input_data is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            env=env,
+            cwd=cwd,
+            start_new_session=True
+        )
+    except OSError as e:
+        duration = time.monotonic() - started
+        hist = _record_latency(name, duration)
+        hist['failures'] += 1
+        return _result(False, '', str(e), 127 if isinstance(e, FileNotFoundError) else -1, duration)
+    if EXECUTOR_CGROUP:
+        _join_cgroup(proc.pid)
+
+    try:
+        stdout, stderr = proc.communicate(input=input_data, timeout=timeout)
+        timed_out = False
+    except subprocess.TimeoutExpired:
+        # Kill the whole session so grandchildren do not outlive the timeout
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        stdout, stderr = proc.communicate()
+        timed_out = True
+
+    duration = time.monotonic() - started
+    hist = _record_latency(name, duration)
+    if timed_out:
+        hist['failures'] += 1
+        return _result(False, stdout or '', 'Command timed out', -1, duration, timed_out=True)
+    if proc.returncode != 0:
+        hist['failures'] += 1
+    return _result(proc.returncode == 0, stdout, stderr, proc.returncode, duration)
+
+
+def _cache_key(argv, input_data, env, cwd):
+    # env changes what a probe sees (PATH, LANG...), so it is part of the key
+    env_key = tuple(sorted(env.items())) if env is not None else None
+    return (tuple(argv), input_data, env_key, cwd)
+
+
+def _cache_store(key, expires, result):
+    """Insert under _cache_lock, pruning expired entries and then the LRU tail"""
+    _cache[key] = (expires, result)
+    _cache.move_to_end(key)
+    if len(_cache) <= CACHE_SIZE:
+        return
+    now = time.monotonic()
+    for stale in [k for k, (until, _) in _cache.items() if until <= now]:
+        del _cache[stale]
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+def submit(argv, timeout=DEFAULT_TIMEOUT, cache_ttl=None, limits=None, input=None, env=None, cwd=None):
+    """Queue a command on the shared pool and return a Future of its result dict.
+
+    `argv` must be a list/tuple; shell strings are rejected. When `cache_ttl`
+    is given the command is treated as an idempotent probe: a fresh cached
+    result is returned directly and identical concurrent calls share one run.
+    """
+    if isinstance(argv, (str, bytes)) or not argv:
+        raise TypeError('argv must be a non-empty list of arguments, not a shell string')
+    argv = [str(arg) for arg in argv]
+    merged_limits = dict(DEFAULT_LIMITS)
+    if limits:
+        merged_limits.update(limits)
+
+    if not cache_ttl:
+        return _get_pool().submit(_execute, argv, timeout, merged_limits, input, env, cwd)
+
+    key = _cache_key(argv, input, env, cwd)
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[0] <= now:
+            del _cache[key]
+            cached = None
+        if cached:
+            _cache.move_to_end(key)
+            future = Future()
+            future.set_result(cached[1])
+            return future
+        inflight = _inflight.get(key)
+        if inflight is not None:
+            return inflight
+        future = _get_pool().submit(_execute, argv, timeout, merged_limits, input, env, cwd)
+        _inflight[key] = future
+
+    def store(done):
+        with _cache_lock:
+            _inflight.pop(key, None)
+            if done.exception() is None and not done.result()['timed_out']:
+                _cache_store(key, time.monotonic() + cache_ttl, done.result())
+
+    future.add_done_callback(store)
+    return future
+
+
+def run_command(argv, timeout=DEFAULT_TIMEOUT, cache_ttl=None, limits=None, input=None, env=None, cwd=None):
+    """Run a command on the shared pool and wait for its result dict"""
+    return submit(argv, timeout=timeout, cache_ttl=cache_ttl, limits=limits,
+                  input=input, env=env, cwd=cwd).result()
+
+
+def run_many(commands, timeout=DEFAULT_TIMEOUT, cache_ttl=None):
+    """Run several argv lists concurrently and return results in the same order"""
+    futures = [submit(argv, timeout=timeout, cache_ttl=cache_ttl) for argv in commands]
+    return [future.result() for future in futures]
+
+
+def invalidate(argv=None):
+    """Drop cached probe results, either for one argv or entirely"""
+    with _cache_lock:
+        if argv is None:
+            _cache.clear()
+        else:
+            prefix = tuple(str(arg) for arg in argv)
+            for key in [k for k in _cache if k[0] == prefix]:
+                del _cache[key]
+
+
+def get_stats():
+    """Per-command latency histograms and pool/cache sizes"""
+    with _histogram_lock:
+        commands = {}
+        for name, hist in _histograms.items():
+            labels = [f'le_{bound}' for bound in LATENCY_BUCKETS] + ['le_inf']
+            commands[name] = {
+                'count': hist['count'],
+                'failures': hist['failures'],
+                'avg_seconds': round(hist['sum'] / hist['count'], 6) if hist['count'] else 0,
+                'max_seconds': round(hist['max'], 6),
+                'buckets': dict(zip(labels, hist['buckets']))
+            }
+    with _cache_lock:
+        cache_entries = len(_cache)
+        inflight = len(_inflight)
+    return {
+        'max_workers': MAX_WORKERS,
+        'cache_entries': cache_entries,
+        'inflight_probes': inflight,
+        'commands': commands
+    }
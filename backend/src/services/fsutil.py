@@ -0,0 +1,43 @@
+import os
+import tempfile
+
+
+def atomic_write(path, content, mode=None, gid=None):
+    """Write a file via temp file + fsync + rename so readers never see a partial file.
+
+    `gid` sets the group before the rename, so a group-readable file is
+    never briefly unreadable to its readers.
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    if mode is None:
+        try:
+            mode = os.stat(path).st_mode & 0o7777
+        except FileNotFoundError:
+            mode = 0o644
+    data = content.encode('utf-8') if isinstance(content, str) else content
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if gid is not None:
+            os.chown(tmp_path, -1, gid)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    # Persist the rename itself
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
@@ -0,0 +1,328 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from flask_jwt_extended import JWTManager
+from jwt import InvalidTokenError
+from jwt.algorithms import OKPAlgorithm, RSAAlgorithm
+from src.services import scheduler
+from src.services.fsutil import atomic_write
+
+KEY_DIR = os.environ.get('PANEL_JWT_KEY_DIR', '/var/lib/hosting-panel/jwt-keys')
+# RS256 or EdDSA (Ed25519); switching only affects keys created afterwards
+ALGORITHM = os.environ.get('PANEL_JWT_ALGORITHM', 'EdDSA')
+RSA_KEY_BITS = 2048
+ROTATION_INTERVAL = 30 * 86400
+# A new key is in the JWKS this long before it signs anything, so
+# verifiers that cache the key set already know it
+PUBLISH_AHEAD = 3600
+# Longest token lifetime (refresh tokens) plus slack; a superseded key
+# stays verifiable this long so rotation never ends a live session
+RETAIN_AFTER_SUPERSEDED = 31 * 86400
+RELOAD_INTERVAL = 5
+ROTATE_CHECK_INTERVAL = 3600
+
+VERIFY_CACHE_SIZE = 10000
+
+_lock = threading.Lock()
+_keys = {}  # kid -> {'kid', 'alg', 'activates_at', 'private', 'public'}
+_state = {'mtime': None, 'checked_at': 0.0}
+
+_verified = OrderedDict()  # sha256(kid, signature, signing input) of signatures that checked out
+_verified_lock = threading.Lock()
+_verify_stats = {'hits': 0, 'misses': 0}
+# The key picked for the token being encoded on this thread, see PanelJWTManager
+_encoding = threading.local()
+
+
+def _manifest_path():
+    return os.path.join(KEY_DIR, 'keys.json')
+
+
+@contextmanager
+def _key_lock():
+    os.makedirs(KEY_DIR, mode=0o700, exist_ok=True)
+    with open(os.path.join(KEY_DIR, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _read_manifest():
+    try:
+        with open(_manifest_path()) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'keys': []}
+
+
+def _generate(alg):
+    if alg == 'RS256':
+        return rsa.generate_private_key(public_exponent=65537, key_size=RSA_KEY_BITS)
+    if alg == 'EdDSA':
+        return ed25519.Ed25519PrivateKey.generate()
+    raise ValueError(f'unsupported JWT algorithm {alg}')
+
+
+def _add_key(manifest, activates_at):
+    kid = uuid.uuid4().hex[:16]
+    private = _generate(ALGORITHM)
+    pem = private.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                serialization.NoEncryption())
+    atomic_write(os.path.join(KEY_DIR, f'{kid}.pem'), pem, mode=0o600)
+    manifest['keys'].append({'kid': kid, 'alg': ALGORITHM, 'created_at': int(time.time()),
+                             'activates_at': int(activates_at)})
+    return kid
+
+
+def _signing_entry(entries, now):
+    signing = None
+    for entry in entries:
+        # Later entries win ties, so a forced rotation takes over within the same second
+        if entry['activates_at'] <= now and (signing is None or entry['activates_at'] >= signing['activates_at']):
+            signing = entry
+    return signing
+
+
+def rotate(force=False):
+    """Publish a successor key when the signing key is due, and drop dead keys.
+
+    Runs under a file lock so only one worker edits the key set. Returns
+    what changed.
+    """
+    now = time.time()
+    changes = {'added': [], 'removed': []}
+    with _key_lock():
+        manifest = _read_manifest()
+        entries = manifest['keys']
+        signing = _signing_entry(entries, now)
+        if signing is None:
+            # First start: a key that signs right away
+            changes['added'].append(_add_key(manifest, now))
+        else:
+            pending = [entry for entry in entries if entry['activates_at'] > now]
+            if not pending and (force or now - signing['activates_at'] >= ROTATION_INTERVAL - PUBLISH_AHEAD):
+                changes['added'].append(_add_key(manifest, now + (0 if force else PUBLISH_AHEAD)))
+            # A key is superseded when the next key starts signing; keep it
+            # RETAIN_AFTER_SUPERSEDED past that so its tokens still verify
+            active = sorted((entry for entry in entries if entry['activates_at'] <= now),
+                            key=lambda entry: entry['activates_at'])
+            for entry, successor in zip(active, active[1:]):
+                if now - successor['activates_at'] > RETAIN_AFTER_SUPERSEDED:
+                    entries.remove(entry)
+                    changes['removed'].append(entry['kid'])
+        if changes['added'] or changes['removed']:
+            atomic_write(_manifest_path(), json.dumps(manifest, indent=2), mode=0o600)
+            for kid in changes['removed']:
+                try:
+                    os.unlink(os.path.join(KEY_DIR, f'{kid}.pem'))
+                except FileNotFoundError:
+                    pass
+    if changes['added'] or changes['removed']:
+        _reload(force=True)
+    return changes
+
+
+def _reload(force=False):
+    """Re-read the key set when keys.json changed; parsed keys are reused"""
+    now = time.monotonic()
+    if not force and now - _state['checked_at'] < RELOAD_INTERVAL:
+        return
+    _state['checked_at'] = now
+    try:
+        mtime = os.stat(_manifest_path()).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if mtime is None:
+        rotate()
+        return
+    if mtime == _state['mtime']:
+        return
+    entries = _read_manifest()['keys']
+    keys = {}
+    for entry in entries:
+        key = _keys.get(entry['kid'])
+        if key is None:
+            with open(os.path.join(KEY_DIR, f"{entry['kid']}.pem"), 'rb') as f:
+                private = serialization.load_pem_private_key(f.read(), password=None)
+            public = private.public_key()
+            key = {'kid': entry['kid'], 'alg': entry['alg'], 'private': private, 'public': public,
+                   'verifier': _verifier(entry['kid'], public)}
+        keys[entry['kid']] = dict(key, activates_at=entry['activates_at'])
+    with _lock:
+        removed = set(_keys) - set(keys)
+        _keys.clear()
+        _keys.update(keys)
+        _state['mtime'] = mtime
+    if removed:
+        clear_verify_cache()
+
+
+def signing_key():
+    _reload()
+    with _lock:
+        entry = _signing_entry(list(_keys.values()), time.time())
+    if entry is None:
+        rotate()
+        with _lock:
+            entry = _signing_entry(list(_keys.values()), time.time())
+    return entry
+
+
+def verification_key(kid):
+    """Public key for a kid; an unknown kid triggers one immediate reload"""
+    _reload()
+    with _lock:
+        key = _keys.get(kid)
+    if key is None:
+        _reload(force=True)
+        with _lock:
+            key = _keys.get(kid)
+    return key
+
+
+def jwks():
+    """Public keys (including pre-published and superseded ones) as a JWK Set"""
+    _reload()
+    with _lock:
+        entries = sorted(_keys.values(), key=lambda entry: entry['activates_at'], reverse=True)
+    keys = []
+    for entry in entries:
+        if entry['alg'] == 'RS256':
+            jwk = RSAAlgorithm.to_jwk(entry['public'], as_dict=True)
+        else:
+            jwk = OKPAlgorithm.to_jwk(entry['public'], as_dict=True)
+        jwk.update({'kid': entry['kid'], 'alg': entry['alg'], 'use': 'sig'})
+        keys.append(jwk)
+    return {'keys': keys}
+
+
+def clear_verify_cache():
+    with _verified_lock:
+        _verified.clear()
+
+
+def get_stats():
+    with _lock:
+        keys = [{'kid': key['kid'], 'alg': key['alg'], 'activates_at': key['activates_at']} for key in _keys.values()]
+    with _verified_lock:
+        stats = dict(_verify_stats, cached=len(_verified))
+    return {'keys': keys, 'verify_cache': stats}
+
+
+class _CachedVerify:
+    """Public key wrapper remembering which signatures verified.
+
+    PyJWT hands the key the signature and signing input, so a token seen
+    before skips the public-key operation. Failures are never cached.
+    """
+
+    def __init__(self, kid, public):
+        self._kid = kid
+        self._public = public
+
+    def verify(self, signature, data, *args):
+        digest = hashlib.sha256(b'\0'.join((self._kid.encode(), signature, data))).digest()
+        with _verified_lock:
+            if digest in _verified:
+                _verified.move_to_end(digest)
+                _verify_stats['hits'] += 1
+                return
+        self._public.verify(signature, data, *args)  # raises InvalidSignature
+        with _verified_lock:
+            _verify_stats['misses'] += 1
+            _verified[digest] = True
+            if len(_verified) > VERIFY_CACHE_SIZE:
+                _verified.popitem(last=False)
+
+    def public_bytes(self, *args, **kwargs):
+        return self._public.public_bytes(*args, **kwargs)
+
+    def __eq__(self, other):
+        return self._public == getattr(other, '_public', other)
+
+    def __copy__(self):
+        return self
+
+
+# Subclassing the key types lets PyJWT's isinstance checks accept the wrappers
+class _CachedEd25519Key(_CachedVerify, ed25519.Ed25519PublicKey):
+    def public_bytes_raw(self):
+        return self._public.public_bytes_raw()
+
+
+class _CachedRSAKey(_CachedVerify, rsa.RSAPublicKey):
+    @property
+    def key_size(self):
+        return self._public.key_size
+
+    def encrypt(self, plaintext, padding):
+        return self._public.encrypt(plaintext, padding)
+
+    def public_numbers(self):
+        return self._public.public_numbers()
+
+    def recover_data_from_signature(self, signature, padding, algorithm):
+        return self._public.recover_data_from_signature(signature, padding, algorithm)
+
+
+def _verifier(kid, public):
+    if isinstance(public, rsa.RSAPublicKey):
+        return _CachedRSAKey(kid, public)
+    return _CachedEd25519Key(kid, public)
+
+
+class PanelJWTManager(JWTManager):
+    """JWTManager signing with the rotating key set and caching verified signatures.
+
+    Uses only the public loader callbacks: the header loader picks the
+    signing key and puts its kid and algorithm in the header, the encode
+    key loader that runs next signs with that same key, and the decode key
+    loader resolves the kid to a caching verifier.
+    """
+
+    def init_app(self, app, add_context_processor=False):
+        super().init_app(app, add_context_processor=add_context_processor)
+        app.config['JWT_ALGORITHM'] = ALGORITHM
+        app.config['JWT_DECODE_ALGORITHMS'] = ['RS256', 'EdDSA']
+        self.additional_headers_loader(self._encode_headers)
+        self.encode_key_loader(self._encode_key)
+        self.decode_key_loader(self._decode_key)
+        # PyJWT 2.10 rejects a non-string `sub`; routes pass user.id as is
+        self.user_identity_loader(str)
+
+    @staticmethod
+    def _encode_headers(identity):
+        # One signing_key() read per token so a rotation can't split kid, alg and key;
+        # PyJWT signs with the header's alg over JWT_ALGORITHM
+        key = signing_key()
+        _encoding.key = key
+        return {'kid': key['kid'], 'alg': key['alg']}
+
+    @staticmethod
+    def _encode_key(identity):
+        key = getattr(_encoding, 'key', None) or signing_key()
+        _encoding.key = None
+        return key['private']
+
+    @staticmethod
+    def _decode_key(jwt_header, jwt_payload):
+        key = verification_key(jwt_header.get('kid'))
+        if key is None:
+            raise InvalidTokenError('Unknown signing key')
+        if key['alg'] != jwt_header.get('alg'):
+            raise InvalidTokenError('Token algorithm does not match its signing key')
+        return key['verifier']
+
+
+def start_rotation(app):
+    return scheduler.start_periodic('jwt-key-rotation', ROTATE_CHECK_INTERVAL, rotate, app=app, leader_only=True)
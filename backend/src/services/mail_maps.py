@@ -0,0 +1,173 @@
+import fcntl
+import grp
+import os
+from contextlib import contextmanager
+from datetime import datetime
+from src.models.user import db, Domain, EmailAccount, MailMapState
+from src.services import events, scheduler
+from src.services.executor import run_command
+from src.services.fsutil import atomic_write
+
+# Postfix: virtual_mailbox_domains = hash:/etc/postfix/panel/virtual_domains
+#          virtual_mailbox_maps = hash:/etc/postfix/panel/virtual_mailboxes
+POSTFIX_MAP_DIR = os.environ.get('PANEL_POSTFIX_MAP_DIR', '/etc/postfix/panel')
+VIRTUAL_DOMAINS = 'virtual_domains'
+VIRTUAL_MAILBOXES = 'virtual_mailboxes'
+# Dovecot: passdb/userdb passwd-file with args = /etc/dovecot/panel-users
+DOVECOT_USERS_PATH = os.environ.get('PANEL_DOVECOT_USERS', '/etc/dovecot/panel-users')
+# Group that owns the passwd-file; Dovecot's auth process reads it through this group
+DOVECOT_GROUP = os.environ.get('PANEL_DOVECOT_GROUP', 'dovecot')
+MAIL_ROOT = os.environ.get('PANEL_MAIL_ROOT', '/var/vmail')
+VMAIL_UID = int(os.environ.get('PANEL_VMAIL_UID', '5000'))
+VMAIL_GID = int(os.environ.get('PANEL_VMAIL_GID', '5000'))
+BUILD_INTERVAL = 10
+QUERY_BATCH = 1000
+
+STATE_ID = 1
+
+
+def maildir_path(email):
+    local, domain = email.split('@', 1)
+    return os.path.join(MAIL_ROOT, domain, local)
+
+
+@contextmanager
+def _build_lock():
+    os.makedirs(POSTFIX_MAP_DIR, exist_ok=True)
+    with open(os.path.join(POSTFIX_MAP_DIR, '.build.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def mark_dirty():
+    """Schedule a map rebuild; call inside the transaction that changes accounts"""
+    updated = db.session.execute(
+        MailMapState.__table__.update()
+        .where(MailMapState.id == STATE_ID)
+        .values(version=MailMapState.version + 1)
+    ).rowcount
+    if not updated:
+        db.session.add(MailMapState(id=STATE_ID, version=1, built_version=0))
+
+
+@events.subscribe(events.DOMAIN_STATUS_CHANGED)
+def _domain_status_changed(**_):
+    # Mail for suspended or expired domains is refused after the next build;
+    # the emitter commits this with the status change
+    mark_dirty()
+
+
+def _dovecot_gid():
+    try:
+        return grp.getgrnam(DOVECOT_GROUP).gr_gid
+    except KeyError:
+        raise RuntimeError(f'Group {DOVECOT_GROUP} not found; set PANEL_DOVECOT_GROUP to the group Dovecot runs as')
+
+
+def _password_field(password_hash):
+    if password_hash.startswith('$argon2id$'):
+        return '{ARGON2ID}' + password_hash
+    return '{BLF-CRYPT}' + password_hash
+
+
+def render():
+    """Contents of every map, streamed from one query over deliverable accounts.
+
+    Accounts of inactive or suspended domains are left out; their domains
+    stay out of virtual_domains so Postfix rejects the mail. Expired
+    domains still receive mail during their grace period.
+    """
+    domains = [name for (name,) in db.session.query(Domain.name).join(
+        EmailAccount, EmailAccount.domain_id == Domain.id
+    ).filter(
+        EmailAccount.is_active.is_(True), Domain.is_active.is_(True), Domain.status.in_(Domain.SERVING_STATUSES)
+    ).distinct().order_by(Domain.name)]
+    mailboxes = []
+    users = []
+    rows = db.session.query(EmailAccount.email, EmailAccount.password_hash, EmailAccount.quota_mb).join(
+        Domain, EmailAccount.domain_id == Domain.id
+    ).filter(
+        EmailAccount.is_active.is_(True), Domain.is_active.is_(True), Domain.status.in_(Domain.SERVING_STATUSES)
+    ).order_by(EmailAccount.email).yield_per(QUERY_BATCH)
+    for email, password_hash, quota_mb in rows:
+        local, domain = email.split('@', 1)
+        mailboxes.append(f'{email} {domain}/{local}/')
+        quota = f'userdb_quota_rule=*:storage={quota_mb}M' if quota_mb else ''
+        users.append(f'{email}:{_password_field(password_hash)}:{VMAIL_UID}:{VMAIL_GID}::'
+                     f'{maildir_path(email)}::{quota}')
+    header = '# Managed by hosting panel - changes will be overwritten'
+    return {
+        VIRTUAL_DOMAINS: '\n'.join([header] + [f'{name} OK' for name in domains]) + '\n',
+        VIRTUAL_MAILBOXES: '\n'.join([header] + mailboxes) + '\n',
+        DOVECOT_USERS_PATH: '\n'.join([header] + users) + '\n',
+    }
+
+
+def _unchanged(path, content):
+    try:
+        with open(path) as f:
+            return f.read() == content
+    except OSError:
+        return False
+
+
+def _install_postfix_map(name, content):
+    """Swap in a map and its postmap'd .db together, so Postfix never sees a half-built map"""
+    path = os.path.join(POSTFIX_MAP_DIR, name)
+    staging = os.path.join(POSTFIX_MAP_DIR, f'.{name}.new')
+    atomic_write(staging, content, mode=0o644)
+    result = run_command(['postmap', f'hash:{staging}'], timeout=120)
+    if not result['success']:
+        os.unlink(staging)
+        raise RuntimeError(f"postmap {name} failed: {(result['stderr'] or result['stdout']).strip()}")
+    os.replace(staging + '.db', path + '.db')
+    os.replace(staging, path)
+
+
+def build(force=False):
+    """Rebuild the maps if any account changed since the last build.
+
+    All accounts changed in between go out in one rewrite, and only files
+    whose content differs are replaced. Dovecot rereads its passwd-file
+    on change and Postfix notices a new .db, so no reload is needed.
+    """
+    state = db.session.query(MailMapState.version, MailMapState.built_version).filter(
+        MailMapState.id == STATE_ID
+    ).first()
+    seen_version = state.version if state else 0
+    if state is not None and not force and state.built_version == seen_version:
+        return {'built': False, 'written': []}
+
+    # Looked up first, so a missing group fails the build before any map is replaced
+    dovecot_gid = _dovecot_gid()
+    written = []
+    with _build_lock():
+        for target, content in render().items():
+            path = target if os.path.isabs(target) else os.path.join(POSTFIX_MAP_DIR, target)
+            is_postfix_map = target != DOVECOT_USERS_PATH
+            if _unchanged(path, content) and (not is_postfix_map or os.path.exists(path + '.db')):
+                continue
+            if is_postfix_map:
+                _install_postfix_map(target, content)
+            else:
+                # Holds password hashes: readable by the dovecot group only
+                atomic_write(path, content, mode=0o640, gid=dovecot_gid)
+            written.append(path)
+
+    if state is None:
+        db.session.add(MailMapState(id=STATE_ID, version=0, built_version=0, built_at=datetime.utcnow()))
+    else:
+        # A change made while rendering bumps version past seen_version and stays pending
+        db.session.execute(
+            MailMapState.__table__.update().where(MailMapState.id == STATE_ID)
+            .values(built_version=seen_version, built_at=datetime.utcnow())
+        )
+    db.session.commit()
+    return {'built': True, 'written': written}
+
+
+def start_builder(app):
+    return scheduler.start_periodic('mail-map-build', BUILD_INTERVAL, build, app=app, leader_only=True)
@@ -0,0 +1,363 @@
+import collections
+import os
+import random
+import smtplib
+import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from email import policy
+from email.message import EmailMessage
+from email.utils import formataddr, formatdate, make_msgid
+from sqlalchemy import bindparam, func
+from src.models.user import db, OutboundMessage, OutboundRecipient
+from src.services import scheduler
+
+# Messages are handed to this MTA (the local Postfix by default), which
+# does the MX lookups; point it at any SMTP sink to test delivery
+RELAY_HOST = os.environ.get('PANEL_SMTP_RELAY_HOST', '127.0.0.1')
+RELAY_PORT = int(os.environ.get('PANEL_SMTP_RELAY_PORT', '25'))
+RELAY_USER = os.environ.get('PANEL_SMTP_RELAY_USER')
+RELAY_PASSWORD = os.environ.get('PANEL_SMTP_RELAY_PASSWORD')
+RELAY_STARTTLS = os.environ.get('PANEL_SMTP_RELAY_STARTTLS', '0') == '1'
+HELO_NAME = os.environ.get('PANEL_SMTP_HELO')
+
+POOL_SIZE = int(os.environ.get('PANEL_SMTP_POOL_SIZE', '4'))
+SMTP_TIMEOUT = 30
+# Idle connections are closed before the relay drops them
+MAX_IDLE = 60
+MAX_TRANSACTIONS_PER_CONNECTION = 100
+MAX_RECIPIENTS_PER_TRANSACTION = 50
+MAX_RECIPIENTS_PER_MESSAGE = 100
+
+DELIVER_INTERVAL = 2
+CLAIM_BATCH = 500
+# A 'sending' claim older than this belongs to a worker that died
+CLAIM_TIMEOUT = timedelta(minutes=10)
+MAX_ATTEMPTS = 12
+MAX_AGE = timedelta(days=3)
+RETRY_BASE = 60
+RETRY_MAX = 6 * 3600
+RETENTION = timedelta(days=7)
+PRUNE_INTERVAL = 3600
+
+THROUGHPUT_WINDOW = 300
+
+# SMTP session counters of this process; only the scheduler leader delivers.
+# Message and recipient counts come from the queue tables instead.
+_stats = {'transactions': 0, 'pipelined': 0, 'connections_opened': 0, 'connections_reused': 0,
+          'connection_errors': 0}
+_stats_lock = threading.Lock()
+
+
+class _Connection:
+    def __init__(self):
+        self.smtp = smtplib.SMTP(RELAY_HOST, RELAY_PORT, local_hostname=HELO_NAME, timeout=SMTP_TIMEOUT)
+        try:
+            self.smtp.ehlo()
+            if RELAY_STARTTLS:
+                self.smtp.starttls(context=ssl.create_default_context())
+                self.smtp.ehlo()
+            if RELAY_USER:
+                self.smtp.login(RELAY_USER, RELAY_PASSWORD or '')
+        except BaseException:
+            self.smtp.close()
+            raise
+        self.transactions = 0
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self.smtp.close()
+
+
+class SMTPPool:
+    """Up to `size` persistent relay connections, reused across transactions"""
+
+    def __init__(self, size):
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def _take(self):
+        with self.lock:
+            while self.idle:
+                conn = self.idle.pop()
+                if time.monotonic() - conn.last_used < MAX_IDLE:
+                    with _stats_lock:
+                        _stats['connections_reused'] += 1
+                    return conn
+                conn.close()
+        conn = _Connection()
+        with _stats_lock:
+            _stats['connections_opened'] += 1
+        return conn
+
+    @contextmanager
+    def connection(self):
+        with self.slots:
+            conn = self._take()
+            try:
+                yield conn.smtp
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPResponseException, OSError):
+                # State of the session is unknown; never hand it out again
+                conn.smtp.close()
+                raise
+            conn.transactions += 1
+            conn.last_used = time.monotonic()
+            if conn.transactions >= MAX_TRANSACTIONS_PER_CONNECTION:
+                conn.close()
+            else:
+                with self.lock:
+                    self.idle.append(conn)
+
+    def close_idle(self, max_idle=MAX_IDLE):
+        with self.lock:
+            stale = [conn for conn in self.idle if time.monotonic() - conn.last_used >= max_idle]
+            self.idle = [conn for conn in self.idle if conn not in stale]
+        for conn in stale:
+            conn.close()
+
+    def stats(self):
+        with self.lock:
+            return {'size': POOL_SIZE, 'idle': len(self.idle)}
+
+
+_pool = SMTPPool(POOL_SIZE)
+_senders = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix='smtp')
+
+
+def build_message(sender, to, subject, body, cc=None, html=None, reply_to=None, sender_name=None):
+    """An RFC 5322 message with CRLF line endings, ready for DATA"""
+    message = EmailMessage()
+    message['From'] = formataddr((sender_name, sender)) if sender_name else sender
+    message['To'] = ', '.join(to)
+    if cc:
+        message['Cc'] = ', '.join(cc)
+    if reply_to:
+        message['Reply-To'] = reply_to
+    message['Subject'] = subject or ''
+    message['Date'] = formatdate(localtime=False)
+    message['Message-ID'] = make_msgid(domain=sender.rsplit('@', 1)[-1])
+    message.set_content(body or '')
+    if html:
+        message.add_alternative(html, subtype='html')
+    return message
+
+
+def enqueue(user_id, sender, recipients, message):
+    """Store a message and one queued row per envelope recipient (caller commits)"""
+    addresses = list(dict.fromkeys(address.strip().lower() for address in recipients))
+    row = OutboundMessage(user_id=user_id, sender=sender, message_id=message['Message-ID'],
+                          content=message.as_bytes(policy=policy.SMTP).decode('utf-8'))
+    row.recipients = [OutboundRecipient(address=address, domain=address.rsplit('@', 1)[-1], status='queued',
+                                        attempts=0, next_attempt_at=datetime.utcnow())
+                      for address in addresses]
+    db.session.add(row)
+    return row
+
+
+def _transaction(smtp, sender, recipients, content):
+    """One MAIL/RCPT/DATA exchange; returns {address: (code, reply)}.
+
+    With PIPELINING (RFC 2920) the whole envelope goes out in one write and
+    the replies are read back in order, so a batch costs one round trip
+    instead of one per recipient.
+    """
+    if smtp.has_extn('pipelining'):
+        commands = [f'MAIL FROM:<{sender}>'] + [f'RCPT TO:<{address}>' for address in recipients]
+        smtp.send(''.join(command + '\r\n' for command in commands))
+        mail_reply = smtp.getreply()
+        rcpt_replies = [smtp.getreply() for _ in recipients]
+        with _stats_lock:
+            _stats['pipelined'] += 1
+    else:
+        mail_reply = smtp.mail(sender)
+        rcpt_replies = [smtp.rcpt(address) for address in recipients] if mail_reply[0] == 250 else []
+    if mail_reply[0] != 250:
+        smtp.rset()
+        return {address: mail_reply for address in recipients}
+
+    results = {}
+    accepted = []
+    for address, reply in zip(recipients, rcpt_replies):
+        if reply[0] in (250, 251):
+            accepted.append(address)
+        else:
+            results[address] = reply
+    if not accepted:
+        smtp.rset()
+        return results
+    try:
+        reply = smtp.data(content.encode('utf-8'))
+    except smtplib.SMTPDataError as e:
+        reply = (e.smtp_code, e.smtp_error)
+        smtp.rset()
+    for address in accepted:
+        results[address] = reply
+    return results
+
+
+def _deliver_group(sender, recipients, content):
+    try:
+        with _pool.connection() as smtp:
+            return _transaction(smtp, sender, recipients, content)
+    except (smtplib.SMTPException, OSError) as e:
+        # Session-level trouble (refused, dropped, bad relay login) says
+        # nothing about the recipients, so it is always retried
+        with _stats_lock:
+            _stats['connection_errors'] += 1
+        return {address: (421, str(e) or type(e).__name__) for address in recipients}
+
+
+def _reply_text(reply):
+    code, text = reply
+    if isinstance(text, bytes):
+        text = text.decode('utf-8', 'replace')
+    return f'{code} {text}'[:500]
+
+
+def _retry_delay(attempts):
+    delay = min(RETRY_MAX, RETRY_BASE * 2 ** (attempts - 1))
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def _claim(now, limit):
+    db.session.execute(
+        OutboundRecipient.__table__.update()
+        .where(OutboundRecipient.status == 'sending', OutboundRecipient.claimed_at < now - CLAIM_TIMEOUT)
+        .values(status='deferred', next_attempt_at=now)
+    )
+    rows = db.session.query(
+        OutboundRecipient.id, OutboundRecipient.message_id, OutboundRecipient.address,
+        OutboundRecipient.domain, OutboundRecipient.attempts
+    ).filter(
+        OutboundRecipient.status.in_(('queued', 'deferred')), OutboundRecipient.next_attempt_at <= now
+    ).order_by(OutboundRecipient.next_attempt_at).limit(limit).all()
+    if rows:
+        db.session.execute(
+            OutboundRecipient.__table__.update()
+            .where(OutboundRecipient.id.in_([row.id for row in rows]))
+            .values(status='sending', claimed_at=now)
+        )
+    db.session.commit()
+    return rows
+
+
+def deliver(limit=CLAIM_BATCH):
+    """One pass over due recipients: claim, send in batches, record outcomes.
+
+    Recipients of one message are grouped by domain into transactions of
+    up to MAX_RECIPIENTS_PER_TRANSACTION and sent concurrently over the
+    connection pool. 2xx marks a recipient sent and 5xx failed. 4xx or a
+    connection problem defers it with exponential backoff until
+    MAX_ATTEMPTS or MAX_AGE.
+    """
+    _pool.close_idle()
+    now = datetime.utcnow()
+    rows = _claim(now, limit)
+    if not rows:
+        return {'claimed': 0, 'transactions': 0, 'sent': 0, 'deferred': 0, 'failed': 0}
+
+    messages = {message.id: message for message in db.session.query(
+        OutboundMessage.id, OutboundMessage.sender, OutboundMessage.content, OutboundMessage.created_at
+    ).filter(OutboundMessage.id.in_({row.message_id for row in rows}))}
+    groups = collections.defaultdict(list)
+    for row in rows:
+        groups[(row.message_id, row.domain)].append(row)
+    batches = []
+    for (message_id, _), members in sorted(groups.items()):
+        for i in range(0, len(members), MAX_RECIPIENTS_PER_TRANSACTION):
+            batches.append((message_id, members[i:i + MAX_RECIPIENTS_PER_TRANSACTION]))
+
+    futures = [(message_id, members, _senders.submit(
+        _deliver_group, messages[message_id].sender, [member.address for member in members],
+        messages[message_id].content
+    )) for message_id, members in batches]
+
+    sent, deferred, failed = [], [], []
+    finished = datetime.utcnow()
+    for message_id, members, future in futures:
+        results = future.result()
+        too_old = finished - messages[message_id].created_at > MAX_AGE
+        for member in members:
+            reply = results.get(member.address, (421, 'No reply'))
+            attempts = (member.attempts or 0) + 1
+            if 200 <= reply[0] < 300:
+                sent.append({'b_id': member.id, 'b_attempts': attempts, 'b_error': None})
+            elif reply[0] >= 500 or attempts >= MAX_ATTEMPTS or too_old:
+                failed.append({'b_id': member.id, 'b_attempts': attempts, 'b_error': _reply_text(reply)})
+            else:
+                deferred.append({'b_id': member.id, 'b_attempts': attempts, 'b_error': _reply_text(reply),
+                                 'b_next': finished + _retry_delay(attempts)})
+
+    table = OutboundRecipient.__table__
+    by_id = table.update().where(table.c.id == bindparam('b_id'))
+    if sent:
+        db.session.execute(by_id.values(status='sent', attempts=bindparam('b_attempts'),
+                                        last_error=bindparam('b_error'), sent_at=finished), sent)
+    if failed:
+        db.session.execute(by_id.values(status='failed', attempts=bindparam('b_attempts'),
+                                        last_error=bindparam('b_error')), failed)
+    if deferred:
+        db.session.execute(by_id.values(status='deferred', attempts=bindparam('b_attempts'),
+                                        last_error=bindparam('b_error'), next_attempt_at=bindparam('b_next')),
+                           deferred)
+    db.session.commit()
+
+    with _stats_lock:
+        _stats['transactions'] += len(batches)
+    return {'claimed': len(rows), 'transactions': len(batches), 'sent': len(sent),
+            'deferred': len(deferred), 'failed': len(failed)}
+
+
+def prune(now=None):
+    """Drop messages whose recipients all finished more than RETENTION ago"""
+    cutoff = (now or datetime.utcnow()) - RETENTION
+    unfinished = db.session.query(OutboundRecipient.message_id).filter(
+        OutboundRecipient.status.in_(('queued', 'deferred', 'sending'))
+    )
+    old = [message_id for (message_id,) in db.session.query(OutboundMessage.id).filter(
+        OutboundMessage.created_at < cutoff, OutboundMessage.id.notin_(unfinished)
+    ).limit(10000)]
+    for i in range(0, len(old), 500):
+        chunk = old[i:i + 500]
+        OutboundRecipient.query.filter(OutboundRecipient.message_id.in_(chunk)).delete(synchronize_session=False)
+        OutboundMessage.query.filter(OutboundMessage.id.in_(chunk)).delete(synchronize_session=False)
+    db.session.commit()
+    return len(old)
+
+
+def get_stats():
+    """Queue depth by status, age of the oldest pending recipient and recent throughput.
+
+    Counts and rates are read from the queue tables, so every worker
+    reports the same numbers whichever process did the delivering.
+    """
+    counts = dict(db.session.query(OutboundRecipient.status, func.count()).group_by(OutboundRecipient.status))
+    oldest = db.session.query(func.min(OutboundMessage.created_at)).join(
+        OutboundRecipient, OutboundRecipient.message_id == OutboundMessage.id
+    ).filter(OutboundRecipient.status.in_(('queued', 'deferred', 'sending'))).scalar()
+    since = datetime.utcnow() - timedelta(seconds=THROUGHPUT_WINDOW)
+    recent_sent = OutboundRecipient.query.filter(OutboundRecipient.sent_at >= since).count()
+    recent_accepted = OutboundMessage.query.filter(OutboundMessage.created_at >= since).count()
+    with _stats_lock:
+        stats = dict(_stats)
+    stats.update({
+        'queue': {status: counts.get(status, 0) for status in ('queued', 'sending', 'deferred', 'sent', 'failed')},
+        'oldest_pending_seconds': int((datetime.utcnow() - oldest).total_seconds()) if oldest else 0,
+        'sent_per_minute': round(recent_sent * 60 / THROUGHPUT_WINDOW, 2),
+        'accepted_per_minute': round(recent_accepted * 60 / THROUGHPUT_WINDOW, 2),
+        'pool': _pool.stats(),
+        'relay': f'{RELAY_HOST}:{RELAY_PORT}'
+    })
+    return stats
+
+
+def start_worker(app):
+    scheduler.start_periodic('mail-queue-prune', PRUNE_INTERVAL, prune, app=app, leader_only=True)
+    return scheduler.start_periodic('mail-queue-deliver', DELIVER_INTERVAL, deliver, app=app, leader_only=True)
@@ -0,0 +1,125 @@
+import os
+import re
+import threading
+from sqlalchemy import bindparam
+from src.models.user import db, EmailAccount
+from src.services import scheduler
+from src.services.mail_maps import maildir_path
+
+SCAN_INTERVAL = 300
+BATCH_SIZE = 500
+# Maildir++ file names carry the message size: 1700000000.M1P2.host,S=4096:2,S
+SIZE_PATTERN = re.compile(r',S=(\d+)')
+
+# folder path -> ((mtime of cur, mtime of new), bytes). Renaming, adding or
+# removing a message changes its directory's mtime and Maildir files are
+# never rewritten in place, so an unchanged pair means an unchanged size.
+_folders = {}
+_folders_lock = threading.Lock()
+_stats = {'scans': 0, 'accounts': 0, 'updated': 0, 'folders_cached': 0, 'folders_scanned': 0}
+_stats_lock = threading.Lock()
+
+
+def _messages_size(directory):
+    total = 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            match = SIZE_PATTERN.search(entry.name)
+            if match:
+                total += int(match.group(1))
+                continue
+            try:
+                total += entry.stat(follow_symlinks=False).st_size
+            except FileNotFoundError:
+                pass  # expunged or moved while we were listing
+    return total
+
+
+def folder_size(path, counts):
+    """Bytes in one Maildir folder's cur/ and new/, from cache when unchanged"""
+    try:
+        key = (os.stat(os.path.join(path, 'cur')).st_mtime_ns, os.stat(os.path.join(path, 'new')).st_mtime_ns)
+    except FileNotFoundError:
+        return 0
+    with _folders_lock:
+        cached = _folders.get(path)
+    if cached is not None and cached[0] == key:
+        counts['folders_cached'] += 1
+        return cached[1]
+    try:
+        size = _messages_size(os.path.join(path, 'cur')) + _messages_size(os.path.join(path, 'new'))
+    except FileNotFoundError:
+        return 0
+    counts['folders_scanned'] += 1
+    with _folders_lock:
+        _folders[path] = (key, size)
+    return size
+
+
+def maildir_size(root, counts, seen):
+    """Total bytes in a Maildir++ mailbox: the inbox plus every .Folder"""
+    folders = [root]
+    try:
+        with os.scandir(root) as entries:
+            folders.extend(entry.path for entry in entries
+                           if entry.name.startswith('.') and entry.name not in ('.', '..') and entry.is_dir())
+    except (FileNotFoundError, NotADirectoryError):
+        return 0
+    seen.update(folders)
+    return sum(folder_size(folder, counts) for folder in folders)
+
+
+def scan(batch_size=BATCH_SIZE):
+    """Recompute used_mb for every account and write back the ones that changed.
+
+    Accounts are read in id-keyed batches and each batch's changes go out
+    as one executemany. Folders whose directories haven't changed since
+    the last pass are not listed again.
+    """
+    counts = {'accounts': 0, 'updated': 0, 'folders_cached': 0, 'folders_scanned': 0}
+    seen = set()
+    last_id = 0
+    while True:
+        rows = db.session.query(EmailAccount.id, EmailAccount.email, EmailAccount.used_mb).filter(
+            EmailAccount.id > last_id
+        ).order_by(EmailAccount.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        changes = []
+        for account_id, email, used_mb in rows:
+            size_mb = round(maildir_size(maildir_path(email), counts, seen) / (1024 * 1024), 2)
+            if size_mb != used_mb:
+                changes.append({'b_id': account_id, 'b_used_mb': size_mb})
+        counts['accounts'] += len(rows)
+        if changes:
+            db.session.execute(
+                EmailAccount.__table__.update()
+                .where(EmailAccount.id == bindparam('b_id'))
+                .values(used_mb=bindparam('b_used_mb')),
+                changes
+            )
+            db.session.commit()
+            counts['updated'] += len(changes)
+
+    with _folders_lock:
+        # Forget folders of deleted mailboxes
+        for path in [path for path in _folders if path not in seen]:
+            del _folders[path]
+    with _stats_lock:
+        _stats['scans'] += 1
+        for key, value in counts.items():
+            _stats[key] += value
+    return counts
+
+
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    with _folders_lock:
+        stats['folders_in_cache'] = len(_folders)
+    return stats
+
+
+def start_scanner(app):
+    return scheduler.start_periodic('maildir-usage-scan', SCAN_INTERVAL, scan, app=app, leader_only=True)
@@ -0,0 +1,320 @@
+import glob
+import os
+import re
+import tempfile
+import threading
+from src.services.executor import run_command
+
+NGINX_PREFIX = '/etc/nginx'
+MAX_INCLUDE_DEPTH = 8
+
+# Directives that must open a block, and the contexts they may appear in
+BLOCK_CONTEXTS = {
+    'events': {'main'},
+    'http': {'main'},
+    'stream': {'main'},
+    'mail': {'main'},
+    'server': {'http', 'stream', 'mail', 'upstream'},
+    'upstream': {'http', 'stream'},
+    'location': {'server', 'location'},
+    'if': {'server', 'location'},
+    'limit_except': {'location'},
+    'map': {'http', 'stream'},
+    'geo': {'http', 'stream'},
+    'split_clients': {'http', 'stream'},
+    'types': {'http', 'server', 'location'},
+    'match': {'http', 'stream'},
+}
+# `server` inside `upstream` is a simple directive (server address)
+SIMPLE_IN_CONTEXT = {('server', 'upstream')}
+# Blocks whose bodies are free-form key/value tables
+OPAQUE_BLOCKS = {'map', 'geo', 'split_clients', 'types', 'match'}
+PASS_DIRECTIVES = {'proxy_pass', 'fastcgi_pass', 'uwsgi_pass', 'scgi_pass', 'grpc_pass', 'memcached_pass'}
+PASS_TARGET_PATTERN = re.compile(r'^(?:[a-z]+://)?([^/:$\s]+)(?::\d+)?(?:/.*)?$')
+
+
+class NginxConfigError(Exception):
+    """Syntax error in an nginx configuration"""
+
+    def __init__(self, message, line=None, file=None):
+        super().__init__(message)
+        self.message = message
+        self.line = line
+        self.file = file
+
+
+class Directive:
+    __slots__ = ('name', 'args', 'line', 'block', 'file')
+
+    def __init__(self, name, args, line, block=None, file=None):
+        self.name = name
+        self.args = args
+        self.line = line
+        self.block = block
+        self.file = file
+
+    def to_dict(self):
+        data = {'directive': self.name, 'args': self.args, 'line': self.line}
+        if self.block is not None:
+            data['block'] = [child.to_dict() for child in self.block]
+        return data
+
+
+def tokenize(text):
+    """Yield (token, line, quoted) tuples; `{`, `}` and `;` are their own tokens"""
+    i = 0
+    line = 1
+    length = len(text)
+    while i < length:
+        ch = text[i]
+        if ch == '\n':
+            line += 1
+            i += 1
+        elif ch in ' \t\r':
+            i += 1
+        elif ch == '#':
+            while i < length and text[i] != '\n':
+                i += 1
+        elif ch in '{};':
+            yield ch, line, False
+            i += 1
+        elif ch in '"\'':
+            start_line = line
+            i += 1
+            buf = []
+            while i < length and text[i] != ch:
+                if text[i] == '\\' and i + 1 < length:
+                    buf.append(text[i + 1])
+                    i += 2
+                    continue
+                if text[i] == '\n':
+                    line += 1
+                buf.append(text[i])
+                i += 1
+            if i >= length:
+                raise NginxConfigError('unterminated quoted string', start_line)
+            i += 1
+            yield ''.join(buf), start_line, True
+        else:
+            start = i
+            while i < length and text[i] not in ' \t\r\n;{}"\'':
+                if text[i] == '$' and i + 1 < length and text[i + 1] == '{':
+                    # ${var} may contain braces
+                    end = text.find('}', i)
+                    i = end + 1 if end != -1 else length
+                    continue
+                i += 1
+            yield text[start:i], line, False
+
+
+def parse(text, file=None):
+    """Parse configuration text into a list of Directive trees"""
+    stack = [[]]
+    current = None  # [name, args, line] being collected
+    for token, line, quoted in tokenize(text):
+        if not quoted and token == ';':
+            if current is None:
+                raise NginxConfigError('unexpected ";"', line, file)
+            stack[-1].append(Directive(current[0], current[1], current[2], file=file))
+            current = None
+        elif not quoted and token == '{':
+            if current is None:
+                raise NginxConfigError('unexpected "{"', line, file)
+            directive = Directive(current[0], current[1], current[2], block=[], file=file)
+            stack[-1].append(directive)
+            stack.append(directive.block)
+            current = None
+        elif not quoted and token == '}':
+            if current is not None:
+                raise NginxConfigError(f'directive "{current[0]}" is not terminated by ";"', current[2], file)
+            if len(stack) == 1:
+                raise NginxConfigError('unexpected "}"', line, file)
+            stack.pop()
+        elif current is None:
+            current = [token, [], line]
+        else:
+            current[1].append(token)
+    if current is not None:
+        raise NginxConfigError(f'directive "{current[0]}" is not terminated by ";"', current[2], file)
+    if len(stack) > 1:
+        raise NginxConfigError('unexpected end of file, expecting "}"', None, file)
+    return stack[0]
+
+
+_include_cache = {}
+_include_lock = threading.Lock()
+
+
+def _parse_file_cached(path):
+    """Parse an included file, reusing the previous tree while its mtime is unchanged"""
+    st = os.stat(path)
+    key = (st.st_mtime_ns, st.st_size)
+    with _include_lock:
+        cached = _include_cache.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+    with open(path, 'r', errors='replace') as f:
+        tree = parse(f.read(), file=path)
+    with _include_lock:
+        _include_cache[path] = (key, tree)
+    return tree
+
+
+def _resolve_include(pattern, prefix):
+    path = pattern if os.path.isabs(pattern) else os.path.join(prefix, pattern)
+    if glob.has_magic(path):
+        return sorted(glob.glob(path)), True
+    return ([path] if os.path.isfile(path) else []), False
+
+
+class _Linter:
+    def __init__(self, prefix, source_name, follow_includes=True):
+        self.prefix = prefix
+        self.follow_includes = follow_includes
+        self.source_name = source_name
+        self.issues = []
+        self.upstreams = set()
+        self.pass_refs = []
+        self.server_names = {}  # (listen, name) -> (file, line)
+        self.visited = set()
+
+    def issue(self, level, message, directive=None, line=None, file=None):
+        file = file if file is not None else (directive.file if directive else None)
+        self.issues.append({
+            'level': level,
+            'message': message,
+            'line': line if line is not None else (directive.line if directive else None),
+            'file': file or self.source_name
+        })
+
+    def walk(self, directives, context, depth=0):
+        for directive in directives:
+            name = directive.name
+            if name == 'include':
+                self.include(directive, context, depth)
+                continue
+
+            expects_block = name in BLOCK_CONTEXTS and (name, context) not in SIMPLE_IN_CONTEXT
+            if expects_block and directive.block is None:
+                self.issue('error', f'directive "{name}" has no opening "{{"', directive)
+                continue
+            if directive.block is not None and name in BLOCK_CONTEXTS and context not in BLOCK_CONTEXTS[name]:
+                self.issue('error', f'"{name}" directive is not allowed in {context} context', directive)
+
+            if name == 'upstream' and directive.args:
+                self.upstreams.add(directive.args[0])
+            elif name in PASS_DIRECTIVES and directive.args:
+                self.pass_refs.append(directive)
+            elif name == 'server' and directive.block is not None and context == 'http':
+                self.server(directive)
+
+            if directive.block is not None and name not in OPAQUE_BLOCKS:
+                self.walk(directive.block, name, depth)
+
+    def include(self, directive, context, depth):
+        if not directive.args:
+            self.issue('error', 'invalid number of arguments in "include" directive', directive)
+            return
+        if not self.follow_includes:
+            return
+        if depth >= MAX_INCLUDE_DEPTH:
+            self.issue('warning', 'include depth limit reached; nested includes not checked', directive)
+            return
+        paths, is_glob = _resolve_include(directive.args[0], self.prefix)
+        if not paths:
+            if not is_glob:
+                self.issue('error', f'include file "{directive.args[0]}" not found', directive)
+            return
+        for path in paths:
+            if path in self.visited:
+                continue
+            self.visited.add(path)
+            try:
+                tree = _parse_file_cached(path)
+            except NginxConfigError as e:
+                self.issue('error', e.message, line=e.line, file=path)
+                continue
+            except OSError as e:
+                self.issue('error', f'cannot open include "{path}": {e.strerror}', directive)
+                continue
+            self.walk(tree, context, depth + 1)
+
+    def server(self, directive):
+        listens = []
+        names = []
+        for child in directive.block:
+            if child.name == 'listen' and child.args:
+                listens.append(child.args[0].split(':')[-1] if not child.args[0].startswith('unix:') else child.args[0])
+            elif child.name == 'server_name':
+                names.extend(child.args)
+        # `listen 80` and `listen [::]:80` are one port as far as name conflicts go
+        for listen in dict.fromkeys(listens or ['80']):
+            for server_name in dict.fromkeys(name.lower() for name in names):
+                if server_name in ('', '_'):
+                    continue
+                key = (listen, server_name)
+                previous = self.server_names.get(key)
+                if previous:
+                    self.issue('warning', f'conflicting server name "{server_name}" on {listen}, '
+                               f'also defined at {previous[0] or self.source_name}:{previous[1]}', directive)
+                else:
+                    self.server_names[key] = (directive.file, directive.line)
+
+    def check_pass_refs(self):
+        for directive in self.pass_refs:
+            target = directive.args[0]
+            if '$' in target or target.startswith('unix:'):
+                continue
+            match = PASS_TARGET_PATTERN.match(target)
+            if not match:
+                continue
+            host = match.group(1)
+            # Dotted names, IPs and localhost are resolved by DNS, not upstream blocks
+            if '.' in host or host == 'localhost' or host.startswith('['):
+                continue
+            # A single-label name may still resolve (/etc/hosts, container DNS); only nginx -t knows
+            if host not in self.upstreams:
+                self.issue('warning', f'"{host}" is not a defined upstream and must resolve at startup', directive)
+
+
+def lint(text, prefix=None, source_name=None, follow_includes=True):
+    """Validate configuration text in-process and return a list of issues.
+
+    Each issue is {'level': 'error'|'warning', 'message', 'line', 'file'}.
+    Syntax, context, include, duplicate server_name and upstream reference
+    checks run without spawning nginx.
+    """
+    prefix = prefix or NGINX_PREFIX
+    linter = _Linter(prefix, source_name or 'submitted', follow_includes)
+    try:
+        tree = parse(text)
+    except NginxConfigError as e:
+        linter.issue('error', e.message, line=e.line)
+        return linter.issues
+    linter.walk(tree, 'main')
+    linter.check_pass_refs()
+    return linter.issues
+
+
+def has_errors(issues):
+    return any(issue['level'] == 'error' for issue in issues)
+
+
+def test_with_nginx(text, config_path):
+    """Final check: `nginx -t` against the submitted text in a temp file.
+
+    The temp file sits next to the real config so relative includes
+    (mime.types, conf.d/...) resolve exactly as they would after saving.
+    """
+    directory = os.path.dirname(config_path)
+    fd, tmp_path = tempfile.mkstemp(prefix='.panel-check-', suffix='.conf', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        return run_command(['nginx', '-t', '-q', '-c', tmp_path], timeout=30,
+                           limits={'cpu_seconds': 20, 'memory_mb': 512})
+    finally:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
@@ -0,0 +1,186 @@
+import os
+import re
+import time
+import urllib.request
+from src.models.user import db, NginxReload, NginxSample
+from src.services import nginx_vhost, scheduler
+
+# Served by the status listener in conf.d/hosting-panel.conf
+NGINX_STUB_STATUS_URL = f'http://{nginx_vhost.NGINX_STATUS_LISTEN}/nginx_status'
+NGINX_PID_FILE = '/run/nginx.pid'
+SCRAPE_INTERVAL = 10
+# 10s samples over 24h = 8640 rows
+HISTORY_SECONDS = 24 * 3600
+RELOAD_HISTORY_SIZE = 100
+
+STUB_STATUS_PATTERN = re.compile(
+    r'Active connections:\s*(\d+)\s*'
+    r'server accepts handled requests\s*(\d+)\s+(\d+)\s+(\d+)\s*'
+    r'Reading:\s*(\d+)\s*Writing:\s*(\d+)\s*Waiting:\s*(\d+)'
+)
+
+# Master and worker PIDs last seen by the collector, which runs only on the leader
+_state = {'pid': None, 'workers': None}
+
+
+def parse_stub_status(text):
+    """Parse ngx_http_stub_status_module output into a dict of counters"""
+    match = STUB_STATUS_PATTERN.search(text)
+    if not match:
+        raise ValueError('Unrecognised stub_status output')
+    active, accepts, handled, requests, reading, writing, waiting = (int(v) for v in match.groups())
+    return {
+        'active': active,
+        'accepts': accepts,
+        'handled': handled,
+        'requests': requests,
+        'reading': reading,
+        'writing': writing,
+        'waiting': waiting
+    }
+
+
+def fetch_stub_status(url=None, timeout=2):
+    with urllib.request.urlopen(url or NGINX_STUB_STATUS_URL, timeout=timeout) as response:
+        return parse_stub_status(response.read().decode('ascii', 'replace'))
+
+
+def _boot_time():
+    with open('/proc/stat') as f:
+        for line in f:
+            if line.startswith('btime'):
+                return int(line.split()[1])
+    return None
+
+
+def master_process():
+    """PID and start time (epoch seconds) of the nginx master, or None"""
+    try:
+        with open(NGINX_PID_FILE) as f:
+            pid = int(f.read().strip())
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+    except (OSError, ValueError):
+        return None
+    # Fields after the parenthesised comm; starttime is field 22 overall
+    fields = stat[stat.rindex(')') + 2:].split()
+    started_at = None
+    try:
+        started_at = _boot_time() + int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (TypeError, ValueError, IndexError, OSError):
+        pass
+    return {'pid': pid, 'started_at': started_at}
+
+
+def worker_pids(master_pid):
+    """Worker PIDs of the master; a changed set means nginx was reloaded"""
+    try:
+        with open(f'/proc/{master_pid}/task/{master_pid}/children') as f:
+            return frozenset(int(pid) for pid in f.read().split())
+    except (OSError, ValueError):
+        return None
+
+
+def record_reload(source, detail=None, at=None):
+    """Append to the reload history shared by all workers.
+
+    Uses its own connection so a reload inside a caller's transaction
+    doesn't commit the caller's pending changes.
+    """
+    with db.engine.begin() as connection:
+        connection.execute(NginxReload.__table__.insert().values(
+            time=at or time.time(), source=source, detail=detail
+        ))
+
+
+@nginx_vhost.on_reload
+def _panel_reload(outcome):
+    record_reload('panel', {'success': outcome['success'], 'stage': outcome['stage']})
+
+
+def _latest(with_error=False):
+    query = NginxSample.query
+    if not with_error:
+        query = query.filter(NginxSample.error.is_(None))
+    return query.order_by(NginxSample.time.desc()).first()
+
+
+def _prune(now):
+    NginxSample.query.filter(NginxSample.time < now - HISTORY_SECONDS).delete(synchronize_session=False)
+    newest = db.session.query(db.func.max(NginxReload.id)).scalar()
+    if newest:
+        NginxReload.query.filter(NginxReload.id <= newest - RELOAD_HISTORY_SIZE).delete(synchronize_session=False)
+
+
+def collect():
+    """Take one sample; called on the leader every SCRAPE_INTERVAL seconds"""
+    now = time.time()
+    master = master_process()
+    workers = worker_pids(master['pid']) if master else None
+
+    if master and _state['pid'] and master['pid'] != _state['pid']:
+        record_reload('detected', {'event': 'restart', 'pid': master['pid']}, at=now)
+    elif workers and _state['workers'] and not (workers & _state['workers']):
+        record_reload('detected', {'event': 'reload', 'pid': master['pid']}, at=now)
+    _state['pid'] = master['pid'] if master else None
+    _state['workers'] = workers
+
+    try:
+        counters = fetch_stub_status()
+    except (OSError, ValueError) as e:
+        sample = NginxSample(time=now, error=str(e)[:500])
+    else:
+        previous = _latest()
+        sample = NginxSample(time=now, **counters)
+        if previous and now > previous.time and counters['requests'] >= previous.requests:
+            sample.rps = round((counters['requests'] - previous.requests) / (now - previous.time), 2)
+    try:
+        db.session.add(sample)
+        _prune(now)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return None if sample.error else sample.to_dict()
+
+
+def start_collector(app):
+    return scheduler.start_periodic('nginx-status', SCRAPE_INTERVAL, collect, app=app, leader_only=True)
+
+
+def get_status():
+    """Current running state, uptime and latest sample"""
+    master = master_process()
+    latest = _latest()
+    newest = _latest(with_error=True)
+    last_reload = NginxReload.query.order_by(NginxReload.id.desc()).first()
+    started_at = master['started_at'] if master else None
+    return {
+        'status': 'running' if master else 'stopped',
+        'pid': master['pid'] if master else None,
+        'started_at': started_at,
+        'uptime_seconds': int(time.time() - started_at) if started_at else None,
+        'latest': latest.to_dict() if latest else None,
+        'last_reload': last_reload.to_dict() if last_reload else None,
+        'scrape_error': newest.error if newest else None
+    }
+
+
+def get_series(window=3600, step=None):
+    """Samples from the last `window` seconds, optionally thinned to one per `step` seconds"""
+    since = time.time() - window
+    samples = [sample.to_dict() for sample in NginxSample.query.filter(
+        NginxSample.time >= since, NginxSample.error.is_(None)
+    ).order_by(NginxSample.time)]
+    if step:
+        thinned = []
+        for sample in samples:
+            if not thinned or sample['time'] - thinned[-1]['time'] >= step:
+                thinned.append(sample)
+        samples = thinned
+    return samples
+
+
+def get_reloads():
+    reloads = NginxReload.query.order_by(NginxReload.id.desc()).limit(RELOAD_HISTORY_SIZE).all()
+    return [reload.to_dict() for reload in reversed(reloads)]
@@ -0,0 +1,470 @@
+import fcntl
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy.orm import selectinload
+from src.models.user import Domain
+from src.services import events, php_fpm
+from src.services.executor import run_command
+from src.services.fsutil import atomic_write
+
+NGINX_SITES_PATH = '/etc/nginx/sites-available'
+NGINX_ENABLED_PATH = '/etc/nginx/sites-enabled'
+NGINX_PANEL_CONF = '/etc/nginx/conf.d/hosting-panel.conf'
+NGINX_SSL_DIR = '/etc/nginx/ssl/panel'
+NGINX_STATE_DIR = '/var/lib/hosting-panel/nginx'
+FASTCGI_CACHE_DIR = '/var/cache/nginx/fastcgi'
+NGINX_STATUS_LISTEN = '127.0.0.1:8089'
+DEFAULT_WEB_ROOT = '/var/www'
+VHOST_SUFFIX = '.panel.conf'
+
+# Per-domain toggles; stored alongside content hashes in the state manifest
+VHOST_DEFAULTS = {
+    'http2': True,
+    'force_https': True,
+    'gzip': True,
+    'brotli': False,
+    'static_cache': True,
+    'open_file_cache': True,
+    'fastcgi_cache': False,
+}
+
+# Tab-separated access log format parsed by services/access_log.py
+PANEL_LOG_FORMAT = ('$msec\\t$status\\t$body_bytes_sent\\t$request_time\\t'
+                    '$upstream_response_time\\t$request_method\\t$remote_addr')
+
+STATIC_EXTENSIONS = 'css|js|mjs|jpg|jpeg|png|gif|ico|svg|webp|avif|woff|woff2|ttf|eot|mp4|webm|pdf'
+GZIP_TYPES = ('text/plain text/css text/xml application/json application/javascript '
+              'application/xml application/rss+xml image/svg+xml')
+
+_reload_listeners = []
+
+
+def on_reload(callback):
+    """Register a callable invoked with the reload result after every graceful reload"""
+    _reload_listeners.append(callback)
+    return callback
+
+
+@events.subscribe(events.DOMAIN_STATUS_CHANGED)
+@events.subscribe(events.DOMAIN_CHANGED)
+def _domain_changed(domain_ids, **_):
+    # New and reactivated domains get their vhost, inactive ones lose it
+    sync(domain_ids=list(domain_ids))
+
+
+@events.subscribe(events.DOMAIN_DELETED)
+def _domain_deleted(domain_name, **_):
+    remove_site(domain_name)
+
+
+def _manifest_path():
+    return os.path.join(NGINX_STATE_DIR, 'manifest.json')
+
+
+@contextmanager
+def _state_lock():
+    """Serialise syncs across gunicorn workers"""
+    os.makedirs(NGINX_STATE_DIR, exist_ok=True)
+    with open(os.path.join(NGINX_STATE_DIR, 'sync.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def load_manifest():
+    try:
+        with open(_manifest_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'domains': {}}
+
+
+def _save_manifest(manifest):
+    atomic_write(_manifest_path(), json.dumps(manifest, sort_keys=True))
+
+
+def vhost_path(domain_name):
+    return os.path.join(NGINX_SITES_PATH, domain_name + VHOST_SUFFIX)
+
+
+def enabled_path(domain_name):
+    return os.path.join(NGINX_ENABLED_PATH, domain_name + VHOST_SUFFIX)
+
+
+def document_root(domain):
+    return domain.document_root or os.path.join(DEFAULT_WEB_ROOT, domain.name, 'public_html')
+
+
+def active_certificate(domain):
+    """Newest active certificate of a domain that carries PEM data"""
+    certs = [c for c in domain.ssl_certificates if c.is_active and c.certificate_data and c.private_key]
+    if not certs:
+        return None
+    return max(certs, key=lambda c: (c.created_at or datetime.min, c.id))
+
+
+def render_panel_conf():
+    """http-level directives shared by all panel vhosts"""
+    return '\n'.join([
+        '# Managed by hosting panel - manual changes will be overwritten',
+        f"log_format panel '{PANEL_LOG_FORMAT}';",
+        f'fastcgi_cache_path {FASTCGI_CACHE_DIR} levels=1:2 keys_zone=panel_fcgi:64m max_size=2g inactive=60m use_temp_path=off;',
+        'fastcgi_cache_key "$scheme$request_method$host$request_uri";',
+        'map $http_cookie $panel_skip_cache {',
+        '    default 0;',
+        '    ~*(wordpress_logged_in|PHPSESSID|comment_author) 1;',
+        '}',
+        '',
+        '# Loopback-only stub_status for the panel metrics collector',
+        'server {',
+        f'    listen {NGINX_STATUS_LISTEN};',
+        '    access_log off;',
+        '    location = /nginx_status {',
+        '        stub_status;',
+        '        allow 127.0.0.1;',
+        '        deny all;',
+        '    }',
+        '}',
+        ''
+    ])
+
+
+def _tls_paths(domain_name):
+    return (os.path.join(NGINX_SSL_DIR, domain_name + '.crt'),
+            os.path.join(NGINX_SSL_DIR, domain_name + '.key'))
+
+
+def render_vhost(domain, cert=None, options=None, php_socket=None):
+    """Render the server blocks of one domain"""
+    opts = dict(VHOST_DEFAULTS)
+    opts.update(options or {})
+    root = document_root(domain)
+    names = f'{domain.name} www.{domain.name}'
+    tls = cert is not None and domain.ssl_enabled
+    log_name = f'/var/log/nginx/{domain.name}'
+
+    lines = [f'# Managed by hosting panel - domain {domain.name} (id {domain.id})']
+    if tls and opts['force_https']:
+        lines += [
+            'server {',
+            '    listen 80;',
+            '    listen [::]:80;',
+            f'    server_name {names};',
+            '    location /.well-known/acme-challenge/ { root ' + root + '; }',
+            '    location / { return 301 https://$host$request_uri; }',
+            '}',
+            '',
+        ]
+
+    lines.append('server {')
+    if not tls or not opts['force_https']:
+        lines += ['    listen 80;', '    listen [::]:80;']
+    if tls:
+        http2 = ' http2' if opts['http2'] else ''
+        crt_path, key_path = _tls_paths(domain.name)
+        lines += [
+            f'    listen 443 ssl{http2};',
+            f'    listen [::]:443 ssl{http2};',
+            f'    ssl_certificate {crt_path};',
+            f'    ssl_certificate_key {key_path};',
+            '    ssl_protocols TLSv1.2 TLSv1.3;',
+            '    ssl_session_cache shared:panel_ssl:20m;',
+            '    ssl_session_timeout 1d;',
+            '    ssl_session_tickets off;',
+        ]
+    lines += [
+        f'    server_name {names};',
+        f'    root {root};',
+        '    index index.php index.html index.htm;',
+        f'    access_log {log_name}.access.log panel;',
+        f'    error_log {log_name}.error.log;',
+    ]
+
+    if opts['gzip']:
+        lines += [
+            '    gzip on;',
+            '    gzip_comp_level 5;',
+            '    gzip_min_length 1024;',
+            '    gzip_vary on;',
+            '    gzip_proxied any;',
+            f'    gzip_types {GZIP_TYPES};',
+        ]
+    if opts['brotli']:
+        lines += [
+            '    brotli on;',
+            '    brotli_comp_level 5;',
+            f'    brotli_types {GZIP_TYPES};',
+        ]
+    if opts['open_file_cache']:
+        lines += [
+            '    open_file_cache max=10000 inactive=60s;',
+            '    open_file_cache_valid 120s;',
+            '    open_file_cache_min_uses 2;',
+            '    open_file_cache_errors on;',
+        ]
+
+    lines += [
+        '',
+        '    location / {',
+        '        try_files $uri $uri/ /index.php?$query_string;',
+        '    }',
+    ]
+    if opts['static_cache']:
+        lines += [
+            '',
+            f'    location ~* \\.({STATIC_EXTENSIONS})$ {{',
+            '        expires 30d;',
+            '        add_header Cache-Control "public, immutable";',
+            '        access_log off;',
+            '        try_files $uri =404;',
+            '    }',
+        ]
+    if php_socket:
+        lines += [
+            '',
+            '    location ~ \\.php$ {',
+            '        try_files $uri =404;',
+            '        include fastcgi_params;',
+            '        fastcgi_param SCRIPT_FILENAME $document_root$fastcgi_script_name;',
+            f'        fastcgi_pass unix:{php_socket};',
+        ]
+        if opts['fastcgi_cache']:
+            lines += [
+                '        fastcgi_cache panel_fcgi;',
+                '        fastcgi_cache_valid 200 301 302 10m;',
+                '        fastcgi_cache_use_stale error timeout updating http_500 http_503;',
+                '        fastcgi_cache_lock on;',
+                '        fastcgi_cache_bypass $panel_skip_cache;',
+                '        fastcgi_no_cache $panel_skip_cache;',
+                '        add_header X-Cache-Status $upstream_cache_status;',
+            ]
+        lines.append('    }')
+    lines += [
+        '',
+        '    location ~ /\\.(?!well-known) {',
+        '        deny all;',
+        '    }',
+        '}',
+        ''
+    ]
+    return '\n'.join(lines)
+
+
+def _digest(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update((part or '').encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def _read_or_none(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _write_tls(domain_name, cert):
+    crt_path, key_path = _tls_paths(domain_name)
+    chain = cert.certificate_data.rstrip('\n') + '\n'
+    if cert.chain_data:
+        chain += cert.chain_data.rstrip('\n') + '\n'
+    atomic_write(crt_path, chain, mode=0o644)
+    atomic_write(key_path, cert.private_key.rstrip('\n') + '\n', mode=0o600)
+
+
+def _enable(domain_name):
+    link = enabled_path(domain_name)
+    if not os.path.islink(link):
+        os.makedirs(NGINX_ENABLED_PATH, exist_ok=True)
+        os.symlink(vhost_path(domain_name), link)
+
+
+def _remove_files(domain_name):
+    for path in (enabled_path(domain_name), vhost_path(domain_name)) + _tls_paths(domain_name):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def test_config():
+    return run_command(['nginx', '-t'], timeout=30)
+
+
+def reload_nginx():
+    """Validate then gracefully reload nginx (old workers drain their connections)"""
+    test = test_config()
+    if not test['success']:
+        return {'success': False, 'stage': 'test', 'result': test}
+    result = run_command(['nginx', '-s', 'reload'], timeout=30)
+    outcome = {'success': result['success'], 'stage': 'reload', 'result': result}
+    for callback in _reload_listeners:
+        try:
+            callback(outcome)
+        except Exception:
+            pass
+    return outcome
+
+
+def sync(domain_ids=None, options=None, batch_size=500):
+    """Render vhosts and write only those whose content changed.
+
+    `domain_ids` limits the pass to specific domains (None = all), and
+    `options` maps domain name -> toggle overrides to persist. The whole
+    batch is validated with a single `nginx -t`; on failure every file
+    touched in this batch is restored and nginx is not reloaded.
+    """
+    options = options or {}
+    with _state_lock():
+        manifest = load_manifest()
+        entries = manifest.setdefault('domains', {})
+        sockets = {pool['domain_id']: pool['socket'] for pool in php_fpm.list_pools()}
+
+        backups = {}
+        written, removed, unchanged = [], [], 0
+        seen = set()
+
+        panel_conf = render_panel_conf()
+        if _read_or_none(NGINX_PANEL_CONF) != panel_conf.encode():
+            backups[NGINX_PANEL_CONF] = _read_or_none(NGINX_PANEL_CONF)
+            atomic_write(NGINX_PANEL_CONF, panel_conf)
+
+        query = Domain.query.options(selectinload(Domain.ssl_certificates)).order_by(Domain.id)
+        if domain_ids is not None:
+            query = query.filter(Domain.id.in_(domain_ids))
+
+        for domain in query.yield_per(batch_size):
+            seen.add(domain.name)
+            entry = entries.get(domain.name, {})
+            domain_options = dict(entry.get('options', {}))
+            domain_options.update(options.get(domain.name, {}))
+
+            if not domain.is_active or domain.status not in Domain.SERVING_STATUSES:
+                if entry.get('enabled'):
+                    for path in (vhost_path(domain.name),) + _tls_paths(domain.name):
+                        backups.setdefault(path, _read_or_none(path))
+                    _remove_files(domain.name)
+                    entries[domain.name] = {'options': domain_options, 'hash': None, 'enabled': False}
+                    removed.append(domain.name)
+                continue
+
+            cert = active_certificate(domain)
+            socket_path = sockets.get(domain.id)
+            content = render_vhost(domain, cert, domain_options, socket_path)
+            tls_hash = _digest(cert.certificate_data, cert.chain_data, cert.private_key) if cert and domain.ssl_enabled else None
+            digest = _digest(content, tls_hash)
+
+            if entry.get('hash') == digest and os.path.exists(vhost_path(domain.name)):
+                unchanged += 1
+                continue
+
+            backups.setdefault(vhost_path(domain.name), _read_or_none(vhost_path(domain.name)))
+            if tls_hash and tls_hash != entry.get('tls_hash'):
+                for path in _tls_paths(domain.name):
+                    backups.setdefault(path, _read_or_none(path))
+                _write_tls(domain.name, cert)
+            atomic_write(vhost_path(domain.name), content)
+            _enable(domain.name)
+            entries[domain.name] = {
+                'options': domain_options,
+                'hash': digest,
+                'tls_hash': tls_hash,
+                'enabled': True,
+                'updated_at': datetime.utcnow().isoformat()
+            }
+            written.append(domain.name)
+
+        if domain_ids is None:
+            # Full pass: drop vhosts of domains that no longer exist
+            for name in [n for n in entries if n not in seen]:
+                for path in (vhost_path(name),) + _tls_paths(name):
+                    backups.setdefault(path, _read_or_none(path))
+                _remove_files(name)
+                del entries[name]
+                removed.append(name)
+
+        result = {'written': written, 'removed': removed, 'unchanged': unchanged, 'reload': None}
+        if not written and not removed and not backups:
+            return result
+
+        reload_result = reload_nginx()
+        result['reload'] = reload_result
+        if not reload_result['success'] and reload_result['stage'] == 'test':
+            _restore(backups)
+            result['rolled_back'] = True
+            return result
+
+        _save_manifest(manifest)
+        return result
+
+
+def _restore(backups):
+    for path, content in backups.items():
+        if content is None:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            if path.startswith(NGINX_SITES_PATH):
+                name = os.path.basename(path)[:-len(VHOST_SUFFIX)]
+                try:
+                    os.unlink(enabled_path(name))
+                except FileNotFoundError:
+                    pass
+        else:
+            atomic_write(path, content)
+            if path.startswith(NGINX_SITES_PATH):
+                _enable(os.path.basename(path)[:-len(VHOST_SUFFIX)])
+
+
+def remove_site(domain_name):
+    """Drop a deleted domain's vhost, TLS files and manifest entry, then reload.
+
+    Returns None when the panel never wrote a vhost for it. Like sync, the
+    files come back if nginx rejects the remaining configuration.
+    """
+    with _state_lock():
+        manifest = load_manifest()
+        entries = manifest.setdefault('domains', {})
+        paths = (vhost_path(domain_name),) + _tls_paths(domain_name)
+        backups = {path: _read_or_none(path) for path in paths}
+        if domain_name not in entries and all(content is None for content in backups.values()):
+            return None
+        _remove_files(domain_name)
+        entries.pop(domain_name, None)
+
+        result = {'removed': [domain_name], 'reload': reload_nginx()}
+        if not result['reload']['success'] and result['reload']['stage'] == 'test':
+            _restore({path: content for path, content in backups.items() if content is not None})
+            result['rolled_back'] = True
+            return result
+
+        _save_manifest(manifest)
+        return result
+
+
+def list_sites():
+    """Vhosts known to the panel as [{'name', 'domain', 'enabled', 'root', 'ssl', ...}]"""
+    manifest = load_manifest()
+    sites = []
+    for domain in Domain.query.order_by(Domain.name).all():
+        entry = manifest['domains'].get(domain.name, {})
+        sites.append({
+            'name': domain.name + VHOST_SUFFIX,
+            'domain': domain.name,
+            'domain_id': domain.id,
+            'enabled': bool(entry.get('enabled')) and os.path.islink(enabled_path(domain.name)),
+            'root': document_root(domain),
+            'ssl': bool(domain.ssl_enabled),
+            'options': dict(VHOST_DEFAULTS, **entry.get('options', {})),
+            'updated_at': entry.get('updated_at')
+        })
+    return sites
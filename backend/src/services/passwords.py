@@ -0,0 +1,227 @@
+import multiprocessing
+import multiprocessing.forkserver
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+
+try:
+    import argon2
+    from argon2 import PasswordHasher
+except ImportError:  # argon2-cffi is optional; bcrypt stays the default
+    argon2 = None
+
+# 'bcrypt' or 'argon2id'; existing hashes of the other kind keep verifying
+ALGORITHM = os.environ.get('PANEL_PASSWORD_ALGORITHM', 'bcrypt')
+BCRYPT_ROUNDS = int(os.environ.get('PANEL_BCRYPT_ROUNDS', '12'))
+ARGON2_TIME_COST = int(os.environ.get('PANEL_ARGON2_TIME_COST', '3'))
+ARGON2_MEMORY_KIB = int(os.environ.get('PANEL_ARGON2_MEMORY_KIB', '65536'))
+ARGON2_PARALLELISM = int(os.environ.get('PANEL_ARGON2_PARALLELISM', '1'))
+
+# Hashing runs in child processes so a login burst can't pin every request
+# thread; beyond MAX_WORKERS busy plus MAX_QUEUE waiting, callers get
+# PasswordQueueFull (HTTP 429) instead of piling up behind the pool
+MAX_WORKERS = int(os.environ.get('PANEL_PASSWORD_WORKERS', str(min(os.cpu_count() or 1, 4))))
+MAX_QUEUE = int(os.environ.get('PANEL_PASSWORD_QUEUE', '32'))
+HASH_TIMEOUT = 30
+RETRY_AFTER = 1
+# Bulk hashing goes out in chunks and leaves one worker free for logins
+BULK_CHUNK = 4
+
+# Children are forked from a fork server rather than from the app: forking
+# a process with request and collector threads can copy a lock another
+# thread holds. The server is a fresh interpreter that preloads only this
+# module, so each child starts with bcrypt already imported.
+_context = multiprocessing.get_context('forkserver')
+_context.set_forkserver_preload([__name__])
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_WORKERS + MAX_QUEUE)
+
+_stats = {'hashes': 0, 'verifies': 0, 'failures': 0, 'rehashes': 0, 'rejected': 0, 'seconds': 0.0}
+_stats_lock = threading.Lock()
+
+
+class PasswordQueueFull(Exception):
+    """Too many hashes already queued; the caller should retry later"""
+
+
+def _argon2_hasher():
+    return PasswordHasher(time_cost=ARGON2_TIME_COST, memory_cost=ARGON2_MEMORY_KIB,
+                          parallelism=ARGON2_PARALLELISM, type=argon2.Type.ID)
+
+
+def _algorithm():
+    return 'argon2id' if ALGORITHM == 'argon2id' and argon2 is not None else 'bcrypt'
+
+
+def _needs_rehash(password_hash):
+    """True when a hash was made with another algorithm or cost than configured"""
+    if _algorithm() == 'argon2id':
+        if not password_hash.startswith('$argon2id$'):
+            return True
+        return _argon2_hasher().check_needs_rehash(password_hash)
+    if not password_hash.startswith('$2'):
+        return True
+    try:
+        return int(password_hash.split('$')[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+def _hash(password):
+    if _algorithm() == 'argon2id':
+        return _argon2_hasher().hash(password)
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+
+def _hash_chunk(batch):
+    return [_hash(password) for password in batch]
+
+
+def _verify(password_hash, password):
+    """Child-side check; returns (matches, upgraded hash or None)"""
+    if password_hash.startswith('$argon2'):
+        if argon2 is None:
+            return False, None
+        try:
+            PasswordHasher().verify(password_hash, password)
+        except (argon2.exceptions.VerificationError, argon2.exceptions.InvalidHashError):
+            return False, None
+    else:
+        try:
+            if not bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8')):
+                return False, None
+        except ValueError:
+            return False, None
+    # The plaintext is only in hand right after a successful login
+    return True, _hash(password) if _needs_rehash(password_hash) else None
+
+
+def start_pool():
+    """Start the fork server now, before the app starts its threads.
+
+    Otherwise it starts with the first hash, which then pays for it.
+    """
+    multiprocessing.forkserver.ensure_running()
+
+
+def _get_pool():
+    """Lazily create the pool, once per forked gunicorn worker"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=_context)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _reset_pool(broken):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+
+
+def _run(func, *args):
+    if not _slots.acquire(blocking=False):
+        with _stats_lock:
+            _stats['rejected'] += 1
+        raise PasswordQueueFull('Password hashing queue is full')
+    started = time.monotonic()
+    try:
+        pool = _get_pool()
+        try:
+            return pool.submit(func, *args).result(timeout=HASH_TIMEOUT)
+        except BrokenProcessPool:
+            # A killed child takes the pool with it; retry once on a fresh one
+            _reset_pool(pool)
+            return _get_pool().submit(func, *args).result(timeout=HASH_TIMEOUT)
+    finally:
+        _slots.release()
+        with _stats_lock:
+            _stats['seconds'] += time.monotonic() - started
+
+
+def hash_password(password):
+    """Hash with the configured algorithm and cost"""
+    result = _run(_hash, password)
+    with _stats_lock:
+        _stats['hashes'] += 1
+    return result
+
+
+def hash_many(passwords):
+    """Hash a list of passwords across the pool, in input order.
+
+    Takes one queue slot for the whole list. Chunks are submitted a few at
+    a time, so a login arriving meanwhile waits behind at most one chunk
+    rather than the whole import.
+    """
+    if not passwords:
+        return []
+    if not _slots.acquire(blocking=False):
+        with _stats_lock:
+            _stats['rejected'] += 1
+        raise PasswordQueueFull('Password hashing queue is full')
+    started = time.monotonic()
+    chunks = [passwords[i:i + BULK_CHUNK] for i in range(0, len(passwords), BULK_CHUNK)]
+    results = [None] * len(chunks)
+    try:
+        pool = _get_pool()
+        in_flight = max(1, MAX_WORKERS - 1)
+        pending = {}
+        submitted = 0
+        while submitted < len(chunks) or pending:
+            while submitted < len(chunks) and len(pending) < in_flight:
+                pending[pool.submit(_hash_chunk, chunks[submitted])] = submitted
+                submitted += 1
+            done, _ = wait(pending, timeout=HASH_TIMEOUT, return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError('Password hashing timed out')
+            for future in done:
+                results[pending.pop(future)] = future.result()
+    finally:
+        _slots.release()
+        with _stats_lock:
+            _stats['seconds'] += time.monotonic() - started
+    with _stats_lock:
+        _stats['hashes'] += len(passwords)
+    return [password_hash for chunk in results for password_hash in chunk]
+
+
+def verify_password(password_hash, password):
+    """Check a password; returns (matches, new_hash).
+
+    new_hash is set when the stored hash uses an outdated algorithm or
+    cost and should replace it, so upgrades happen on the next login.
+    """
+    if not password_hash:
+        return False, None
+    matches, new_hash = _run(_verify, password_hash, password)
+    with _stats_lock:
+        _stats['verifies'] += 1
+        if not matches:
+            _stats['failures'] += 1
+        if new_hash:
+            _stats['rehashes'] += 1
+    return matches, new_hash
+
+
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    operations = stats['hashes'] + stats['verifies']
+    stats['avg_seconds'] = round(stats.pop('seconds') / operations, 6) if operations else 0
+    stats.update({
+        'algorithm': _algorithm(),
+        'bcrypt_rounds': BCRYPT_ROUNDS,
+        'argon2_available': argon2 is not None,
+        'max_workers': MAX_WORKERS,
+        'max_queue': MAX_QUEUE
+    })
+    return stats
@@ -0,0 +1,445 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+import signal
+import socket
+import struct
+from contextlib import contextmanager
+from src.models.user import Domain
+from src.services import events, php_ini
+from src.services.executor import run_command
+from src.services.fsutil import atomic_write
+
+POOL_SOCKET_DIR = '/run/php'
+POOL_USER = 'www-data'
+POOL_GROUP = 'www-data'
+STATUS_PATH = '/fpm-status'
+FPM_STATE_DIR = '/var/lib/hosting-panel/php-fpm'
+MANAGED_MARKER = '; Managed by hosting panel'
+
+# Share of host memory that all panel pools together may use, and the
+# resident size assumed per PHP worker when sizing pm.max_children
+FPM_MEMORY_FRACTION = 0.6
+AVG_WORKER_MB = 64
+# Above this many pools idle workers cost more than spawn latency saves
+ONDEMAND_THRESHOLD = 20
+DEFAULT_MAX_REQUESTS = 500
+DEFAULT_TERMINATE_TIMEOUT = 60
+
+OVERRIDABLE = {'pm', 'pm.max_children', 'pm.max_requests', 'request_terminate_timeout'}
+PM_MODES = ('static', 'dynamic', 'ondemand')
+# Pool files carry their overrides and domain so every pool can be re-sized later
+OVERRIDES_PATTERN = re.compile(r'^; overrides: (\{.*\})$', re.MULTILINE)
+DOMAIN_ID_PATTERN = re.compile(r'^; domain: \S+ \(id (\d+)\)$', re.MULTILINE)
+
+FCGI_VERSION = 1
+FCGI_BEGIN_REQUEST = 1
+FCGI_END_REQUEST = 3
+FCGI_PARAMS = 4
+FCGI_STDIN = 5
+FCGI_STDOUT = 6
+FCGI_RESPONDER = 1
+FCGI_HEADER = struct.Struct('!BBHHBx')
+
+
+def pool_name(domain_name):
+    """FPM pool / socket name for a domain (dots are not allowed in some tools).
+
+    Replacing punctuation alone would give my-site.com and my.site.com the
+    same pool, so a short hash of the full name keeps them apart.
+    """
+    domain_name = domain_name.lower()
+    digest = hashlib.sha1(domain_name.encode()).hexdigest()[:8]
+    return re.sub(r'[^a-z0-9_]', '_', domain_name) + '_' + digest
+
+
+def pool_socket(name, version):
+    return os.path.join(POOL_SOCKET_DIR, f'php{version}-fpm-{name}.sock')
+
+
+def _pool_dir(version):
+    return os.path.join(php_ini.PHP_CONF_ROOT, version, 'fpm', 'pool.d')
+
+
+@contextmanager
+def _pools_lock():
+    """Serialise pool changes across gunicorn workers; each one rewrites every pool"""
+    os.makedirs(FPM_STATE_DIR, exist_ok=True)
+    with open(os.path.join(FPM_STATE_DIR, 'pools.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def host_resources():
+    """CPU count and total memory (MB) of the host"""
+    memory_mb = None
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    memory_mb = int(line.split()[1]) // 1024
+                    break
+    except OSError:
+        pass
+    if memory_mb is None:
+        try:
+            memory_mb = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+        except (ValueError, OSError):
+            memory_mb = 2048
+    return {'cpus': os.cpu_count() or 1, 'memory_mb': memory_mb}
+
+
+def compute_sizing(pool_count, resources=None, overrides=None):
+    """Derive pm settings for one pool when `pool_count` pools share the host.
+
+    `overrides` replace the derived values; the spare-server settings are
+    worked out afterwards so they always fit the final pm and max_children.
+    """
+    resources = resources or host_resources()
+    pool_count = max(pool_count, 1)
+    budget_mb = resources['memory_mb'] * FPM_MEMORY_FRACTION / pool_count
+    max_children = int(budget_mb // AVG_WORKER_MB)
+    max_children = max(2, min(max_children, resources['cpus'] * 8))
+
+    sizing = {
+        'pm': 'ondemand' if pool_count > ONDEMAND_THRESHOLD else 'dynamic',
+        'pm.max_children': max_children,
+        'pm.max_requests': DEFAULT_MAX_REQUESTS,
+        'request_terminate_timeout': DEFAULT_TERMINATE_TIMEOUT
+    }
+    for key, value in (overrides or {}).items():
+        if key in OVERRIDABLE:
+            sizing[key] = value
+    max_children = sizing['pm.max_children']
+    if sizing['pm'] == 'dynamic' and isinstance(max_children, int) and max_children >= 1:
+        sizing['pm.start_servers'] = max(1, min(resources['cpus'], max_children // 4))
+        sizing['pm.min_spare_servers'] = 1
+        sizing['pm.max_spare_servers'] = min(max_children, max(2, max_children // 2))
+    elif sizing['pm'] == 'ondemand':
+        sizing['pm.process_idle_timeout'] = '10s'
+    return sizing
+
+
+def validate_sizing(sizing):
+    """Why FPM would refuse this pool configuration, or None"""
+    if sizing['pm'] not in PM_MODES:
+        return f"pm must be one of {', '.join(PM_MODES)}"
+    for key in ('pm.max_children', 'pm.max_requests', 'request_terminate_timeout'):
+        value = sizing[key]
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            return f'{key} must be a non-negative integer'
+    if sizing['pm.max_children'] < 1:
+        return 'pm.max_children must be at least 1'
+    if sizing['pm'] == 'dynamic':
+        spare = [sizing.get(key) for key in ('pm.min_spare_servers', 'pm.start_servers', 'pm.max_spare_servers')]
+        if None in spare:
+            return 'pm = dynamic needs pm.start_servers, pm.min_spare_servers and pm.max_spare_servers'
+        if not 1 <= spare[0] <= spare[1] <= spare[2] <= sizing['pm.max_children']:
+            return ('pm.min_spare_servers <= pm.start_servers <= pm.max_spare_servers <= pm.max_children '
+                    'must hold')
+    return None
+
+
+def render_pool(domain, version, sizing, overrides=None):
+    """Render the pool.d file for a Domain row"""
+    name = pool_name(domain.name)
+    lines = [
+        f'{MANAGED_MARKER} - manual changes will be overwritten',
+        f'; domain: {domain.name} (id {domain.id})',
+    ]
+    if overrides:
+        lines.append(f'; overrides: {json.dumps(overrides, sort_keys=True)}')
+    lines += [
+        f'[{name}]',
+        f'user = {POOL_USER}',
+        f'group = {POOL_GROUP}',
+        f'listen = {pool_socket(name, version)}',
+        f'listen.owner = {POOL_USER}',
+        f'listen.group = {POOL_GROUP}',
+        'listen.mode = 0660',
+        f'pm.status_path = {STATUS_PATH}',
+    ]
+    for key in ('pm', 'pm.max_children', 'pm.start_servers', 'pm.min_spare_servers',
+                'pm.max_spare_servers', 'pm.process_idle_timeout', 'pm.max_requests'):
+        if key in sizing:
+            lines.append(f'{key} = {sizing[key]}')
+    lines.append(f"request_terminate_timeout = {sizing['request_terminate_timeout']}")
+    if domain.document_root:
+        lines.append(f'chdir = {domain.document_root}')
+        lines.append(f'php_admin_value[open_basedir] = {domain.document_root}:/tmp')
+    return '\n'.join(lines) + '\n'
+
+
+def list_pools():
+    """Panel-managed pools as [{'name', 'version', 'path', 'socket', 'config'}]"""
+    pools = []
+    for version in php_ini.list_versions():
+        directory = _pool_dir(version)
+        try:
+            names = sorted(os.listdir(directory))
+        except OSError:
+            continue
+        for filename in names:
+            if not filename.endswith('.conf'):
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                with open(path) as f:
+                    text = f.read()
+            except OSError:
+                continue
+            if not text.startswith(MANAGED_MARKER):
+                continue
+            overrides = OVERRIDES_PATTERN.search(text)
+            domain_id = DOMAIN_ID_PATTERN.search(text)
+            for name, pool in php_ini.parse_pool_file(text, source=path).items():
+                pools.append({
+                    'name': name,
+                    'version': version,
+                    'path': path,
+                    'socket': pool['directives'].get('listen'),
+                    'config': pool['directives'],
+                    'overrides': json.loads(overrides.group(1)) if overrides else {},
+                    'domain_id': int(domain_id.group(1)) if domain_id else None
+                })
+    return pools
+
+
+def _domain_pool(pools, domain_id):
+    # Keyed on the id recorded in the file, so pools named before the hash suffix are still found
+    return next((pool for pool in pools if pool['domain_id'] == domain_id), None)
+
+
+def find_pool(domain_id):
+    return _domain_pool(list_pools(), domain_id)
+
+
+def test_fpm(version):
+    result = run_command([f'php-fpm{version}', '-t'], timeout=30)
+    # A missing binary (127) means FPM isn't installed for this version; nothing to protect
+    return dict(result, success=result['success'] or result['returncode'] == 127)
+
+
+def _signal_reload(version):
+    result = run_command(['systemctl', 'reload', f'php{version}-fpm'], timeout=30)
+    if not result['success']:
+        # Fall back to signalling the master directly when systemd is absent
+        pid_file = os.path.join(POOL_SOCKET_DIR, f'php{version}-fpm.pid')
+        try:
+            with open(pid_file) as f:
+                os.kill(int(f.read().strip()), signal.SIGUSR2)
+            result = {'success': True, 'stdout': '', 'stderr': '', 'returncode': 0, 'signal': 'USR2'}
+        except (OSError, ValueError) as e:
+            result = dict(result, stderr=result['stderr'] or str(e))
+    return {'success': result['success'], 'stage': 'reload', 'result': result}
+
+
+def reload_fpm(version):
+    """Gracefully reload one FPM master after validating its configuration.
+
+    A reload (SIGUSR2) lets busy workers finish their current request,
+    unlike a restart which drops every in-flight request on the box.
+    """
+    test = test_fpm(version)
+    if not test['success']:
+        return {'success': False, 'stage': 'test', 'result': test}
+    return _signal_reload(version)
+
+
+def _read_or_none(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _restore(backups):
+    for path, content in backups.items():
+        if content is None:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        else:
+            atomic_write(path, content)
+
+
+def _install(writes, removes=()):
+    """Write {path: (version, content)}, delete [(path, version)], then test and reload.
+
+    Every affected FPM version is tested before any is reloaded. If one
+    rejects its configuration all files go back to their previous
+    contents, so one bad pool can't block later reloads of that version.
+    """
+    backups = {}
+    versions = set()
+    for path, (version, content) in writes.items():
+        current = _read_or_none(path)
+        if current == content:
+            continue
+        backups[path] = current
+        atomic_write(path, content)
+        versions.add(version)
+    for path, version in removes:
+        backups[path] = _read_or_none(path)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        versions.add(version)
+
+    tests = {version: test_fpm(version) for version in sorted(versions)}
+    failed = {version: {'success': False, 'stage': 'test', 'result': test}
+              for version, test in tests.items() if not test['success']}
+    if failed:
+        _restore(backups)
+        return {'changed': [], 'rolled_back': True, 'reloads': failed}
+    reloads = {version: _signal_reload(version) for version in sorted(versions)}
+    return {'changed': sorted(backups), 'rolled_back': False, 'reloads': reloads}
+
+
+def _resized(pools, pool_count, resources):
+    """New contents for other managed pools once `pool_count` pools share the host"""
+    domains = {domain.id: domain for domain in Domain.query.filter(
+        Domain.id.in_([pool['domain_id'] for pool in pools if pool['domain_id'] is not None])
+    )}
+    writes = {}
+    for pool in pools:
+        domain = domains.get(pool['domain_id'])
+        if domain is None:
+            continue  # its domain is gone; leave the file for remove_pool
+        sizing = compute_sizing(pool_count, resources, pool['overrides'])
+        writes[pool['path']] = (pool['version'], render_pool(domain, pool['version'], sizing, pool['overrides']))
+    return writes
+
+
+def apply_pool(domain, version, overrides=None):
+    """Write the domain's pool and re-size every other pool to the new pool count.
+
+    `overrides` replace the pool's stored overrides; None keeps them.
+    Raises ValueError for a configuration FPM would refuse.
+    """
+    with _pools_lock():
+        pools = list_pools()
+        existing = _domain_pool(pools, domain.id)
+        others = [pool for pool in pools if pool is not existing]
+        pool_count = len(others) + 1
+        if overrides is None:
+            overrides = existing['overrides'] if existing else {}
+        overrides = {key: value for key, value in overrides.items() if key in OVERRIDABLE}
+        resources = host_resources()
+        sizing = compute_sizing(pool_count, resources, overrides)
+        error = validate_sizing(sizing)
+        if error:
+            raise ValueError(error)
+
+        path = os.path.join(_pool_dir(version), pool_name(domain.name) + '.conf')
+        writes = _resized(others, pool_count, resources)
+        writes[path] = (version, render_pool(domain, version, sizing, overrides))
+        # A domain moved to another PHP version (or named before the hash suffix) loses its old pool
+        removes = [(existing['path'], existing['version'])] if existing and existing['path'] != path else []
+        result = _install(writes, removes)
+        changed = not result['rolled_back'] and (path in result['changed'] or bool(removes))
+        removed = {old_path for old_path, _ in removes}
+        resized = [other for other in result['changed'] if other != path and other not in removed]
+        return dict(result, path=path, changed=changed, resized=resized, sizing=sizing)
+
+
+def remove_pool(domain_id):
+    """Remove a domain's pool and let the remaining pools grow into the freed memory"""
+    with _pools_lock():
+        pools = list_pools()
+        pool = _domain_pool(pools, domain_id)
+        if not pool:
+            return None
+        others = [other for other in pools if other is not pool]
+        return _install(_resized(others, len(others), host_resources()), [(pool['path'], pool['version'])])
+
+
+@events.subscribe(events.DOMAIN_DELETED)
+def _domain_deleted(domain_id, **_):
+    remove_pool(domain_id)
+
+
+def _encode_length(length):
+    if length < 128:
+        return bytes([length])
+    return struct.pack('!I', length | 0x80000000)
+
+
+def _record(record_type, content, request_id=1):
+    return FCGI_HEADER.pack(FCGI_VERSION, record_type, request_id, len(content), 0) + content
+
+
+def fastcgi_get(socket_path, script, query='', timeout=3):
+    """Minimal FastCGI GET against an FPM socket; returns the response body"""
+    params = {
+        'GATEWAY_INTERFACE': 'FastCGI/1.0',
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': script,
+        'SCRIPT_FILENAME': script,
+        'REQUEST_URI': script + ('?' + query if query else ''),
+        'QUERY_STRING': query,
+        'SERVER_SOFTWARE': 'hosting-panel',
+        'REMOTE_ADDR': '127.0.0.1',
+    }
+    encoded = b''.join(
+        _encode_length(len(k)) + _encode_length(len(v)) + k.encode() + v.encode()
+        for k, v in params.items()
+    )
+    payload = (
+        _record(FCGI_BEGIN_REQUEST, struct.pack('!HB5x', FCGI_RESPONDER, 0))
+        + _record(FCGI_PARAMS, encoded) + _record(FCGI_PARAMS, b'')
+        + _record(FCGI_STDIN, b'')
+    )
+
+    stdout = b''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(payload)
+        buffer = b''
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            buffer += chunk
+            while len(buffer) >= FCGI_HEADER.size:
+                _, record_type, _, length, padding = FCGI_HEADER.unpack_from(buffer)
+                end = FCGI_HEADER.size + length + padding
+                if len(buffer) < end:
+                    break
+                if record_type == FCGI_STDOUT:
+                    stdout += buffer[FCGI_HEADER.size:FCGI_HEADER.size + length]
+                elif record_type == FCGI_END_REQUEST:
+                    return stdout.split(b'\r\n\r\n', 1)[-1]
+                buffer = buffer[end:]
+    return stdout.split(b'\r\n\r\n', 1)[-1]
+
+
+def pool_status(pool):
+    """Worker counts and listen queue of one pool, read from its status page"""
+    try:
+        body = fastcgi_get(pool['socket'], STATUS_PATH, 'json')
+        data = json.loads(body.decode('utf-8', 'replace'))
+    except (OSError, ValueError, TypeError) as e:
+        return {'available': False, 'error': str(e)}
+    return {
+        'available': True,
+        'process_manager': data.get('process manager'),
+        'start_since': data.get('start since'),
+        'accepted_conn': data.get('accepted conn'),
+        'listen_queue': data.get('listen queue'),
+        'max_listen_queue': data.get('max listen queue'),
+        'active_processes': data.get('active processes'),
+        'idle_processes': data.get('idle processes'),
+        'total_processes': data.get('total processes'),
+        'max_children_reached': data.get('max children reached'),
+        'slow_requests': data.get('slow requests')
+    }
@@ -0,0 +1,224 @@
+import os
+import re
+import threading
+from src.services.fsutil import atomic_write
+
+# Debian/Ubuntu layout: /etc/php/<version>/<sapi>/php.ini + conf.d/*.ini,
+# FPM pools in /etc/php/<version>/fpm/pool.d/*.conf
+PHP_CONF_ROOT = '/etc/php'
+PANEL_INI_NAME = '99-hosting-panel.ini'
+
+VERSION_DIR_PATTERN = re.compile(r'^\d+\.\d+$')
+INI_LINE_PATTERN = re.compile(r'^\s*([A-Za-z0-9_.\-]+)(\[[^\]]*\])?\s*=\s*(.*?)\s*$')
+POOL_VALUE_PATTERN = re.compile(r'^(php_value|php_flag|php_admin_value|php_admin_flag)\[([^\]]+)\]$')
+
+_lock = threading.Lock()
+_cache = {}  # (version, sapi) -> (stat key, parsed config)
+
+
+def _unquote(value):
+    """Strip inline comments and surrounding quotes from an ini value"""
+    if value[:1] in ('"', "'"):
+        quote = value[0]
+        end = value.find(quote, 1)
+        if end != -1:
+            return value[1:end]
+    comment = value.find(';')
+    if comment != -1:
+        value = value[:comment]
+    return value.strip()
+
+
+def parse_ini(text, source=None):
+    """Parse php.ini syntax into {key: {'value', 'file', 'line'}}; later keys win.
+
+    Keys are matched exactly, so `memory_limit` never collides with
+    `opcache.memory_consumption` or `pcre.jit` style names.
+    """
+    settings = {}
+    for lineno, line in enumerate(text.splitlines(), 1):
+        stripped = line.strip()
+        if not stripped or stripped[0] in ';#' or stripped.startswith('['):
+            continue
+        match = INI_LINE_PATTERN.match(line)
+        if not match:
+            continue
+        key, index, raw = match.groups()
+        value = _unquote(raw)
+        if index is not None:
+            entry = settings.setdefault(key, {'value': [], 'file': source, 'line': lineno})
+            if isinstance(entry['value'], list):
+                entry['value'].append(value)
+            continue
+        settings[key] = {'value': value, 'file': source, 'line': lineno}
+    return settings
+
+
+def parse_pool_file(text, source=None):
+    """Parse an FPM pool file into {pool: {'directives': {}, 'php_values': {}}}"""
+    pools = {}
+    current = None
+    for lineno, line in enumerate(text.splitlines(), 1):
+        stripped = line.strip()
+        if not stripped or stripped[0] in ';#':
+            continue
+        if stripped.startswith('[') and stripped.endswith(']'):
+            current = pools.setdefault(stripped[1:-1], {'directives': {}, 'php_values': {}, 'file': source})
+            continue
+        if current is None or '=' not in stripped:
+            continue
+        key, raw = [part.strip() for part in stripped.split('=', 1)]
+        value = _unquote(raw)
+        match = POOL_VALUE_PATTERN.match(key)
+        if match:
+            kind, name = match.groups()
+            current['php_values'][name] = {
+                'value': value,
+                'admin': kind.startswith('php_admin'),
+                'file': source,
+                'line': lineno
+            }
+        else:
+            current['directives'][key] = value
+    return pools
+
+
+def _read(path):
+    with open(path, 'r', errors='replace') as f:
+        return f.read()
+
+
+def _sapi_dir(version, sapi):
+    return os.path.join(PHP_CONF_ROOT, version, sapi)
+
+
+def _config_files(version, sapi):
+    """php.ini followed by conf.d/*.ini in the order PHP scans them"""
+    base = _sapi_dir(version, sapi)
+    files = [os.path.join(base, 'php.ini')]
+    conf_d = os.path.join(base, 'conf.d')
+    try:
+        files.extend(os.path.join(conf_d, name) for name in sorted(os.listdir(conf_d)) if name.endswith('.ini'))
+    except OSError:
+        pass
+    return files, conf_d
+
+
+def _pool_files(version):
+    pool_d = os.path.join(PHP_CONF_ROOT, version, 'fpm', 'pool.d')
+    try:
+        return [os.path.join(pool_d, name) for name in sorted(os.listdir(pool_d)) if name.endswith('.conf')], pool_d
+    except OSError:
+        return [], pool_d
+
+
+def _stat_key(paths):
+    key = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            key.append((path, st.st_mtime_ns, st.st_size))
+        except OSError:
+            key.append((path, None, None))
+    return tuple(key)
+
+
+def list_versions():
+    """PHP versions that have a configuration tree under PHP_CONF_ROOT"""
+    try:
+        names = os.listdir(PHP_CONF_ROOT)
+    except OSError:
+        return []
+    return sorted((name for name in names if VERSION_DIR_PATTERN.match(name)),
+                  key=lambda v: tuple(int(part) for part in v.split('.')))
+
+
+def list_sapis(version):
+    base = os.path.join(PHP_CONF_ROOT, version)
+    try:
+        return sorted(name for name in os.listdir(base) if os.path.isfile(os.path.join(base, name, 'php.ini')))
+    except OSError:
+        return []
+
+
+def load_config(version, sapi='fpm'):
+    """Effective ini settings and pool overrides for a version/SAPI, cached on file mtimes"""
+    files, conf_d = _config_files(version, sapi)
+    pool_files, pool_d = _pool_files(version) if sapi == 'fpm' else ([], None)
+    # Directory mtimes catch added/removed drop-in files
+    watched = files + pool_files + [conf_d] + ([pool_d] if pool_d else [])
+    key = _stat_key(watched)
+
+    with _lock:
+        cached = _cache.get((version, sapi))
+        if cached and cached[0] == key:
+            return cached[1]
+
+    settings = {}
+    loaded = []
+    for path in files:
+        try:
+            text = _read(path)
+        except OSError:
+            continue
+        settings.update(parse_ini(text, source=path))
+        loaded.append(path)
+
+    pools = {}
+    for path in pool_files:
+        try:
+            pools.update(parse_pool_file(_read(path), source=path))
+        except OSError:
+            continue
+
+    config = {'version': version, 'sapi': sapi, 'files': loaded, 'settings': settings, 'pools': pools}
+    with _lock:
+        _cache[(version, sapi)] = (key, config)
+    return config
+
+
+def get_settings(version, sapi='fpm', keys=None, pool=None):
+    """Flat {key: value} view, optionally narrowed to `keys` and overlaid with a pool's php_value entries"""
+    config = load_config(version, sapi)
+    values = {key: entry['value'] for key, entry in config['settings'].items()}
+    if pool and pool in config['pools']:
+        values.update({key: entry['value'] for key, entry in config['pools'][pool]['php_values'].items()})
+    if keys is not None:
+        values = {key: values[key] for key in keys if key in values}
+    return values
+
+
+def _format_value(value):
+    value = str(value)
+    if any(ch in value for ch in '\r\n\0'):
+        raise ValueError('Setting values must be a single line')
+    if re.match(r'^[A-Za-z0-9_.\-/:]*$', value):
+        return value
+    return '"' + value.replace('"', '') + '"'
+
+
+def update_settings(version, settings, sapi='fpm'):
+    """Persist overrides into the panel-owned conf.d drop-in, loaded after php.ini.
+
+    Existing panel overrides are merged; the file is replaced atomically.
+    Returns the path written.
+    """
+    conf_d = os.path.join(_sapi_dir(version, sapi), 'conf.d')
+    if not os.path.isdir(_sapi_dir(version, sapi)):
+        raise FileNotFoundError(f'No PHP {version} {sapi} configuration found')
+    path = os.path.join(conf_d, PANEL_INI_NAME)
+
+    current = {}
+    try:
+        current = {key: entry['value'] for key, entry in parse_ini(_read(path)).items()}
+    except OSError:
+        pass
+    current.update({key: str(value) for key, value in settings.items()})
+
+    lines = ['; Managed by hosting panel - manual changes will be overwritten']
+    lines.extend(f'{key} = {_format_value(value)}' for key, value in sorted(current.items()))
+    atomic_write(path, '\n'.join(lines) + '\n')
+
+    with _lock:
+        _cache.pop((version, sapi), None)
+    return path
@@ -0,0 +1,175 @@
+import os
+import re
+import threading
+import time
+from src.services.executor import submit
+
+# Where distro and source builds put their PHP CLI binaries
+PHP_BIN_DIRS = ['/usr/bin', '/usr/local/bin']
+BINARY_PATTERN = re.compile(r'^php(\d+\.\d+)?$')
+VERSION_PATTERN = re.compile(r'PHP (\d+\.\d+)(\.\d+)?')
+
+# How often the bin directories are re-listed; between scans lookups are pure memory
+RESCAN_INTERVAL = 10
+
+_lock = threading.Lock()       # guards the data below
+_scan_lock = threading.Lock()  # held by the one thread probing binaries
+_entries = {}       # realpath -> {'mtime': ..., 'size': ..., 'info': {...}}
+_binaries = []      # [(name, path, realpath)]
+_last_scan = 0.0
+_scanned = False    # set once the first scan has finished
+
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _discover():
+    """List php / phpX.Y binaries on the search path"""
+    found = []
+    seen = set()
+    for directory in PHP_BIN_DIRS:
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        for name in sorted(names):
+            if not BINARY_PATTERN.match(name) or name in seen:
+                continue
+            path = os.path.join(directory, name)
+            if not os.access(path, os.X_OK):
+                continue
+            seen.add(name)
+            found.append((name, path, os.path.realpath(path)))
+    return found
+
+
+def _parse_probe(realpath, version_result, modules_result):
+    info = {'realpath': realpath, 'version': None, 'full_version': None, 'modules': []}
+    if version_result['success']:
+        first_line = version_result['stdout'].split('\n', 1)[0]
+        match = VERSION_PATTERN.search(first_line)
+        if match:
+            info['version'] = match.group(1)
+            info['full_version'] = match.group(1) + (match.group(2) or '')
+    if modules_result['success']:
+        info['modules'] = [
+            line.strip() for line in modules_result['stdout'].split('\n')
+            if line.strip() and not line.startswith('[')
+        ]
+    return info
+
+
+def _probe(realpaths):
+    """Probe binaries concurrently on the shared executor; binaries whose probe failed are left out"""
+    futures = {
+        realpath: (submit([realpath, '--version'], timeout=10), submit([realpath, '-m'], timeout=10))
+        for realpath in realpaths
+    }
+    probed = {}
+    for realpath, (version_future, modules_future) in futures.items():
+        version_result, modules_result = version_future.result(), modules_future.result()
+        # Not cached, so a binary that timed out or crashed is tried again on the next scan
+        if not (version_result['success'] and modules_result['success']):
+            continue
+        probed[realpath] = _parse_probe(realpath, version_result, modules_result)
+    return probed
+
+
+def _refresh(force=False):
+    """Re-list binaries and re-probe only those whose path or mtime changed.
+
+    Probes run without _lock held, so lookups keep answering from the last
+    scan meanwhile; _scan_lock lets one thread scan at a time. Only a caller
+    with nothing scanned yet waits for a scan in progress.
+    """
+    global _binaries, _last_scan, _scanned
+    with _lock:
+        scanned = _scanned
+        if scanned and not force and time.monotonic() - _last_scan < RESCAN_INTERVAL:
+            return
+    if not _scan_lock.acquire(blocking=not scanned):
+        return
+    try:
+        with _lock:
+            if _scanned and not force and time.monotonic() - _last_scan < RESCAN_INTERVAL:
+                return  # another thread scanned while this one waited
+            known = {realpath: (entry['mtime'], entry['size']) for realpath, entry in _entries.items()}
+        binaries = _discover()
+        stale = {}
+        for _, _, realpath in binaries:
+            key = _stat_key(realpath)
+            if key and known.get(realpath) != key:
+                stale[realpath] = key
+        probed = _probe(stale)
+
+        live = {realpath for _, _, realpath in binaries}
+        with _lock:
+            for realpath, info in probed.items():
+                mtime, size = stale[realpath]
+                _entries[realpath] = {'mtime': mtime, 'size': size, 'info': info}
+            for realpath in [path for path in _entries if path not in live or
+                             (path in stale and path not in probed)]:
+                del _entries[realpath]
+            _binaries = binaries
+            _last_scan = time.monotonic()
+            _scanned = True
+    finally:
+        _scan_lock.release()
+
+
+def invalidate():
+    """Force the next lookup to rescan the bin directories"""
+    global _last_scan
+    with _lock:
+        _last_scan = 0.0
+
+
+def get_versions():
+    """Installed PHP binaries as [{'version', 'status', 'path', ...}] plus the default version"""
+    _refresh()
+    with _lock:
+        versions = []
+        default = None
+        for name, path, realpath in _binaries:
+            entry = _entries.get(realpath)
+            if not entry or not entry['info']['version']:
+                continue
+            info = entry['info']
+            if name == 'php':
+                default = info['version']
+                continue
+            versions.append({
+                'version': info['version'],
+                'full_version': info['full_version'],
+                'status': 'installed',
+                'path': path,
+                'module_count': len(info['modules'])
+            })
+        return versions, default
+
+
+def get_binary(version=None):
+    """Resolve a version like '8.2' (or the default `php`) to its binary path"""
+    _refresh()
+    with _lock:
+        wanted = f'php{version}' if version else 'php'
+        for name, path, realpath in _binaries:
+            if name == wanted and realpath in _entries:
+                return path
+    return None
+
+
+def get_modules(version=None):
+    """Loaded extensions of the given (or default) PHP binary, or None if not installed"""
+    path = get_binary(version)
+    if not path:
+        return None
+    with _lock:
+        entry = _entries.get(os.path.realpath(path))
+        return list(entry['info']['modules']) if entry else None
+
@@ -0,0 +1,276 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import redis
+except ImportError:  # only needed for PANEL_RATELIMIT_STORE=redis://...
+    redis = None
+
+# memory | sqlite:///path/to/file.db | redis://host:6379/0
+# The default SQLite file is shared by every gunicorn worker on the host
+STORE_URL = os.environ.get('PANEL_RATELIMIT_STORE', 'sqlite:////var/lib/hosting-panel/ratelimit.db')
+# Only these peers may tell us the client address through X-Forwarded-For
+TRUSTED_PROXIES = {
+    address.strip() for address in os.environ.get('PANEL_TRUSTED_PROXIES', '127.0.0.1,::1').split(',') if address.strip()
+}
+
+
+class Limit:
+    def __init__(self, name, max_attempts, window):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.window = window
+
+
+# Every attempt from one address, and failed attempts against one account
+# from one address. Keying the account limit on the address too means a
+# stranger guessing at `admin` locks out only themselves.
+LOGIN_IP = Limit('login-ip', int(os.environ.get('PANEL_LOGIN_IP_LIMIT', '30')), 60)
+LOGIN_USER = Limit('login-user', int(os.environ.get('PANEL_LOGIN_USER_LIMIT', '10')), 900)
+# Failed attempts against one account from anywhere. Far looser, so it only
+# bites a guessing campaign spread over many addresses.
+LOGIN_ACCOUNT = Limit('login-account', int(os.environ.get('PANEL_LOGIN_ACCOUNT_LIMIT', '100')), 3600)
+
+
+class MemoryStore:
+    """Per-process counters; fine for a single worker or development"""
+
+    def __init__(self):
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.time()
+        with self.lock:
+            return [count if expires > now else 0 for count, expires in
+                    (self.counters.get(key, (0, 0)) for key in keys)]
+
+    def incr(self, key, ttl):
+        now = time.time()
+        with self.lock:
+            count, expires = self.counters.get(key, (0, 0))
+            if expires <= now:
+                count, expires = 0, now + ttl
+            self.counters[key] = (count + 1, expires)
+            if len(self.counters) > 100000:
+                self.counters = {k: v for k, v in self.counters.items() if v[1] > now}
+
+    def delete(self, keys):
+        with self.lock:
+            for key in keys:
+                self.counters.pop(key, None)
+
+
+class SQLiteStore:
+    """Counters in a small WAL-mode SQLite file shared across workers"""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.local = threading.local()
+        self.calls = 0
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS counters '
+                         '(key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires REAL NOT NULL)')
+
+    def _connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def get_many(self, keys):
+        placeholders = ','.join('?' * len(keys))
+        rows = dict(self._connect().execute(
+            f'SELECT key, count FROM counters WHERE key IN ({placeholders}) AND expires > ?',
+            (*keys, time.time())
+        ).fetchall())
+        return [rows.get(key, 0) for key in keys]
+
+    def incr(self, key, ttl):
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            'INSERT INTO counters (key, count, expires) VALUES (?, 1, ?) '
+            'ON CONFLICT(key) DO UPDATE SET '
+            'count = CASE WHEN expires > ? THEN count + 1 ELSE 1 END, '
+            'expires = CASE WHEN expires > ? THEN expires ELSE excluded.expires END',
+            (key, now + ttl, now, now)
+        )
+        self.calls += 1
+        if self.calls % 1000 == 0:
+            conn.execute('DELETE FROM counters WHERE expires <= ?', (now,))
+
+    def delete(self, keys):
+        placeholders = ','.join('?' * len(keys))
+        self._connect().execute(f'DELETE FROM counters WHERE key IN ({placeholders})', tuple(keys))
+
+
+class RedisStore:
+    """Counters in Redis (or anything speaking its protocol, e.g. a local KeyDB)"""
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError('redis package is not installed')
+        self.client = redis.Redis.from_url(url, socket_timeout=1)
+
+    def get_many(self, keys):
+        return [int(value or 0) for value in self.client.mget(keys)]
+
+    def incr(self, key, ttl):
+        pipe = self.client.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, int(math.ceil(ttl)))
+        pipe.execute()
+
+    def delete(self, keys):
+        self.client.delete(*keys)
+
+
+def create_store(url):
+    if url == 'memory':
+        return MemoryStore()
+    if url.startswith('sqlite:///'):
+        return SQLiteStore(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStore(url)
+    raise ValueError(f'unsupported rate limit store {url}')
+
+
+_store = None
+_store_lock = threading.Lock()
+
+_stats = {'accepted': 0, 'rejected': 0, 'failures': 0, 'store_errors': 0, 'rejected_by': {}}
+_stats_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                try:
+                    _store = create_store(STORE_URL)
+                except Exception as e:
+                    # Losing cross-worker sharing beats failing every login
+                    print(f'Rate limit store {STORE_URL} unavailable ({e}); using in-process counters')
+                    _store = MemoryStore()
+    return _store
+
+
+def _bucket_keys(limit, key, now):
+    index = int(now // limit.window)
+    return f'{limit.name}:{key}:{index}', f'{limit.name}:{key}:{index - 1}', now - index * limit.window
+
+
+def retry_after(limit, key, now=None):
+    """Seconds until `key` may try again under `limit`; 0 when not throttled.
+
+    Sliding-window counter: the previous fixed window is weighted by how
+    much of it still overlaps the sliding one, so two counters per key
+    give a smooth limit without storing every attempt.
+    """
+    now = now or time.time()
+    current_key, previous_key, elapsed = _bucket_keys(limit, key, now)
+    current, previous = get_store().get_many([current_key, previous_key])
+    estimate = previous * (1 - elapsed / limit.window) + current
+    if estimate < limit.max_attempts:
+        return 0
+    if current >= limit.max_attempts or not previous:
+        return max(1, math.ceil(limit.window - elapsed))
+    # When the decaying previous window has dropped enough
+    clears_at = limit.window * (1 - (limit.max_attempts - current) / previous)
+    return max(1, math.ceil(clears_at - elapsed))
+
+
+def hit(limit, key, now=None):
+    current_key = _bucket_keys(limit, key, now or time.time())[0]
+    get_store().incr(current_key, limit.window * 2)
+
+
+def reset(limit, key, now=None):
+    current_key, previous_key, _ = _bucket_keys(limit, key, now or time.time())
+    get_store().delete([current_key, previous_key])
+
+
+def client_ip(request):
+    """Client address, taking X-Forwarded-For only from a trusted proxy"""
+    address = request.remote_addr or ''
+    forwarded = request.headers.get('X-Forwarded-For')
+    if forwarded and address in TRUSTED_PROXIES:
+        return forwarded.split(',')[-1].strip() or address
+    return address
+
+
+def _username(username):
+    return (username or '').strip().lower()
+
+
+def _account_key(ip, username):
+    return f'{_username(username)}|{ip}'
+
+
+def check_login(ip, username):
+    """Throttle check run before any password hashing.
+
+    Counts the attempt against the address and returns the seconds to
+    wait (0 = go ahead). The store failing open keeps logins working.
+    """
+    try:
+        wait = retry_after(LOGIN_IP, ip)
+        reason = 'ip'
+        if not wait:
+            wait = retry_after(LOGIN_USER, _account_key(ip, username))
+            reason = 'user'
+        if not wait:
+            wait = retry_after(LOGIN_ACCOUNT, _username(username))
+            reason = 'account'
+        hit(LOGIN_IP, ip)
+    except Exception:
+        with _stats_lock:
+            _stats['store_errors'] += 1
+        return 0
+    with _stats_lock:
+        if wait:
+            _stats['rejected'] += 1
+            _stats['rejected_by'][reason] = _stats['rejected_by'].get(reason, 0) + 1
+        else:
+            _stats['accepted'] += 1
+    return wait
+
+
+def login_failed(ip, username):
+    with _stats_lock:
+        _stats['failures'] += 1
+    try:
+        hit(LOGIN_USER, _account_key(ip, username))
+        hit(LOGIN_ACCOUNT, _username(username))
+    except Exception:
+        with _stats_lock:
+            _stats['store_errors'] += 1
+
+
+def login_succeeded(ip, username):
+    try:
+        reset(LOGIN_USER, _account_key(ip, username))
+        reset(LOGIN_ACCOUNT, _username(username))
+    except Exception:
+        with _stats_lock:
+            _stats['store_errors'] += 1
+
+
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats, rejected_by=dict(_stats['rejected_by']))
+    stats.update({
+        'store': type(get_store()).__name__,
+        'limits': {limit.name: {'max_attempts': limit.max_attempts, 'window': limit.window}
+                   for limit in (LOGIN_IP, LOGIN_USER, LOGIN_ACCOUNT)}
+    })
+    return stats
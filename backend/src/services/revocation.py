@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from src.models.user import db, TokenRevocation
+from src.services import scheduler
+
+# Other workers pick up a revocation within this many seconds
+SYNC_INTERVAL = 1.0
+PRUNE_INTERVAL = 3600
+SYNC_BATCH = 5000
+# A watermark must outlive the longest-lived token it can cut off
+WATERMARK_TTL = timedelta(days=30)
+
+_lock = threading.Lock()
+_jtis = {}  # 16-byte jti -> token expiry (epoch seconds)
+_watermarks = {}  # str(user id), as in the sub claim -> tokens issued before this epoch ms are revoked
+_state = {'last_id': 0, 'synced_at': 0.0, 'pid': None}
+
+
+def _key(jti):
+    # uuid4 jtis kept as raw bytes are a third the size of their str form
+    try:
+        return uuid.UUID(jti).bytes
+    except (TypeError, ValueError):
+        return jti
+
+
+def _apply(rows):
+    with _lock:
+        for row in rows:
+            if row.jti:
+                _jtis[_key(row.jti)] = int(row.expires_at.timestamp())
+            elif row.user_id is not None:
+                user = str(row.user_id)
+                _watermarks[user] = max(_watermarks.get(user, 0), row.not_before or 0)
+            _state['last_id'] = max(_state['last_id'], row.id)
+
+
+def sync(force=False):
+    """Replay revocations written by any worker since the last sync.
+
+    Reads only rows past the last seen id, so the steady-state cost is an
+    empty primary-key range scan at most once per SYNC_INTERVAL.
+    """
+    now = time.monotonic()
+    if _state['pid'] != os.getpid():
+        # A forked worker starts from scratch rather than trusting inherited state
+        with _lock:
+            _jtis.clear()
+            _watermarks.clear()
+            _state.update(last_id=0, synced_at=0.0, pid=os.getpid())
+    if not force and now - _state['synced_at'] < SYNC_INTERVAL:
+        return
+    _state['synced_at'] = now
+    while True:
+        rows = TokenRevocation.query.filter(TokenRevocation.id > _state['last_id']) \
+            .order_by(TokenRevocation.id).limit(SYNC_BATCH).all()
+        _apply(rows)
+        if len(rows) < SYNC_BATCH:
+            break
+
+
+def is_revoked(payload):
+    """O(1) check used by the JWT blocklist callback"""
+    sync()
+    jti = payload.get('jti')
+    with _lock:
+        if jti and _key(jti) in _jtis:
+            return True
+        watermark = _watermarks.get(str(payload.get('sub')))
+    if watermark is None:
+        return False
+    # iat has whole-second resolution; tokens from this panel also carry iat_ms
+    issued = payload.get('iat_ms') or payload.get('iat', 0) * 1000
+    return issued < watermark
+
+
+def revoke_token(payload):
+    """Revoke a single token by its jti until it would have expired anyway"""
+    expires = payload.get('exp')
+    expires_at = datetime.utcfromtimestamp(expires) if expires else datetime.utcnow() + WATERMARK_TTL
+    sub = payload.get('sub')
+    row = TokenRevocation(jti=payload['jti'], user_id=int(sub) if sub is not None else None, expires_at=expires_at)
+    db.session.add(row)
+    db.session.commit()
+    _apply([row])
+
+
+def revoke_user(user_id):
+    """Revoke every token issued to a user up to now"""
+    row = TokenRevocation(user_id=user_id, not_before=int(time.time() * 1000),
+                          expires_at=datetime.utcnow() + WATERMARK_TTL)
+    db.session.add(row)
+    db.session.commit()
+    _apply([row])
+
+
+def prune():
+    """Drop rows whose tokens have expired on their own.
+
+    The newest row is always kept: tables created before AUTOINCREMENT was
+    set hand out max(id) + 1, so removing it would let the next revocation
+    reuse an id that workers have already synced past.
+    """
+    now = datetime.utcnow()
+    newest = db.session.query(db.func.max(TokenRevocation.id)).scalar()
+    if newest is None:
+        return 0
+    deleted = TokenRevocation.query.filter(
+        TokenRevocation.expires_at < now, TokenRevocation.id < newest
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    cutoff = int(now.timestamp())
+    with _lock:
+        for key in [key for key, expires in _jtis.items() if expires < cutoff]:
+            del _jtis[key]
+    return deleted
+
+
+def get_stats():
+    with _lock:
+        return {'revoked_tokens': len(_jtis), 'user_watermarks': len(_watermarks), 'last_id': _state['last_id']}
+
+
+def init_jwt(jwt):
+    @jwt.additional_claims_loader
+    def _issued_ms(identity):
+        return {'iat_ms': int(time.time() * 1000)}
+
+    @jwt.token_in_blocklist_loader
+    def _token_revoked(jwt_header, jwt_payload):
+        return is_revoked(jwt_payload)
+
+
+def start_pruner(app):
+    return scheduler.start_periodic('token-revocation-prune', PRUNE_INTERVAL, prune, app=app, leader_only=True)
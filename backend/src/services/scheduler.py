@@ -0,0 +1,118 @@
+import fcntl
+import os
+import threading
+import time
+import traceback
+
+LOCK_DIR = '/var/lib/hosting-panel/locks'
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+class _Job(threading.Thread):
+    def __init__(self, name, interval, func, app, leader_only):
+        super().__init__(name=f'panel-job-{name}', daemon=True)
+        self.job_name = name
+        self.interval = interval
+        self.func = func
+        self.app = app
+        self.leader_only = leader_only
+        self.stop_event = threading.Event()
+        self.lock_file = None
+        self.runs = 0
+        self.failures = 0
+        self.last_run = None
+        self.last_duration = None
+        self.last_error = None
+
+    def _is_leader(self):
+        """Only one gunicorn worker holds the job's flock and runs it"""
+        if not self.leader_only:
+            return True
+        if self.lock_file is not None:
+            return True
+        os.makedirs(LOCK_DIR, exist_ok=True)
+        lock_file = open(os.path.join(LOCK_DIR, f'{self.job_name}.lock'), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self.lock_file = lock_file
+        return True
+
+    def run_once(self):
+        started = time.monotonic()
+        try:
+            if self.app is not None:
+                with self.app.app_context():
+                    self.func()
+            else:
+                self.func()
+            self.last_error = None
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            traceback.print_exc()
+        self.runs += 1
+        self.last_run = time.time()
+        self.last_duration = time.monotonic() - started
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                leader = self._is_leader()
+            except OSError:
+                leader = False
+            if leader:
+                self.run_once()
+            self.stop_event.wait(self.interval)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+
+def start_periodic(name, interval, func, app=None, leader_only=False):
+    """Run `func` every `interval` seconds on a daemon thread.
+
+    With `app` the call runs inside an application context. With
+    `leader_only` just one process on the host runs the job at a time.
+    Starting a job that is already running is a no-op.
+    """
+    with _jobs_lock:
+        job = _jobs.get(name)
+        if job is not None and job.is_alive():
+            return job
+        job = _Job(name, interval, func, app, leader_only)
+        _jobs[name] = job
+        job.start()
+        return job
+
+
+def stop(name):
+    with _jobs_lock:
+        job = _jobs.pop(name, None)
+    if job is not None:
+        job.stop()
+
+
+def get_jobs():
+    with _jobs_lock:
+        jobs = list(_jobs.values())
+    return {
+        job.job_name: {
+            'interval': job.interval,
+            'leader_only': job.leader_only,
+            'leader': job.lock_file is not None if job.leader_only else True,
+            'runs': job.runs,
+            'failures': job.failures,
+            'last_run': job.last_run,
+            'last_duration': job.last_duration,
+            'last_error': job.last_error
+        }
+        for job in jobs
+    }
@@ -0,0 +1,327 @@
+import base64
+import csv
+import hashlib
+import io
+import json
+import re
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from cryptography.fernet import Fernet, InvalidToken
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from src.models.user import db, User, Domain, UserImport
+from src.services import passwords
+from src.services.dns_validation import validate_domain
+
+ROLES = ('admin', 'user', 'readonly')
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+CSV_COLUMNS = ('username', 'email', 'password', 'role', 'domains')
+
+MAX_IMPORT_ROWS = 10000
+# Users (with their domains) written per transaction
+INSERT_BATCH = 500
+# Values per IN (...) when checking for existing names; SQLite caps bound parameters
+LOOKUP_CHUNK = 500
+GENERATED_PASSWORD_BYTES = 12
+# Generated passwords are kept encrypted in the import's result until read
+# once or this many seconds pass, whichever is first
+GENERATED_PASSWORD_TTL = 3600
+# Imports still unfinished after this belonged to a process that is gone
+IMPORT_TIMEOUT = timedelta(hours=2)
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Imports run one at a time; hashing already spreads each across the password pool
+_imports = ThreadPoolExecutor(max_workers=1, thread_name_prefix='user-import')
+
+
+def parse_csv(text):
+    """Rows from CSV with a header; `domains` holds names separated by spaces or ';'"""
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames or not {'username', 'email'} <= {name.strip().lower() for name in reader.fieldnames}:
+        raise ValueError('CSV needs a header with at least username and email')
+    rows = []
+    for record in reader:
+        row = {(key or '').strip().lower(): (value or '').strip() for key, value in record.items()
+               if key and key.strip().lower() in CSV_COLUMNS}
+        row['domains'] = [name for name in re.split(r'[\s;]+', row.get('domains', '')) if name]
+        rows.append(row)
+    return rows
+
+
+def _validate(rows):
+    """Normalised rows plus per-row errors, including duplicates within the upload"""
+    valid = []
+    errors = []
+    seen_usernames, seen_emails, seen_domains = set(), set(), set()
+    for index, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            errors.append({'row': index, 'error': 'Row must be an object'})
+            continue
+        username = str(row.get('username') or '').strip()
+        email = str(row.get('email') or '').strip()
+        password = row.get('password') or None
+        role = str(row.get('role') or 'user').strip()
+        domains = row.get('domains') or []
+        if isinstance(domains, str):
+            domains = [name for name in re.split(r'[\s;,]+', domains) if name]
+        domains = [str(name).strip().lower().rstrip('.') for name in domains]
+
+        if not username or len(username) > 80:
+            error = 'Invalid username'
+        elif not EMAIL_PATTERN.match(email) or len(email) > 120:
+            error = 'Invalid email'
+        elif password is not None and not isinstance(password, str):
+            error = 'Password must be a string'
+        elif role not in ROLES:
+            error = f'Role must be one of {", ".join(ROLES)}'
+        elif any(not validate_domain(name) for name in domains):
+            error = 'Invalid domain name'
+        elif username in seen_usernames:
+            error = 'Duplicate username in upload'
+        elif email in seen_emails:
+            error = 'Duplicate email in upload'
+        elif len(set(domains)) != len(domains) or seen_domains & set(domains):
+            error = 'Duplicate domain in upload'
+        else:
+            error = None
+        if error:
+            errors.append({'row': index, 'username': username or None, 'error': error})
+            continue
+        seen_usernames.add(username)
+        seen_emails.add(email)
+        seen_domains.update(domains)
+        valid.append({'row': index, 'username': username, 'email': email, 'password': password,
+                      'role': role, 'domains': domains})
+    return valid, errors
+
+
+def _existing(column, values):
+    found = set()
+    values = list(values)
+    for i in range(0, len(values), LOOKUP_CHUNK):
+        chunk = values[i:i + LOOKUP_CHUNK]
+        found.update(value for (value,) in db.session.query(column).filter(column.in_(chunk)))
+    return found
+
+
+def _drop_conflicts(rows, errors):
+    """Rows whose username, email or domains are already taken become errors"""
+    usernames = _existing(User.username, (row['username'] for row in rows))
+    emails = _existing(User.email, (row['email'] for row in rows))
+    domains = _existing(Domain.name, (name for row in rows for name in row['domains']))
+    kept = []
+    for row in rows:
+        if row['username'] in usernames:
+            error = 'Username already exists'
+        elif row['email'] in emails:
+            error = 'Email already exists'
+        elif any(name in domains for name in row['domains']):
+            error = 'Domain already exists'
+        else:
+            kept.append(row)
+            continue
+        errors.append({'row': row['row'], 'username': row['username'], 'error': error})
+    return kept
+
+
+def _insert(rows):
+    """Add one batch's users and domains to the session; returns the new ids"""
+    users = [User(username=row['username'], email=row['email'], role=row['role'],
+                  password_hash=row['password_hash']) for row in rows]
+    db.session.add_all(users)
+    db.session.flush()
+    db.session.add_all([Domain(name=name, user_id=user.id, status='active')
+                        for user, row in zip(users, rows) for name in row['domains']])
+    db.session.flush()
+    # Read before commit expires the objects, which would reload each one
+    return [user.id for user in users]
+
+
+def provision(rows, dry_run=False):
+    """Create users and their domains in bulk.
+
+    Rows are validated and checked against existing names up front, the
+    passwords are hashed in the process pool, and inserts are committed
+    INSERT_BATCH users at a time. A batch hit by a concurrent insert is
+    retried row by row so one conflict doesn't sink the others. Rows
+    without a password get a generated one, returned once in the result.
+    """
+    if len(rows) > MAX_IMPORT_ROWS:
+        raise ValueError(f'At most {MAX_IMPORT_ROWS} rows per import')
+    valid, errors = _validate(rows)
+    valid = _drop_conflicts(valid, errors)
+    if dry_run:
+        errors.sort(key=lambda error: error['row'])
+        return {'created': 0, 'valid': len(valid), 'errors': errors, 'users': []}
+
+    generated = {}
+    for row in valid:
+        if row['password'] is None:
+            row['password'] = generated[row['row']] = secrets.token_urlsafe(GENERATED_PASSWORD_BYTES)
+    for row, password_hash in zip(valid, passwords.hash_many([row['password'] for row in valid])):
+        row['password_hash'] = password_hash
+
+    created = []
+    for i in range(0, len(valid), INSERT_BATCH):
+        batch = valid[i:i + INSERT_BATCH]
+        try:
+            ids = _insert(batch)
+            db.session.commit()
+            created.extend(zip(batch, ids))
+        except IntegrityError:
+            db.session.rollback()
+            for row in batch:
+                try:
+                    with db.session.begin_nested():
+                        ids = _insert([row])
+                    created.append((row, ids[0]))
+                except IntegrityError:
+                    errors.append({'row': row['row'], 'username': row['username'],
+                                   'error': 'Username, email or domain already exists'})
+            db.session.commit()
+
+    results = []
+    for row, user_id in created:
+        result = {'row': row['row'], 'id': user_id, 'username': row['username'], 'domains': row['domains']}
+        if row['row'] in generated:
+            result['password'] = generated[row['row']]
+        results.append(result)
+    errors.sort(key=lambda error: error['row'])
+    return {'created': len(results), 'valid': len(valid), 'errors': errors, 'users': results}
+
+
+def _fernet():
+    # Keyed on the app secret, which lives in config and not in the database
+    secret = current_app.config['SECRET_KEY'].encode('utf-8')
+    return Fernet(base64.urlsafe_b64encode(hashlib.sha256(b'user-import:' + secret).digest()))
+
+
+def _seal_passwords(result):
+    """Move generated passwords out of a provision() result into one encrypted token"""
+    generated = {str(user['row']): user.pop('password') for user in result['users'] if 'password' in user}
+    if generated:
+        result['sealed_passwords'] = _fernet().encrypt(json.dumps(generated).encode('utf-8')).decode('ascii')
+    return result
+
+
+def _unseal_passwords(token):
+    """{row: password}, or None once the token has expired"""
+    try:
+        return json.loads(_fernet().decrypt(token.encode('ascii'), ttl=GENERATED_PASSWORD_TTL))
+    except InvalidToken:
+        return None
+
+
+def _import_job(app, import_id, rows):
+    with app.app_context():
+        job = db.session.get(UserImport, import_id)
+        job.status = 'running'
+        db.session.commit()
+        try:
+            while True:
+                try:
+                    result = provision(rows)
+                    break
+                except passwords.PasswordQueueFull:
+                    # Logins keep their queue slots; the import waits its turn
+                    db.session.rollback()
+                    time.sleep(passwords.RETRY_AFTER)
+            job.status = 'completed'
+            job.result = _seal_passwords(result)
+        except Exception as e:
+            db.session.rollback()
+            job.status = 'failed'
+            job.error = str(e)[:2000]
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+
+def start_import(rows, created_by):
+    """Queue provision(rows) in the background; returns the UserImport to poll.
+
+    Hashing thousands of passwords takes minutes, far past the request
+    timeout, so only the row count is checked here.
+    """
+    if len(rows) > MAX_IMPORT_ROWS:
+        raise ValueError(f'At most {MAX_IMPORT_ROWS} rows per import')
+    job = UserImport(created_by=created_by, total=len(rows))
+    db.session.add(job)
+    db.session.commit()
+    _imports.submit(_import_job, current_app._get_current_object(), job.id, rows)
+    return job
+
+
+def import_status(job):
+    """The import as a dict; generated passwords are handed out only once.
+
+    They are never stored in clear: the job keeps them encrypted, and the
+    first poll after it finishes decrypts them and drops the ciphertext.
+    """
+    if job.status in ('queued', 'running') and job.started_at < datetime.utcnow() - IMPORT_TIMEOUT:
+        job.status = 'failed'
+        job.error = 'interrupted'
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+    status = job.to_dict()
+    token = (job.result or {}).get('sealed_passwords')
+    if token:
+        job.result = {key: value for key, value in job.result.items() if key != 'sealed_passwords'}
+        db.session.commit()
+        generated = _unseal_passwords(token)
+        users = job.result['users']
+        if generated is None:
+            status['result'] = dict(job.result, passwords_expired=True)
+        else:
+            status['result'] = dict(job.result, users=[
+                dict(user, password=generated[str(user['row'])]) if str(user['row']) in generated else user
+                for user in users
+            ])
+    return status
+
+
+def list_page(limit=None, after=None, search=None, role=None, is_active=None, descending=False):
+    """One page of users by id, continuing after the `after` id.
+
+    Keyset pagination: each page is an index range scan on the primary
+    key, so page 2000 costs the same as page 1. `search` is a prefix of
+    the username or email, matched as a range on their unique indexes.
+    Returns (users, next cursor or None).
+    """
+    limit = min(max(int(limit or PAGE_SIZE), 1), MAX_PAGE_SIZE)
+    query = User.query
+    if search:
+        # A range instead of LIKE keeps the lookup on the index
+        search = search.strip()
+        upper = search + '\uffff'
+        query = query.filter(db.or_(
+            db.and_(User.username >= search, User.username < upper),
+            db.and_(User.email >= search, User.email < upper)
+        ))
+    if role:
+        query = query.filter(User.role == role)
+    if is_active is not None:
+        query = query.filter(User.is_active == is_active)
+    if after is not None:
+        query = query.filter(User.id < after if descending else User.id > after)
+    query = query.order_by(User.id.desc() if descending else User.id.asc())
+    users = query.limit(limit + 1).all()
+    next_cursor = users[limit - 1].id if len(users) > limit else None
+    return users[:limit], next_cursor
+
+
+def page_from_args(args):
+    """list_page() driven by query string: limit, cursor, q, role, active, order"""
+    cursor = args.get('cursor')
+    active = args.get('active')
+    return list_page(
+        limit=args.get('limit', type=int),
+        after=int(cursor) if cursor else None,
+        search=args.get('q') or None,
+        role=args.get('role') or None,
+        is_active=None if active is None else active.lower() in ('1', 'true', 'yes'),
+        descending=args.get('order') == 'desc'
+    )
@@ -0,0 +1,344 @@
+import re
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.exc import IntegrityError
+from src.models.user import db, Domain, WhoisCache
+from src.services import scheduler
+
+IANA_SERVER = 'whois.iana.org'
+WHOIS_PORT = 43
+QUERY_TIMEOUT = 10
+MAX_RESPONSE_BYTES = 256 * 1024
+MAX_WORKERS = 8
+RAW_KEEP_BYTES = 16 * 1024
+REFRESH_INTERVAL = 6 * 3600
+REFRESH_BATCH = 200
+# Domains whose expiry is unknown or this close are re-checked by the refresh job
+REFRESH_WINDOW = timedelta(days=45)
+
+# How long each kind of answer stays valid; "available" flips fastest
+CACHE_TTL = {
+    'registered': timedelta(hours=24),
+    'available': timedelta(minutes=15),
+    'error': timedelta(minutes=5),
+    'referral': timedelta(days=7),
+}
+
+# Per-server token bucket; registries throttle or ban clients that burst
+RATE_PER_SECOND = 1.0
+RATE_BURST = 4
+RATE_MAX_WAIT = 5.0
+
+AVAILABLE_PATTERN = re.compile(
+    r'no match for|not found|no data found|no entries found|no object found|'
+    r'domain not found|status:\s*(?:free|available)|is available for registration|'
+    r'no information available',
+    re.IGNORECASE
+)
+RATE_LIMITED_PATTERN = re.compile(r'limit exceeded|too many (?:requests|queries)|try again later', re.IGNORECASE)
+REFER_PATTERN = re.compile(r'^(?:refer|whois):\s*(\S+)', re.IGNORECASE | re.MULTILINE)
+REGISTRAR_PATTERN = re.compile(
+    r'^\s*(?:registrar|sponsoring registrar|registrar name|registrar organization)\s*:\s*(.+?)\s*$',
+    re.IGNORECASE | re.MULTILINE
+)
+EXPIRY_PATTERN = re.compile(
+    r'^\s*(?:registry expiry date|registrar registration expiration date|expiry date|expiration date|'
+    r'expiration time|expires on|expires|expire date|paid-till|valid until|renewal date)\s*:\s*(.+?)\s*$',
+    re.IGNORECASE | re.MULTILINE
+)
+CREATED_PATTERN = re.compile(
+    r'^\s*(?:creation date|created on|created|registered on|registration time|registered)\s*:\s*(.+?)\s*$',
+    re.IGNORECASE | re.MULTILINE
+)
+DATE_FORMATS = (
+    '%Y-%m-%dT%H:%M:%S%z', '%Y-%m-%dT%H:%M:%S.%f%z', '%Y-%m-%d %H:%M:%S%z', '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d', '%d-%b-%Y', '%d-%B-%Y', '%d.%m.%Y', '%Y.%m.%d', '%Y/%m/%d',
+    '%d/%m/%Y', '%b %d %Y', '%a %b %d %H:%M:%S %Z %Y',
+)
+
+
+class WhoisError(Exception):
+    """A whois server could not be queried"""
+
+
+class WhoisRateLimited(WhoisError):
+    """Our own per-server budget is spent; not worth caching"""
+
+
+class _TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, max_wait):
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_servers = {}  # tld -> (server, valid_until) resolved through IANA
+_servers_lock = threading.Lock()
+_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='whois')
+
+
+def _bucket(server):
+    with _buckets_lock:
+        bucket = _buckets.get(server)
+        if bucket is None:
+            bucket = _buckets[server] = _TokenBucket(RATE_PER_SECOND, RATE_BURST)
+        return bucket
+
+
+def query_server(server, query, port=None, timeout=QUERY_TIMEOUT):
+    """Send one port-43 query, honouring the per-server rate limit"""
+    if not _bucket(server).acquire(RATE_MAX_WAIT):
+        raise WhoisRateLimited(f'Rate limit for {server} reached, try again shortly')
+    chunks = []
+    size = 0
+    try:
+        with socket.create_connection((server, port or WHOIS_PORT), timeout=timeout) as sock:
+            sock.sendall(query.encode('idna') + b'\r\n')
+            while size < MAX_RESPONSE_BYTES:
+                chunk = sock.recv(8192)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                size += len(chunk)
+    except (OSError, UnicodeError) as e:
+        raise WhoisError(f'{server}: {e}')
+    return b''.join(chunks).decode('utf-8', 'replace')
+
+
+def parse_date(value):
+    """Best-effort parse of the many whois date styles to a naive UTC datetime"""
+    value = value.strip().split(' (')[0].strip()
+    candidate = value.replace('Z', '+0000') if value.endswith('Z') else value
+    for fmt in DATE_FORMATS:
+        try:
+            parsed = datetime.strptime(candidate, fmt)
+        except ValueError:
+            continue
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
+    return None
+
+
+def _first_date(pattern, text):
+    for match in pattern.finditer(text):
+        parsed = parse_date(match.group(1))
+        if parsed:
+            return parsed
+    return None
+
+
+def parse_response(text):
+    """Registration status, registrar and dates from a whois answer"""
+    registrar = REGISTRAR_PATTERN.search(text)
+    expires_at = _first_date(EXPIRY_PATTERN, text)
+    if RATE_LIMITED_PATTERN.search(text) and not expires_at:
+        return {'status': 'error', 'error': 'Rate limited by whois server'}
+    if not expires_at and not registrar and AVAILABLE_PATTERN.search(text):
+        return {'status': 'available'}
+    return {
+        'status': 'registered',
+        'registrar': registrar.group(1)[:255] if registrar else None,
+        'expires_at': expires_at,
+        'registered_at': _first_date(CREATED_PATTERN, text)
+    }
+
+
+def _cached_rows(keys):
+    if not keys:
+        return {}
+    rows = WhoisCache.query.filter(WhoisCache.lookup_key.in_(keys)).all()
+    return {row.lookup_key: row for row in rows}
+
+
+def _store(rows, key, status, now, **fields):
+    row = rows.get(key)
+    if row is None:
+        row = rows[key] = WhoisCache(lookup_key=key)
+        db.session.add(row)
+    row.status = status
+    row.server = fields.get('server')
+    row.registrar = fields.get('registrar')
+    row.registered_at = fields.get('registered_at')
+    row.expires_at = fields.get('expires_at')
+    row.raw = (fields.get('raw') or '')[:RAW_KEEP_BYTES] or None
+    row.fetched_at = now
+    row.valid_until = now + CACHE_TTL[status]
+    return row
+
+
+def _servers_for(tlds, now):
+    """Whois server per TLD via IANA referral, cached in-process and in WhoisCache"""
+    servers = {}
+    missing = []
+    with _servers_lock:
+        for tld in tlds:
+            cached = _servers.get(tld)
+            if cached and cached[1] > now:
+                servers[tld] = cached[0]
+            else:
+                missing.append(tld)
+    if not missing:
+        return servers
+
+    rows = _cached_rows([f'tld:{tld}' for tld in missing])
+    to_ask = []
+    for tld in missing:
+        row = rows.get(f'tld:{tld}')
+        if row is not None and row.valid_until > now:
+            servers[tld] = row.server
+        else:
+            to_ask.append(tld)
+
+    futures = {tld: _pool.submit(query_server, IANA_SERVER, tld) for tld in to_ask}
+    for tld, future in futures.items():
+        try:
+            match = REFER_PATTERN.search(future.result())
+        except WhoisError:
+            servers[tld] = None
+            continue
+        servers[tld] = match.group(1).lower() if match else None
+        if servers[tld]:
+            _store(rows, f'tld:{tld}', 'referral', now, server=servers[tld])
+
+    with _servers_lock:
+        for tld in missing:
+            if servers.get(tld):
+                _servers[tld] = (servers[tld], now + CACHE_TTL['referral'])
+    return servers
+
+
+def _result(domain, row, cached):
+    return {
+        'domain': domain,
+        'status': row.status,
+        'available': {'available': True, 'registered': False}.get(row.status),
+        'registrar': row.registrar,
+        'registered_at': row.registered_at.isoformat() if row.registered_at else None,
+        'expires_at': row.expires_at.isoformat() if row.expires_at else None,
+        'server': row.server,
+        'fetched_at': row.fetched_at.isoformat() if row.fetched_at else None,
+        'cached': cached,
+        'error': row.raw if row.status == 'error' else None
+    }
+
+
+def lookup_many(domains, use_cache=True):
+    """Whois for several domains: cache first, then concurrent port-43 queries.
+
+    Results come back in input order. Answers are persisted in WhoisCache
+    with a TTL depending on whether the domain was registered, available
+    or the lookup failed.
+    """
+    names = [domain.strip().lower().rstrip('.') for domain in domains]
+    now = datetime.utcnow()
+    rows = _cached_rows(list(set(names)))
+    results = {}
+    misses = []
+    for name in dict.fromkeys(names):
+        row = rows.get(name)
+        if use_cache and row is not None and row.valid_until > now:
+            results[name] = _result(name, row, True)
+        else:
+            misses.append(name)
+
+    if misses:
+        servers = _servers_for({name.rsplit('.', 1)[-1] for name in misses}, now)
+        futures = {}
+        for name in misses:
+            server = servers.get(name.rsplit('.', 1)[-1])
+            if server:
+                futures[name] = (server, _pool.submit(query_server, server, name))
+            else:
+                row = _store(rows, name, 'error', now, raw='No whois server for this TLD')
+                results[name] = _result(name, row, False)
+        for name, (server, future) in futures.items():
+            try:
+                text = future.result()
+            except WhoisRateLimited as e:
+                row = WhoisCache(lookup_key=name, status='error', server=server, raw=str(e))
+            except WhoisError as e:
+                row = _store(rows, name, 'error', now, server=server, raw=str(e))
+            else:
+                parsed = parse_response(text)
+                if parsed['status'] == 'error':
+                    row = _store(rows, name, 'error', now, server=server, raw=parsed['error'])
+                else:
+                    row = _store(rows, name, parsed['status'], now, server=server, raw=text,
+                                 registrar=parsed.get('registrar'), expires_at=parsed.get('expires_at'),
+                                 registered_at=parsed.get('registered_at'))
+            results[name] = _result(name, row, False)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another worker cached the same name first; our answer is just as fresh
+            db.session.rollback()
+
+    return [results[name] for name in names]
+
+
+def lookup(domain, use_cache=True):
+    return lookup_many([domain], use_cache=use_cache)[0]
+
+
+def sync_expiry(domains, results):
+    """Copy parsed expiry dates onto Domain rows; returns how many changed"""
+    by_name = {result['domain']: result for result in results}
+    changed = 0
+    for domain in domains:
+        result = by_name.get(domain.name.lower())
+        if not result or not result['expires_at']:
+            continue
+        expires_at = datetime.fromisoformat(result['expires_at'])
+        if domain.expires_at != expires_at:
+            domain.expires_at = expires_at
+            changed += 1
+    return changed
+
+
+def refresh_domain_expiry():
+    """Re-check panel domains with an unknown or approaching expiry date.
+
+    Least recently checked first, so names whose whois never yields a date
+    rotate through the batch instead of holding it forever.
+    """
+    now = datetime.utcnow()
+    domains = Domain.query.filter(
+        db.or_(Domain.expires_at.is_(None), Domain.expires_at < now + REFRESH_WINDOW)
+    ).order_by(Domain.expiry_checked_at.is_(None).desc(), Domain.expiry_checked_at,
+               Domain.expires_at).limit(REFRESH_BATCH).all()
+    if not domains:
+        return 0
+    results = lookup_many([domain.name for domain in domains])
+    changed = sync_expiry(domains, results)
+    for domain in domains:
+        domain.expiry_checked_at = now
+    db.session.commit()
+    return changed
+
+
+def start_expiry_refresh(app):
+    return scheduler.start_periodic('whois-expiry-refresh', REFRESH_INTERVAL, refresh_domain_expiry,
+                                    app=app, leader_only=True)
@@ -0,0 +1,381 @@
+import csv
+import io
+import json
+from sqlalchemy import bindparam
+from src.models.user import db, DNSRecord, DNSZone
+from src.services import dns_zone, dns_validation
+
+CSV_FIELDS = ('name', 'type', 'value', 'ttl', 'priority')
+MAX_IMPORT_RECORDS = 20000
+
+
+class ZoneImportError(Exception):
+    """Import input that could not be parsed"""
+
+    def __init__(self, message, line=None):
+        super().__init__(message)
+        self.message = message
+        self.line = line
+
+
+def _bind_tokens(line):
+    """Split a zone file line into tokens, honouring quotes and `;` comments"""
+    tokens = []
+    i = 0
+    length = len(line)
+    while i < length:
+        ch = line[i]
+        if ch in ' \t\r\n':
+            i += 1
+        elif ch == ';':
+            break
+        elif ch in '()':
+            tokens.append(ch)
+            i += 1
+        elif ch == '"':
+            i += 1
+            buf = bytearray()
+            while i < length and line[i] != '"':
+                if line[i] == '\\' and line[i + 1:i + 4].isdigit() and len(line[i + 1:i + 4]) == 3:
+                    # \DDD is one octet, as dns_zone writes non-ASCII and control bytes
+                    buf.append(int(line[i + 1:i + 4]) & 0xff)
+                    i += 4
+                    continue
+                if line[i] == '\\' and i + 1 < length:
+                    i += 1
+                buf.extend(line[i].encode('utf-8'))
+                i += 1
+            i += 1
+            tokens.append(('"', buf.decode('utf-8', 'replace')))
+        else:
+            start = i
+            while i < length and line[i] not in ' \t\r\n;()"':
+                i += 1
+            tokens.append(line[start:i])
+    return tokens
+
+
+def _bind_entries(text):
+    """Yield (line_number, starts_with_blank, tokens) with parenthesised records joined"""
+    pending = None
+    for number, line in enumerate(text.splitlines(), 1):
+        tokens = _bind_tokens(line)
+        if pending is not None:
+            pending[2].extend(tokens)
+            if ')' in tokens:
+                yield pending[0], pending[1], [t for t in pending[2] if t not in ('(', ')')]
+                pending = None
+            continue
+        if not tokens:
+            continue
+        blank_owner = line[:1] in (' ', '\t')
+        if '(' in tokens and ')' not in tokens:
+            pending = (number, blank_owner, tokens)
+            continue
+        yield number, blank_owner, [t for t in tokens if t not in ('(', ')')]
+    if pending is not None:
+        raise ZoneImportError('unbalanced parentheses', pending[0])
+
+
+def _relative(name, origin):
+    """Owner name relative to the zone, fully qualified names without the dot"""
+    if name == '@':
+        return '@'
+    if name.endswith('.'):
+        bare = name[:-1]
+        if bare.lower() == origin:
+            return '@'
+        if bare.lower().endswith('.' + origin):
+            return bare[:-len(origin) - 1]
+        return bare
+    return name
+
+
+def _relative_target(name, origin, current_origin):
+    """A target as dns_zone._target will render it back.
+
+    dns_zone reads any dotted value as fully qualified, so only a single
+    in-zone label may become relative; deeper in-zone names keep their
+    full form (without the dot) instead of turning into `cdn.static.`.
+    """
+    if name == '@':
+        return '@'
+    if not name.endswith('.'):
+        if '.' not in name and current_origin == origin:
+            return name
+        name = f'{name}.{current_origin}.'
+    bare = name[:-1]
+    if bare.lower() == origin:
+        return '@'
+    if bare.lower().endswith('.' + origin) and '.' not in bare[:-len(origin) - 1]:
+        return bare[:-len(origin) - 1]
+    return bare if '.' in bare else name
+
+
+def _text(token):
+    return token[1] if isinstance(token, tuple) else token
+
+
+def parse_bind(text, origin):
+    """Parse a BIND zone file into record dicts; SOA records are skipped"""
+    origin = origin.lower().rstrip('.')
+    current_origin = origin
+    default_ttl = dns_zone.DEFAULT_TTL
+    last_owner = '@'
+    records = []
+
+    for number, blank_owner, tokens in _bind_entries(text):
+        first = _text(tokens[0])
+        if first.upper() == '$ORIGIN':
+            current_origin = _text(tokens[1]).lower().rstrip('.') if len(tokens) > 1 else origin
+            continue
+        if first.upper() == '$TTL':
+            try:
+                default_ttl = int(_text(tokens[1]))
+            except (IndexError, ValueError):
+                raise ZoneImportError('invalid $TTL', number)
+            continue
+        if first.startswith('$'):
+            raise ZoneImportError(f'unsupported directive {first}', number)
+
+        if blank_owner:
+            owner = last_owner
+        else:
+            owner = first
+            tokens = tokens[1:]
+            if owner != '@' and not owner.endswith('.') and current_origin != origin:
+                owner = f'{owner}.{current_origin}.'
+            owner = _relative(owner, origin)
+            last_owner = owner
+
+        ttl = None
+        record_type = None
+        while tokens:
+            token = _text(tokens[0])
+            if token.isdigit() and ttl is None:
+                ttl = int(token)
+            elif token.upper() in ('IN', 'CH', 'HS'):
+                pass
+            else:
+                record_type = token.upper()
+                tokens = tokens[1:]
+                break
+            tokens = tokens[1:]
+        if record_type is None:
+            raise ZoneImportError('missing record type', number)
+        if record_type == 'SOA':
+            continue
+
+        rdata = [_text(t) for t in tokens]
+        record = {'name': owner, 'type': record_type, 'ttl': ttl if ttl is not None else default_ttl,
+                  'priority': None, 'line': number}
+        if record_type == 'MX' and len(rdata) == 2:
+            record['priority'] = int(rdata[0]) if rdata[0].isdigit() else rdata[0]
+            record['value'] = _relative_target(rdata[1], origin, current_origin)
+        elif record_type == 'SRV' and len(rdata) == 4:
+            record['priority'] = int(rdata[0]) if rdata[0].isdigit() else rdata[0]
+            record['value'] = f'{rdata[1]} {rdata[2]} {_relative_target(rdata[3], origin, current_origin)}'
+        elif record_type in ('CNAME', 'NS', 'PTR') and len(rdata) == 1:
+            record['value'] = _relative_target(rdata[0], origin, current_origin)
+        elif record_type == 'TXT':
+            record['value'] = ''.join(rdata)
+        elif record_type == 'CAA' and len(rdata) == 3:
+            record['value'] = f'{rdata[0]} {rdata[1]} "{rdata[2]}"'
+        else:
+            record['value'] = ' '.join(rdata)
+        records.append(record)
+    return records
+
+
+def parse_csv(text):
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames or not {'name', 'type', 'value'} <= {f.strip().lower() for f in reader.fieldnames}:
+        raise ZoneImportError('CSV header must include name, type and value')
+    records = []
+    for row in reader:
+        row = {(k or '').strip().lower(): (v or '').strip() for k, v in row.items()}
+        records.append({
+            'name': row.get('name') or '@',
+            'type': row.get('type', '').upper(),
+            'value': row.get('value', ''),
+            'ttl': row.get('ttl') or None,
+            'priority': row.get('priority') or None,
+            'line': reader.line_num
+        })
+    return records
+
+
+def parse_json(data):
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except ValueError as e:
+            raise ZoneImportError(f'invalid JSON: {e}')
+    if isinstance(data, dict):
+        data = data.get('records')
+    if not isinstance(data, list):
+        raise ZoneImportError('JSON must be a list of records or {"records": [...]}')
+    records = []
+    for index, item in enumerate(data, 1):
+        if not isinstance(item, dict):
+            raise ZoneImportError('record must be an object', index)
+        records.append({
+            'name': item.get('name') or '@',
+            'type': str(item.get('type') or item.get('record_type') or '').upper(),
+            'value': item.get('value', ''),
+            'ttl': item.get('ttl'),
+            'priority': item.get('priority'),
+            'line': index
+        })
+    return records
+
+
+def parse(fmt, content, origin):
+    if fmt == 'bind':
+        return parse_bind(content, origin)
+    if fmt == 'csv':
+        return parse_csv(content)
+    if fmt == 'json':
+        return parse_json(content)
+    raise ZoneImportError(f'unsupported format {fmt}')
+
+
+def normalize(records, origin):
+    """Coerce field types; returns (records, errors) for rows that can't be coerced"""
+    origin = origin.lower().rstrip('.')
+    clean = []
+    errors = []
+    for record in records:
+        line = record.get('line')
+        record_type = record['type']
+        value = str(record.get('value') or '').strip()
+        try:
+            ttl = int(record['ttl']) if record.get('ttl') not in (None, '') else dns_zone.DEFAULT_TTL
+            priority = int(record['priority']) if record.get('priority') not in (None, '') else None
+        except (TypeError, ValueError):
+            errors.append({'line': line, 'error': 'ttl and priority must be integers'})
+            continue
+        clean.append({
+            'name': _relative(str(record.get('name') or '@').strip(), origin) or '@',
+            'type': record_type,
+            'value': value,
+            'ttl': ttl,
+            'priority': priority,
+            'line': line
+        })
+    return clean, errors
+
+
+def diff(existing, incoming, replace=False, origin=None):
+    """Plan inserts, updates and deletes turning `existing` rows into `incoming`.
+
+    Records are matched on (name, type, value); a match whose TTL or
+    priority differs becomes an update. Without `replace`, existing
+    records absent from the import are kept.
+    """
+    by_identity = {}
+    for row in existing:
+        by_identity.setdefault(dns_validation.identity(row.name, row.record_type, row.value, origin), []).append(row)
+
+    inserts, updates = [], []
+    unchanged = 0
+    matched = set()
+    seen = set()
+    for record in incoming:
+        key = dns_validation.identity(record['name'], record['type'], record['value'], origin)
+        if key in seen:
+            continue
+        seen.add(key)
+        rows = by_identity.get(key)
+        if not rows:
+            inserts.append(record)
+            continue
+        row = rows[0]
+        matched.update(r.id for r in rows)
+        if row.ttl != record['ttl'] or row.priority != record['priority']:
+            updates.append({'b_id': row.id, 'b_ttl': record['ttl'], 'b_priority': record['priority']})
+        else:
+            unchanged += 1
+        # Exact duplicates already stored are collapsed on a replace
+        if replace:
+            matched.difference_update(r.id for r in rows[1:])
+
+    deletes = [row.id for row in existing if row.id not in matched] if replace else []
+    return {'insert': inserts, 'update': updates, 'delete': deletes, 'unchanged': unchanged}
+
+
+def apply(domain, plan):
+    """Apply a diff plan in a single transaction using executemany"""
+    table = DNSRecord.__table__
+    if plan['insert']:
+        db.session.execute(table.insert(), [{
+            'domain_id': domain.id,
+            'name': record['name'],
+            'record_type': record['type'],
+            'value': record['value'],
+            'ttl': record['ttl'],
+            'priority': record['priority']
+        } for record in plan['insert']])
+    if plan['update']:
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('b_id'))
+            .values(ttl=bindparam('b_ttl'), priority=bindparam('b_priority')),
+            plan['update']
+        )
+    if plan['delete']:
+        for start in range(0, len(plan['delete']), 500):
+            db.session.execute(table.delete().where(table.c.id.in_(plan['delete'][start:start + 500])))
+    if plan['insert'] or plan['update'] or plan['delete']:
+        dns_zone.mark_dirty(domain.id)
+
+
+def import_records(domain, fmt, content, replace=False, dry_run=False):
+    """Parse, validate and diff an import; applies it unless `dry_run` or invalid"""
+    records = parse(fmt, content, domain.name)
+    if len(records) > MAX_IMPORT_RECORDS:
+        raise ZoneImportError(f'too many records (max {MAX_IMPORT_RECORDS})')
+    clean, errors = normalize(records, domain.name)
+    existing = DNSRecord.query.filter_by(domain_id=domain.id).all()
+    # A replace is checked on its own; a merge must also fit the records it keeps
+    errors.extend(dns_validation.validate_records(clean, () if replace else existing, domain.name))
+    summary = {'parsed': len(records), 'errors': errors}
+    if errors:
+        return dict(summary, applied=False)
+
+    plan = diff(existing, clean, replace=replace, origin=domain.name)
+    summary.update({
+        'insert': len(plan['insert']),
+        'update': len(plan['update']),
+        'delete': len(plan['delete']),
+        'unchanged': plan['unchanged']
+    })
+    if dry_run:
+        return dict(summary, applied=False)
+    apply(domain, plan)
+    db.session.commit()
+    return dict(summary, applied=True)
+
+
+def export_records(domain, fmt):
+    records = DNSRecord.query.filter_by(domain_id=domain.id).order_by(DNSRecord.name, DNSRecord.record_type).all()
+    if fmt == 'bind':
+        zone = DNSZone.query.filter_by(domain_id=domain.id).first()
+        body = dns_zone.render_records(domain.name, records)
+        return dns_zone.render_zone(domain.name, body, zone.serial if zone and zone.serial else dns_zone.next_serial(0))
+    if fmt == 'csv':
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(CSV_FIELDS)
+        for record in records:
+            writer.writerow([record.name, record.record_type, record.value, record.ttl,
+                             record.priority if record.priority is not None else ''])
+        return out.getvalue()
+    if fmt == 'json':
+        return json.dumps({'domain': domain.name, 'records': [{
+            'name': record.name,
+            'type': record.record_type,
+            'value': record.value,
+            'ttl': record.ttl,
+            'priority': record.priority
+        } for record in records]}, indent=2)
+    raise ZoneImportError(f'unsupported format {fmt}')
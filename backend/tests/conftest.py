@@ -0,0 +1,65 @@
+import os
+import sys
+
+import pytest
+
+# The app imports itself as the `src` package from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Cheap hashes and no shared files outside the test run
+os.environ.setdefault('PANEL_BCRYPT_ROUNDS', '4')
+os.environ.setdefault('PANEL_RATELIMIT_STORE', 'memory')
+
+
+@pytest.fixture
+def app():
+    """A bare Flask app on an in-memory database, with an application context pushed"""
+    from flask import Flask
+    from src.models.user import db
+
+    app = Flask('tests')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    """Test client with the blueprints mounted as in main.py and JWTs signed with a fixed secret"""
+    from flask_jwt_extended import JWTManager
+    from src.routes.auth import auth_bp
+    from src.routes.database import database_bp
+    from src.routes.dns import dns_bp
+    from src.routes.domain import domain_bp
+    from src.routes.email import email_bp
+    from src.routes.nginx import nginx_bp
+    from src.routes.php import php_bp
+    from src.routes.ssl import ssl_bp
+    from src.routes.user import user_bp
+    from src.services import revocation
+
+    app.config['SECRET_KEY'] = app.config['JWT_SECRET_KEY'] = 'tests'
+    jwt = JWTManager(app)
+    jwt.user_identity_loader(str)
+    revocation.init_jwt(jwt)
+    app.register_blueprint(auth_bp, url_prefix='/api/auth')
+    for blueprint in (user_bp, domain_bp, dns_bp, ssl_bp, nginx_bp, php_bp, database_bp, email_bp):
+        app.register_blueprint(blueprint, url_prefix='/api')
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(app):
+    """make_user(username, role='user') -> (User, Authorization headers)"""
+    from flask_jwt_extended import create_access_token
+    from src.models.user import db, User
+
+    def make(username, role='user'):
+        user = User(username=username, email=f'{username}@example.com', role=role, password_hash='x')
+        db.session.add(user)
+        db.session.commit()
+        return user, {'Authorization': f'Bearer {create_access_token(identity=user.id)}'}
+    return make
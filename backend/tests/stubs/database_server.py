@@ -0,0 +1,95 @@
+"""An in-process stand-in for the MySQL and PostgreSQL admin connections.
+
+Hands out DB-API style connections whose cursors record every statement
+(rendered to text, psycopg2 sql objects included) instead of running it.
+Statements matching a pattern in `failures` raise `error`; queries
+matching a pattern in `results` return those rows.
+"""
+import re
+
+try:
+    from psycopg2 import sql as pgsql
+except ImportError:
+    pgsql = None
+
+
+class StubDatabaseError(Exception):
+    pass
+
+
+def render(query):
+    """Text of a statement, with psycopg2 identifiers quoted the way the server would"""
+    if isinstance(query, str):
+        return query
+    if pgsql is not None:
+        if isinstance(query, pgsql.Composed):
+            return ''.join(render(part) for part in query.seq)
+        if isinstance(query, pgsql.SQL):
+            return query.string
+        if isinstance(query, pgsql.Identifier):
+            return '.'.join('"%s"' % part.replace('"', '""') for part in query.strings)
+        if isinstance(query, pgsql.Literal):
+            return repr(query.wrapped)
+    raise TypeError(f'Cannot render {query!r}')
+
+
+class StubCursor:
+    def __init__(self, server, dbname):
+        self.server = server
+        self.dbname = dbname
+        self.rows = []
+
+    def execute(self, query, params=None):
+        text = render(query)
+        self.server.statements.append((self.dbname, text, params))
+        for pattern in self.server.failures:
+            if re.search(pattern, text):
+                raise self.server.error(f'stub refused: {text}')
+        self.rows = next((list(rows) for pattern, rows in self.server.results.items() if re.search(pattern, text)), [])
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class StubConnection:
+    def __init__(self, server, dbname):
+        self.server = server
+        self.dbname = dbname
+        self.autocommit = True
+        self.closed = False
+
+    def cursor(self):
+        return StubCursor(self.server, self.dbname)
+
+    def close(self):
+        self.closed = True
+
+
+class StubDatabaseServer:
+    """`connect(dbname=None)` opens a connection; every statement lands in `statements`"""
+
+    def __init__(self, error=StubDatabaseError, results=None):
+        self.error = error
+        self.results = dict(results or {})
+        self.failures = []
+        self.statements = []  # (dbname or None, text, params)
+
+    def connect(self, dbname=None):
+        return StubConnection(self, dbname)
+
+    def executed(self, dbname=None):
+        """Statement texts run against one database (None = the admin session)"""
+        return [text for name, text, _ in self.statements if name == dbname]
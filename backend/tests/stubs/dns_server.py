@@ -0,0 +1,199 @@
+"""A small authoritative DNS server for tests.
+
+Serves records over UDP and TCP on 127.0.0.1 from a dict, or from a BIND
+zone file read by its own minimal parser (not zone_io), so compiled
+zones can be checked by asking for them over the wire.
+"""
+import ipaddress
+import socketserver
+import struct
+import threading
+
+TYPES = {'A': 1, 'NS': 2, 'CNAME': 5, 'SOA': 6, 'PTR': 12, 'MX': 15, 'TXT': 16, 'AAAA': 28, 'SRV': 33, 'CAA': 257}
+UDP_LIMIT = 1232
+
+
+class ZoneSyntaxError(ValueError):
+    pass
+
+
+def encode_name(name):
+    return b''.join(bytes([len(label)]) + label.encode('ascii') for label in name.rstrip('.').split('.') if label) + b'\0'
+
+
+def _tokens(line):
+    """Tokens of one zone line; quoted strings come back as bytes"""
+    tokens = []
+    i = 0
+    while i < len(line):
+        ch = line[i]
+        if ch in ' \t':
+            i += 1
+        elif ch == ';':
+            break
+        elif ch in '()':
+            tokens.append(ch)
+            i += 1
+        elif ch == '"':
+            i += 1
+            buf = bytearray()
+            while True:
+                if i >= len(line):
+                    raise ZoneSyntaxError(f'unterminated string: {line!r}')
+                if line[i] == '"':
+                    break
+                if line[i] == '\\':
+                    digits = line[i + 1:i + 4]
+                    if len(digits) == 3 and digits.isdigit():
+                        buf.append(int(digits))
+                        i += 4
+                        continue
+                    i += 1
+                if ord(line[i]) > 0x7e or ord(line[i]) < 0x20:
+                    raise ZoneSyntaxError(f'unescaped byte {line[i]!r} in string')
+                buf.extend(line[i].encode('ascii'))
+                i += 1
+            i += 1
+            tokens.append(bytes(buf))
+        else:
+            start = i
+            while i < len(line) and line[i] not in ' \t;()"':
+                i += 1
+            tokens.append(line[start:i])
+    return tokens
+
+
+def _absolute(name, origin):
+    if name == '@':
+        return origin
+    return name.rstrip('.') if name.endswith('.') else f'{name}.{origin}'
+
+
+def parse_zone(text, origin):
+    """{(lowercase name, type code): [(ttl, rdata bytes)]} from a zone file"""
+    origin = origin.rstrip('.').lower()
+    default_ttl = 3600
+    owner = origin
+    records = {}
+    lines = text.split('\n')
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        index += 1
+        tokens = _tokens(line)
+        while tokens.count('(') > tokens.count(')'):
+            if index >= len(lines):
+                raise ZoneSyntaxError('unbalanced parentheses')
+            tokens += _tokens(lines[index])
+            index += 1
+        tokens = [token for token in tokens if token not in ('(', ')')]
+        if not tokens:
+            continue
+        first = tokens[0]
+        if isinstance(first, str) and first.startswith('$'):
+            if first == '$ORIGIN':
+                origin = tokens[1].rstrip('.').lower()
+            elif first == '$TTL':
+                default_ttl = int(tokens[1])
+            else:
+                raise ZoneSyntaxError(f'directive {first} not allowed')
+            continue
+        if line[:1] not in (' ', '\t'):
+            owner = _absolute(first, origin).lower()
+            tokens = tokens[1:]
+        ttl = default_ttl
+        while tokens and isinstance(tokens[0], str) and (tokens[0].isdigit() or tokens[0] == 'IN'):
+            if tokens[0].isdigit():
+                ttl = int(tokens[0])
+            tokens = tokens[1:]
+        rtype, rdata = tokens[0], tokens[1:]
+        if rtype not in TYPES:
+            raise ZoneSyntaxError(f'unknown type {rtype}')
+        if rtype == 'A':
+            wire = ipaddress.IPv4Address(rdata[0]).packed
+        elif rtype == 'AAAA':
+            wire = ipaddress.IPv6Address(rdata[0]).packed
+        elif rtype in ('NS', 'CNAME', 'PTR'):
+            wire = encode_name(_absolute(rdata[0], origin))
+        elif rtype == 'MX':
+            wire = struct.pack('!H', int(rdata[0])) + encode_name(_absolute(rdata[1], origin))
+        elif rtype == 'SRV':
+            wire = struct.pack('!HHH', *(int(part) for part in rdata[:3])) + encode_name(_absolute(rdata[3], origin))
+        elif rtype == 'TXT':
+            if not all(isinstance(part, bytes) and len(part) <= 255 for part in rdata):
+                raise ZoneSyntaxError(f'bad TXT strings {rdata!r}')
+            wire = b''.join(bytes([len(part)]) + part for part in rdata)
+        elif rtype == 'CAA':
+            tag = rdata[1].encode('ascii')
+            wire = bytes([int(rdata[0]), len(tag)]) + tag + rdata[2]
+        else:  # SOA
+            wire = (encode_name(_absolute(rdata[0], origin)) + encode_name(_absolute(rdata[1], origin))
+                    + struct.pack('!IIIII', *(int(part) for part in rdata[2:7])))
+        records.setdefault((owner, TYPES[rtype]), []).append((ttl, wire))
+    return records
+
+
+class _UDPServer(socketserver.ThreadingUDPServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class StubDNSServer:
+    """Answers from `records`; names not in it get NXDOMAIN. Use as a context manager."""
+
+    def __init__(self, records=None):
+        self.records = records or {}
+        self.queries = []
+        server = self
+
+        class UDPHandler(socketserver.BaseRequestHandler):
+            def handle(self):
+                data, sock = self.request
+                sock.sendto(server.answer(data, UDP_LIMIT), self.client_address)
+
+        class TCPHandler(socketserver.BaseRequestHandler):
+            def handle(self):
+                length = struct.unpack('!H', self.request.recv(2))[0]
+                data = b''
+                while len(data) < length:
+                    data += self.request.recv(length - len(data))
+                reply = server.answer(data, None)
+                self.request.sendall(struct.pack('!H', len(reply)) + reply)
+
+        self.udp = _UDPServer(('127.0.0.1', 0), UDPHandler)
+        self.port = self.udp.server_address[1]
+        self.tcp = _TCPServer(('127.0.0.1', self.port), TCPHandler)
+
+    def answer(self, query, limit):
+        query_id = struct.unpack('!H', query[:2])[0]
+        offset = 12
+        labels = []
+        while query[offset]:
+            labels.append(query[offset + 1:offset + 1 + query[offset]].decode('ascii'))
+            offset += 1 + query[offset]
+        qtype = struct.unpack('!H', query[offset + 1:offset + 3])[0]
+        question = query[12:offset + 5]
+        name = '.'.join(labels).lower()
+        self.queries.append((name, qtype))
+        if not any(key[0] == name for key in self.records):
+            return struct.pack('!HHHHHH', query_id, 0x8403, 1, 0, 0, 0) + question
+        answers = self.records.get((name, qtype), [])
+        body = b''.join(b'\xc0\x0c' + struct.pack('!HHIH', qtype, 1, ttl, len(rdata)) + rdata
+                        for ttl, rdata in answers)
+        if limit and 12 + len(question) + len(body) > limit:
+            return struct.pack('!HHHHHH', query_id, 0x8600, 1, 0, 0, 0) + question
+        return struct.pack('!HHHHHH', query_id, 0x8400, 1, len(answers), 0, 0) + question + body
+
+    def __enter__(self):
+        for server in (self.udp, self.tcp):
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        for server in (self.udp, self.tcp):
+            server.shutdown()
+            server.server_close()
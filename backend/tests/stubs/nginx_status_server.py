@@ -0,0 +1,57 @@
+"""A fake nginx stub_status endpoint for tests.
+
+Serves the ngx_http_stub_status_module page on 127.0.0.1 from the
+counters in `counters`; `serve(requests=...)` moves them on between
+scrapes, and `status` / `body` can be set to simulate a broken endpoint.
+"""
+import http.server
+import threading
+
+PAGE = ('Active connections: {active} \n'
+        'server accepts handled requests\n'
+        ' {accepts} {handled} {requests} \n'
+        'Reading: {reading} Writing: {writing} Waiting: {waiting} \n')
+
+
+class _HTTPServer(http.server.ThreadingHTTPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class StubStatusServer:
+    """Use as a context manager; `url` is the status page"""
+
+    def __init__(self):
+        self.counters = {'active': 1, 'accepts': 1, 'handled': 1, 'requests': 1,
+                         'reading': 0, 'writing': 1, 'waiting': 0}
+        self.status = 200
+        self.body = None  # served instead of the page when set
+        self.hits = 0
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.hits += 1
+                body = (server.body if server.body is not None else PAGE.format(**server.counters)).encode()
+                self.send_response(server.status)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.http = _HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.http.server_address[1]}/nginx_status'
+
+    def serve(self, **counters):
+        self.counters.update(counters)
+
+    def __enter__(self):
+        threading.Thread(target=self.http.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.http.shutdown()
+        self.http.server_close()
@@ -0,0 +1,144 @@
+"""A small Redis-compatible server for tests.
+
+Speaks RESP on 127.0.0.1 and implements the commands the panel uses
+(GET/SET/MGET/INCR[BY]/EXPIRE/TTL/DEL, MULTI/EXEC pipelines) plus the HELLO
+handshake redis-py sends, with keys expiring on the wall clock. After
+HELLO 3 nulls are sent the RESP3 way; every other reply is the same.
+"""
+import socketserver
+import threading
+import time
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def _encode(value, resp3=False):
+    if value is None:
+        return b'_\r\n' if resp3 else b'$-1\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, Exception):
+        return b'-ERR %s\r\n' % str(value).encode()
+    if isinstance(value, list):
+        return b'*%d\r\n' % len(value) + b''.join(_encode(item, resp3) for item in value)
+    if isinstance(value, str):
+        return b'+%s\r\n' % value.encode()
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+def _hello(protocol):
+    fields = {'server': 'redis', 'version': '7.2.0', 'proto': protocol, 'mode': 'standalone'}
+    if protocol == 3:
+        return b'%%%d\r\n' % len(fields) + b''.join(_encode(key) + _encode(value) for key, value in fields.items())
+    return _encode([item for pair in fields.items() for item in pair])
+
+
+def _read_command(stream):
+    """One command as a list of bytes, or None at EOF"""
+    line = stream.readline()
+    if not line:
+        return None
+    if not line.startswith(b'*'):
+        return line.split()  # inline command, e.g. from telnet
+    args = []
+    for _ in range(int(line[1:])):
+        length = int(stream.readline()[1:])
+        args.append(stream.read(length + 2)[:-2])
+    return args
+
+
+class StubRedisServer:
+    """Keys live in `data` as {key: (value, expires_at or None)}. Use as a context manager."""
+
+    def __init__(self):
+        self.data = {}
+        self.commands = []
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                queued = None
+                resp3 = False
+                while True:
+                    args = _read_command(self.rfile)
+                    if args is None:
+                        return
+                    name = args[0].upper().decode()
+                    server.commands.append(name)
+                    if name == 'HELLO':
+                        resp3 = len(args) > 1 and args[1] == b'3'
+                        self.wfile.write(_hello(3 if resp3 else 2))
+                        continue
+                    if name == 'MULTI':
+                        queued = []
+                        reply = 'OK'
+                    elif name == 'EXEC':
+                        reply = [server.execute(*command) for command in queued or []]
+                        queued = None
+                    elif queued is not None:
+                        queued.append((name, args[1:]))
+                        reply = 'QUEUED'
+                    else:
+                        reply = server.execute(name, args[1:])
+                    self.wfile.write(_encode(reply, resp3))
+
+        self.tcp = _TCPServer(('127.0.0.1', 0), Handler)
+        self.port = self.tcp.server_address[1]
+        self.url = f'redis://127.0.0.1:{self.port}/0'
+
+    def _get(self, key, now):
+        value, expires = self.data.get(key, (None, None))
+        if expires is not None and expires <= now:
+            del self.data[key]
+            return None
+        return value
+
+    def execute(self, name, args):
+        now = time.time()
+        with self.lock:
+            if name == 'PING':
+                return 'PONG'
+            if name in ('CLIENT', 'SELECT'):
+                return 'OK'
+            if name == 'GET':
+                return self._get(args[0], now)
+            if name == 'MGET':
+                return [self._get(key, now) for key in args]
+            if name == 'SET':
+                self.data[args[0]] = (args[1], None)
+                return 'OK'
+            if name in ('INCR', 'INCRBY'):
+                value = self._get(args[0], now)
+                try:
+                    value = int(value or 0) + (int(args[1]) if name == 'INCRBY' else 1)
+                except ValueError:
+                    return ValueError('value is not an integer or out of range')
+                expires = self.data.get(args[0], (None, None))[1]
+                self.data[args[0]] = (str(value).encode(), expires)
+                return value
+            if name == 'EXPIRE':
+                value = self._get(args[0], now)
+                if value is None:
+                    return 0
+                self.data[args[0]] = (value, now + int(args[1]))
+                return 1
+            if name == 'TTL':
+                if self._get(args[0], now) is None:
+                    return -2
+                expires = self.data[args[0]][1]
+                return -1 if expires is None else int(round(expires - now))
+            if name == 'DEL':
+                return sum(self.data.pop(key, None) is not None for key in args)
+            return ValueError(f"unknown command '{name}'")
+
+    def __enter__(self):
+        threading.Thread(target=self.tcp.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.tcp.shutdown()
+        self.tcp.server_close()
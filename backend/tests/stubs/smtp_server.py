@@ -0,0 +1,108 @@
+"""An SMTP sink for tests.
+
+Accepts mail on 127.0.0.1 and keeps it in `messages` instead of
+delivering it. PIPELINING is advertised unless turned off, and every
+recv() is logged in `chunks` as the commands it carried, so a test can
+tell a pipelined envelope (one chunk) from a lock-step one. Replies to
+RCPT come from `rcpt_replies` by address prefix, e.g. {'bad': '550 ...'}.
+"""
+import socketserver
+import threading
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class StubSMTPServer:
+    """Use as a context manager; `sessions` counts connections"""
+
+    def __init__(self, pipelining=True, rcpt_replies=None, mail_reply='250 2.1.0 Ok'):
+        self.pipelining = pipelining
+        self.rcpt_replies = dict(rcpt_replies or {})
+        self.mail_reply = mail_reply
+        self.messages = []  # (sender, [recipients], data)
+        self.chunks = []    # [commands] per recv()
+        self.sessions = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def setup(self):
+                self.buffer = b''
+
+            def send(self, *lines):
+                self.request.sendall(b''.join(line.encode() + b'\r\n' for line in lines))
+
+            def lines(self):
+                """Yield command lines, logging which arrived together"""
+                while True:
+                    data = self.request.recv(65536)
+                    if not data:
+                        return
+                    self.buffer += data
+                    *complete, self.buffer = self.buffer.split(b'\r\n')
+                    with server.lock:
+                        server.chunks.append([line.decode('utf-8', 'replace') for line in complete])
+                    yield from complete
+
+            def handle(self):
+                with server.lock:
+                    server.sessions += 1
+                self.send('220 sink.test ESMTP')
+                sender, recipients, data = None, [], None
+                for raw in self.lines():
+                    if data is not None:
+                        if raw == b'.':
+                            with server.lock:
+                                server.messages.append((sender, recipients, b'\r\n'.join(data)))
+                            sender, recipients, data = None, [], None
+                            self.send('250 2.0.0 Ok: queued')
+                        else:
+                            data.append(raw[1:] if raw.startswith(b'..') else raw)
+                        continue
+                    command = raw.decode('utf-8', 'replace')
+                    verb = command.split(' ', 1)[0].upper()
+                    if verb == 'EHLO':
+                        features = ['PIPELINING'] if server.pipelining else []
+                        self.send(*[f'250-{line}' for line in ['sink.test'] + features], '250 8BITMIME')
+                    elif verb == 'HELO':
+                        self.send('250 sink.test')
+                    elif verb == 'MAIL':
+                        sender, recipients = command[command.index('<') + 1:command.rindex('>')], []
+                        self.send(server.mail_reply)
+                    elif verb == 'RCPT':
+                        address = command[command.index('<') + 1:command.rindex('>')]
+                        reply = next((reply for prefix, reply in server.rcpt_replies.items()
+                                      if address.startswith(prefix)), '250 2.1.5 Ok')
+                        if reply.startswith('2') and sender is not None:
+                            recipients.append(address)
+                        self.send(reply)
+                    elif verb == 'DATA':
+                        if not recipients:
+                            self.send('554 5.5.1 No valid recipients')
+                        else:
+                            data = []
+                            self.send('354 End data with <CR><LF>.<CR><LF>')
+                    elif verb == 'RSET':
+                        sender, recipients = None, []
+                        self.send('250 2.0.0 Ok')
+                    elif verb == 'NOOP':
+                        self.send('250 2.0.0 Ok')
+                    elif verb == 'QUIT':
+                        self.send('221 2.0.0 Bye')
+                        return
+                    else:
+                        self.send('502 5.5.2 Command not recognized')
+
+        self.tcp = _TCPServer(('127.0.0.1', 0), Handler)
+        self.port = self.tcp.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.tcp.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.tcp.shutdown()
+        self.tcp.server_close()
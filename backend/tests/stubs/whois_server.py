@@ -0,0 +1,42 @@
+"""A port-43 whois server for tests.
+
+Answers each query line from `responses` (keyed by the lowercased query)
+and closes the connection, like a registry does. It plays both IANA and
+the registries: give TLD keys a `refer: 127.0.0.1` answer.
+"""
+import socketserver
+import threading
+
+NOT_FOUND = 'No match for "{query}".\n'
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class StubWhoisServer:
+    """Queries seen land in `queries`. Use as a context manager."""
+
+    def __init__(self, responses=None):
+        self.responses = dict(responses or {})
+        self.queries = []
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                query = self.rfile.readline().decode('utf-8', 'replace').strip().lower()
+                server.queries.append(query)
+                answer = server.responses.get(query, NOT_FOUND.format(query=query.upper()))
+                self.wfile.write(answer.replace('\n', '\r\n').encode())
+
+        self.tcp = _TCPServer(('127.0.0.1', 0), Handler)
+        self.port = self.tcp.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.tcp.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.tcp.shutdown()
+        self.tcp.server_close()
@@ -0,0 +1,46 @@
+from src.models.user import db, Domain, User
+
+
+def test_register_refuses_a_role_without_an_admin_token(client, make_user):
+    body = {'username': 'mallory', 'email': 'mallory@example.com', 'password': 'secret123', 'role': 'admin'}
+    response = client.post('/api/auth/register', json=body)
+    assert response.status_code == 403
+    assert User.query.filter_by(username='mallory').first() is None
+
+    _, headers = make_user('owner')
+    assert client.post('/api/auth/register', json=body, headers=headers).status_code == 403
+
+    del body['role']
+    response = client.post('/api/auth/register', json=body)
+    assert response.status_code == 201
+    assert response.get_json()['user']['role'] == 'user'
+
+
+def test_admin_may_register_with_a_role(client, make_user):
+    _, headers = make_user('root', role='admin')
+    body = {'username': 'helper', 'email': 'helper@example.com', 'password': 'secret123', 'role': 'readonly'}
+    response = client.post('/api/auth/register', json=body, headers=headers)
+    assert response.status_code == 201
+    assert response.get_json()['user']['role'] == 'readonly'
+
+    body.update(username='other', email='other@example.com', role='superuser')
+    assert client.post('/api/auth/register', json=body, headers=headers).status_code == 400
+
+
+def test_owner_cannot_lift_a_suspension(client, make_user):
+    owner, headers = make_user('owner')
+    _, admin_headers = make_user('root', role='admin')
+    domain = Domain(name='held.test', user_id=owner.id, status='suspended')
+    db.session.add(domain)
+    db.session.commit()
+
+    for body in ({'status': 'active'}, {'expires_at': '2099-01-01T00:00:00'}):
+        response = client.put(f'/api/domains/{domain.id}', json=body, headers=headers)
+        assert response.status_code == 403
+    db.session.refresh(domain)
+    assert domain.status == 'suspended' and domain.expires_at is None
+
+    response = client.put(f'/api/domains/{domain.id}', json={'status': 'active'}, headers=admin_headers)
+    assert response.status_code == 200
+    db.session.refresh(domain)
+    assert domain.status == 'active'
@@ -0,0 +1,63 @@
+import types
+
+import pytest
+from src.services import db_provisioning
+from stubs.database_server import StubDatabaseError, StubDatabaseServer
+
+
+def _attach(server, stub, monkeypatch):
+    server.pool = db_provisioning.ConnectionPool(stub.connect, 2)
+    monkeypatch.setattr(server, '_connect', stub.connect)
+    return server
+
+
+@pytest.fixture
+def mysql(monkeypatch):
+    # The driver is only touched for its exception class once connections come from the stand-in
+    monkeypatch.setattr(db_provisioning, 'pymysql', types.SimpleNamespace(MySQLError=StubDatabaseError))
+    stub = StubDatabaseServer(results={r'VERSION\(\)': [('8.0.36',)]})
+    return stub, _attach(db_provisioning.MySQLServer(), stub, monkeypatch)
+
+
+@pytest.fixture
+def postgres(monkeypatch):
+    psycopg2 = pytest.importorskip('psycopg2')
+    stub = StubDatabaseServer(error=type('Refused', (psycopg2.Error,), {}), results={
+        'server_version': [('16.2', 160002, 'scram-sha-256')],
+        'datdba': [('shop_owner',)],
+    })
+    return stub, _attach(db_provisioning.PostgresServer(), stub, monkeypatch)
+
+
+def test_mysql_failed_grant_drops_the_new_account(mysql):
+    stub, server = mysql
+    stub.failures.append('^GRANT')
+    results = server.create_many([{'name': 'shop', 'user': 'shop_rw', 'password': 'pw'}])
+    assert results[0].startswith('stub refused')
+    drops = [text for text in stub.executed() if text.startswith('DROP')]
+    assert drops == ["DROP USER 'shop_rw'@'localhost'", 'DROP DATABASE IF EXISTS `shop`']
+
+
+def test_mysql_failed_create_user_leaves_existing_accounts_alone(mysql):
+    stub, server = mysql
+    stub.failures.append('^CREATE USER')
+    assert server.create_many([{'name': 'shop', 'user': 'shop_rw', 'password': 'pw'}])[0]
+    drops = [text for text in stub.executed() if text.startswith('DROP')]
+    assert drops == ['DROP DATABASE IF EXISTS `shop`']
+
+
+def test_postgres_readonly_default_privileges_follow_the_owner(postgres):
+    stub, server = postgres
+    server.create_user('shop', 'shop_ro', 'pw', 'readonly')
+    grants, = stub.executed('shop')
+    assert 'ALTER DEFAULT PRIVILEGES FOR ROLE "shop_owner" IN SCHEMA public GRANT SELECT ON TABLES TO "shop_ro"' in grants
+    assert 'GRANT CONNECT ON DATABASE "shop" TO "shop_ro"' in stub.executed()
+
+
+def test_postgres_failed_schema_grant_drops_the_role(postgres):
+    stub, server = postgres
+    stub.failures.append('GRANT ALL ON SCHEMA')
+    with pytest.raises(db_provisioning.ProvisioningError):
+        server.create_user('shop', 'shop_rw', 'pw', 'all')
+    drops = [text for text in stub.executed() if text.startswith('DROP')]
+    assert drops == ['DROP OWNED BY "shop_rw"', 'DROP ROLE IF EXISTS "shop_rw"']
@@ -0,0 +1,92 @@
+import struct
+
+import pytest
+from src.services import dns_client
+from stubs.dns_server import StubDNSServer, encode_name
+
+QNAME = encode_name('Example.COM')  # at offset 12, so b'\xc0\x0c' points at it
+
+
+def _rr(rtype, rdata, name=b'\xc0\x0c', ttl=300):
+    return name + struct.pack('!HHIH', rtype, 1, ttl, len(rdata)) + rdata
+
+
+def _message(answers=(), authority=(), flags=0x8180, qtype=15):
+    header = struct.pack('!HHHHHH', 0x1234, flags, 1, len(answers), len(authority), 0)
+    return header + QNAME + struct.pack('!HH', qtype, 1) + b''.join(answers) + b''.join(authority)
+
+
+def test_parse_response_follows_compression_pointers():
+    soa = (encode_name('ns1')[:-1] + b'\xc0\x0c' + encode_name('hostmaster')[:-1] + b'\xc0\x0c'
+           + struct.pack('!IIIII', 2024010101, 7200, 900, 1209600, 300))
+    data = _message(answers=[_rr(15, struct.pack('!H', 10) + b'\x04mail\xc0\x0c')], authority=[_rr(6, soa)])
+    response = dns_client.parse_response(data)
+    assert response['id'] == 0x1234 and response['rcode'] == 0 and not response['truncated']
+    assert response['question'] == ('example.com', 15)
+    assert response['answers'] == [{'name': 'Example.COM', 'type': 'MX', 'ttl': 300,
+                                    'value': {'priority': 10, 'exchange': 'mail.Example.COM'}}]
+    assert response['authority'][0]['value'] == {
+        'mname': 'ns1.Example.COM', 'rname': 'hostmaster.Example.COM', 'serial': 2024010101,
+        'refresh': 7200, 'retry': 900, 'expire': 1209600, 'minimum': 300
+    }
+
+
+def test_parse_response_decodes_each_record_type():
+    answers = [
+        _rr(1, bytes([192, 0, 2, 1])),
+        _rr(28, bytes.fromhex('20010db8000000000000000000000001')),
+        _rr(16, b'\x05hello\x06 world'),
+        _rr(33, struct.pack('!HHH', 10, 5, 5222) + encode_name('xmpp.example.com')),
+        _rr(257, b'\x00\x05issueletsencrypt.org'),
+        _rr(99, b'\xde\xad'),
+        _rr(41, b''),  # EDNS OPT is not an answer
+    ]
+    values = [(r['type'], r['value']) for r in dns_client.parse_response(_message(answers))['answers']]
+    assert values == [
+        ('A', '192.0.2.1'),
+        ('AAAA', '2001:db8::1'),
+        ('TXT', 'hello world'),
+        ('SRV', {'priority': 10, 'weight': 5, 'port': 5222, 'target': 'xmpp.example.com'}),
+        ('CAA', {'flags': 0, 'tag': 'issue', 'value': 'letsencrypt.org'}),
+        ('99', 'dead'),
+    ]
+
+
+@pytest.mark.parametrize('data', [
+    b'\x12\x34\x81\x80',                                                       # short header
+    struct.pack('!HHHHHH', 1, 0x8180, 1, 0, 0, 0) + b'\x07examp',              # truncated name
+    struct.pack('!HHHHHH', 1, 0x8180, 1, 0, 0, 0) + b'\xc0\x0c',               # pointer to itself
+    _message(answers=[_rr(1, bytes([192, 0, 2, 1]))])[:-2],                    # truncated rdata
+])
+def test_parse_response_rejects_malformed_messages(data):
+    with pytest.raises(dns_client.DNSError):
+        dns_client.parse_response(data)
+
+
+def test_query_round_trips_through_the_stand_in():
+    records = {
+        ('example.com', 1): [(300, bytes([192, 0, 2, 1])), (300, bytes([192, 0, 2, 2]))],
+        ('example.com', 15): [(600, struct.pack('!H', 10) + encode_name('mail.example.com'))],
+    }
+    dns_client.clear_cache()
+    with StubDNSServer(records) as server:
+        a, mx, missing = dns_client.query_many(
+            [('Example.com.', 'A'), ('example.com', 'MX'), ('nope.example.com', 'A')],
+            server='127.0.0.1', port=server.port)
+        assert [r['value'] for r in a['answers']] == ['192.0.2.1', '192.0.2.2']
+        assert mx['answers'][0]['value'] == {'priority': 10, 'exchange': 'mail.example.com'}
+        assert missing['status'] == 'NXDOMAIN'
+
+        asked = len(server.queries)
+        again = dns_client.query('example.com', 'A', server='127.0.0.1', port=server.port)
+        assert again['cached'] and len(server.queries) == asked
+    dns_client.clear_cache()
+
+
+def test_truncated_udp_answer_is_retried_over_tcp():
+    strings = [(300, bytes([255]) + bytes([65 + i]) * 255) for i in range(8)]
+    fallbacks = dns_client.get_stats()['tcp_fallbacks']
+    with StubDNSServer({('big.example.com', 16): strings}) as server:
+        result = dns_client.query('big.example.com', 'TXT', server='127.0.0.1', port=server.port, use_cache=False)
+    assert result['status'] == 'NOERROR' and len(result['answers']) == 8
+    assert dns_client.get_stats()['tcp_fallbacks'] == fallbacks + 1
@@ -0,0 +1,55 @@
+import pytest
+from src.services.dns_validation import ZoneIndex, owner_key, validate_domain, validate_record
+
+
+@pytest.mark.parametrize('record_type, value', [
+    ('TXT', '"a"\n$INCLUDE /etc/shadow\n"b"'),
+    ('TXT', 'v=spf1 -all\r\n$ORIGIN evil.'),
+    ('TXT', 'line\rbreak'),
+    ('CAA', '0 issue "letsencrypt.org\n$INCLUDE /etc/shadow"'),
+    ('CAA', '0 issue "ca.example"\n$INCLUDE /etc/shadow'),
+    ('CNAME', 'www.example.com\n$INCLUDE /etc/shadow'),
+    ('MX', 'mail.example.com\n'),
+    ('SRV', '5 443 sip.example.com\n$TTL 0'),
+    ('A', '192.0.2.1\n'),
+])
+def test_rejects_line_breaks_in_values(record_type, value):
+    assert validate_record('@' if record_type != 'SRV' else '_sip._tcp', record_type, value, priority=10)
+
+
+@pytest.mark.parametrize('name', ['www\n', 'www\n$INCLUDE /etc/shadow', 'a\rb'])
+def test_rejects_line_breaks_in_names(name):
+    assert validate_record(name, 'A', '192.0.2.1') == 'invalid record name'
+
+
+def test_rejects_line_break_in_domain():
+    assert not validate_domain('example.com\n')
+
+
+@pytest.mark.parametrize('name, record_type, value, priority', [
+    ('@', 'TXT', 'v=spf1 include:_spf.example.com -all', None),
+    ('@', 'TXT', 'tab\tseparated', None),
+    ('@', 'TXT', '"already quoted"', None),
+    ('@', 'CAA', '0 issue "letsencrypt.org"', None),
+    ('_sip._tcp', 'SRV', '5 5060 sip.example.com', 10),
+    ('www', 'CNAME', 'example.net.', None),
+    ('@', 'MX', 'mail', 10),
+    ('*.dev', 'AAAA', '2001:db8::1', None),
+])
+def test_accepts_valid_records(name, record_type, value, priority):
+    assert validate_record(name, record_type, value, priority=priority) is None
+
+
+def test_owner_key_is_relative_to_origin():
+    assert owner_key('www.example.com.', 'example.com') == 'www'
+    assert owner_key('Example.COM', 'example.com') == '@'
+    assert owner_key('www.other.com.', 'example.com') == 'www.other.com.'
+
+
+def test_zone_index_conflicts_across_spellings():
+    index = ZoneIndex(origin='example.com')
+    index.add('www.example.com.', 'A', '192.0.2.1', 1)
+    assert index.check('www', 'CNAME', 'example.net.') is not None
+    assert index.check('@', 'CNAME', 'example.net.') == 'CNAME is not allowed at the zone apex'
+    assert index.check('www', 'A', '192.0.2.1') == 'an identical record already exists'
+    assert index.check('www', 'A', '192.0.2.2') is None
@@ -0,0 +1,166 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+from src.services import dns_client, dns_zone, zone_io
+from stubs.dns_server import StubDNSServer, ZoneSyntaxError, parse_zone
+
+INJECTIONS = [
+    '"a"\n$INCLUDE /etc/shadow\n"b"',
+    '"a\n$INCLUDE /etc/shadow"',
+    'plain\r\n$ORIGIN evil.',
+]
+
+
+def record(name, record_type, value, ttl=3600, priority=None):
+    return SimpleNamespace(name=name, record_type=record_type, value=value, ttl=ttl, priority=priority)
+
+
+@pytest.mark.parametrize('value', INJECTIONS)
+def test_txt_cannot_break_out_of_its_line(value):
+    body = dns_zone.render_records('example.com', [record('@', 'TXT', value)])
+    assert not any(line.startswith('$') for line in body.splitlines())
+    assert len(body.splitlines()) == 1 + len(dns_zone.NAMESERVERS)
+    parse_zone(dns_zone.render_zone('example.com', body, 1), 'example.com')
+
+
+def test_stand_in_rejects_an_injected_directive():
+    with pytest.raises(ZoneSyntaxError):
+        parse_zone('@ IN TXT "a"\n$INCLUDE /etc/shadow\n', 'example.com')
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('v=spf1 -all', '"v=spf1 -all"'),
+    ('"v=spf1 " "-all"', '"v=spf1 -all"'),
+    ('say "hi" \\o/', '"say \\"hi\\" \\\\o/"'),
+    ('"pre-quoted \\" quote"', '"pre-quoted \\" quote"'),
+    ('tab\there', '"tab\\009here"'),
+    ('héllo', '"h\\195\\169llo"'),
+])
+def test_quote_txt_escapes_every_value(value, expected):
+    assert dns_zone._quote_txt(value) == expected
+
+
+def test_quote_txt_splits_into_255_byte_strings():
+    for value in ('x' * 600, '"' + 'y' * 600 + '"', 'é' * 300):
+        data = dns_zone._txt_bytes(value)
+        strings = parse_zone(f'@ IN TXT {dns_zone._quote_txt(value)}\n', 'example.com')[('example.com', 16)][0][1]
+        chunks = []
+        while strings:
+            chunks.append(strings[1:1 + strings[0]])
+            strings = strings[1 + strings[0]:]
+        assert all(len(chunk) <= 255 for chunk in chunks)
+        assert len(chunks) == -(-len(data) // 255)
+        assert b''.join(chunks) == data
+
+
+def test_records_are_sorted_with_apex_ns_first():
+    body = dns_zone.render_records('example.com', [
+        record('www', 'A', '192.0.2.2'),
+        record('@', 'MX', 'mail', priority=10),
+        record('@', 'A', '192.0.2.1', ttl=300),
+    ])
+    lines = body.splitlines()
+    assert [line.split()[-2] for line in lines[:len(dns_zone.NAMESERVERS)]] == ['NS'] * len(dns_zone.NAMESERVERS)
+    assert lines[-1].split()[0] == 'www'
+    assert '300' in next(line for line in lines if line.split()[-2] == 'A' and line.startswith('@'))
+
+
+def test_export_and_import_round_trip():
+    records = [
+        record('@', 'TXT', 'héllo "world" \\ ' + 'z' * 400),
+        record('_sip._tcp', 'SRV', '5 5060 sip', priority=10),
+        record('@', 'CAA', '0 issue "letsencrypt.org"'),
+        record('www', 'CNAME', 'example.net'),
+        record('mail', 'AAAA', '2001:db8::1', ttl=60),
+    ]
+    text = dns_zone.render_zone('example.com', dns_zone.render_records('example.com', records), 2024010101)
+    parsed = {(r['name'], r['type']): r for r in zone_io.parse_bind(text, 'example.com')}
+    assert parsed[('@', 'TXT')]['value'] == records[0].value
+    assert parsed[('_sip._tcp', 'SRV')]['value'] == '5 5060 sip' and parsed[('_sip._tcp', 'SRV')]['priority'] == 10
+    assert parsed[('@', 'CAA')]['value'] == '0 issue "letsencrypt.org"'
+    assert parsed[('www', 'CNAME')]['value'] == 'example.net'
+    assert parsed[('mail', 'AAAA')]['ttl'] == 60
+
+
+@pytest.fixture
+def zone_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(dns_zone, 'ZONE_DIR', str(tmp_path / 'zones'))
+    monkeypatch.setattr(dns_zone, 'ZONE_INCLUDE_PATH', str(tmp_path / 'named.conf.panel-zones'))
+    reloads = []
+    ok = {'success': True, 'stdout': '', 'stderr': ''}
+    monkeypatch.setattr(dns_zone, 'run_command', lambda argv, **_: reloads.append(argv) or ok)
+    monkeypatch.setattr(dns_zone, 'run_many', lambda commands, **_: [reloads.append(argv) or ok for argv in commands])
+    return reloads
+
+
+def _domain_with_records(db, name, records):
+    from src.models.user import DNSRecord, Domain, User
+    user = User.query.first()
+    if user is None:
+        user = User(username='owner', email='owner@example.com', password_hash='x')
+        db.session.add(user)
+        db.session.flush()
+    domain = Domain(name=name, user_id=user.id)
+    db.session.add(domain)
+    db.session.flush()
+    db.session.add_all([DNSRecord(domain_id=domain.id, name=n, record_type=t, value=v, ttl=3600, priority=p)
+                        for n, t, v, p in records])
+    db.session.commit()
+    return domain
+
+
+def test_build_writes_only_dirty_zones_and_bumps_serials(app, zone_dir):
+    from src.models.user import db, DNSZone
+    first = _domain_with_records(db, 'one.test', [('@', 'A', '192.0.2.1', None)])
+    _domain_with_records(db, 'two.test', [('@', 'A', '192.0.2.2', None)])
+
+    result = dns_zone.build()
+    assert sorted(result['written']) == ['one.test', 'two.test']
+    assert ['rndc', 'reconfig'] in zone_dir
+    serial = DNSZone.query.filter_by(domain_id=first.id).one().serial
+
+    assert dns_zone.build() == {'written': [], 'removed': [], 'unchanged': 0, 'reload': None}
+
+    dns_zone.mark_dirty(first.id)
+    db.session.commit()
+    assert dns_zone.build()['unchanged'] == 1
+
+    first.dns_records[0].value = '192.0.2.9'
+    dns_zone.mark_dirty(first.id)
+    db.session.commit()
+    result = dns_zone.build()
+    assert result['written'] == ['one.test']
+    assert DNSZone.query.filter_by(domain_id=first.id).one().serial > serial
+    with open(dns_zone.ZONE_INCLUDE_PATH) as f:
+        assert f.read().count('type master') == 2
+
+
+def test_compiled_zone_is_served_by_an_authoritative_stand_in(app, zone_dir):
+    from src.models.user import db
+    long_text = 'v=DKIM1; k=rsa; p=' + 'A' * 700
+    _domain_with_records(db, 'served.test', [
+        ('@', 'A', '192.0.2.10', None),
+        ('@', 'MX', 'mail', 10),
+        ('mail', 'A', '192.0.2.11', None),
+        ('key._domainkey', 'TXT', long_text, None),
+        ('evil', 'TXT', INJECTIONS[0], None),
+        ('_xmpp._tcp', 'SRV', '5 5222 mail', 10),
+    ])
+    dns_zone.build()
+    with open(dns_zone.zone_path('served.test')) as f:
+        records = parse_zone(f.read(), 'served.test')
+
+    with StubDNSServer(records) as server:
+        answers = dns_client.query_many(
+            [('served.test', 'A'), ('served.test', 'MX'), ('key._domainkey.served.test', 'TXT'),
+             ('evil.served.test', 'TXT'), ('_xmpp._tcp.served.test', 'SRV'), ('nothere.served.test', 'A')],
+            server='127.0.0.1', port=server.port, use_cache=False)
+    a, mx, dkim, evil, srv, missing = answers
+    assert [r['value'] for r in a['answers']] == ['192.0.2.10']
+    assert mx['answers'][0]['value'] == {'priority': 10, 'exchange': 'mail.served.test'}
+    assert dkim['answers'][0]['value'] == long_text
+    assert evil['answers'][0]['value'] == INJECTIONS[0]
+    assert srv['answers'][0]['value']['target'] == 'mail.served.test'
+    assert missing['status'] == 'NXDOMAIN'
+    assert os.path.exists(dns_zone.ZONE_INCLUDE_PATH)
@@ -0,0 +1,103 @@
+import os
+
+import pytest
+from src.services import dns_zone, nginx_vhost, php_fpm, php_ini
+
+VERSION = '8.2'
+
+
+@pytest.fixture
+def hosting(tmp_path, monkeypatch):
+    """nginx, PHP-FPM and named trees under tmp_path with every reload succeeding"""
+    ok = {'success': True, 'stdout': '', 'stderr': '', 'returncode': 0}
+    for name in ('NGINX_SITES_PATH', 'NGINX_ENABLED_PATH', 'NGINX_SSL_DIR', 'NGINX_STATE_DIR'):
+        monkeypatch.setattr(nginx_vhost, name, str(tmp_path / 'nginx' / name.lower()))
+    monkeypatch.setattr(nginx_vhost, 'NGINX_PANEL_CONF', str(tmp_path / 'nginx' / 'panel.conf'))
+    monkeypatch.setattr(nginx_vhost, 'run_command', lambda argv, **_: ok)
+
+    monkeypatch.setattr(php_ini, 'PHP_CONF_ROOT', str(tmp_path / 'php'))
+    monkeypatch.setattr(php_fpm, 'FPM_STATE_DIR', str(tmp_path / 'php-state'))
+    os.makedirs(tmp_path / 'php' / VERSION / 'fpm' / 'pool.d')
+    (tmp_path / 'php' / VERSION / 'fpm' / 'php.ini').write_text('')
+    monkeypatch.setattr(php_fpm, 'host_resources', lambda: {'cpus': 2, 'memory_mb': 4096})
+    monkeypatch.setattr(php_fpm, 'test_fpm', lambda version: {'success': True})
+    monkeypatch.setattr(php_fpm, '_signal_reload', lambda version: {'success': True})
+
+    monkeypatch.setattr(dns_zone, 'ZONE_DIR', str(tmp_path / 'zones'))
+    monkeypatch.setattr(dns_zone, 'ZONE_INCLUDE_PATH', str(tmp_path / 'named.conf.panel-zones'))
+    monkeypatch.setattr(dns_zone, 'run_command', lambda argv, **_: ok)
+    monkeypatch.setattr(dns_zone, 'run_many', lambda commands, **_: [ok for _ in commands])
+
+
+def _vhost(name):
+    try:
+        with open(nginx_vhost.vhost_path(name)) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def test_domain_lifecycle_keeps_vhost_and_pool_in_step(client, make_user, hosting):
+    admin, admin_headers = make_user('root', role='admin')
+    owner, headers = make_user('owner')
+
+    response = client.post('/api/domains', json={'name': 'shop.example.com'}, headers=headers)
+    assert response.status_code == 201
+    domain_id = response.get_json()['domain']['id']
+    assert 'server_name shop.example.com' in _vhost('shop.example.com')
+    assert os.path.islink(nginx_vhost.enabled_path('shop.example.com'))
+
+    response = client.post(f'/api/php/pools/{domain_id}', json={'version': VERSION}, headers=admin_headers)
+    assert response.status_code == 200
+    assert f'fastcgi_pass unix:{php_fpm.find_pool(domain_id)["socket"]};' in _vhost('shop.example.com')
+
+    response = client.post('/api/ssl/certificates', json={'domain': 'shop.example.com'}, headers=headers)
+    assert response.status_code == 201
+    cert_id = response.get_json()['certificate']['id']
+    assert 'listen 443 ssl' in _vhost('shop.example.com')
+    assert all(os.path.exists(path) for path in nginx_vhost._tls_paths('shop.example.com'))
+
+    response = client.put(f'/api/ssl/certificates/{cert_id}', json={'status': 'inactive'}, headers=headers)
+    assert response.status_code == 200
+    assert 'listen 443' not in _vhost('shop.example.com')
+
+    response = client.delete(f'/api/ssl/certificates/{cert_id}', headers=headers)
+    assert response.status_code == 200
+    assert 'listen 443' not in _vhost('shop.example.com')
+
+    response = client.delete(f'/api/domains/{domain_id}', headers=headers)
+    assert response.status_code == 200
+    assert _vhost('shop.example.com') is None
+    assert not os.path.lexists(nginx_vhost.enabled_path('shop.example.com'))
+    assert not any(os.path.exists(path) for path in nginx_vhost._tls_paths('shop.example.com'))
+    assert 'shop.example.com' not in nginx_vhost.load_manifest()['domains']
+    assert php_fpm.find_pool(domain_id) is None
+
+
+def test_deleting_a_domain_keeps_other_sites(client, make_user, hosting):
+    _, headers = make_user('owner')
+    ids = [client.post('/api/domains', json={'name': name}, headers=headers).get_json()['domain']['id']
+           for name in ('one.test', 'two.test')]
+    assert client.delete(f'/api/domains/{ids[0]}', headers=headers).status_code == 200
+    assert _vhost('one.test') is None
+    assert 'server_name two.test' in _vhost('two.test')
+    assert list(nginx_vhost.load_manifest()['domains']) == ['two.test']
+
+
+def test_remove_site_restores_files_when_nginx_rejects(app, hosting, monkeypatch):
+    from src.models.user import db, Domain, User
+    user = User(username='owner', email='owner@example.com', password_hash='x')
+    db.session.add(user)
+    db.session.flush()
+    domain = Domain(name='keep.test', user_id=user.id)
+    db.session.add(domain)
+    db.session.commit()
+    nginx_vhost.sync(domain_ids=[domain.id])
+    content = _vhost('keep.test')
+
+    monkeypatch.setattr(nginx_vhost, 'test_config', lambda: {'success': False, 'stderr': 'emerg'})
+    result = nginx_vhost.remove_site('keep.test')
+    assert result['rolled_back']
+    assert _vhost('keep.test') == content
+    assert os.path.islink(nginx_vhost.enabled_path('keep.test'))
+    assert nginx_vhost.remove_site('never-served.test') is None
@@ -0,0 +1,38 @@
+import os
+import time
+
+import pytest
+from src.services import executor
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    executor.invalidate()
+    yield
+    executor.invalidate()
+
+
+def test_cached_probe_keys_on_env():
+    env = dict(os.environ, PANEL_PROBE='one')
+    first = executor.run_command(['sh', '-c', 'echo $PANEL_PROBE'], cache_ttl=60, env=env)
+    again = executor.run_command(['sh', '-c', 'echo $PANEL_PROBE'], cache_ttl=60, env=dict(env))
+    other = executor.run_command(['sh', '-c', 'echo $PANEL_PROBE'], cache_ttl=60,
+                                 env=dict(env, PANEL_PROBE='two'))
+    assert first['stdout'] == again['stdout'] == 'one\n'
+    assert other['stdout'] == 'two\n'
+    assert executor.get_stats()['cache_entries'] == 2
+
+
+def test_cache_is_bounded_and_drops_expired_first(monkeypatch):
+    monkeypatch.setattr(executor, 'CACHE_SIZE', 3)
+    executor.run_command(['echo', 'short'], cache_ttl=0.01)
+    time.sleep(0.02)
+    for n in range(3):
+        executor.run_command(['echo', str(n)], cache_ttl=60)
+    cached = [key[0] for key in executor._cache]
+    assert ('echo', 'short') not in cached and len(cached) == 3
+
+    # A hit makes an entry recent, so the next insert evicts another one
+    executor.run_command(['echo', '0'], cache_ttl=60)
+    executor.run_command(['echo', '3'], cache_ttl=60)
+    assert [key[0][1] for key in executor._cache] == ['2', '0', '3']
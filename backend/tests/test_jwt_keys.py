@@ -0,0 +1,107 @@
+import base64
+import json
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from flask import Flask, jsonify
+from flask_jwt_extended import create_access_token, get_jwt_identity, jwt_required
+from src.services import jwt_keys
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(jwt_keys, 'KEY_DIR', str(tmp_path / 'keys'))
+    monkeypatch.setattr(jwt_keys, '_keys', {})
+    monkeypatch.setattr(jwt_keys, '_state', {'mtime': None, 'checked_at': 0.0})
+    monkeypatch.setattr(jwt_keys, '_verify_stats', {'hits': 0, 'misses': 0})
+    jwt_keys.clear_verify_cache()
+
+    app = Flask('tests')
+    jwt_keys.PanelJWTManager(app)
+
+    @app.route('/token/<int:user_id>')
+    def token(user_id):
+        return jsonify(token=create_access_token(identity=user_id))
+
+    @app.route('/whoami')
+    @jwt_required()
+    def whoami():
+        return jsonify(user=get_jwt_identity())
+
+    with app.test_client() as client:
+        yield client
+
+
+def _token(client, user_id=1):
+    return client.get(f'/token/{user_id}').get_json()['token']
+
+
+def _whoami(client, token):
+    return client.get('/whoami', headers={'Authorization': f'Bearer {token}'})
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _forge(token, **header):
+    """Same payload and signature under a rewritten header"""
+    _, payload, signature = token.split('.')
+    current = jwt.get_unverified_header(token)
+    return '.'.join((_b64(json.dumps(dict(current, **header)).encode()), payload, signature))
+
+
+def test_token_carries_the_signing_kid_and_verifies(client):
+    token = _token(client, 7)
+    header = jwt.get_unverified_header(token)
+    assert header['kid'] == jwt_keys.signing_key()['kid']
+    assert header['alg'] == 'EdDSA'
+    assert _whoami(client, token).get_json() == {'user': '7'}
+
+
+def test_repeated_verification_hits_the_signature_cache(client):
+    token = _token(client)
+    for _ in range(3):
+        assert _whoami(client, token).status_code == 200
+    assert jwt_keys.get_stats()['verify_cache'] == {'hits': 2, 'misses': 1, 'cached': 1}
+
+
+def test_tampered_payload_is_rejected_after_caching(client):
+    token = _token(client, 1)
+    assert _whoami(client, token).status_code == 200
+    header, _, signature = token.split('.')
+    payload = dict(jwt.decode(token, options={'verify_signature': False}), sub='2')
+    forged = '.'.join((header, _b64(json.dumps(payload).encode()), signature))
+    assert _whoami(client, forged).status_code == 422
+
+
+@pytest.mark.parametrize('header', [
+    {'alg': 'RS256', 'kid': 'unknown'},
+    {'alg': 'EdDSA', 'kid': 'unknown'},
+    {'alg': 'RS256'},
+])
+def test_unknown_or_mismatched_key_is_a_client_error(client, header):
+    response = _whoami(client, _forge(_token(client), **header))
+    assert response.status_code == 422
+    assert 'msg' in response.get_json()
+
+
+def test_rotation_keeps_old_tokens_valid(client, monkeypatch):
+    old = _token(client)
+    monkeypatch.setattr(jwt_keys, 'ALGORITHM', 'RS256')
+    monkeypatch.setattr(jwt_keys, 'RSA_KEY_BITS', 1024)
+    added = jwt_keys.rotate(force=True)['added']
+
+    new = _token(client)
+    assert jwt.get_unverified_header(new) == {'alg': 'RS256', 'kid': added[0], 'typ': 'JWT'}
+    assert _whoami(client, old).status_code == 200
+    assert _whoami(client, new).status_code == 200
+    # An RS256 token re-labelled as EdDSA must not reach the wrong verifier
+    assert _whoami(client, _forge(new, alg='EdDSA')).status_code == 422
+
+    jwks = {key['kid']: key for key in jwt_keys.jwks()['keys']}
+    assert jwks[added[0]]['kty'] == 'RSA'
+    public = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(jwks[added[0]]))
+    assert isinstance(public, rsa.RSAPublicKey)
+    assert jwt.decode(new, public, algorithms=['RS256'])['sub'] == '1'
@@ -0,0 +1,65 @@
+import grp
+import os
+import stat
+
+import pytest
+from src.services import dns_zone, mail_maps
+
+
+@pytest.fixture
+def maps(tmp_path, monkeypatch):
+    monkeypatch.setattr(mail_maps, 'POSTFIX_MAP_DIR', str(tmp_path / 'postfix'))
+    monkeypatch.setattr(mail_maps, 'DOVECOT_USERS_PATH', str(tmp_path / 'dovecot' / 'panel-users'))
+    monkeypatch.setattr(mail_maps, 'DOVECOT_GROUP', grp.getgrgid(os.getgid()).gr_name)
+
+    def postmap(argv, **_):
+        open(argv[1].split(':', 1)[1] + '.db', 'w').close()
+        return {'success': True, 'stdout': '', 'stderr': ''}
+
+    monkeypatch.setattr(mail_maps, 'run_command', postmap)
+    return tmp_path
+
+
+def _domain(db):
+    from src.models.user import Domain, DNSZone, User
+    user = User(username='owner', email='owner@example.com', password_hash='x')
+    db.session.add(user)
+    db.session.flush()
+    domain = Domain(name='mail.test', user_id=user.id)
+    db.session.add(domain)
+    db.session.flush()
+    db.session.add(DNSZone(domain_id=domain.id, dirty=False, version=1))
+    db.session.commit()
+    return domain
+
+
+def test_status_handlers_leave_the_commit_to_the_emitter(app):
+    from src.models.user import db, DNSZone, MailMapState
+    domain = _domain(db)
+    mail_maps._domain_status_changed(domain_ids=[domain.id], new_status='suspended')
+    dns_zone._domain_status_changed(domain_ids=[domain.id], new_status='suspended')
+    db.session.rollback()
+    assert db.session.get(MailMapState, mail_maps.STATE_ID) is None
+    assert DNSZone.query.filter_by(domain_id=domain.id).one().dirty is False
+
+    mail_maps._domain_status_changed(domain_ids=[domain.id], new_status='suspended')
+    dns_zone._domain_status_changed(domain_ids=[domain.id], new_status='suspended')
+    db.session.commit()
+    assert db.session.get(MailMapState, mail_maps.STATE_ID).version == 1
+    assert DNSZone.query.filter_by(domain_id=domain.id).one().dirty is True
+
+
+def test_dovecot_users_file_belongs_to_the_dovecot_group(app, maps):
+    result = mail_maps.build(force=True)
+    assert mail_maps.DOVECOT_USERS_PATH in result['written']
+    st = os.stat(mail_maps.DOVECOT_USERS_PATH)
+    assert stat.S_IMODE(st.st_mode) == 0o640
+    assert st.st_gid == os.getgid()
+
+
+def test_missing_dovecot_group_fails_before_writing(app, maps, monkeypatch):
+    monkeypatch.setattr(mail_maps, 'DOVECOT_GROUP', 'no-such-group-here')
+    with pytest.raises(RuntimeError):
+        mail_maps.build(force=True)
+    assert not os.path.exists(mail_maps.DOVECOT_USERS_PATH)
+    assert not os.path.exists(os.path.join(mail_maps.POSTFIX_MAP_DIR, mail_maps.VIRTUAL_DOMAINS))
@@ -0,0 +1,105 @@
+import smtplib
+
+import pytest
+from src.services import mail_queue
+from stubs.smtp_server import StubSMTPServer
+
+REPLIES = {'bad': '550 5.1.1 User unknown', 'slow': '451 4.7.1 Try again later'}
+
+
+@pytest.fixture
+def sink(monkeypatch):
+    with StubSMTPServer(rcpt_replies=REPLIES) as server:
+        monkeypatch.setattr(mail_queue, 'RELAY_HOST', '127.0.0.1')
+        monkeypatch.setattr(mail_queue, 'RELAY_PORT', server.port)
+        pool = mail_queue.SMTPPool(2)
+        monkeypatch.setattr(mail_queue, '_pool', pool)
+        yield server
+        pool.close_idle(max_idle=0)
+
+
+def _message():
+    return mail_queue.build_message('noreply@shop.test', ['a@example.com'], 'Order 42', 'Thanks.\n.\nBye')
+
+
+def _envelope_chunks(server):
+    # smtplib sends its own commands in lower case
+    return [chunk for chunk in server.chunks if any(line.upper().startswith('MAIL FROM') for line in chunk)]
+
+
+@pytest.mark.parametrize('pipelining', [True, False])
+def test_transaction_maps_each_recipient_to_its_reply(pipelining):
+    recipients = ['ok@example.com', 'bad@example.com', 'slow@example.com', 'ok2@example.com']
+    content = _message().as_bytes(policy=mail_queue.policy.SMTP).decode()
+    with StubSMTPServer(pipelining=pipelining, rcpt_replies=REPLIES) as server:
+        smtp = smtplib.SMTP('127.0.0.1', server.port)
+        smtp.ehlo()
+        results = mail_queue._transaction(smtp, 'noreply@shop.test', recipients, content)
+        smtp.quit()
+
+    assert results['bad@example.com'][0] == 550 and results['slow@example.com'][0] == 451
+    assert results['ok@example.com'][0] == results['ok2@example.com'][0] == 250
+    (sender, accepted, data), = server.messages
+    assert (sender, accepted) == ('noreply@shop.test', ['ok@example.com', 'ok2@example.com'])
+    assert b'Subject: Order 42' in data and b'\r\n.\r\nBye' in data
+    envelope = _envelope_chunks(server)
+    if pipelining:
+        # MAIL and every RCPT went out in one write
+        assert len(envelope) == 1 and len(envelope[0]) == 1 + len(recipients)
+    else:
+        assert len(envelope) == 1 and len(envelope[0]) == 1
+
+
+def test_rejected_sender_applies_to_every_recipient():
+    with StubSMTPServer(mail_reply='553 5.7.1 Sender rejected') as server:
+        smtp = smtplib.SMTP('127.0.0.1', server.port)
+        smtp.ehlo()
+        results = mail_queue._transaction(smtp, 'spoof@else.test', ['a@example.com', 'b@example.com'], 'x')
+        smtp.quit()
+    assert {code for code, _ in results.values()} == {553}
+    assert not server.messages and ['rset'] in server.chunks
+
+
+def test_deliver_batches_records_outcomes_and_reuses_connections(app, sink, monkeypatch):
+    from src.models.user import db, OutboundRecipient, User
+    monkeypatch.setattr(mail_queue, 'MAX_RECIPIENTS_PER_TRANSACTION', 3)
+    user = User(username='owner', email='owner@example.com', password_hash='x')
+    db.session.add(user)
+    db.session.flush()
+    recipients = ([f'user{n}@example.com' for n in range(5)] + ['bad@example.com', 'slow@example.com']
+                  + ['someone@other.test'])
+    mail_queue.enqueue(user.id, 'noreply@shop.test', recipients, _message())
+    db.session.commit()
+
+    result = mail_queue.deliver()
+    # example.com's 7 recipients in batches of 3, plus one for other.test
+    assert (result['claimed'], result['transactions']) == (8, 4)
+    assert (result['sent'], result['deferred'], result['failed']) == (6, 1, 1)
+    statuses = {row.address: row.status for row in OutboundRecipient.query}
+    assert statuses['bad@example.com'] == 'failed' and statuses['slow@example.com'] == 'deferred'
+    assert sum(len(accepted) for _, accepted, _ in sink.messages) == 6
+    assert sink.sessions <= 2
+    assert all(len(chunk) >= 2 for chunk in _envelope_chunks(sink))
+
+    stats = mail_queue.get_stats()
+    assert stats['queue']['sent'] == 6 and stats['queue']['deferred'] == 1
+    assert stats['sent_per_minute'] > 0
+    # The deferred recipient isn't due yet, so a second pass claims nothing
+    assert mail_queue.deliver()['claimed'] == 0
+
+
+def test_unreachable_relay_defers_everyone(app, monkeypatch):
+    from src.models.user import db, OutboundRecipient, User
+    with StubSMTPServer() as closed:
+        port = closed.port
+    monkeypatch.setattr(mail_queue, 'RELAY_HOST', '127.0.0.1')
+    monkeypatch.setattr(mail_queue, 'RELAY_PORT', port)
+    monkeypatch.setattr(mail_queue, '_pool', mail_queue.SMTPPool(1))
+    user = User(username='owner', email='owner@example.com', password_hash='x')
+    db.session.add(user)
+    db.session.flush()
+    mail_queue.enqueue(user.id, 'noreply@shop.test', ['a@example.com', 'b@example.com'], _message())
+    db.session.commit()
+
+    assert mail_queue.deliver()['deferred'] == 2
+    assert {row.last_error[:3] for row in OutboundRecipient.query} == {'421'}
@@ -0,0 +1,77 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+from src.services import nginx_status
+from stubs.nginx_status_server import PAGE, StubStatusServer
+
+NOW = 1_700_000_000.0
+
+
+@pytest.fixture
+def stub(app, tmp_path, monkeypatch):
+    """The collector pointed at a stand-in page, with this process as the nginx master"""
+    clock = SimpleNamespace(now=NOW)
+    monkeypatch.setattr(nginx_status, 'time', SimpleNamespace(time=lambda: clock.now))
+    pid_file = tmp_path / 'nginx.pid'
+    pid_file.write_text(f'{os.getpid()}\n')
+    monkeypatch.setattr(nginx_status, 'NGINX_PID_FILE', str(pid_file))
+    monkeypatch.setattr(nginx_status, '_state', {'pid': None, 'workers': None})
+    with StubStatusServer() as server:
+        monkeypatch.setattr(nginx_status, 'NGINX_STUB_STATUS_URL', server.url)
+        server.clock = clock
+        server.pid_file = pid_file
+        yield server
+
+
+def test_parse_stub_status():
+    page = PAGE.format(active=291, accepts=16630948, handled=16630948, requests=31070465,
+                       reading=6, writing=179, waiting=106)
+    assert nginx_status.parse_stub_status(page) == {
+        'active': 291, 'accepts': 16630948, 'handled': 16630948, 'requests': 31070465,
+        'reading': 6, 'writing': 179, 'waiting': 106
+    }
+    with pytest.raises(ValueError):
+        nginx_status.parse_stub_status('<html>404 Not Found</html>')
+
+
+def test_collect_scrapes_the_page_and_derives_rps(stub):
+    stub.serve(requests=1000)
+    first = nginx_status.collect()
+    assert first['requests'] == 1000 and first['rps'] is None
+
+    stub.clock.now += 10
+    stub.serve(requests=1250, active=7)
+    second = nginx_status.collect()
+    assert second['rps'] == 25.0 and second['active'] == 7
+
+    status = nginx_status.get_status()
+    assert status['status'] == 'running' and status['pid'] == os.getpid()
+    assert status['latest']['requests'] == 1250 and status['scrape_error'] is None
+    assert [sample['requests'] for sample in nginx_status.get_series(window=60)] == [1000, 1250]
+
+
+def test_scrape_errors_are_recorded_without_breaking_rps(stub):
+    stub.serve(requests=100)
+    nginx_status.collect()
+    stub.body = 'stub_status is not enabled here'
+    stub.clock.now += 10
+    assert nginx_status.collect() is None
+    assert nginx_status.get_status()['scrape_error'] == 'Unrecognised stub_status output'
+
+    # The next good sample measures from the last good one
+    stub.body = None
+    stub.clock.now += 10
+    stub.serve(requests=500)
+    assert nginx_status.collect()['rps'] == 20.0
+    assert nginx_status.get_status()['scrape_error'] is None
+
+
+def test_master_restart_is_recorded(stub):
+    nginx_status.collect()
+    stub.pid_file.write_text(f'{os.getppid()}\n')
+    stub.clock.now += 10
+    nginx_status.collect()
+    reloads = nginx_status.get_reloads()
+    assert [(r['source'], r['detail']['event']) for r in reloads] == [('detected', 'restart')]
+    assert reloads[0]['detail']['pid'] == os.getppid()
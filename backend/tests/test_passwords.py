@@ -0,0 +1,18 @@
+import os
+
+from src.services import passwords
+
+
+def test_hash_and_verify_round_trip():
+    password_hash = passwords.hash_password('correct horse')
+    assert passwords.verify_password(password_hash, 'correct horse') == (True, None)
+    assert passwords.verify_password(password_hash, 'wrong horse') == (False, None)
+    hashes = passwords.hash_many(['a', 'b', 'c', 'd', 'e'])
+    assert [passwords.verify_password(h, p)[0] for h, p in zip(hashes, 'abcde')] == [True] * 5
+
+
+def test_children_are_not_forked_from_the_app():
+    passwords.start_pool()
+    pool = passwords._get_pool()
+    assert pool._mp_context.get_start_method() == 'forkserver'
+    assert pool.submit(os.getppid).result(timeout=30) != os.getpid()
@@ -0,0 +1,99 @@
+import os
+import threading
+
+import pytest
+from src.services import php_fpm, php_ini
+
+VERSION = '8.2'
+
+
+@pytest.fixture
+def fpm(tmp_path, monkeypatch):
+    """A PHP_CONF_ROOT with one FPM version whose test and reload always pass"""
+    monkeypatch.setattr(php_ini, 'PHP_CONF_ROOT', str(tmp_path / 'php'))
+    monkeypatch.setattr(php_fpm, 'FPM_STATE_DIR', str(tmp_path / 'state'))
+    os.makedirs(tmp_path / 'php' / VERSION / 'fpm' / 'pool.d')
+    monkeypatch.setattr(php_fpm, 'host_resources', lambda: {'cpus': 4, 'memory_mb': 8192})
+    reloads = []
+    monkeypatch.setattr(php_fpm, 'test_fpm', lambda version: {'success': True})
+    monkeypatch.setattr(php_fpm, '_signal_reload', lambda version: reloads.append(version) or {'success': True})
+    return reloads
+
+
+def _domains(db, *names):
+    from src.models.user import Domain, User
+    user = User(username='owner', email='owner@example.com', password_hash='x')
+    db.session.add(user)
+    db.session.flush()
+    domains = [Domain(name=name, user_id=user.id) for name in names]
+    db.session.add_all(domains)
+    db.session.commit()
+    return domains
+
+
+def test_pool_names_do_not_collide():
+    names = ['my-site.com', 'my.site.com', 'my_site.com', 'MY-SITE.COM']
+    pools = {php_fpm.pool_name(name) for name in names}
+    assert len(pools) == 3
+    assert php_fpm.pool_name('MY-SITE.COM') == php_fpm.pool_name('my-site.com')
+    assert all(php_fpm.re.fullmatch(r'[a-z0-9_]+', name) for name in pools)
+
+
+def test_lookalike_domains_get_separate_pools(app, fpm):
+    from src.models.user import db
+    dashed, dotted = _domains(db, 'my-site.com', 'my.site.com')
+    php_fpm.apply_pool(dashed, VERSION)
+    php_fpm.apply_pool(dotted, VERSION)
+
+    pools = php_fpm.list_pools()
+    assert sorted(pool['domain_id'] for pool in pools) == [dashed.id, dotted.id]
+    assert len({pool['socket'] for pool in pools}) == 2
+    assert php_fpm.find_pool(dashed.id)['socket'] != php_fpm.find_pool(dotted.id)['socket']
+
+    assert php_fpm.remove_pool(dashed.id)['rolled_back'] is False
+    assert [pool['domain_id'] for pool in php_fpm.list_pools()] == [dotted.id]
+    assert php_fpm.remove_pool(dashed.id) is None
+
+
+def test_pool_from_before_the_hash_suffix_is_replaced(app, fpm):
+    from src.models.user import db
+    domain, = _domains(db, 'old.example.com')
+    sizing = php_fpm.compute_sizing(1, {'cpus': 4, 'memory_mb': 8192})
+    legacy = os.path.join(php_fpm._pool_dir(VERSION), 'old_example_com.conf')
+    with open(legacy, 'w') as f:
+        f.write(php_fpm.render_pool(domain, VERSION, sizing).replace(
+            php_fpm.pool_name(domain.name), 'old_example_com'))
+
+    assert php_fpm.find_pool(domain.id)['path'] == legacy
+    result = php_fpm.apply_pool(domain, VERSION)
+    assert result['changed'] and not os.path.exists(legacy)
+    assert [pool['name'] for pool in php_fpm.list_pools()] == [php_fpm.pool_name(domain.name)]
+
+
+def test_concurrent_applies_keep_every_pool(app, fpm, monkeypatch):
+    from src.models.user import db
+    domains = _domains(db, *(f'site{i}.test' for i in range(6)))
+    apply = php_fpm.apply_pool
+    barrier = threading.Barrier(len(domains))
+    errors = []
+
+    def worker(domain):
+        with app.app_context():
+            barrier.wait()
+            try:
+                apply(db.session.merge(domain, load=False), VERSION)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(domain,)) for domain in domains]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    pools = php_fpm.list_pools()
+    assert sorted(pool['domain_id'] for pool in pools) == sorted(domain.id for domain in domains)
+    # Every pool ends up sized for the final count, not the count one writer saw
+    expected = php_fpm.compute_sizing(len(domains), {'cpus': 4, 'memory_mb': 8192})
+    assert {pool['config']['pm.max_children'] for pool in pools} == {str(expected['pm.max_children'])}
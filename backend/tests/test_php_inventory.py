@@ -0,0 +1,66 @@
+import os
+import threading
+
+import pytest
+from src.services import php_inventory
+
+SCRIPT = '''#!/bin/sh
+{wait}
+if [ -f "{fail}" ]; then exit 1; fi
+case "$1" in
+--version) echo "PHP {version} (cli)";;
+-m) printf '[PHP Modules]\\ncore\\njson\\n';;
+esac
+'''
+
+
+@pytest.fixture
+def bin_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(php_inventory, 'PHP_BIN_DIRS', [str(tmp_path)])
+    monkeypatch.setattr(php_inventory, '_entries', {})
+    monkeypatch.setattr(php_inventory, '_binaries', [])
+    monkeypatch.setattr(php_inventory, '_last_scan', 0.0)
+    monkeypatch.setattr(php_inventory, '_scanned', False)
+    return tmp_path
+
+
+def _install(directory, name, version, wait=''):
+    path = directory / name
+    path.write_text(SCRIPT.format(version=version, fail=directory / f'{name}.fail', wait=wait))
+    path.chmod(0o755)
+    return path
+
+
+def test_failed_probe_is_retried_on_the_next_scan(bin_dir):
+    _install(bin_dir, 'php8.2', '8.2.7')
+    (bin_dir / 'php8.2.fail').touch()
+    assert php_inventory.get_versions() == ([], None)
+    assert php_inventory.get_binary('8.2') is None
+
+    os.unlink(bin_dir / 'php8.2.fail')
+    php_inventory.invalidate()
+    versions, _ = php_inventory.get_versions()
+    assert [(v['full_version'], v['module_count']) for v in versions] == [('8.2.7', 2)]
+
+
+def test_lookups_answer_from_the_last_scan_while_probing(bin_dir):
+    path = _install(bin_dir, 'php8.1', '8.1.2')
+    assert php_inventory.get_binary('8.1') == str(path)
+
+    gate = bin_dir / 'gate'
+    _install(bin_dir, 'php8.1', '8.1.3', wait=f'while [ ! -f "{gate}" ]; do sleep 0.01; done')
+    os.utime(path, ns=(0, 0))
+    php_inventory.invalidate()
+    scanner = threading.Thread(target=php_inventory.get_versions)
+    scanner.start()
+    try:
+        while not php_inventory._scan_lock.locked():
+            pass
+        # The probe is stuck on the gate, yet lookups don't wait for it
+        assert php_inventory.get_binary('8.1') == str(path)
+        assert php_inventory.get_modules('8.1') == ['core', 'json']
+        assert scanner.is_alive()
+    finally:
+        gate.touch()
+        scanner.join()
+    assert php_inventory.get_versions()[0][0]['full_version'] == '8.1.3'
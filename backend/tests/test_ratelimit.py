@@ -0,0 +1,102 @@
+import pytest
+from src.services import ratelimit
+from stubs.redis_server import StubRedisServer
+
+NOW = 1_700_000_000.0
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def store(request, tmp_path, monkeypatch):
+    if request.param == 'memory':
+        instance = ratelimit.MemoryStore()
+    elif request.param == 'sqlite':
+        instance = ratelimit.SQLiteStore(str(tmp_path / 'ratelimit.db'))
+    else:
+        if ratelimit.redis is None:
+            pytest.skip('redis package is not installed')
+        server = StubRedisServer().__enter__()
+        request.addfinalizer(server.__exit__)
+        instance = ratelimit.create_store(server.url)
+    monkeypatch.setattr(ratelimit, '_store', instance)
+    monkeypatch.setattr(ratelimit, 'LOGIN_IP', ratelimit.Limit('login-ip', 1000, 60))
+    monkeypatch.setattr(ratelimit, 'LOGIN_USER', ratelimit.Limit('login-user', 3, 900))
+    monkeypatch.setattr(ratelimit, 'LOGIN_ACCOUNT', ratelimit.Limit('login-account', 6, 3600))
+    return instance
+
+
+def test_sliding_window_decays(store):
+    limit = ratelimit.Limit('test', 4, 60)
+    for _ in range(4):
+        assert ratelimit.retry_after(limit, 'k', NOW) == 0
+        ratelimit.hit(limit, 'k', NOW)
+    assert 0 < ratelimit.retry_after(limit, 'k', NOW) <= 60
+    # Half the previous window still counts, so two of four slots are free again
+    assert ratelimit.retry_after(limit, 'k', NOW + 90 - NOW % 60) == 0
+    assert ratelimit.retry_after(limit, 'k', NOW + 180) == 0
+
+
+def test_store_round_trip(store):
+    store.incr('a', 60)
+    store.incr('a', 60)
+    store.incr('b', 60)
+    assert store.get_many(['a', 'b', 'missing']) == [2, 1, 0]
+    store.delete(['a', 'missing'])
+    assert store.get_many(['a', 'b']) == [0, 1]
+
+
+def test_lockout_is_per_user_and_address(store):
+    for _ in range(3):
+        assert ratelimit.check_login('198.51.100.1', 'Admin') == 0
+        ratelimit.login_failed('198.51.100.1', 'Admin')
+    assert ratelimit.check_login('198.51.100.1', 'admin ') > 0
+    # The real admin elsewhere is not locked out by a stranger's guesses
+    assert ratelimit.check_login('203.0.113.9', 'admin') == 0
+    assert ratelimit.check_login('198.51.100.1', 'someone-else') == 0
+
+
+def test_guesses_spread_over_addresses_hit_the_account_limit(store):
+    for n in range(6):
+        ip = f'198.51.100.{n}'
+        assert ratelimit.check_login(ip, 'admin') == 0
+        ratelimit.login_failed(ip, 'admin')
+    assert ratelimit.check_login('203.0.113.9', 'admin') > 0
+    assert ratelimit.get_stats()['rejected_by'].get('account', 0) >= 1
+    assert ratelimit.check_login('203.0.113.9', 'other') == 0
+
+    ratelimit.login_succeeded('198.51.100.0', 'admin')
+    assert ratelimit.check_login('203.0.113.9', 'admin') == 0
+
+
+def test_store_failure_fails_open(monkeypatch):
+    class Broken:
+        def __getattr__(self, name):
+            raise ConnectionError('store down')
+
+    monkeypatch.setattr(ratelimit, '_store', Broken())
+    errors = ratelimit.get_stats()['store_errors']
+    assert ratelimit.check_login('198.51.100.1', 'admin') == 0
+    ratelimit.login_failed('198.51.100.1', 'admin')
+    assert ratelimit.get_stats()['store_errors'] == errors + 2
+
+
+def test_redis_stand_in_expires_keys():
+    with StubRedisServer() as server:
+        server.data[b'k'] = (b'1', 0.0)
+        assert server.execute('GET', [b'k']) is None
+        assert server.execute('INCR', [b'n']) == 1
+        assert server.execute('EXPIRE', [b'n', b'30']) == 1
+        assert 29 <= server.execute('TTL', [b'n']) <= 30
+
+
+def test_login_route_answers_429_with_retry_after(client, make_user, store):
+    user, _ = make_user('owner')
+    user.set_password('right password')
+    from src.models.user import db
+    db.session.commit()
+
+    for _ in range(3):
+        response = client.post('/api/auth/login', json={'username': 'owner', 'password': 'wrong'})
+        assert response.status_code == 401
+    response = client.post('/api/auth/login', json={'username': 'owner', 'password': 'right password'})
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
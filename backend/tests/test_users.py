@@ -0,0 +1,72 @@
+import json
+import time
+
+import pytest
+from src.services import passwords, users as user_service
+
+
+def _wait(client, headers, import_id):
+    for _ in range(200):
+        status = client.get(f'/api/users/import/{import_id}', headers=headers).get_json()
+        if status['status'] in ('completed', 'failed'):
+            return status
+        time.sleep(0.05)
+    raise AssertionError('import did not finish')
+
+
+def _stored_result(import_id):
+    from src.models.user import db, UserImport
+    db.session.expire_all()
+    return db.session.get(UserImport, import_id).result
+
+
+@pytest.fixture
+def admin(make_user):
+    return make_user('root', role='admin')[1]
+
+
+def test_generated_passwords_are_never_stored_in_clear(client, admin):
+    rows = [{'username': f'u{i}', 'email': f'u{i}@example.com', 'domains': [f'site{i}.test']} for i in range(3)]
+    rows.append({'username': 'chosen', 'email': 'chosen@example.com', 'password': 'my own password'})
+    response = client.post('/api/users/import', json={'users': rows}, headers=admin)
+    assert response.status_code == 202
+    import_id = response.get_json()['id']
+
+    # Look at what reached the database before anyone polls
+    while _stored_result(import_id) is None:
+        time.sleep(0.05)
+    at_rest = json.dumps(_stored_result(import_id))
+    assert 'sealed_passwords' in at_rest and '"password"' not in at_rest
+
+    status = _wait(client, admin, import_id)
+    handed_out = {user['username']: user.get('password') for user in status['result']['users']}
+    assert handed_out['chosen'] is None and all(handed_out[f'u{i}'] for i in range(3))
+    assert 'sealed_passwords' not in status['result']
+    from src.models.user import User
+    for i in range(3):
+        user = User.query.filter_by(username=f'u{i}').one()
+        assert passwords.verify_password(user.password_hash, handed_out[f'u{i}'])[0]
+        assert handed_out[f'u{i}'] not in json.dumps(_stored_result(import_id))
+
+    again = client.get(f'/api/users/import/{import_id}', headers=admin).get_json()
+    assert all('password' not in user for user in again['result']['users'])
+    assert 'sealed_passwords' not in _stored_result(import_id)
+
+
+def test_expired_passwords_are_dropped_unread(client, admin, monkeypatch):
+    monkeypatch.setattr(user_service, 'GENERATED_PASSWORD_TTL', -1)
+    response = client.post('/api/users/import', json={'users': [{'username': 'late', 'email': 'late@example.com'}]},
+                           headers=admin)
+    status = _wait(client, admin, response.get_json()['id'])
+    assert status['result']['passwords_expired'] is True
+    assert 'password' not in status['result']['users'][0]
+
+
+def test_create_user_validates_role_and_duplicates(client, admin):
+    body = {'username': 'alice', 'email': 'alice@example.com', 'password': 'secret'}
+    assert client.post('/api/users', json=dict(body, role='superuser'), headers=admin).status_code == 400
+    assert client.post('/api/users', json=body, headers=admin).status_code == 201
+    response = client.post('/api/users', json=dict(body, email='other@example.com'), headers=admin)
+    assert response.status_code == 409
+    response = client.post('/api/users', json=dict(body, username='bob'), headers=admin)
+    assert response.status_code == 409
@@ -0,0 +1,104 @@
+from datetime import datetime
+
+import pytest
+from src.services import whois
+from stubs.whois_server import StubWhoisServer
+
+VERISIGN = '''   Domain Name: EXAMPLE.COM
+   Registry Domain ID: 2336799_DOMAIN_COM-VRSN
+   Registrar: RESERVED-Internet Assigned Numbers Authority
+   Updated Date: 2024-08-14T07:01:34Z
+   Creation Date: 1995-08-14T04:00:00Z
+   Registry Expiry Date: 2025-08-13T04:00:00Z
+>>> Last update of whois database: 2024-10-01T12:00:00Z <<<
+'''
+NOMINET = '''    Domain name:
+        example.co.uk
+
+    Registrar:
+        Example Registrar Ltd [Tag = EXAMPLE]
+
+    Relevant dates:
+        Registered on: 26-Jun-2001
+        Expiry date:  26-Jun-2026
+'''
+RU = '''domain:        EXAMPLE.RU
+registrar:     RU-CENTER-RU
+created:       2003-04-22T20:00:00Z
+paid-till:     2026-04-23T21:00:00Z
+'''
+DENIC = '''Domain: example.de
+Nserver: a.iana-servers.net
+Status: connect
+Changed: 2018-03-12T21:44:25+01:00
+'''
+
+
+@pytest.mark.parametrize('text, expected', [
+    (VERISIGN, {'status': 'registered', 'registrar': 'RESERVED-Internet Assigned Numbers Authority',
+                'expires_at': datetime(2025, 8, 13, 4), 'registered_at': datetime(1995, 8, 14, 4)}),
+    # Nominet puts values on the line after their label
+    (NOMINET, {'status': 'registered', 'registrar': 'Example Registrar Ltd [Tag = EXAMPLE]',
+               'expires_at': datetime(2026, 6, 26), 'registered_at': datetime(2001, 6, 26)}),
+    (RU, {'status': 'registered', 'registrar': 'RU-CENTER-RU',
+          'expires_at': datetime(2026, 4, 23, 21), 'registered_at': datetime(2003, 4, 22, 20)}),
+    (DENIC, {'status': 'registered', 'registrar': None, 'expires_at': None, 'registered_at': None}),
+    ('No match for "FREE-NAME.COM".\r\n', {'status': 'available'}),
+    ('%ERROR:101: no entries found\n', {'status': 'available'}),
+    ('Query limit exceeded, try again later\n', {'status': 'error', 'error': 'Rate limited by whois server'}),
+])
+def test_parse_response(text, expected):
+    assert whois.parse_response(text) == expected
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('2025-08-13T04:00:00Z', datetime(2025, 8, 13, 4)),
+    ('2025-08-13T06:00:00+02:00', datetime(2025, 8, 13, 4)),
+    ('2025-08-13 (YYYY-MM-DD)', datetime(2025, 8, 13)),
+    ('13.08.2025', datetime(2025, 8, 13)),
+    ('someday', None),
+])
+def test_parse_date(value, expected):
+    assert whois.parse_date(value) == expected
+
+
+@pytest.fixture
+def registry(app, monkeypatch):
+    """IANA and every registry answered by one stand-in, with the rate limit out of the way"""
+    with StubWhoisServer({'com': 'refer: 127.0.0.1\n', 'de': 'whois: 127.0.0.1\n',
+                          'example.com': VERISIGN, 'example.de': DENIC}) as server:
+        monkeypatch.setattr(whois, 'IANA_SERVER', '127.0.0.1')
+        monkeypatch.setattr(whois, 'WHOIS_PORT', server.port)
+        monkeypatch.setattr(whois, 'RATE_BURST', 100)
+        monkeypatch.setattr(whois, '_buckets', {})
+        monkeypatch.setattr(whois, '_servers', {})
+        yield server
+
+
+def test_lookup_many_follows_referrals_and_caches(registry):
+    taken, free, denic = whois.lookup_many(['Example.com.', 'free-name.com', 'example.de'])
+    assert (taken['status'], taken['available'], taken['expires_at']) == ('registered', False, '2025-08-13T04:00:00')
+    assert (free['status'], free['available']) == ('available', True)
+    assert denic['status'] == 'registered' and denic['expires_at'] is None
+    assert sorted(registry.queries) == ['com', 'de', 'example.com', 'example.de', 'free-name.com']
+
+    # Answers and TLD referrals both come from the cache now, even in a fresh process
+    whois._servers.clear()
+    again = whois.lookup_many(['example.com', 'free-name.com', 'other.com'])
+    assert [result['cached'] for result in again] == [True, True, False]
+    assert registry.queries[5:] == ['other.com']
+
+
+def test_refresh_copies_expiry_onto_domains(registry):
+    from src.models.user import db, Domain, User
+    user = User(username='owner', email='owner@example.com', password_hash='x')
+    db.session.add(user)
+    db.session.flush()
+    db.session.add_all([Domain(name='example.com', user_id=user.id), Domain(name='example.de', user_id=user.id)])
+    db.session.commit()
+
+    assert whois.refresh_domain_expiry() == 1
+    domains = {domain.name: domain for domain in Domain.query}
+    assert domains['example.com'].expires_at == datetime(2025, 8, 13, 4)
+    assert domains['example.de'].expires_at is None
+    assert all(domain.expiry_checked_at is not None for domain in domains.values())
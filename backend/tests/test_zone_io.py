@@ -0,0 +1,126 @@
+import pytest
+from src.services import dns_zone, zone_io
+
+ZONE = '''$ORIGIN example.com.
+$TTL 600
+@   IN SOA ns1.example.com. hostmaster.example.com. (
+        2024010101 ; serial
+        7200 900 1209600 300 )
+@       IN  A     192.0.2.1
+        IN  MX    10 mail
+www 300 IN  CNAME @
+cdn     IN  CNAME cdn.static.example.com.
+api     IN  CNAME api.example.net.
+@       IN  MX    20 mx1.mail.example.com.
+_sip._tcp IN SRV  10 5 5060 sip.example.com.
+@       IN  TXT   "v=spf1 " "include:_spf.example.net -all"
+@       IN  CAA   0 issue "letsencrypt.org"
+$ORIGIN sub.example.com.
+host    IN  A     192.0.2.7
+alias   IN  CNAME host
+'''
+
+
+def _by_key(records):
+    return {(r['name'], r['type'], r['value']): r for r in records}
+
+
+def test_parse_bind():
+    records = _by_key(zone_io.parse_bind(ZONE, 'Example.com.'))
+    assert set(records) == {
+        ('@', 'A', '192.0.2.1'),
+        ('@', 'MX', 'mail'),
+        ('www', 'CNAME', '@'),
+        ('cdn', 'CNAME', 'cdn.static.example.com'),
+        ('api', 'CNAME', 'api.example.net'),
+        ('@', 'MX', 'mx1.mail.example.com'),
+        ('_sip._tcp', 'SRV', '5 5060 sip'),
+        ('@', 'TXT', 'v=spf1 include:_spf.example.net -all'),
+        ('@', 'CAA', '0 issue "letsencrypt.org"'),
+        ('host.sub', 'A', '192.0.2.7'),
+        ('alias.sub', 'CNAME', 'host.sub.example.com'),
+    }
+    assert records[('@', 'MX', 'mail')]['priority'] == 10
+    assert records[('@', 'MX', 'mail')]['ttl'] == 600
+    assert records[('www', 'CNAME', '@')]['ttl'] == 300
+    assert records[('_sip._tcp', 'SRV', '5 5060 sip')]['priority'] == 10
+
+
+@pytest.mark.parametrize('text, line', [
+    ('@ IN A 192.0.2.1\n$INCLUDE /etc/passwd\n', 2),
+    ('@ IN A 192.0.2.1\n@ IN SOA ns1 host ( 1 2 3\n', 2),
+    ('$TTL forever\n', 1),
+    ('www 300 IN\n', 1),
+])
+def test_parse_bind_reports_the_failing_line(text, line):
+    with pytest.raises(zone_io.ZoneImportError) as error:
+        zone_io.parse_bind(text, 'example.com')
+    assert error.value.line == line
+
+
+def test_parse_csv_and_json():
+    csv_records = zone_io.parse_csv('Name,Type,Value,TTL,Priority\n@,mx,mail,300,10\n,A,192.0.2.1,,\n')
+    assert [(r['name'], r['type'], r['ttl'], r['priority']) for r in csv_records] == [
+        ('@', 'MX', '300', '10'), ('@', 'A', None, None)]
+    json_records = zone_io.parse_json('{"records": [{"name": "www", "record_type": "a", "value": "192.0.2.2"}]}')
+    assert (json_records[0]['name'], json_records[0]['type']) == ('www', 'A')
+    with pytest.raises(zone_io.ZoneImportError):
+        zone_io.parse_csv('host,address\n')
+    with pytest.raises(zone_io.ZoneImportError):
+        zone_io.parse_json('[1, 2]')
+
+
+def _domain(db, name):
+    from src.models.user import Domain, User
+    user = User.query.filter_by(username='owner').first()
+    if user is None:
+        user = User(username='owner', email='owner@example.com', password_hash='x')
+        db.session.add(user)
+        db.session.flush()
+    domain = Domain(name=name, user_id=user.id)
+    db.session.add(domain)
+    db.session.commit()
+    return domain
+
+
+def _stored(domain):
+    from src.models.user import DNSRecord
+    return sorted((r.name, r.record_type, r.value, r.ttl, r.priority)
+                  for r in DNSRecord.query.filter_by(domain_id=domain.id))
+
+
+@pytest.mark.parametrize('fmt', ['bind', 'csv', 'json'])
+def test_export_then_import_round_trips(app, fmt):
+    from src.models.user import db
+    source = _domain(db, 'example.com')
+    result = zone_io.import_records(source, 'bind', ZONE)
+    assert result['applied'] and result['insert'] == 11 and not result['errors']
+    expected = _stored(source)
+
+    exported = zone_io.export_records(source, fmt)
+    if fmt == 'bind':
+        # A zone file names its own origin, so it goes back into the same domain; it also
+        # carries the panel's apex NS records, which come back as the only new rows
+        again = zone_io.import_records(source, 'bind', exported, replace=True)
+        assert (again['unchanged'], again['delete']) == (len(expected), 0)
+        assert again['insert'] == len(dns_zone.NAMESERVERS)
+        assert [r for r in _stored(source) if r[1] != 'NS'] == expected
+    else:
+        copy = _domain(db, 'copy.example.com')
+        zone_io.import_records(copy, fmt, exported, replace=True)
+        assert _stored(copy) == expected
+
+
+def test_dry_run_and_replace(app):
+    from src.models.user import db
+    domain = _domain(db, 'example.com')
+    zone_io.import_records(domain, 'bind', ZONE)
+    before = _stored(domain)
+
+    plan = zone_io.import_records(domain, 'json', '[{"name": "www", "type": "A", "value": "192.0.2.9"}]',
+                                  replace=True, dry_run=True)
+    assert (plan['insert'], plan['delete'], plan['applied']) == (1, len(before), False)
+    assert _stored(domain) == before
+
+    zone_io.import_records(domain, 'json', '[{"name": "www", "type": "A", "value": "192.0.2.9"}]', replace=True)
+    assert _stored(domain) == [('www', 'A', '192.0.2.9', 3600, None)]